@@ -0,0 +1,123 @@
+"""
+Compares the time taken to generate Flickr image sizes from a large JPEG:
+
+1. The old way: decoding the full original for every size, then using
+   Transpose(), ResizeToFit()/ResizeToFill() and Adjust().
+2. Using the DraftSpecs, decoding the original in draft mode for each size.
+3. Using the DraftSpecs with one Intermediate shared between all sizes, as
+   ditto.core.utils.thumbnails does.
+
+Run from the repository's root directory:
+
+    python benchmarks/imagegenerators.py
+    python benchmarks/imagegenerators.py path/to/photo.jpg
+
+If no image is given, a noisy 6000x4000 JPEG is made to use.
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import django
+from django.conf import settings
+
+settings.configure(INSTALLED_APPS=['imagekit'])
+django.setup()
+
+from django.core.files import File
+from imagekit.processors import Adjust, ResizeToFill, ResizeToFit, Transpose
+from PIL import Image
+from pilkit.utils import process_image
+
+from ditto.core.imagegenerators import Intermediate
+from ditto.flickr import imagegenerators
+
+
+SPECS = [
+    imagegenerators.Large2048,
+    imagegenerators.Large1600,
+    imagegenerators.Large,
+    imagegenerators.Medium800,
+    imagegenerators.Medium640,
+    imagegenerators.Medium,
+    imagegenerators.Small320,
+    imagegenerators.Small,
+    imagegenerators.LargeSquare,
+    imagegenerators.Thumbnail,
+    imagegenerators.Square,
+]
+
+REPEATS = 3
+
+
+def make_image(path):
+    "Saves a noisy 6000x4000 JPEG to path."
+    noise = Image.effect_noise((1500, 1000), 64).convert('RGB')
+    noise.resize((6000, 4000), Image.BICUBIC).save(path, 'JPEG', quality=90)
+
+
+def old_processors(spec):
+    "The processors the specs used before they were DraftSpecs."
+    if spec.crop:
+        resize = ResizeToFill(spec.size, spec.size, upscale=spec.upscale)
+    else:
+        resize = ResizeToFit(spec.width, spec.height, upscale=spec.upscale)
+    return [Transpose(), resize, Adjust(sharpness=2.0)]
+
+
+def generate_old(source):
+    for generator in SPECS:
+        spec = generator(source=source)
+        source.open()
+        img = Image.open(source)
+        process_image(img, processors=old_processors(spec),
+                      format=spec.format, options=spec.options)
+        source.close()
+
+
+def generate_draft(source):
+    for generator in SPECS:
+        generator(source=source).generate()
+
+
+def generate_shared(source):
+    intermediate = Intermediate(source)
+    for generator in SPECS:
+        spec = generator(source=source)
+        spec.intermediate = intermediate
+        spec.generate()
+
+
+def main():
+    tmp_dir = None
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, 'original.jpg')
+        make_image(path)
+
+    source = File(open(path, 'rb'))
+    print('Generating %s sizes from %s (%dx%d), best of %s:' % (
+                len(SPECS), path, *Image.open(path).size, REPEATS))
+
+    old = None
+    for name, func in (('Full decode', generate_old),
+                       ('Draft mode', generate_draft),
+                       ('Draft mode, shared', generate_shared)):
+        seconds = min(timeit.repeat(lambda: func(source),
+                                    number=1, repeat=REPEATS))
+        old = old or seconds
+        print('  %-20s %6.2fs  (%.1fx)' % (name, seconds, old / seconds))
+
+    source.close()
+    if tmp_dir:
+        os.remove(path)
+        os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+from django.conf import settings
+
+
+# Creating all the defaults for settings.
+# In our code, if we want to use a DITTO_* setting that isn't specific to one
+# service we should import from here, not django.conf.settings.
+
+
+# The directory, within MEDIA_ROOT, that remote images are saved in by the
+# media cache view.
+DITTO_MEDIA_CACHE_DIR = getattr(settings, 'DITTO_MEDIA_CACHE_DIR',
+                                                                'media-cache')
+
+# How long, in seconds, browsers should cache images from the media cache view.
+DITTO_MEDIA_CACHE_MAX_AGE = getattr(settings, 'DITTO_MEDIA_CACHE_MAX_AGE',
+                                                            60 * 60 * 24 * 365)
+
+# If set to 'X-Sendfile' or 'X-Accel-Redirect', the media cache view leaves
+# serving files to the web server, using that header.
+DITTO_MEDIA_CACHE_SENDFILE_HEADER = getattr(settings,
+                                    'DITTO_MEDIA_CACHE_SENDFILE_HEADER', None)
+
+# How long, in seconds, browsers should cache JSON from the map tiles view.
+DITTO_MAP_TILES_MAX_AGE = getattr(settings, 'DITTO_MAP_TILES_MAX_AGE', 60 * 60)
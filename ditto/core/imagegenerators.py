@@ -0,0 +1,207 @@
+import base64
+import math
+
+from imagekit import ImageSpec
+from imagekit.exceptions import MissingSource
+from imagekit.processors import ResizeToFit, Transpose
+from imagekit.utils import open_image
+from pilkit.utils import process_image
+from PIL import Image
+
+
+# How much bigger than the final image we keep an image when decoding it in
+# draft mode, or shrinking an intermediate image, so that the final resize
+# still has enough pixels to give a smooth result.
+DRAFT_FACTOR = 2
+
+# EXIF orientations that swap an image's width and height.
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def webp_supported():
+    "Can the installed Pillow save WebP images?"
+    Image.init()
+    return 'WEBP' in Image.SAVE
+
+
+def _is_rotated(img):
+    "Will Transpose() swap this image's width and height?"
+    try:
+        return img._getexif()[0x0112] in ROTATED_ORIENTATIONS
+    except (IndexError, KeyError, TypeError, AttributeError):
+        return False
+
+
+class Intermediate(object):
+    """
+    A decoded version of an original image, shared between several
+    DraftSpecs that generate different sizes from the same original.
+
+    The original is only decoded once, in draft mode, at the size the first
+    spec needs. Then, for each smaller spec, the image is shrunk again so
+    that each resize works on as few pixels as possible. So specs should be
+    used largest first, eg:
+
+        intermediate = Intermediate(photo.original_file)
+        for generator in (Large, Medium, Small):
+            spec = generator(source=photo.original_file)
+            spec.intermediate = intermediate
+            spec.generate()
+    """
+
+    def __init__(self, source):
+        self.source = source
+        # The decoded image, after Transpose() has been applied:
+        self.image = None
+        # The original's format, eg 'JPEG':
+        self.format = None
+        # The original's (width, height), after Transpose() has been applied:
+        self.original_size = None
+
+    def get_image(self, spec):
+        """
+        Returns a PIL Image that's big enough for spec to make its final
+        image from.
+        """
+        if self.image is None:
+            self._load(spec)
+        else:
+            size = spec.get_draft_size(self.original_size)
+            if size is None or size[0] > self.image.size[0]:
+                # This spec needs a bigger image than we have.
+                if self.image.size != self.original_size:
+                    self._load(spec)
+            elif size[0] * DRAFT_FACTOR <= self.image.size[0]:
+                self.image = self.image.resize(size, Image.ANTIALIAS)
+
+        return self.image
+
+    def _load(self, spec):
+        "Decode the source file, as small as spec will allow."
+        try:
+            img = open_image(self.source)
+        except ValueError:
+            # Re-open the file -- https://code.djangoproject.com/ticket/13750
+            self.source.open()
+            img = open_image(self.source)
+
+        rotated = _is_rotated(img)
+        width, height = img.size
+        self.original_size = (height, width) if rotated else (width, height)
+        self.format = img.format
+
+        size = spec.get_draft_size(self.original_size)
+        if size is not None:
+            # Only does anything for JPEGs, which are then decoded at
+            # 1/2, 1/4 or 1/8 scale, as long as that's still at least size.
+            img.draft(img.mode, (size[1], size[0]) if rotated else size)
+
+        self.image = Transpose().process(img)
+        self.image.load()
+        self.source.close()
+
+
+class DraftSpec(ImageSpec):
+    """
+    Base class for specs that shrink images to fit, or fill, a box.
+
+    Rather than decoding the whole original and then resizing it, JPEGs are
+    decoded in Pillow's draft mode, which shrinks them while decoding. This
+    is much faster, and uses much less memory, for large originals.
+
+    Child classes should set `processors` in __init__(), starting with
+    Transpose(), and implement get_box().
+    """
+
+    # True if the image is cropped to fill the box (ResizeToFill), False if
+    # it's resized to fit within it (ResizeToFit):
+    crop = False
+
+    upscale = False
+
+    # Can be set to an Intermediate shared with other specs, instead of
+    # decoding the source file again.
+    intermediate = None
+
+    def get_box(self):
+        "Child classes should return the (width, height) of the box."
+        raise NotImplementedError
+
+    def get_draft_size(self, original_size):
+        """
+        The smallest (width, height) that an image of original_size can be
+        shrunk to and still be used to make our final image.
+        Or None if it shouldn't be shrunk.
+        """
+        box_width, box_height = self.get_box()
+        width, height = original_size
+        ratios = (box_width / width, box_height / height)
+        ratio = (max(ratios) if self.crop else min(ratios)) * DRAFT_FACTOR
+        if ratio >= 1:
+            return None
+        else:
+            return (int(math.ceil(width * ratio)),
+                    int(math.ceil(height * ratio)))
+
+    def generate(self):
+        if not self.source:
+            raise MissingSource("The spec '%s' has no source file associated"
+                                " with it." % self)
+
+        intermediate = self.intermediate or Intermediate(self.source)
+        img = intermediate.get_image(self)
+        return process_image(img, processors=self.processors,
+                             format=self.format or intermediate.format,
+                             autoconvert=self.autoconvert,
+                             options=self.options)
+
+
+class WebPSpecMixin(object):
+    """
+    Mix in before an existing spec to make a WebP version of it, eg:
+
+        class SmallWebP(WebPSpecMixin, Small):
+            pass
+    """
+    format = 'WEBP'
+
+
+class Placeholder(DraftSpec):
+    """
+    A tiny, low quality, version of an image to show while the real image
+    loads. See make_placeholder().
+    """
+    format = 'JPEG'
+    options = {'quality': 40, 'optimize': True}
+    width = 16
+    height = 16
+
+    def __init__(self, source):
+        self.processors = [
+                Transpose(),
+                ResizeToFit(self.width, self.height, upscale=self.upscale),]
+        super().__init__(source)
+
+    def get_box(self):
+        return (self.width, self.height)
+
+
+def make_placeholder(source, intermediate=None):
+    """
+    Returns a data URI of a tiny JPEG version of the source image, to use
+    while the real image loads. Or '' if it can't be made.
+
+    Arguments:
+        source -- The original image file.
+        intermediate -- An optional Intermediate, already used for other
+                        sizes of source.
+    """
+    spec = Placeholder(source=source)
+    spec.intermediate = intermediate
+    try:
+        content = spec.generate()
+    except Exception:
+        # Not an image we can read, or a 0 byte file, or something.
+        return ''
+    return 'data:image/jpeg;base64,%s' % (
+                            base64.b64encode(content.read()).decode('ascii'))
@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError
 
+from ...utils.thumbnails import ThumbnailGenerator
+
 
 class DittoBaseCommand(BaseCommand):
     """
@@ -62,3 +64,58 @@ class DittoBaseCommand(BaseCommand):
             return "%s%s" % ("\n", "\n".join(messages))
 
 
+
+
+class ThumbnailsCommandMixin(object):
+    """
+    For commands that pre-generate the resized images from downloaded
+    original image files. See ditto.core.utils.thumbnails.
+
+    Child classes should set `thumbnails_field` and `thumbnails_sizes`, eg:
+
+        thumbnails_field = 'original_file'
+        thumbnails_sizes = Photo.PHOTO_SIZES
+        thumbnails_singular_noun = 'Photo'
+        thumbnails_plural_noun = 'Photos'
+    """
+
+    thumbnails_field = None
+    thumbnails_sizes = {}
+
+    # What we're generating images for:
+    thumbnails_singular_noun = 'Thing'
+    thumbnails_plural_noun = 'Things'
+
+    def thumbnails_webp(self):
+        "Child classes should return True if WebP images should be made too."
+        return False
+
+    def add_processes_argument(self, parser):
+        parser.add_argument(
+            '--processes',
+            action='store',
+            type=int,
+            default=None,
+            help="How many processes to use when generating images. Defaults to the number of CPUs."
+        )
+
+    def generate_thumbnails(self, queryset, regenerate=False, processes=None,
+                                                                verbosity=1):
+        "Generates images for objects in queryset, and outputs the result."
+        result = ThumbnailGenerator(sizes=self.thumbnails_sizes,
+                                    field_name=self.thumbnails_field,
+                                    processes=processes,
+                                    webp=self.thumbnails_webp(),
+                                ).generate(queryset, regenerate=regenerate)
+
+        if verbosity > 0:
+            noun = self.thumbnails_singular_noun if result['generated'] == 1 else self.thumbnails_plural_noun
+            self.stdout.write('Generated images for %d %s' % (
+                                                    result['generated'], noun))
+            if result['success'] == False:
+                self.stderr.write('Failed to generate images: %s' % (
+                                    self.format_messages(result['messages'])))
+            for warning in result.get('warnings', []):
+                self.stderr.write(warning)
+
+        return result
@@ -1,7 +1,73 @@
+from contextlib import contextmanager
+from functools import reduce
+import operator
+import threading
+
 from django.db import models
+from django.db.models.functions import Substr
+
+from .utils import geohash
+
+
+class DittoItemQuerySet(models.QuerySet):
+
+    def within_bbox(self, south, west, north, east):
+        """
+        Returns the items whose latitude and longitude are within an area.
+        If west is greater than east the area crosses the 180th meridian.
+
+        For models with a `geohash` field (see
+        ditto.core.models.GeohashMixin) the items are first narrowed down
+        to those in geohash cells covering the area, which can use its index.
+        """
+        qs = self.filter(latitude__gte=south, latitude__lte=north)
+
+        if west <= east:
+            qs = qs.filter(longitude__gte=west, longitude__lte=east)
+        else:
+            qs = qs.filter(models.Q(longitude__gte=west) |
+                           models.Q(longitude__lte=east))
+
+        if self._has_geohash():
+            prefixes = geohash.covering_prefixes(south, west, north, east)
+            if prefixes:
+                qs = qs.filter(reduce(operator.or_,
+                        [models.Q(geohash__startswith=p) for p in prefixes]))
+
+        return qs
+
+    def geohash_clusters(self, precision):
+        """
+        Groups the items by the first `precision` characters of their
+        geohashes. Returns a list of dicts, one per group, each with:
+            'geohash': The shortened geohash.
+            'count': The number of items.
+            'latitude', 'longitude': Floats, the items' average position.
+        Only for models with a `geohash` field.
+        """
+        groups = self.exclude(geohash='')\
+                    .annotate(cell=Substr('geohash', 1, precision))\
+                    .values('cell')\
+                    .annotate(count=models.Count('pk'),
+                              avg_latitude=models.Avg('latitude'),
+                              avg_longitude=models.Avg('longitude'))\
+                    .order_by('cell')
+        return [{
+                'geohash': g['cell'],
+                'count': g['count'],
+                'latitude': float(g['avg_latitude']),
+                'longitude': float(g['avg_longitude']),
+                } for g in groups]
+
+    def _has_geohash(self):
+        return 'geohash' in [f.name for f in self.model._meta.get_fields()]
+
 
+class DittoItemManager(models.Manager.from_queryset(DittoItemQuerySet)):
+    pass
 
-class PublicItemManager(models.Manager):
+
+class PublicItemManager(DittoItemManager):
     """
     Only returns items that are public.
     Should be used on ALL public pages of the site.
@@ -9,3 +75,52 @@ class PublicItemManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset().filter(is_private=False)
 
+
+# Tag IDs waiting to be counted within TagCountsManagerMixin.batch_updates(),
+# keyed by the counting model's label.
+_pending_tag_ids = threading.local()
+
+
+class TagCountsManagerMixin(object):
+    """
+    For the managers of models that store how many items have each tag.
+    Subclasses must define update_tag_counts(tag_ids).
+
+    Call tags_changed() whenever items' tags change. Within batch_updates()
+    the counts are updated once, at the end, rather than on every change.
+    """
+
+    def update_tag_counts(self, tag_ids):
+        "Counts the items with each of the tags, and saves their counts."
+        raise NotImplementedError()
+
+    def tags_changed(self, tag_ids):
+        "Updates the counts of the tags now, or at the end of the batch."
+        pending = getattr(_pending_tag_ids, self.model._meta.label, None)
+        if pending is None:
+            self.update_tag_counts(tag_ids)
+        else:
+            pending.update(tag_ids)
+
+    @contextmanager
+    def batch_updates(self):
+        """
+        Within this, counts are updated once, when it ends, rather than
+        every time tags_changed() is called. Nothing's updated if an
+        exception is raised.
+        """
+        label = self.model._meta.label
+        if getattr(_pending_tag_ids, label, None) is not None:
+            # We're already within a batch.
+            yield
+            return
+
+        setattr(_pending_tag_ids, label, set())
+        try:
+            yield
+            tag_ids = getattr(_pending_tag_ids, label)
+        finally:
+            setattr(_pending_tag_ids, label, None)
+
+        if tag_ids:
+            self.update_tag_counts(tag_ids)
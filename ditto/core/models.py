@@ -1,9 +1,12 @@
 # coding: utf-8
+import json
+
 from django.db import models
 from django.forms.models import model_to_dict
 
-from .managers import PublicItemManager
-from .utils import truncate_string
+from .managers import DittoItemManager, PublicItemManager
+from .utils import geohash, truncate_string
+from .utils.thumbnails import get_cachefile_storage
 
 
 class TimeStampedModelMixin(models.Model):
@@ -69,6 +72,109 @@ class DiffModelMixin(object):
                              self._meta.fields])
 
 
+class GeneratedSizesMixin(models.Model):
+    """
+    For models with a downloaded original image file from which Imagekit
+    generates other sizes.
+
+    Records the names of files that have been pre-generated (see
+    ditto.core.utils.thumbnails) so that their URLs can be made without
+    asking the storage backend whether they exist.
+
+    Also stores a tiny placeholder version of the image, to show while
+    the real image loads.
+
+    Child classes should set `generated_sizes_source` to the name of the
+    ImageField holding the original file.
+    """
+
+    generated_sizes_source = 'set__generated_sizes_source__in_child_class'
+
+    generated_sizes = models.TextField(blank=True,
+        help_text="JSON recording pre-generated image files for each size. Set automatically.")
+    placeholder = models.TextField(blank=True,
+        help_text="Data URI of a tiny version of the image, shown while it loads. Set automatically.")
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def make_generated_sizes(source_name, names, placeholder_failed=False):
+        """
+        Returns the string to store in generated_sizes.
+        source_name -- The name of the original file the sizes came from.
+        names -- Dict mapping size names to generated files' names.
+        placeholder_failed -- True if the placeholder couldn't be made from
+                              the original file, so we don't keep trying.
+        """
+        data = {'source': source_name, 'sizes': names}
+        if placeholder_failed:
+            data['placeholder_failed'] = True
+        return json.dumps(data, sort_keys=True)
+
+    def get_generated_sizes(self):
+        """
+        Returns a dict mapping size names to generated files' names.
+        Empty if nothing's been generated, or if the original file has changed
+        since it was.
+        """
+        return self._get_generated_data().get('sizes', {})
+
+    def placeholder_failed(self):
+        """
+        True if making the placeholder from the current original file failed
+        when its sizes were generated.
+        """
+        return self._get_generated_data().get('placeholder_failed', False)
+
+    def _get_generated_data(self):
+        """
+        Returns the dict stored in generated_sizes, or an empty dict if
+        there's nothing, or if the original file has changed since.
+        """
+        if self.generated_sizes:
+            try:
+                data = json.loads(self.generated_sizes)
+            except ValueError:
+                return {}
+            source = getattr(self, self.generated_sizes_source)
+            if source and data.get('source') == source.name:
+                return data
+        return {}
+
+    def get_generated_size_url(self, size):
+        "Returns the URL of a pre-generated file for size, or None."
+        name = self.get_generated_sizes().get(size, None)
+        if name:
+            return get_cachefile_storage().url(name)
+        else:
+            return None
+
+
+class GeohashMixin(models.Model):
+    """
+    For models with a latitude and longitude, so that items within an area
+    of the map can be found using an index. eg:
+
+        Photo.public_objects.within_bbox(51.4, -0.3, 51.6, 0.1)
+
+    The geohash is set from the latitude and longitude when saved.
+    """
+
+    geohash = models.CharField(blank=True, max_length=12, db_index=True,
+        help_text="Identifies the area of the map the item's in. Set automatically on save.")
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geohash.encode(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+        super().save(*args, **kwargs)
+
+
 class DittoItemModel(TimeStampedModelMixin, DiffModelMixin, models.Model):
     """
     A content item on whatever service we're copying.
@@ -110,7 +216,7 @@ class DittoItemModel(TimeStampedModelMixin, DiffModelMixin, models.Model):
                                     help_text="eg, the raw JSON from the API.")
 
     # All Items (eg, used in Admin):
-    objects = models.Manager()
+    objects = DittoItemManager()
 
     # All Items which aren't private. Should ALWAYS be used for public pages:
     public_objects = PublicItemManager()
@@ -18,6 +18,18 @@ urlpatterns = [
         #view=views.TagDetailView.as_view(),
         #name='tag_detail'
     #),
+    url(
+        # /media-cache/flickr/26069027966/medium
+        regex=r"^media-cache/(?P<service>[a-z]+)/(?P<id>\d+)/(?P<size>[a-z_]+)$",
+        view=views.MediaCacheView.as_view(),
+        name='media_cache'
+    ),
+    url(
+        # /map/flickr/12/2046/1362.json
+        regex=r"^map/(?P<service>[a-z]+)/(?P<zoom>\d+)/(?P<x>\d+)/(?P<y>\d+)\.json$",
+        view=views.MapTilesView.as_view(),
+        name='map_tiles'
+    ),
     url(
         # /2016/04/18/twitter/favorites
         regex=r"^(?P<year>\d{4})/(?P<month>\d{2})/(?P<day>\d{2})(?:/(?P<app>[a-z]+))?(?:/(?P<variety>[a-z\/]+|))?$",
@@ -1,5 +1,5 @@
 # coding: utf-8
-from django.utils.html import strip_tags
+from django.utils.html import format_html, strip_tags
 from django.utils.text import Truncator
 
 import datetime
@@ -109,3 +109,61 @@ def get_annual_item_counts(qs, field_name='post_year'):
 
     return results
 
+
+def make_srcset(candidates):
+    """
+    Returns the value for an <img> or <source>'s srcset attribute, like:
+        'http://example.org/small.jpg 240w, http://example.org/medium.jpg 500w'
+
+    Arguments:
+        candidates -- A list of (url, width) tuples, smallest first. Any
+                      without a url or width are skipped, as are any with the
+                      same width as an earlier one.
+    """
+    widths = set()
+    parts = []
+    for url, width in candidates:
+        if url and width and width not in widths:
+            widths.add(width)
+            parts.append('%s %sw' % (url, width))
+    return ', '.join(parts)
+
+
+def make_picture(src, width, height, srcset='', webp_srcset='', sizes='',
+                                    css_class='', alt='', placeholder=''):
+    """
+    Returns the HTML for an <img>, using srcset if there is one. If there's a
+    webp_srcset it's wrapped in a <picture> with a WebP <source>.
+
+    Arguments:
+        src -- URL of the image to use if srcset isn't understood.
+        width, height -- Dimensions of that image.
+        srcset -- From make_srcset().
+        webp_srcset -- From make_srcset(), for WebP versions of the images.
+        sizes -- Value for the sizes attribute. Defaults to '{width}px'.
+        css_class -- Value for the <img>'s class attribute.
+        alt -- Value for the <img>'s alt attribute.
+        placeholder -- A data URI of a tiny version of the image, shown as the
+                       <img>'s background while it loads.
+    """
+    if not sizes:
+        sizes = '%spx' % width
+
+    img = format_html('<img src="{}" width="{}" height="{}" alt="{}"',
+                                                    src, width, height, alt)
+    if srcset:
+        img += format_html(' srcset="{}" sizes="{}"', srcset, sizes)
+    if css_class:
+        img += format_html(' class="{}"', css_class)
+    if placeholder:
+        img += format_html(
+            ' style="background-image:url({});background-size:cover"',
+            placeholder)
+    img += format_html('>')
+
+    if webp_srcset:
+        return format_html(
+                '<picture><source type="image/webp" srcset="{}" sizes="{}">{}</picture>',
+                webp_srcset, sizes, img)
+    else:
+        return img
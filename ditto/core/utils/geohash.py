@@ -0,0 +1,132 @@
+"""
+Geohashes, for finding items within an area of the map using an index.
+
+A geohash is a string like 'gcpvj0' identifying a rectangular cell of the
+map. Each extra character divides its cell into 32 smaller ones, so all the
+points within a cell have geohashes starting with that cell's geohash.
+See https://en.wikipedia.org/wiki/Geohash
+"""
+import math
+
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# The length of the geohashes we store. About 3.7cm x 1.9cm.
+MAX_PRECISION = 12
+
+
+def _cell_size(precision):
+    """
+    Returns (latitude bits, longitude bits, cell height, cell width), in
+    degrees, for geohashes of length precision.
+    """
+    bits = precision * 5
+    lon_bits = int(math.ceil(bits / 2))
+    lat_bits = bits // 2
+    return (lat_bits, lon_bits, 180 / 2**lat_bits, 360 / 2**lon_bits)
+
+
+def _cell_indexes(latitude, longitude, precision):
+    "Returns the (row, column) of the cell containing a point."
+    lat_bits, lon_bits, height, width = _cell_size(precision)
+    row = min(int((float(latitude) + 90) // height), 2**lat_bits - 1)
+    col = min(int((float(longitude) + 180) // width), 2**lon_bits - 1)
+    return (max(row, 0), max(col, 0))
+
+
+def _encode_cell(row, col, precision):
+    "Returns the geohash of the cell at (row, column)."
+    lat_bits, lon_bits, height, width = _cell_size(precision)
+    value = 0
+    for i in range(precision * 5):
+        # Bits alternate between longitude and latitude, longitude first.
+        if i % 2 == 0:
+            lon_bits -= 1
+            value = (value << 1) | ((col >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            value = (value << 1) | ((row >> lat_bits) & 1)
+    chars = []
+    for i in range(precision):
+        chars.append(BASE32[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def encode(latitude, longitude, precision=MAX_PRECISION):
+    """
+    Returns the geohash of a point.
+    latitude, longitude -- Numbers or Decimals.
+    precision -- The length of the geohash.
+    """
+    row, col = _cell_indexes(latitude, longitude, precision)
+    return _encode_cell(row, col, precision)
+
+
+def decode(geohash):
+    """
+    Returns the (latitude, longitude) of the centre of a geohash's cell.
+    """
+    row, col = 0, 0
+    lat_bits, lon_bits = 0, 0
+    bit = 0
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            if bit % 2 == 0:
+                col = (col << 1) | ((value >> shift) & 1)
+                lon_bits += 1
+            else:
+                row = (row << 1) | ((value >> shift) & 1)
+                lat_bits += 1
+            bit += 1
+    height = 180 / 2**lat_bits
+    width = 360 / 2**lon_bits
+    return ((row + 0.5) * height - 90, (col + 0.5) * width - 180)
+
+
+def covering_prefixes(south, west, north, east, max_cells=16):
+    """
+    Returns a list of geohashes whose cells, between them, cover the area.
+    The geohashes are as long as possible while there are no more than
+    max_cells of them. Returns [] if even the largest cells can't cover it
+    within max_cells, ie, the area's most of the world.
+
+    If west is greater than east the area crosses the 180th meridian.
+    """
+    if west > east:
+        # Cover each side of the 180th meridian separately.
+        max_cells = max_cells // 2
+        west_prefixes = covering_prefixes(south, west, north, 180, max_cells)
+        east_prefixes = covering_prefixes(south, -180, north, east, max_cells)
+        if west_prefixes and east_prefixes:
+            return west_prefixes + east_prefixes
+        else:
+            return []
+
+    prefixes = []
+    for precision in range(1, MAX_PRECISION + 1):
+        south_row, west_col = _cell_indexes(south, west, precision)
+        north_row, east_col = _cell_indexes(north, east, precision)
+        count = (north_row - south_row + 1) * (east_col - west_col + 1)
+        if count > max_cells:
+            break
+        prefixes = [_encode_cell(row, col, precision)
+                    for row in range(south_row, north_row + 1)
+                    for col in range(west_col, east_col + 1)]
+    return prefixes
+
+
+def tile_bbox(zoom, x, y):
+    """
+    Returns the (south, west, north, east) of a Web Mercator map tile, as
+    used by OpenStreetMap, Google Maps, Leaflet, etc.
+    See https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames
+    """
+    n = 2 ** zoom
+
+    def latitude(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return (latitude(y + 1), x / n * 360 - 180,
+            latitude(y), (x + 1) / n * 360 - 180)
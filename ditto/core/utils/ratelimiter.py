@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class RateLimiter(object):
+    """
+    For making sure that something, such as calling an API, happens no more
+    than a certain number of times per second, even when it's being done
+    from several threads at once.
+
+    Use like:
+        from ditto.core.utils.ratelimiter import RateLimiter
+        limiter = RateLimiter(per_second=5)
+
+        # Then, in each thread, before each API call:
+        limiter.wait()
+
+    If per_second is None or 0 then wait() never waits.
+    """
+
+    def __init__(self, per_second=None):
+        if per_second:
+            # The minimum number of seconds between each call:
+            self.interval = 1.0 / per_second
+        else:
+            self.interval = 0
+
+        # The earliest time.monotonic() the next call can happen.
+        self._next_time = 0
+
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until it's OK to make the next call.
+        Each caller reserves the next slot, so callers are spread out evenly.
+        """
+        if not self.interval:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
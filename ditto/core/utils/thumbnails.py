@@ -0,0 +1,179 @@
+import multiprocessing
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+
+from imagekit.cachefiles import ImageCacheFile
+from imagekit.utils import get_singleton
+
+from ..imagegenerators import DraftSpec, Intermediate, make_placeholder
+
+
+def get_cachefile_storage():
+    """
+    The storage backend Imagekit saves its generated files to.
+    """
+    return get_singleton(settings.IMAGEKIT_DEFAULT_FILE_STORAGE,
+                                                    'file storage backend')
+
+
+def _init_worker():
+    "Makes sure Django is ready in each worker process."
+    if not apps.ready:
+        django.setup()
+
+
+def _generate_sizes(job):
+    """
+    Generates every size of image for one original file, and its placeholder.
+    Run in a worker process, so it doesn't touch the database; the
+    ThumbnailGenerator saves the results.
+
+    job is a tuple of:
+        model_label -- eg, 'flickr.photo'.
+        field_name -- The name of the ImageField with the original file.
+        pk -- The ID of the object.
+        source_name -- The name of the original file.
+        sizes -- A list of (size name, Imagekit generator class) tuples.
+        force -- Boolean. Regenerate files even if they already exist?
+
+    Returns a tuple of:
+        pk
+        source_name
+        A dict of size names to generated file names, or None on failure.
+        The placeholder data URI, or None on failure.
+        An error message, or None on success.
+    """
+    model_label, field_name, pk, source_name, sizes, force = job
+
+    field = apps.get_model(model_label)._meta.get_field(field_name)
+    source = field.attr_class(None, field, source_name)
+
+    # Generate the largest sizes first, so that the original is only decoded
+    # once and then shrunk further for each smaller size.
+    specs = [(size, generator(source=source)) for size, generator in sizes]
+    specs.sort(key=lambda s: max(s[1].get_box())
+                        if isinstance(s[1], DraftSpec) else 0, reverse=True)
+    intermediate = Intermediate(source)
+
+    names = {}
+    try:
+        for size, spec in specs:
+            if isinstance(spec, DraftSpec):
+                spec.intermediate = intermediate
+            cachefile = ImageCacheFile(spec)
+            cachefile.generate(force=force)
+            names[size] = cachefile.name
+    except Exception as e:
+        return (pk, source_name, None, None,
+                "Couldn't generate images from %s: %s" % (source_name, e))
+
+    placeholder = make_placeholder(source, intermediate)
+
+    return (pk, source_name, names, placeholder, None)
+
+
+class ThumbnailGenerator(object):
+    """
+    Pre-generates the Imagekit files for every size of image for objects that
+    have downloaded original image files, using a pool of processes.
+
+    The names of the generated files are recorded on each object (see
+    ditto.core.models.GeneratedSizesMixin) so that their URLs can be made
+    without checking the storage backend. Each object's placeholder is
+    also made.
+
+    Use like:
+
+        generator = ThumbnailGenerator(sizes=Photo.PHOTO_SIZES,
+                                       field_name='original_file')
+        result = generator.generate(Photo.objects.all())
+
+    result is a dict that will have:
+        'success': Boolean.
+        'generated': Integer. The number of objects we generated images for.
+        'messages': List of strings. If no success, the failure message(s).
+        'warnings': List of strings. If any placeholders couldn't be made.
+
+    If an object's placeholder can't be made (eg, the original isn't an
+    image Pillow can read) that's recorded, along with its sizes, and it
+    isn't tried again unless the original file changes, or regenerate=True.
+    """
+
+    def __init__(self, sizes, field_name, processes=None, webp=False):
+        """
+        sizes -- A dict like Photo.PHOTO_SIZES. Only sizes that have a
+                 'generator' are generated.
+        field_name -- The name of the ImageField holding the original file.
+        processes -- How many worker processes to use. Default is the number
+                     of CPUs. If 1, no extra processes are started.
+        webp -- If True, also generate sizes' 'webp_generator' images,
+                recorded with names like 'small_webp'.
+        """
+        self.sizes = [(size, data['generator'])
+                            for size, data in sorted(sizes.items())
+                            if 'generator' in data]
+        if webp:
+            self.sizes += [('%s_webp' % size, data['webp_generator'])
+                            for size, data in sorted(sizes.items())
+                            if 'webp_generator' in data]
+        self.field_name = field_name
+        self.processes = processes
+
+    def generate(self, queryset, regenerate=False):
+        """
+        queryset -- Objects whose images we should generate.
+        regenerate -- Boolean. If False, objects that already have all their
+                      sizes recorded are skipped. If True, every file is
+                      generated again.
+        """
+        model = queryset.model
+        model_label = '%s.%s' % (model._meta.app_label, model._meta.model_name)
+        size_names = set(size for size, generator in self.sizes)
+
+        jobs = []
+        for obj in queryset.exclude(**{self.field_name: ''}):
+            if not regenerate and size_names.issubset(
+                                        obj.get_generated_sizes().keys()) \
+                    and (obj.placeholder or obj.placeholder_failed()):
+                continue
+            jobs.append((model_label, self.field_name, obj.pk,
+                    getattr(obj, self.field_name).name, self.sizes, regenerate))
+
+        generated = 0
+        error_messages = []
+        warnings = []
+
+        for pk, source_name, names, placeholder, error in self._run(jobs):
+            if error is None:
+                if not placeholder:
+                    warnings.append(
+                        "Couldn't make a placeholder from %s" % source_name)
+                model.objects.filter(pk=pk).update(
+                    generated_sizes=model.make_generated_sizes(source_name,
+                                names, placeholder_failed=not placeholder),
+                    placeholder=placeholder or '')
+                generated += 1
+            else:
+                error_messages.append(error)
+
+        result = {'success': len(error_messages) == 0, 'generated': generated}
+        if error_messages:
+            result['messages'] = error_messages
+        if warnings:
+            result['warnings'] = warnings
+        return result
+
+    def _run(self, jobs):
+        "Returns an iterable of the results of _generate_sizes() for jobs."
+        if self.processes == 1 or len(jobs) < 2:
+            return map(_generate_sizes, jobs)
+
+        # Forked processes mustn't share the parent's database connections.
+        connections.close_all()
+
+        with multiprocessing.Pool(self.processes,
+                                        initializer=_init_worker) as pool:
+            return pool.map(_generate_sizes, jobs)
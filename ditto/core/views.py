@@ -2,23 +2,34 @@ from collections import OrderedDict
 from itertools import chain
 from operator import attrgetter
 import datetime
+import math
+import mimetypes
+import os
+from urllib.parse import urlparse
 
 from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.core.paginator import InvalidPage
 from django.core.urlresolvers import reverse
 from django.db import models
-from django.http import Http404
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.shortcuts import redirect
 from django.utils import six, timezone
+from django.utils.cache import patch_cache_control, patch_response_headers
 from django.utils.encoding import force_str, force_text
 from django.utils.translation import ugettext as _
 from django.views.generic import DetailView, ListView, TemplateView, View
 from django.views.generic import DayArchiveView as DjangoDayArchiveView
 
+from . import app_settings
 from .apps import ditto_apps
 from .paginator import DiggPaginator
+from .utils import geohash
+from .utils.downloader import DownloadException, filedownloader
 
 if ditto_apps.is_installed('flickr'):
+    from ..flickr import app_settings as flickr_settings
     from ..flickr.models import Photo
 
 if ditto_apps.is_installed('lastfm'):
@@ -28,7 +39,8 @@ if ditto_apps.is_installed('pinboard'):
     from ..pinboard.models import Bookmark
 
 if ditto_apps.is_installed('twitter'):
-    from ..twitter.models import Tweet, User as TwitterUser
+    from ..twitter import app_settings as twitter_settings
+    from ..twitter.models import Media, Tweet, User as TwitterUser
 
 
 class PaginatedListView(ListView):
@@ -561,6 +573,168 @@ class DayArchiveView(DittoAppsMixin, DjangoDayArchiveView):
         return counts
 
 
+class MediaCacheView(View):
+    """
+    Serves a local copy of a remote image, such as a Flickr Photo or a
+    Twitter Media item, in one of its sizes.
+
+    The first time an image is requested it's fetched from the service and
+    saved in DITTO_MEDIA_CACHE_DIR. After that it's served from there. So
+    images are only copied locally when someone looks at them.
+
+    Only used for a service if its DITTO_*_USE_MEDIA_CACHE setting is True.
+
+    eg: /media-cache/flickr/26069027966/medium
+    """
+
+    # The types of file we'll save:
+    acceptable_content_types = ['image/jpeg', 'image/jpg', 'image/png',
+                                                                'image/gif',]
+
+    def get(self, request, *args, **kwargs):
+        remote_url = self.get_remote_url(
+                            kwargs['service'], kwargs['id'], kwargs['size'])
+        name = self.get_cache_name(kwargs['service'], kwargs['id'],
+                                                kwargs['size'], remote_url)
+
+        if not default_storage.exists(name):
+            try:
+                filepath = filedownloader.download(remote_url,
+                                                self.acceptable_content_types)
+            except DownloadException:
+                # Let the visitor get the image from the service instead.
+                return redirect(remote_url)
+            with open(filepath, 'rb') as f:
+                name = default_storage.save(name, File(f))
+            os.remove(filepath)
+
+        return self.serve(name)
+
+    def get_remote_url(self, service, id, size):
+        """
+        Returns the URL of the image on its service.
+        Raises Http404 if the service isn't cached, or there's no such
+        public item, or no such size.
+        """
+        if service == 'flickr' and ditto_apps.is_installed('flickr') and \
+                flickr_settings.DITTO_FLICKR_USE_MEDIA_CACHE:
+            if size not in Photo.PHOTO_SIZES:
+                raise Http404("Invalid size '%s'" % size)
+            try:
+                photo = Photo.public_objects.get(flickr_id=id)
+            except Photo.DoesNotExist:
+                raise Http404("No Photo found with ID '%s'" % id)
+            return photo._remote_image_url(size)
+
+        elif service == 'twitter' and ditto_apps.is_installed('twitter') and \
+                twitter_settings.DITTO_TWITTER_USE_MEDIA_CACHE:
+            if size not in ('large', 'medium', 'small', 'thumb'):
+                raise Http404("Invalid size '%s'" % size)
+            try:
+                # Only Media attached to at least one public Tweet:
+                media = Media.objects.filter(tweets__is_private=False)\
+                                    .distinct().get(twitter_id=id)
+            except Media.DoesNotExist:
+                raise Http404("No Media found with ID '%s'" % id)
+            return media._remote_image_url(size)
+
+        else:
+            raise Http404("Invalid service '%s'" % service)
+
+    def get_cache_name(self, service, id, size, remote_url):
+        """
+        The name of the image's file in storage.
+        eg, 'media-cache/flickr/26069027966/medium.jpg'
+        """
+        # Twitter's URLs end like 'abc.jpg:medium' so remove the size.
+        path = urlparse(remote_url).path.split(':')[0]
+        extension = os.path.splitext(path)[1].lower() or '.jpg'
+        return '/'.join([app_settings.DITTO_MEDIA_CACHE_DIR,
+                                service, str(id), '%s%s' % (size, extension)])
+
+    def serve(self, name):
+        "Returns a response for the file, with far-future cache headers."
+        content_type = mimetypes.guess_type(name)[0] or \
+                                                    'application/octet-stream'
+        header = app_settings.DITTO_MEDIA_CACHE_SENDFILE_HEADER
+
+        if header == 'X-Accel-Redirect':
+            # nginx serves the file from an internal location at its URL.
+            response = HttpResponse(content_type=content_type)
+            response[header] = default_storage.url(name)
+        elif header:
+            # eg, Apache's mod_xsendfile serves the file from its path.
+            response = HttpResponse(content_type=content_type)
+            response[header] = default_storage.path(name)
+        else:
+            response = FileResponse(default_storage.open(name, 'rb'),
+                                                    content_type=content_type)
+
+        patch_response_headers(response,
+                            cache_timeout=app_settings.DITTO_MEDIA_CACHE_MAX_AGE)
+        patch_cache_control(response, public=True)
+        return response
+
+
+class MapTilesView(View):
+    """
+    Returns JSON describing the public geotagged items, such as Flickr Photos
+    or Tweets, within one map tile, grouped into clusters.
+
+    Tiles are numbered as for OpenStreetMap, Leaflet, etc, so a map library
+    can request them as it would image tiles.
+
+    eg: /map/flickr/12/2046/1362.json returns something like:
+
+        {"clusters": [
+            {"geohash": "gcpvj0", "count": 23,
+             "latitude": 51.5074, "longitude": -0.1278},
+            ...
+        ]}
+    """
+
+    # The most zoomed-in tiles we provide.
+    max_zoom = 22
+
+    # About how many clusters wide each tile is.
+    clusters_per_tile = 8
+
+    def get(self, request, *args, **kwargs):
+        zoom, x, y = int(kwargs['zoom']), int(kwargs['x']), int(kwargs['y'])
+        if zoom > self.max_zoom or x >= 2**zoom or y >= 2**zoom:
+            raise Http404("Invalid tile %s/%s/%s" % (zoom, x, y))
+
+        queryset = self.get_queryset(kwargs['service'])
+        south, west, north, east = geohash.tile_bbox(zoom, x, y)
+        clusters = queryset.within_bbox(south, west, north, east)\
+                            .geohash_clusters(self.get_precision(zoom))
+
+        response = JsonResponse({'clusters': clusters})
+        patch_response_headers(response,
+                            cache_timeout=app_settings.DITTO_MAP_TILES_MAX_AGE)
+        patch_cache_control(response, public=True)
+        return response
+
+    def get_queryset(self, service):
+        "Raises Http404 if the service has no map."
+        if service == 'flickr' and ditto_apps.is_installed('flickr'):
+            return Photo.public_photo_objects.all()
+        elif service == 'twitter' and ditto_apps.is_installed('twitter'):
+            return Tweet.public_tweet_objects.all()
+        else:
+            raise Http404("Invalid service '%s'" % service)
+
+    def get_precision(self, zoom):
+        """
+        The length of geohash to group items by for a zoom level. Each
+        geohash cell is about 1/clusters_per_tile of a tile's width.
+        """
+        # Longitude bits needed, and each geohash character has 2.5 of them.
+        bits = zoom + math.log(self.clusters_per_tile, 2)
+        precision = int(math.ceil(bits * 2 / 5))
+        return max(1, min(precision, geohash.MAX_PRECISION))
+
+
 #class TagListView(TemplateView):
     #"Doesn't really do anything at the moment."
     #template_name = 'ditto/tag_list.html'
@@ -14,3 +14,25 @@ DITTO_FLICKR_DIR_PHOTOS_FORMAT = getattr(settings,
 DITTO_FLICKR_USE_LOCAL_MEDIA = getattr(settings,
                                         'DITTO_FLICKR_USE_LOCAL_MEDIA', False)
 
+
+DITTO_FLICKR_USE_WEBP = getattr(settings, 'DITTO_FLICKR_USE_WEBP', False)
+
+DITTO_FLICKR_USE_MEDIA_CACHE = getattr(settings,
+                                        'DITTO_FLICKR_USE_MEDIA_CACHE', False)
+
+# How many threads fetch extra data about photos at once:
+DITTO_FLICKR_FETCH_THREADS = getattr(settings,
+                                        'DITTO_FLICKR_FETCH_THREADS', 4)
+
+# The maximum number of API requests per second those threads make:
+DITTO_FLICKR_FETCH_RATE_LIMIT = getattr(settings,
+                                        'DITTO_FLICKR_FETCH_RATE_LIMIT', 5)
+
+# If True, photos' sizes are fetched in bulk with the list of photos, rather
+# than with an extra API call per photo:
+DITTO_FLICKR_FETCH_LEAN = getattr(settings, 'DITTO_FLICKR_FETCH_LEAN', False)
+
+# How many seconds a Flickr User's data is used for before it's fetched again
+# when fetching Photos. 0 means fetch it every time:
+DITTO_FLICKR_USER_CACHE_TTL = getattr(settings,
+                                    'DITTO_FLICKR_USER_CACHE_TTL', 60*60*24)
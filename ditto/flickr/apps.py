@@ -6,6 +6,6 @@ class DittoFlickrConfig(AppConfig):
     verbose_name = "Ditto Flickr"
 
     def ready(self):
-        # import ditto.flickr.signals
+        import ditto.flickr.signals
         import ditto.flickr.checks
 
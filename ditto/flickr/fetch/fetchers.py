@@ -1,18 +1,24 @@
 import calendar
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import os
+import threading
 import time
 
 import flickrapi
 from flickrapi.exceptions import FlickrError
 
 from django.core.files import File
+from django.db import connections
+from django.db.models import Count
 
 from . import FetchError
 from .savers import UserSaver, PhotoSaver, PhotosetSaver
+from .. import app_settings
 from ..models import Account, Photo, Photoset, User
 from ...core.utils import datetime_now
 from ...core.utils.downloader import DownloadException, filedownloader
+from ...core.utils.ratelimiter import RateLimiter
 
 # These classes call the Flickr API to fetch data about particular things,
 # from the point of view of a single Account. eg, Photos, Users, Photosets.
@@ -27,6 +33,7 @@ from ...core.utils.downloader import DownloadException, filedownloader
 #   UserFetcher
 #   PhotosFetcher
 #       RecentPhotosFetcher
+#           UpdatedPhotosFetcher
 #   PhotosetsFetcher
 
 
@@ -71,6 +78,13 @@ class Fetcher(object):
         # When fetching Photos or Users this will be the total number fetched.
         self.results_count = 0
 
+        # How many threads _map_in_threads() uses at once.
+        self.max_workers = app_settings.DITTO_FLICKR_FETCH_THREADS
+
+        # Shared by all threads so they don't call the API too often.
+        self.rate_limiter = RateLimiter(
+                        per_second=app_settings.DITTO_FLICKR_FETCH_RATE_LIMIT)
+
         # What we'll return:
         self.return_value = {'fetched': 0}
 
@@ -159,6 +173,38 @@ class Fetcher(object):
         self.results before we save the data in the DB."""
         pass
 
+    def _map_in_threads(self, func, items):
+        """Calls func(item) for each of items, using a pool of
+        self.max_workers threads, and returns a list of the results in the
+        same order as items.
+
+        If any call raises FetchError, the calls that haven't started yet are
+        cancelled, and the error is raised.
+
+        func should call self.rate_limiter.wait() before each API call.
+        """
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._call_in_thread, func, item)
+                                                            for item in items]
+            try:
+                return [future.result() for future in futures]
+            except FetchError:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def _call_in_thread(self, func, item):
+        """Calls func(item) and, because it's run in a thread from the pool,
+        closes any database connection the thread opened.
+        """
+        try:
+            return func(item)
+        finally:
+            connections.close_all()
+
     def _save_results(self, **kwargs):
         """
         Should go through self.results and create/update things in the DB based
@@ -228,8 +274,18 @@ class UserFetcher(Fetcher):
         self.results = [ info['person'] ]
 
     def _save_results(self):
+        # The user's current icon, if we already have them:
+        old_icon = User.objects.filter(nsid=self.results[0]['nsid']).values(
+                                                'iconserver', 'iconfarm').first()
+
         user_obj = UserSaver().save_user(self.results[0], datetime_now())
-        self._fetch_and_save_avatar(user_obj)
+
+        # Only download the avatar if it's new or has changed.
+        if not user_obj.avatar or old_icon is None or \
+                str(old_icon['iconserver']) != str(user_obj.iconserver) or \
+                str(old_icon['iconfarm']) != str(user_obj.iconfarm):
+            self._fetch_and_save_avatar(user_obj)
+
         self.return_value['user'] = {'name': user_obj.name}
         self.results_count = 1
 
@@ -250,8 +306,36 @@ class UserFetcher(Fetcher):
 
 class PhotosFetcher(Fetcher):
     """Parent class for fetching and saving data about Photos for an Account.
+
+    The extra data about each page of photos is fetched by a pool of
+    DITTO_FLICKR_FETCH_THREADS threads, which between them make no more than
+    DITTO_FLICKR_FETCH_RATE_LIMIT API calls per second. See _map_in_threads().
+
+    If DITTO_FLICKR_FETCH_LEAN is True, child classes should request the
+    `lean_extras` when fetching lists of photos. Then photos' sizes are made
+    from those lists, instead of calling photos.getSizes() for each photo.
+    Videos' sizes aren't in the lists, so they're still fetched separately.
     """
 
+    # Maps the suffixes of the url_* extras for lists of photos to the
+    # labels that photos.getSizes() uses for those sizes.
+    # Square sizes are left out because we don't store their sizes.
+    lean_size_extras = (
+        ('t', 'Thumbnail'),
+        ('s', 'Small'),
+        ('n', 'Small 320'),
+        ('m', 'Medium'),
+        ('z', 'Medium 640'),
+        ('c', 'Medium 800'),
+        ('l', 'Large'),
+        ('h', 'Large 1600'),
+        ('k', 'Large 2048'),
+        ('o', 'Original'),
+    )
+
+    # The extras to request when fetching lists of photos in lean mode.
+    lean_extras = ['media'] + ['url_%s' % s for s, l in lean_size_extras]
+
     def __init__(self, *args, **kwargs):
         # Will match Flickr IDs with their User object.
         # eg '35034346050@N01' => User
@@ -259,6 +343,12 @@ class PhotosFetcher(Fetcher):
         # we add their object to this, so we don't fetch again this time.
         self.fetched_users = {}
 
+        # Used by threads when checking, and adding to, fetched_users.
+        self._fetched_users_lock = threading.RLock()
+
+        # Get photos' sizes from lists of photos instead of photos.getSizes()?
+        self.lean = app_settings.DITTO_FLICKR_FETCH_LEAN
+
         super().__init__(*args, **kwargs)
 
     def _call_api(self):
@@ -271,41 +361,101 @@ class PhotosFetcher(Fetcher):
     def _fetch_extra(self):
         """Before saving we need to go through the big list of photos we've
         fetched, and fetch more detailed info to add to each photo's data.
-        """
-        extra_results = []
-
-        for i, photo in enumerate(self.results):
 
+        The photos' owners are fetched first, then the info, sizes and EXIF
+        for all the photos are fetched concurrently. The results are in the
+        same order as the photos in self.results.
+        """
+        for photo in self.results:
             self._fetch_user_if_missing(photo['owner'])
 
-            extra_results.append({
-                'fetch_time': datetime_now(),
-                # Add the data for the photo's owner:
-                'user_obj': self.fetched_users[ photo['owner'] ],
-                # Get all the info about this photo:
-                'info': self._fetch_photo_info(photo['id']),
-                'sizes': self._fetch_photo_sizes(photo['id']),
-                'exif': self._fetch_photo_exif(photo['id']),
-            })
+        extra_results = self._map_in_threads(self._fetch_photo_extra,
+                                                                self.results)
+
+        for photo, extra in zip(self.results, extra_results):
+            # Add the data for the photo's owner:
+            extra['user_obj'] = self.fetched_users[ photo['owner'] ]
 
         # Replace self.results with our new array that contains more info.
         self.results = extra_results
 
+    def _fetch_photo_extra(self, photo):
+        """Fetches all the extra data about a single photo.
+        Returns a dict of the data.
+        photo -- The photo's data from the list of photos.
+        """
+        if self.lean and photo.get('media') == 'photo':
+            sizes = self._sizes_from_extras(photo)
+        else:
+            sizes = self._fetch_photo_sizes(photo['id'])
+
+        return {
+            'fetch_time': datetime_now(),
+            # Get all the info about this photo:
+            'info': self._fetch_photo_info(photo['id']),
+            'sizes': sizes,
+            'exif': self._fetch_photo_exif(photo['id']),
+        }
+
+    def _sizes_from_extras(self, photo):
+        """Makes data in the same format as photos.getSizes() returns, from
+        the url_* extras in a photo's data from a list of photos.
+        Sizes the photo doesn't have (eg, larger than the original) are
+        missing from the list, so are left out.
+        photo -- The photo's data from the list of photos.
+        """
+        sizes = []
+        for suffix, label in self.lean_size_extras:
+            if 'url_%s' % suffix in photo:
+                sizes.append({
+                    'label':    label,
+                    'width':    photo['width_%s' % suffix],
+                    'height':   photo['height_%s' % suffix],
+                    'source':   photo['url_%s' % suffix],
+                    'media':    photo['media'],
+                })
+        return {'size': sizes}
+
     def _fetch_user_if_missing(self, flickr_user_id):
         """
         If we don't have flickr_user_id in self.fetched_users, then fetch, and
         save, that user from the API. Then add their User to self.fetched_users.
+        Safe to call from several threads at once; each user is only fetched
+        once.
+
+        Users whose data was fetched within the last
+        DITTO_FLICKR_USER_CACHE_TTL seconds, on this or a previous occasion,
+        are used without fetching them again.
+
         flickr_user_id -- The user's ID on Flickr, eg '35034346050@N01'.
         """
-        if self.fetched_users.get(flickr_user_id, None) is None:
-            results = UserFetcher(account=self.account).fetch(
+        with self._fetched_users_lock:
+            if self.fetched_users.get(flickr_user_id, None) is None:
+                user = self._get_recently_fetched_user(flickr_user_id)
+
+                if user is None:
+                    results = UserFetcher(account=self.account).fetch(
                                                         nsid=flickr_user_id)
-            if results['success'] == False:
-                raise FetchError(results['messages'][0])
+                    if results['success'] == False:
+                        raise FetchError(results['messages'][0])
+
+                    # Get the user we just saved. A bit clunky!
+                    user = User.objects.get(nsid=flickr_user_id)
+
+                self.fetched_users[flickr_user_id] = user
 
-            # Get the user we just saved. A bit clunky!
-            self.fetched_users[flickr_user_id] = User.objects.get(
-                                                           nsid=flickr_user_id)
+    def _get_recently_fetched_user(self, flickr_user_id):
+        """
+        Returns the User with flickr_user_id if their data was fetched within
+        the last DITTO_FLICKR_USER_CACHE_TTL seconds. Otherwise, None.
+        flickr_user_id -- The user's ID on Flickr, eg '35034346050@N01'.
+        """
+        ttl = app_settings.DITTO_FLICKR_USER_CACHE_TTL
+        if not ttl:
+            return None
+        return User.objects.filter(nsid=flickr_user_id,
+                fetch_time__gte=datetime_now() - datetime.timedelta(seconds=ttl)
+            ).first()
 
     def _fetch_photo_info(self, photo_id):
         """Calls the photos.getInfo() method of the Flickr API and returns the
@@ -313,6 +463,7 @@ class PhotosFetcher(Fetcher):
         https://www.flickr.com/services/api/explore/flickr.photos.getInfo
         photo_id -- The Flickr photo ID.
         """
+        self.rate_limiter.wait()
         try:
             results = self.api.photos.getInfo(photo_id = photo_id)
         except FlickrError as e:
@@ -333,6 +484,7 @@ class PhotosFetcher(Fetcher):
         https://www.flickr.com/services/api/explore/flickr.photos.getSizes
         photo_id -- The Flickr photo ID.
         """
+        self.rate_limiter.wait()
         try:
             results = self.api.photos.getSizes(photo_id = photo_id)
         except FlickrError as e:
@@ -347,6 +499,7 @@ class PhotosFetcher(Fetcher):
         https://www.flickr.com/services/api/explore/flickr.photos.getExif
         photo_id -- The Flickr photo ID.
         """
+        self.rate_limiter.wait()
         try:
             results = self.api.photos.getExif(photo_id = photo_id)
         except FlickrError as e:
@@ -360,6 +513,7 @@ class PhotosFetcher(Fetcher):
         saver = PhotoSaver()
         for photo in self.results:
             p = saver.save_photo(photo)
+        saver.update_equipment_counts()
         self.results_count += len(self.results)
 
 
@@ -371,6 +525,11 @@ class RecentPhotosFetcher(PhotosFetcher):
     Supply a number of days to fetch() to restrict to the most recent days.
     """
 
+    # Optional extra fields to request for each photo in the list, eg
+    # ['last_update'].
+    # https://www.flickr.com/services/api/flickr.people.getPhotos.html
+    extras = []
+
     def fetch(self, days=None):
         """Fetch all of the Account's user's photos, by default.
         days -- Required. The number of days back to look, by upload date, or
@@ -391,13 +550,18 @@ class RecentPhotosFetcher(PhotosFetcher):
         # Turn our datetime object into a unix timestamp:
         min_unixtime = calendar.timegm(self.min_date.timetuple())
 
+        kwargs = {
+            'user_id':          self.account.user.nsid,
+            'min_upload_date':  min_unixtime,
+            'per_page':         self.items_per_page,
+            'page':             self.page_number,
+        }
+        extras = self.extras + (self.lean_extras if self.lean else [])
+        if extras:
+            kwargs['extras'] = ','.join(extras)
+
         try:
-            results = self.api.people.getPhotos(
-                                            user_id=self.account.user.nsid,
-                                            min_upload_date=min_unixtime,
-                                            per_page=self.items_per_page,
-                                            page=self.page_number
-                                        )
+            results = self.api.people.getPhotos(**kwargs)
         except FlickrError as e:
             raise FetchError(
                 "Error when fetching recent photos (page %s): %s" % \
@@ -408,7 +572,82 @@ class RecentPhotosFetcher(PhotosFetcher):
             self.total_pages = int(results['photos']['pages'])
 
         # Add the list of photos' data from this page on to our total list:
-        self.results += results['photos']['photo']
+        self.results += self._filter_photos(results['photos']['photo'])
+
+    def _filter_photos(self, photos):
+        """Child classes can return only some of the photos from a page of
+        results, to avoid fetching extra data about the rest.
+        photos -- A list of dicts, one per photo, from people.getPhotos().
+        """
+        return photos
+
+
+class UpdatedPhotosFetcher(RecentPhotosFetcher):
+    """Fetches and saves data about an Account's Photos that are new, or
+    that have changed on Flickr since we last fetched them.
+
+    The list of all the Account's Photos is fetched, including when each was
+    last updated. Extra data is only fetched, and saved, for those that
+    are newer than our copy in the database.
+
+    The most recent update time is saved as the Account's
+    photos_last_update_time. Next time, Photos not updated since then are
+    skipped without checking the database.
+    """
+
+    extras = ['last_update']
+
+    def __init__(self, *args, **kwargs):
+        # Unixtime of the Account's photos_last_update_time, if any.
+        self.last_update_watermark = None
+
+        # The most recent update unixtime of any photo we've seen.
+        self.latest_update = None
+
+        super().__init__(*args, **kwargs)
+
+        if self.account and self.account.photos_last_update_time:
+            self.last_update_watermark = calendar.timegm(
+                        self.account.photos_last_update_time.utctimetuple())
+
+    def fetch(self):
+        "Fetch all new and updated Photos for the Account's user."
+        self.return_value = super().fetch(days='all')
+
+        if self._not_failed() and self.latest_update is not None:
+            latest = datetime.datetime.utcfromtimestamp(self.latest_update)
+            self.account.photos_last_update_time = latest.replace(
+                                                    tzinfo=datetime.timezone.utc)
+            Account.objects.filter(pk=self.account.pk).update(
+                photos_last_update_time=self.account.photos_last_update_time)
+
+        return self.return_value
+
+    def _filter_photos(self, photos):
+        """Returns only those photos that aren't in the database, or that
+        have been updated since they were saved.
+        """
+        candidates = []
+        for photo in photos:
+            last_update = int(photo['lastupdate'])
+
+            if self.latest_update is None or last_update > self.latest_update:
+                self.latest_update = last_update
+
+            if self.last_update_watermark is None or \
+                                    last_update > self.last_update_watermark:
+                candidates.append(photo)
+
+        stored = Photo.objects.filter(
+                        flickr_id__in=[photo['id'] for photo in candidates]
+                    ).values_list('flickr_id', 'last_update_time')
+        stored = {str(flickr_id): (calendar.timegm(last_update_time.utctimetuple())
+                                        if last_update_time else None)
+                  for flickr_id, last_update_time in stored}
+
+        return [photo for photo in candidates
+                if stored.get(photo['id']) is None
+                    or int(photo['lastupdate']) > stored[photo['id']]]
 
 
 class PhotosetsFetcher(Fetcher):
@@ -438,23 +677,53 @@ class PhotosetsFetcher(Fetcher):
         self.results += results['photosets']['photoset']
 
     def _fetch_extra(self):
-        """Before saving we need to get the list of photos in each photoset."""
-
-        extra_results = []
-
-        for i, photoset in enumerate(self.results):
+        """Before saving we need to get the list of photos in each photoset.
+        Photosets that haven't changed since we last saved them are skipped.
+        The lists for the rest are fetched concurrently.
+        """
+        photosets = self._filter_photosets(self.results)
 
-            photos = self._fetch_photos_in_photoset(photoset['id'])
+        photos = self._map_in_threads(
+                        lambda photoset: self._fetch_photos_in_photoset(
+                                                        photoset['id']),
+                        photosets)
 
-            extra_results.append({
+        # Replace self.results with our new array that contains more info.
+        self.results = [{
                 'fetch_time': datetime_now(),
                 'photoset': photoset,
-                'photos': photos,
+                'photos': photoset_photos,
                 'user_obj': self.account.user,
-            })
+            } for photoset, photoset_photos in zip(photosets, photos)]
 
-        # Replace self.results with our new array that contains more info.
-        self.results = extra_results
+    def _filter_photosets(self, photosets):
+        """Returns only the photosets that we need to fetch and save.
+
+        That's those that are new, or whose date_update has changed since we
+        saved them, or which are missing some of their photos. (Because
+        we might have since fetched photos that weren't in the DB when the
+        photoset was saved.)
+
+        photosets -- A list of dicts of photosets' data from the API.
+        """
+        stored = Photoset.objects.filter(
+                flickr_id__in=[photoset['id'] for photoset in photosets]
+            ).annotate(num_photos=Count('photos'))
+        stored = {str(photoset.flickr_id): photoset for photoset in stored}
+
+        changed = []
+        for photoset in photosets:
+            photoset_obj = stored.get(photoset['id'], None)
+            if photoset_obj is None or photoset_obj.last_update_time is None:
+                changed.append(photoset)
+            elif calendar.timegm(photoset_obj.last_update_time.utctimetuple()) \
+                                        != int(photoset['date_update']):
+                changed.append(photoset)
+            elif photoset_obj.num_photos < \
+                        int(photoset['photos']) + int(photoset['videos']):
+                changed.append(photoset)
+
+        return changed
 
     def _fetch_photos_in_photoset(self, photoset_id):
         """Gets the info about all the photos in the photoset.
@@ -474,6 +743,7 @@ class PhotosetsFetcher(Fetcher):
         total_pages = 1 # Will get set to its proper value below.
 
         while page_number <= total_pages:
+            self.rate_limiter.wait()
             try:
                 results = self.api.photosets.getPhotos(
                                                 photoset_id=photoset_id,
@@ -491,7 +761,6 @@ class PhotosetsFetcher(Fetcher):
                 photos += results['photoset']['photo']
 
             page_number += 1
-            time.sleep(0.5) # Being nice.
 
         return photos
 
@@ -4,6 +4,7 @@ from django.core.files import File
 
 from . import FetchError
 from ..models import Photo
+from ...core.imagegenerators import make_placeholder
 from ...core.utils.downloader import DownloadException, filedownloader
 
 
@@ -139,6 +140,11 @@ class OriginalFilesFetcher(object):
                 photo.video_original_file.save(
                                     os.path.basename(filepath), django_file)
             else:
+                # Make this from its own copy of the file, which is closed
+                # after use, before the original is saved.
+                with open(filepath, 'rb') as placeholder_source:
+                    photo.placeholder = make_placeholder(
+                                                File(placeholder_source))
                 photo.original_file.save(
                                     os.path.basename(filepath), django_file)
 
@@ -1,5 +1,6 @@
 from . import FetchError
-from .fetchers import RecentPhotosFetcher, PhotosetsFetcher
+from .fetchers import RecentPhotosFetcher, PhotosetsFetcher,\
+    UpdatedPhotosFetcher
 from .filesfetchers import OriginalFilesFetcher
 from ..models import Account, User
 
@@ -12,6 +13,7 @@ from ..models import Account, User
 #
 # MultiAccountFetcher
 #   RecentPhotosMultiAccountFetcher
+#   UpdatedPhotosMultiAccountFetcher
 #   PhotosetsMultiAccountFetcher
 #   OriginalFilesMultiAccountFetcher
 
@@ -95,6 +97,26 @@ class RecentPhotosMultiAccountFetcher(MultiAccountFetcher):
         return self.return_value
 
 
+class UpdatedPhotosMultiAccountFetcher(MultiAccountFetcher):
+    """For fetching new and updated photos for ALL or ONE account(s).
+
+    Usage:
+
+        results = UpdatedPhotosMultiAccountFetcher().fetch()
+
+    results will be a list of dicts containing info about what was fetched (or
+    went wrong) for each account.
+    """
+
+    def fetch(self):
+        for account in self.accounts:
+            self.return_value.append(
+                UpdatedPhotosFetcher(account).fetch()
+            )
+
+        return self.return_value
+
+
 class PhotosetsMultiAccountFetcher(MultiAccountFetcher):
     """For fetching ALL photosets for ALL or ONE account(s).
 
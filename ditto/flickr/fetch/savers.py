@@ -5,7 +5,7 @@ import pytz
 from taggit.models import Tag
 
 from . import FetchError
-from ..models import Photo, Photoset, User
+from ..models import EquipmentCount, Photo, Photoset, PhotoTagCount, User
 
 
 # These classes are passed JSON data from the Flickr API and create/update
@@ -110,6 +110,16 @@ class PhotoSaver(SaveUtilsMixin, object):
     """
 
     def __init__(self, *args, **kwargs):
+        # Tag objects we've used, keyed by slug.
+        self.tags = {}
+
+        # User objects who've authored tags, keyed by NSID.
+        self.users = {}
+
+        # The years of each User's Photos whose EquipmentCounts need
+        # rebuilding, keyed by User ID. See update_equipment_counts().
+        self.equipment_years = {}
+
         super().__init__(*args, **kwargs)
 
     def save_photo(self, photo):
@@ -243,76 +253,153 @@ class PhotoSaver(SaveUtilsMixin, object):
         except KeyError:
             pass
 
+        old_equipment = Photo.objects.filter(flickr_id=photo['info']['id'])\
+                                .values(*self._equipment_fields()).first()
+
         photo_obj, created = Photo.objects.update_or_create(
                 flickr_id=photo['info']['id'],
                 defaults=defaults
             )
 
+        new_equipment = {f: getattr(photo_obj, f)
+                                        for f in self._equipment_fields()}
+        if new_equipment != old_equipment:
+            for equipment in (old_equipment, new_equipment):
+                if equipment is not None and not equipment['is_private']:
+                    self.equipment_years.setdefault(equipment['user_id'],
+                                        set()).add(equipment['taken_year'])
+
         self._save_tags(photo_obj, photo['info']['tags']['tag'])
 
         return photo_obj
 
+    def update_equipment_counts(self):
+        """
+        Rebuilds the EquipmentCounts for the Users and years of any Photos
+        whose cameras, lenses, etc have changed in save_photo().
+        Should be called after saving a batch of Photos.
+        """
+        for user_id, years in self.equipment_years.items():
+            EquipmentCount.objects.rebuild(user=user_id, years=list(years))
+        self.equipment_years = {}
+
+    def _equipment_fields(self):
+        "The names of the Photo fields that affect EquipmentCounts."
+        return ['user_id', 'taken_year', 'is_private'] + \
+                                    sorted(EquipmentCount.KIND_FIELDS.values())
+
     def _save_tags(self, photo_obj, tags_data):
         """
         Adds/deletes tags for a photo.
 
+        Rather than querying for each tag, this works out which tag-photo
+        relationships are new and which have gone, then creates and deletes
+        them in bulk. The PhotoTagCounts for those Tags are then updated.
+
         Required Arguments
           photo_obj: The Photo object we're altering tags for.
-          photo_user_obj: The User whose photo this is (because they're most
-                            likely to have created the tags.)
           tags_data: A list of dicts about the tags, straight from the API.
         """
+        through = Photo.tags.through
 
-        # The existing tag-photo relationships.
-        tagged_photos = Photo.tags.through.objects.filter(
-                                                   content_object=photo_obj)
+        # Get the Flickr IDs of all the current tag-photo relationships.
+        local_flickr_ids = set(through.objects.filter(
+                    content_object=photo_obj).values_list('flickr_id', flat=True))
+
+        remote_flickr_ids = set([tag['id'] for tag in tags_data])
+
+        # Tags that aren't currently on the photo, so need adding.
+        new_tags_data = [tag for tag in tags_data
+                                    if tag['id'] not in local_flickr_ids]
+
+        # IDs of the Tags being added, whose PhotoTagCounts need updating.
+        changed_tag_ids = set()
+
+        if new_tags_data:
+            tag_objs = self._get_or_create_tags(new_tags_data)
+            changed_tag_ids.update(t.pk for t in tag_objs.values())
+            users = self._get_tag_authors(photo_obj, new_tags_data)
+
+            through.objects.bulk_create([
+                through(
+                    flickr_id = tag['id'],
+                    author = users[tag['author']],
+                    machine_tag = (tag['machine_tag'] == "1"),
+                    content_object = photo_obj,
+                    tag = tag_objs[tag['_content']]
+                ) for tag in new_tags_data])
+
+        # Finally, delete any tag-photo relationships which are no longer on
+        # the photo on Flickr.
+        flickr_ids_to_delete = local_flickr_ids.difference(remote_flickr_ids)
 
-        local_flickr_ids = set([])
-        remote_flickr_ids = set([])
+        with PhotoTagCount.objects.batch_updates():
+            if flickr_ids_to_delete:
+                # Deleting these adds their Tags to the batch, see signals.py.
+                through.objects.filter(content_object=photo_obj,
+                                flickr_id__in=flickr_ids_to_delete).delete()
 
-        # Get the Flickr IDs of all the current tag-photo relationships.
-        for tagged_photo in tagged_photos:
-            local_flickr_ids.add(tagged_photo.flickr_id)
-
-        for tag in tags_data:
-            remote_flickr_ids.add(tag['id'])
-
-            if tag['id'] not in local_flickr_ids:
-
-                # This tag isn't currently on the photo, so add it.
-                tag_obj, tag_created = Tag.objects.get_or_create(
-                    slug=tag['_content'], defaults={ 'name':tag['raw'] }
-                )
-
-                # Who created this tag?
-                if tag['author'] == photo_obj.user.nsid:
-                    # The same person whose photo these tags are on.
-                    user = photo_obj.user
-                else:
-                    # In theory we'll already have fetched and saved data for
-                    # all authors of these tags when fetching this photo's
-                    # data.
-                    try:
-                        user = User.objects.get(nsid=tag['author'])
-                    except User.DoesNotExist:
-                        raise FetchError("Tried to add a Tag authored by a Flickr user with NSID %s who doesn't exist in the DB." % tag['author'])
-
-                pt_obj = Photo.tags.through(
-                            flickr_id = tag['id'],
-                            author = user,
-                            machine_tag = (tag['machine_tag'] == "1"),
-                            content_object = photo_obj,
-                            tag = tag_obj
-                        )
-                pt_obj.save()
+            # bulk_create() doesn't send signals, so add the new ones here:
+            PhotoTagCount.objects.tags_changed(changed_tag_ids)
 
-        flickr_ids_to_delete = local_flickr_ids.difference(remote_flickr_ids)
+    def _get_or_create_tags(self, tags_data):
+        """
+        Returns a dict of Tag objects for the tags, keyed by slug, creating
+        any Tags that don't exist yet.
+        Tags are remembered, so that saving several photos with the same
+        saver doesn't look them up again.
+
+        tags_data: A list of dicts about tags, straight from the API.
+        """
+        slugs = set([tag['_content'] for tag in tags_data])
+        missing_slugs = slugs.difference(self.tags.keys())
+
+        if missing_slugs:
+            for tag_obj in Tag.objects.filter(slug__in=missing_slugs):
+                self.tags[tag_obj.slug] = tag_obj
 
-        # Finally, delete any tag-photo relationships which were identified
-        # above as no longer on the photo on Flickr.
-        for tagged_photo in tagged_photos:
-            if tagged_photo.flickr_id in flickr_ids_to_delete:
-                tagged_photo.delete()
+            new_tag_objs = {}
+            for tag in tags_data:
+                if tag['_content'] not in self.tags:
+                    new_tag_objs.setdefault(tag['_content'],
+                            Tag(slug=tag['_content'], name=tag['raw']))
+
+            if new_tag_objs:
+                Tag.objects.bulk_create(new_tag_objs.values())
+                # Get them again, because bulk_create() doesn't set IDs on
+                # all databases.
+                for tag_obj in Tag.objects.filter(slug__in=new_tag_objs.keys()):
+                    self.tags[tag_obj.slug] = tag_obj
+
+        return {slug: self.tags[slug] for slug in slugs}
+
+    def _get_tag_authors(self, photo_obj, tags_data):
+        """
+        Returns a dict of User objects for the authors of the tags, keyed by
+        NSID.
+
+        In theory we'll already have fetched and saved data for all authors
+        of these tags when fetching this photo's data. If not, raises
+        FetchError.
+
+        photo_obj: The Photo object the tags are on.
+        tags_data: A list of dicts about tags, straight from the API.
+        """
+        # Usually the same person whose photo these tags are on.
+        self.users[photo_obj.user.nsid] = photo_obj.user
+
+        nsids = set([tag['author'] for tag in tags_data])
+        missing_nsids = nsids.difference(self.users.keys())
+
+        if missing_nsids:
+            for user in User.objects.filter(nsid__in=missing_nsids):
+                self.users[user.nsid] = user
+
+        for nsid in nsids:
+            if nsid not in self.users:
+                raise FetchError("Tried to add a Tag authored by a Flickr user with NSID %s who doesn't exist in the DB." % nsid)
+
+        return {nsid: self.users[nsid] for nsid in nsids}
 
 
 class PhotosetSaver(SaveUtilsMixin, object):
@@ -358,11 +445,19 @@ class PhotosetSaver(SaveUtilsMixin, object):
             'photos_raw':           json.dumps(photoset['photos']),
         }
 
-        try:
-            defaults['primary_photo'] = \
+        # All the photoset's photos that we have in the DB, keyed by Flickr ID.
+        photo_objs = {str(photo.flickr_id): photo for photo in
+                        Photo.objects.filter(flickr_id__in=
+                            [photo['id'] for photo in photoset['photos']])}
+
+        if ps['primary'] in photo_objs:
+            defaults['primary_photo'] = photo_objs[ps['primary']]
+        else:
+            try:
+                defaults['primary_photo'] = \
                                     Photo.objects.get(flickr_id=ps['primary'])
-        except Photo.DoesNotExist:
-            pass
+            except Photo.DoesNotExist:
+                pass
 
         photoset_obj, created = Photoset.objects.update_or_create(
                 flickr_id=ps['id'],
@@ -371,16 +466,44 @@ class PhotosetSaver(SaveUtilsMixin, object):
 
         if photoset_obj:
             # Add all the photoset's photos that we have in the DB to the
-            # photoset object.
-            photos = []
-            for photo in photoset['photos']:
-                try:
-                    photos.append( Photo.objects.get(flickr_id=photo['id']) )
-                except Photo.DoesNotExist:
-                    pass
-
-            # Sets/updates the SortedManyToMany field of the photoset's photos:
-            photoset_obj.photos = photos
+            # photoset object, in order.
+            self._save_photos(photoset_obj, [photo_objs[photo['id']]
+                                    for photo in photoset['photos']
+                                    if photo['id'] in photo_objs])
 
         return photoset_obj
 
+    def _save_photos(self, photoset_obj, photo_objs):
+        """
+        Makes the photoset's SortedManyToMany field of photos match
+        photo_objs, in the same order. Only the relationships that are
+        missing, gone, or in a different position are changed.
+
+        photoset_obj -- The Photoset object.
+        photo_objs -- A list of Photo objects, in the photoset's order.
+        """
+        through = Photoset.photos.through
+        sort_field = through._sort_field_name
+
+        existing = {row.photo_id: row for row in
+                        through.objects.filter(photoset=photoset_obj)}
+        photo_ids = [photo.pk for photo in photo_objs]
+        photo_id_set = set(photo_ids)
+
+        ids_to_delete = [row.pk for photo_id, row in existing.items()
+                                            if photo_id not in photo_id_set]
+        if ids_to_delete:
+            through.objects.filter(pk__in=ids_to_delete).delete()
+
+        rows_to_create = []
+        for position, photo_id in enumerate(photo_ids):
+            row = existing.get(photo_id, None)
+            if row is None:
+                rows_to_create.append(through(photoset=photoset_obj,
+                                **{'photo_id': photo_id, sort_field: position}))
+            elif getattr(row, sort_field) != position:
+                through.objects.filter(pk=row.pk).update(
+                                                    **{sort_field: position})
+
+        if rows_to_create:
+            through.objects.bulk_create(rows_to_create)
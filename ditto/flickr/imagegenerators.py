@@ -1,6 +1,8 @@
-from imagekit import ImageSpec, register
+from imagekit import register
 from imagekit.processors import Adjust, ResizeToFill, ResizeToFit, Transpose
 
+from ..core.imagegenerators import DraftSpec, WebPSpecMixin
+
 
 # Info about different Flickr image sizes:
 # https://www.flickr.com/services/api/misc.urls.html
@@ -10,13 +12,16 @@ from imagekit.processors import Adjust, ResizeToFill, ResizeToFit, Transpose
 
 # BASE CLASSES
 
-class FlickrSpec(ImageSpec):
+class FlickrSpec(DraftSpec):
     "Base class for most specs. Keeps same proportions."
     format = 'JPEG'
     options = {'quality': 80}
     # If original image is smaller, don't enlarge it:
     upscale = False
 
+    def get_box(self):
+        return (self.width, self.height)
+
     def __init__(self, source):
         self.processors = [
                 Transpose(),
@@ -25,12 +30,16 @@ class FlickrSpec(ImageSpec):
         super().__init__(source)
 
 
-class FlickrSquareSpec(ImageSpec):
+class FlickrSquareSpec(DraftSpec):
     "Base class for the square specs. Crops to a square."
     format = 'JPEG'
     options = {'quality': 70}
     # If original image is smaller, enlarge it to fill:
     upscale = True
+    crop = True
+
+    def get_box(self):
+        return (self.size, self.size)
 
     def __init__(self, source):
         self.processors = [
@@ -100,3 +109,50 @@ class Large2048(FlickrSpec):
     height = 2048
 register.generator('ditto_flickr:large_2048', Large2048)
 
+
+# WEBP VERSIONS
+# Used if DITTO_FLICKR_USE_WEBP is True.
+
+class SquareWebP(WebPSpecMixin, Square):
+    pass
+register.generator('ditto_flickr:square_webp', SquareWebP)
+
+class LargeSquareWebP(WebPSpecMixin, LargeSquare):
+    pass
+register.generator('ditto_flickr:large_square_webp', LargeSquareWebP)
+
+class ThumbnailWebP(WebPSpecMixin, Thumbnail):
+    pass
+register.generator('ditto_flickr:thumbnail_webp', ThumbnailWebP)
+
+class SmallWebP(WebPSpecMixin, Small):
+    pass
+register.generator('ditto_flickr:small_webp', SmallWebP)
+
+class Small320WebP(WebPSpecMixin, Small320):
+    pass
+register.generator('ditto_flickr:small_320_webp', Small320WebP)
+
+class MediumWebP(WebPSpecMixin, Medium):
+    pass
+register.generator('ditto_flickr:medium_webp', MediumWebP)
+
+class Medium640WebP(WebPSpecMixin, Medium640):
+    pass
+register.generator('ditto_flickr:medium_640_webp', Medium640WebP)
+
+class Medium800WebP(WebPSpecMixin, Medium800):
+    pass
+register.generator('ditto_flickr:medium_800_webp', Medium800WebP)
+
+class LargeWebP(WebPSpecMixin, Large):
+    pass
+register.generator('ditto_flickr:large_webp', LargeWebP)
+
+class Large1600WebP(WebPSpecMixin, Large1600):
+    pass
+register.generator('ditto_flickr:large_1600_webp', Large1600WebP)
+
+class Large2048WebP(WebPSpecMixin, Large2048):
+    pass
+register.generator('ditto_flickr:large_2048_webp', Large2048WebP)
@@ -2,8 +2,11 @@ import argparse
 
 from django.core.management.base import BaseCommand, CommandError
 
-from ....core.management.commands import DittoBaseCommand
-from ...models import Account, User
+from ....core.imagegenerators import webp_supported
+from ....core.management.commands import DittoBaseCommand,\
+                                            ThumbnailsCommandMixin
+from ... import app_settings
+from ...models import Account, Photo, User
 
 
 class FetchCommand(DittoBaseCommand):
@@ -69,3 +72,35 @@ class FetchPhotosCommand(FetchCommand):
         """
         return {}
 
+
+
+class PhotoThumbnailsMixin(ThumbnailsCommandMixin):
+    """
+    For commands that pre-generate all the sizes of Photos' images from their
+    downloaded original files.
+    """
+
+    thumbnails_field = 'original_file'
+    thumbnails_sizes = Photo.PHOTO_SIZES
+    thumbnails_singular_noun = 'Photo'
+    thumbnails_plural_noun = 'Photos'
+
+    def thumbnails_webp(self):
+        return app_settings.DITTO_FLICKR_USE_WEBP and webp_supported()
+
+    def generate_photo_thumbnails(self, nsid=None, regenerate=False,
+                                            processes=None, verbosity=1):
+        """
+        nsid -- If set, only generate for Photos by the User with this NSID,
+                which should be associated with an Account.
+        """
+        photos = Photo.objects.all()
+
+        if nsid is not None:
+            if not Account.objects.filter(user__nsid=nsid).exists():
+                raise CommandError(
+                        "There's no Account with a User NSID of '%s'" % nsid)
+            photos = photos.filter(user__nsid=nsid)
+
+        return self.generate_thumbnails(photos, regenerate=regenerate,
+                                processes=processes, verbosity=verbosity)
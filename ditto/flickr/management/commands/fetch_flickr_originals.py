@@ -1,10 +1,10 @@
 from django.core.management.base import BaseCommand, CommandError
 
-from . import FetchCommand
+from . import FetchCommand, PhotoThumbnailsMixin
 from ...fetch.multifetchers import OriginalFilesMultiAccountFetcher
 
 
-class Command(FetchCommand):
+class Command(PhotoThumbnailsMixin, FetchCommand):
     """Fetches original photo files from Flickr.
 
     For all accounts:
@@ -14,6 +14,9 @@ class Command(FetchCommand):
     For one account:
         ./manage.py fetch_flickr_originals --account=35034346050@N01
         ./manage.py fetch_flickr_originals --account=35034346050@N01 --all
+
+    To also pre-generate all the resized images afterwards:
+        ./manage.py fetch_flickr_originals --thumbnails
     """
 
     help = "Fetches the original image files for one or all Flickr Accounts"
@@ -31,6 +34,15 @@ class Command(FetchCommand):
             help="Fetch ALL files, even if they've been downloaded before. Otherwise, only fetch files that haven't already been downloaded."
         )
 
+        parser.add_argument(
+            '--thumbnails',
+            action='store_true',
+            default=False,
+            help="After fetching, generate all the resized images for Photos that don't have them yet."
+        )
+
+        self.add_processes_argument(parser)
+
     def handle(self, *args, **options):
         # We might be fetching for a specific account or all (None).
         nsid = options['account'] if options['account'] else None;
@@ -38,6 +50,11 @@ class Command(FetchCommand):
         results = self.fetch_files(nsid, options['all'])
         self.output_results(results, options.get('verbosity', 1))
 
+        if options['thumbnails']:
+            self.generate_photo_thumbnails(nsid,
+                                    processes=options['processes'],
+                                    verbosity=options.get('verbosity', 1))
+
     def fetch_files(self, nsid, fetch_all=False):
         return OriginalFilesMultiAccountFetcher(nsid=nsid).fetch(
                                                         fetch_all=fetch_all)
@@ -1,5 +1,8 @@
+from django.core.management.base import CommandError
+
 from . import FetchPhotosCommand
-from ...fetch.multifetchers import RecentPhotosMultiAccountFetcher
+from ...fetch.multifetchers import RecentPhotosMultiAccountFetcher,\
+    UpdatedPhotosMultiAccountFetcher
 
 
 class Command(FetchPhotosCommand):
@@ -8,10 +11,12 @@ class Command(FetchPhotosCommand):
     For all accounts:
         ./manage.py fetch_flickr_photos --days=3
         ./manage.py fetch_flickr_photos --days=all
+        ./manage.py fetch_flickr_photos --updated
 
     For one account:
         ./manage.py fetch_flickr_photos --account=35034346050@N01 --days=3
         ./manage.py fetch_flickr_photos --account=35034346050@N01 --days=all
+        ./manage.py fetch_flickr_photos --account=35034346050@N01 --updated
 
     """
 
@@ -19,6 +24,26 @@ class Command(FetchPhotosCommand):
 
     days_help = 'Fetches the most recent or all Photos, eg "3" or "all".'
 
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            '--updated',
+            action='store_true',
+            default=False,
+            help='Fetches only new Photos, and those changed on Flickr since they were last fetched.'
+        )
+
+    def handle(self, *args, **options):
+        if options['updated']:
+            if options['days']:
+                raise CommandError("Use either --days or --updated, not both.")
+
+            nsid = options['account'] if options['account'] else None
+            results = UpdatedPhotosMultiAccountFetcher(nsid=nsid).fetch()
+            self.output_results(results, options.get('verbosity', 1))
+        else:
+            super().handle(*args, **options)
+
     def fetch_photos(self, nsid, days):
         return RecentPhotosMultiAccountFetcher(nsid=nsid).fetch(days=days)
-
@@ -0,0 +1,40 @@
+from . import FetchCommand, PhotoThumbnailsMixin
+
+
+class Command(PhotoThumbnailsMixin, FetchCommand):
+    """Generates all the resized images for Photos with downloaded original
+    files, so that they don't have to be generated when first requested.
+
+    For all accounts:
+        ./manage.py generate_flickr_thumbnails
+        ./manage.py generate_flickr_thumbnails --all
+
+    For one account:
+        ./manage.py generate_flickr_thumbnails --account=35034346050@N01
+
+    Using a set number of processes:
+        ./manage.py generate_flickr_thumbnails --processes=4
+    """
+
+    help = "Generates resized images from Photos' original files for one or all Flickr Accounts"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            default=False,
+            help="Generate images for ALL Photos, even if they've been generated before. Otherwise, only generate those that haven't been."
+        )
+
+        self.add_processes_argument(parser)
+
+    def handle(self, *args, **options):
+        # We might be generating for a specific account or all (None).
+        nsid = options['account'] if options['account'] else None;
+
+        self.generate_photo_thumbnails(nsid,
+                                    regenerate=options['all'],
+                                    processes=options['processes'],
+                                    verbosity=options.get('verbosity', 1))
@@ -0,0 +1,35 @@
+from django.core.management.base import CommandError
+
+from . import FetchCommand
+from ...models import Account, EquipmentCount
+
+
+class Command(FetchCommand):
+    """Rebuilds the counts of public Photos per camera, lens and focal length
+    from Photos' EXIF data. These are kept up to date when Photos are
+    fetched, so this is only needed to create them for existing Photos.
+
+    For all accounts:
+        ./manage.py update_flickr_equipment_counts
+
+    For one account:
+        ./manage.py update_flickr_equipment_counts --account=35034346050@N01
+    """
+
+    help = "Rebuilds the counts of Photos per camera, lens and focal length for one or all Flickr Accounts"
+
+    def handle(self, *args, **options):
+        user = None
+
+        if options['account']:
+            try:
+                account = Account.objects.get(user__nsid=options['account'])
+            except Account.DoesNotExist:
+                raise CommandError("There's no Account with a User NSID of '%s'" % options['account'])
+            user = account.user
+
+        count = EquipmentCount.objects.rebuild(user=user)
+
+        if options.get('verbosity', 1) > 0:
+            self.stdout.write('Created %s equipment count%s' % (
+                                        count, '' if count == 1 else 's'))
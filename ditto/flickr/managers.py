@@ -1,8 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
 
 from taggit.managers import _TaggableManager
 
-from ..core.managers import PublicItemManager
+from ..core.managers import PublicItemManager, TagCountsManagerMixin
 
 
 class PhotosManager(models.Manager):
@@ -38,6 +39,133 @@ class WithAccountsManager(models.Manager):
         return super().get_queryset().filter(pk__in=user_ids)
 
 
+class EquipmentCountManager(models.Manager):
+
+    def rebuild(self, user=None, years=None):
+        """
+        Replaces EquipmentCounts with new ones counted from public Photos.
+        Returns the number of EquipmentCounts created.
+
+        Keyword arguments:
+        user -- A User, or User ID, to only rebuild their counts.
+                Default, all Users.
+        years -- A list of the years (Photos' taken_year) to rebuild, which
+                 can include None. Default, all years.
+        """
+        from .models import Photo
+        photos = Photo.public_objects.all()
+        counts = self.get_queryset()
+
+        if user is not None:
+            photos = photos.filter(user=user)
+            counts = counts.filter(user=user)
+
+        if years is not None:
+            known_years = [y for y in years if y is not None]
+            photos_q = models.Q(taken_year__in=known_years)
+            counts_q = models.Q(year__in=known_years)
+            if None in years:
+                photos_q |= models.Q(taken_year__isnull=True)
+                counts_q |= models.Q(year__isnull=True)
+            photos = photos.filter(photos_q)
+            counts = counts.filter(counts_q)
+
+        new_counts = []
+        for kind, field_name in sorted(self.model.KIND_FIELDS.items()):
+            rows = photos.exclude(**{field_name: ''})\
+                        .values('user_id', 'taken_year', field_name)\
+                        .annotate(num=models.Count('pk'))\
+                        .order_by()
+            new_counts += [self.model(user_id=row['user_id'],
+                                      year=row['taken_year'],
+                                      kind=kind,
+                                      name=row[field_name],
+                                      count=row['num']) for row in rows]
+
+        with transaction.atomic():
+            counts.delete()
+            self.bulk_create(new_counts)
+
+        return len(new_counts)
+
+
+class PhotoTagCountManager(TagCountsManagerMixin, models.Manager):
+
+    # How many Tags to count and update in each query, to keep under
+    # SQLite's limit of 999 parameters per query.
+    batch_size = 150
+
+    def update_for_tags(self, tag_ids=None):
+        """
+        Counts the public, and all, Photos with each Tag, and creates,
+        updates or deletes their PhotoTagCounts.
+
+        Keyword arguments:
+        tag_ids -- An iterable of the IDs of Tags to count. Default, all.
+        """
+        from .models import TaggedPhoto
+
+        if tag_ids is None:
+            self._update_counts(TaggedPhoto.objects.all(), self.get_queryset())
+            return
+
+        tag_ids = sorted(set(tag_ids))
+        for i in range(0, len(tag_ids), self.batch_size):
+            batch = tag_ids[i:i + self.batch_size]
+            self._update_counts(TaggedPhoto.objects.filter(tag_id__in=batch),
+                                self.filter(tag_id__in=batch))
+
+    def update_tag_counts(self, tag_ids):
+        "Used by TagCountsManagerMixin."
+        self.update_for_tags(tag_ids)
+
+    def _update_counts(self, tagged_photos, counts):
+        """
+        Makes the PhotoTagCounts in the counts QuerySet match the
+        TaggedPhotos in the tagged_photos QuerySet, which should be for the
+        same Tags.
+        """
+        rows = tagged_photos.values('tag_id').annotate(
+                    total=Count('pk'),
+                    public=Sum(Case(
+                        When(content_object__is_private=False, then=Value(1)),
+                        default=Value(0), output_field=IntegerField()))
+                ).order_by()
+        new_counts = {row['tag_id']: (row['public'], row['total'])
+                                                            for row in rows}
+
+        unused_tag_ids = []
+        changed_counts = {}
+        for count in counts:
+            if count.tag_id not in new_counts:
+                unused_tag_ids.append(count.tag_id)
+                continue
+            public, total = new_counts.pop(count.tag_id)
+            if (count.public_count, count.total_count) != (public, total):
+                changed_counts[count.tag_id] = (public, total)
+
+        for i in range(0, len(unused_tag_ids), self.batch_size):
+            self.filter(
+                tag_id__in=unused_tag_ids[i:i + self.batch_size]).delete()
+
+        # Update them in as few queries as possible.
+        changed_counts = list(changed_counts.items())
+        for i in range(0, len(changed_counts), self.batch_size):
+            batch = changed_counts[i:i + self.batch_size]
+            self.filter(tag_id__in=[tag_id for tag_id, counts in batch]).update(
+                public_count=Case(*[When(tag_id=tag_id, then=Value(public))
+                                    for tag_id, (public, total) in batch],
+                                    output_field=IntegerField()),
+                total_count=Case(*[When(tag_id=tag_id, then=Value(total))
+                                    for tag_id, (public, total) in batch],
+                                    output_field=IntegerField()))
+
+        if new_counts:
+            self.bulk_create([
+                self.model(tag_id=tag_id, public_count=public, total_count=total)
+                for tag_id, (public, total) in new_counts.items()])
+
+
 class _PhotoTaggableManager(_TaggableManager):
     """Providing some extra features related to private Photos."""
 
@@ -45,7 +173,15 @@ class _PhotoTaggableManager(_TaggableManager):
         """Gets the most commonly-used tags but:
             * Doesn't count tags on private Photos
         Overriding django-taggit's standard `most_common()` method.
+
+        For all Photos, this reads the counts stored in PhotoTagCount.
         """
+        if self.instance is None:
+            return self.through.tag_model().objects\
+                    .filter(flickr_photo_count__public_count__gt=0)\
+                    .annotate(num_times=F('flickr_photo_count__public_count'))\
+                    .order_by('-num_times')
+
         extra_filters = {
             'photo__is_private': False,
         }
@@ -54,3 +190,23 @@ class _PhotoTaggableManager(_TaggableManager):
             num_times=models.Count(self.through.tag_relname())
         ).order_by('-num_times')
 
+    # Removing tags updates their PhotoTagCounts (see signals.py) once for
+    # all of the tags, rather than once for each. (We can't add() tags
+    # because a TaggedPhoto needs an author.)
+
+    def set(self, *tags, **kwargs):
+        with self._photo_tag_counts().batch_updates():
+            super().set(*tags, **kwargs)
+
+    def remove(self, *tags):
+        with self._photo_tag_counts().batch_updates():
+            super().remove(*tags)
+
+    def clear(self):
+        with self._photo_tag_counts().batch_updates():
+            super().clear()
+
+    def _photo_tag_counts(self):
+        from .models import PhotoTagCount
+        return PhotoTagCount.objects
+
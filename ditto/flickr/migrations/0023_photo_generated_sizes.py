@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 21:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickr', '0022_photo_taken_year'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='generated_sizes',
+            field=models.TextField(blank=True, help_text='JSON recording pre-generated image files for each size. Set automatically.'),
+        ),
+    ]
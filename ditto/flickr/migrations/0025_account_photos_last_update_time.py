@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 21:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickr', '0024_photo_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='photos_last_update_time',
+            field=models.DateTimeField(blank=True, help_text="The most recent time any of this Account's Photos had been modified on Flickr, when they were last fetched with fetch_flickr_photos --updated. Set automatically.", null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 21:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from ditto.core.utils import geohash
+
+
+def set_geohash(apps, schema_editor):
+    """
+    Sets the `geohash` value on every Photo with a location.
+    """
+    Photo = apps.get_model('flickr', 'Photo')
+    for row in Photo.objects.exclude(latitude=None).exclude(longitude=None):
+        Photo.objects.filter(pk=row.pk).update(
+                        geohash=geohash.encode(row.latitude, row.longitude))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickr', '0025_account_photos_last_update_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, help_text="Identifies the area of the map the item's in. Set automatically on save.", max_length=12),
+        ),
+
+        migrations.RunPython(set_geohash, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 22:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickr', '0026_photo_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EquipmentCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_created', models.DateTimeField(auto_now_add=True, help_text='The time this item was created in the database.')),
+                ('time_modified', models.DateTimeField(auto_now=True, help_text='The time this item was last saved to the database.')),
+                ('year', models.PositiveSmallIntegerField(blank=True, help_text='The year the Photos were taken, if known.', null=True)),
+                ('kind', models.CharField(choices=[('camera', 'Camera'), ('lens', 'Lens'), ('focal_length', 'Focal length')], max_length=20)),
+                ('name', models.CharField(help_text="eg, 'Canon EOS 5D' or '50 mm'.", max_length=50)),
+                ('count', models.PositiveIntegerField(default=0, help_text='The number of public Photos.')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='flickr.User')),
+            ],
+            options={
+                'ordering': ('-count',),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='equipmentcount',
+            unique_together=set([('user', 'year', 'kind', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='equipmentcount',
+            index_together=set([('kind', 'year')]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 22:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_tag_counts(apps, schema_editor):
+    """
+    Creates a PhotoTagCount for every Tag used on Photos.
+    """
+    TaggedPhoto = apps.get_model('flickr', 'TaggedPhoto')
+    PhotoTagCount = apps.get_model('flickr', 'PhotoTagCount')
+    counts = {}
+    for row in TaggedPhoto.objects.values('tag_id',
+                                            'content_object__is_private'):
+        public, total = counts.get(row['tag_id'], (0, 0))
+        if not row['content_object__is_private']:
+            public += 1
+        counts[row['tag_id']] = (public, total + 1)
+    PhotoTagCount.objects.bulk_create([
+        PhotoTagCount(tag_id=tag_id, public_count=public, total_count=total)
+        for tag_id, (public, total) in counts.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0002_auto_20150616_2121'),
+        ('flickr', '0027_equipmentcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoTagCount',
+            fields=[
+                ('time_created', models.DateTimeField(auto_now_add=True, help_text='The time this item was created in the database.')),
+                ('time_modified', models.DateTimeField(auto_now=True, help_text='The time this item was last saved to the database.')),
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='flickr_photo_count', serialize=False, to='taggit.Tag')),
+                ('public_count', models.PositiveIntegerField(db_index=True, default=0, help_text='The number of public Photos with this Tag.')),
+                ('total_count', models.PositiveIntegerField(default=0, help_text='The number of public and private Photos with this Tag.')),
+            ],
+            options={
+                'verbose_name': 'Photo tag count',
+            },
+        ),
+
+        migrations.RunPython(set_tag_counts, reverse_code=migrations.RunPython.noop),
+    ]
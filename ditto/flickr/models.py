@@ -6,12 +6,15 @@ from django.templatetags.static import static
 from imagekit.cachefiles import ImageCacheFile
 from sortedm2m.fields import SortedManyToManyField
 from taggit.managers import TaggableManager
-from taggit.models import TaggedItemBase
+from taggit.models import Tag, TaggedItemBase
 
 from . import app_settings
 from . import imagegenerators
 from . import managers
-from ..core.models import DiffModelMixin, DittoItemModel, TimeStampedModelMixin
+from ..core.imagegenerators import webp_supported
+from ..core.models import DiffModelMixin, DittoItemModel, GeohashMixin,\
+                            GeneratedSizesMixin, TimeStampedModelMixin
+from ..core.utils.thumbnails import get_cachefile_storage
 
 
 class Account(TimeStampedModelMixin, models.Model):
@@ -26,6 +29,9 @@ class Account(TimeStampedModelMixin, models.Model):
     is_active = models.BooleanField(default=True,
                             help_text="If false, new Photos won't be fetched.")
 
+    photos_last_update_time = models.DateTimeField(null=True, blank=True,
+        help_text="The most recent time any of this Account's Photos had been modified on Flickr, when they were last fetched with fetch_flickr_photos --updated. Set automatically.")
+
     def __str__(self):
         if self.user:
             return str(self.user)
@@ -76,6 +82,60 @@ class TaggedPhoto(TaggedItemBase):
         verbose_name = 'Photo/Tag Relationship'
 
 
+class PhotoTagCount(TimeStampedModelMixin, models.Model):
+    """
+    The number of Photos with each Tag, so that the most common Tags can be
+    listed without counting all the TaggedPhotos each time.
+
+    Kept up to date by PhotoSaver, Photo.save(), and when Photos are deleted
+    (see signals.py).
+    """
+    tag = models.OneToOneField(Tag, primary_key=True,
+                                        related_name='flickr_photo_count')
+    public_count = models.PositiveIntegerField(default=0, db_index=True,
+                help_text="The number of public Photos with this Tag.")
+    total_count = models.PositiveIntegerField(default=0,
+                help_text="The number of public and private Photos with this Tag.")
+
+    objects = managers.PhotoTagCountManager()
+
+    class Meta:
+        verbose_name = 'Photo tag count'
+
+    def __str__(self):
+        return '%s (%s)' % (self.tag, self.public_count)
+
+
+class SizeURLDescriptor(object):
+    """
+    Provides Photo's URL properties, like `small_320_url` or `site_mp4_url`,
+    one for each of Photo.PHOTO_SIZES and Photo.VIDEO_SIZES.
+
+    Each URL is made once per Photo instance and then kept in the instance's
+    `_url_cache` dict, which is emptied when the Photo is saved.
+    """
+
+    def __init__(self, size, method_name):
+        """
+        size -- A key from Photo.PHOTO_SIZES or Photo.VIDEO_SIZES.
+        method_name -- The Photo method that makes this size's URL,
+                        eg '_image_url' or '_video_url'.
+        """
+        self.size = size
+        self.method_name = method_name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        cache = instance.__dict__.setdefault('_url_cache', {})
+        try:
+            return cache[self.size]
+        except KeyError:
+            url = getattr(instance, self.method_name)(self.size)
+            cache[self.size] = url
+            return url
+
+
 class ExtraPhotoManagers(models.Model):
     """Managers to use in the Photo model, in addition to the defaults defined
     in DittoItemModel.
@@ -89,75 +149,89 @@ class ExtraPhotoManagers(models.Model):
         abstract = True
 
 
-class Photo(DittoItemModel, ExtraPhotoManagers):
+class Photo(DittoItemModel, ExtraPhotoManagers, GeneratedSizesMixin,
+                                                            GeohashMixin):
 
     ditto_item_name = 'flickr_photo'
 
+    generated_sizes_source = 'original_file'
+
     # The keys in this dict are what we use internally, for method names and
     # for the sizes of PhotoDownloads.
     # The 'label's are used in Flickr's API to identify sizes.
     # The 'generator's are used to create an image of that size from original
-    # files.
+    # files, and the 'webp_generator's to create WebP versions of them.
     # See https://www.flickr.com/services/api/misc.urls.html
     PHOTO_SIZES = {
         'square': {
             'label':    'Square',
             'suffix':   's',   # Used in this size's flickr.com URL.
             'generator': imagegenerators.Square,
+            'webp_generator': imagegenerators.SquareWebP,
         },
         'large_square': {
             'label':    'Large square',
             'suffix':   'q',
             'generator': imagegenerators.LargeSquare,
+            'webp_generator': imagegenerators.LargeSquareWebP,
         },
         'thumbnail': {
             'label':    'Thumbnail',
             'suffix':   't',
             'generator': imagegenerators.Thumbnail,
+            'webp_generator': imagegenerators.ThumbnailWebP,
         },
         'small':    {
             'label':    'Small',
             'suffix':   'm',
             'generator': imagegenerators.Small,
+            'webp_generator': imagegenerators.SmallWebP,
         },
         'small_320':    {
             'label':    'Small 320',
             'suffix':   'n',
             'generator': imagegenerators.Small320,
+            'webp_generator': imagegenerators.Small320WebP,
         },
         'medium':    {
             'label':    'Medium',
             'suffix':   '',
             'generator': imagegenerators.Medium,
+            'webp_generator': imagegenerators.MediumWebP,
         },
         'medium_640':    {
             'label':    'Medium 640',
             'suffix':   'z',
             'generator': imagegenerators.Medium640,
+            'webp_generator': imagegenerators.Medium640WebP,
         },
         # Only exist after March 1st 2012.
         'medium_800':    {
             'label':    'Medium 800',
             'suffix':   'c',
             'generator': imagegenerators.Medium800,
+            'webp_generator': imagegenerators.Medium800WebP,
         },
         # Before May 25th 2010, large only exist for very large original images.
         'large':    {
             'label':    'Large',
             'suffix':   'b',
             'generator': imagegenerators.Large,
+            'webp_generator': imagegenerators.LargeWebP,
         },
         # Only exist after March 1st 2012.
         'large_1600':    {
             'label':    'Large 1600',
             'suffix':   'h',
             'generator': imagegenerators.Large1600,
+            'webp_generator': imagegenerators.Large1600WebP,
         },
         # Only exist after March 1st 2012.
         'large_2048':    {
             'label':    'Large 2048',
             'suffix':   'k',
             'generator': imagegenerators.Large2048,
+            'webp_generator': imagegenerators.Large2048WebP,
         },
         'original':    {
             'label':    'Original',
@@ -442,7 +516,19 @@ class Photo(DittoItemModel, ExtraPhotoManagers):
             self.taken_year = self.taken_time.year
         else:
             self.taken_year = None
+        privacy_changed = self.pk is not None and \
+                                    self.get_field_diff('is_private') is not None
         super().save(*args, **kwargs)
+        if privacy_changed:
+            # The public counts of all this Photo's Tags have changed.
+            PhotoTagCount.objects.tags_changed(
+                                    self.tags.values_list('pk', flat=True))
+        # The URLs may have changed, eg if we have a new original_file.
+        self.__dict__.pop('_url_cache', None)
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.__dict__.pop('_url_cache', None)
 
     def get_absolute_url(self):
         return reverse('flickr:photo_detail',
@@ -556,19 +642,68 @@ class Photo(DittoItemModel, ExtraPhotoManagers):
         """
         if app_settings.DITTO_FLICKR_USE_LOCAL_MEDIA:
             return self._local_image_url(size)
+        elif app_settings.DITTO_FLICKR_USE_MEDIA_CACHE and not self.is_private:
+            return self._cached_image_url(size)
         else:
             return self._remote_image_url(size)
 
-    def _local_image_url(self, size):
+    def webp_image_url(self, size):
+        """
+        The URL of a WebP version of an image of a particular size, hosted
+        locally. Or '' if DITTO_FLICKR_USE_LOCAL_MEDIA and
+        DITTO_FLICKR_USE_WEBP aren't both True, or there's no WebP version of
+        this size.
+        size -- One of the keys from self.PHOTO_SIZES.
+        """
+        if app_settings.DITTO_FLICKR_USE_LOCAL_MEDIA and \
+            app_settings.DITTO_FLICKR_USE_WEBP and \
+            'webp_generator' in self.PHOTO_SIZES[size] and \
+            webp_supported():
+            return self._local_image_url(size, webp=True)
+        else:
+            return ''
+
+    def generated_image_url(self, size, webp=False, generated_sizes=None):
+        """
+        The URL of an image of a particular size, hosted locally, but only if
+        it doesn't need generating first: ie, it's the original file, or a
+        size that's been pre-generated. Otherwise None.
+        size -- One of the keys from self.PHOTO_SIZES.
+        webp -- If True, the URL of the WebP version of the image.
+        generated_sizes -- The result of get_generated_sizes(), if it's
+                           already been called.
+        """
+        if not self.original_file:
+            return None
+        if size == 'original':
+            return None if webp else self.original_file.url
+        if generated_sizes is None:
+            generated_sizes = self.get_generated_sizes()
+        name = generated_sizes.get('%s_webp' % size if webp else size)
+        if name:
+            return get_cachefile_storage().url(name)
+        else:
+            return None
+
+    def _local_image_url(self, size, webp=False):
         """
         Generate the URL of an image of a particular size, hosted locally,
         based on the original file (which must already be downloaded).
+        webp -- If True, the URL of the WebP version of the image.
         """
         if self.original_file:
             if size == 'original':
                 return self.original_file.url
             else:
-                generator = self.PHOTO_SIZES[size]['generator']
+                if webp:
+                    generator = self.PHOTO_SIZES[size]['webp_generator']
+                    size = '%s_webp' % size
+                else:
+                    generator = self.PHOTO_SIZES[size]['generator']
+                url = self.get_generated_size_url(size)
+                if url is not None:
+                    # Already generated, so no need to check storage.
+                    return url
                 try:
                     image_generator = generator(source=self.original_file)
                     result = ImageCacheFile(image_generator)
@@ -581,6 +716,15 @@ class Photo(DittoItemModel, ExtraPhotoManagers):
             # We haven't downloaded an original file for this Photo.
             return static('img/original_missing.jpg')
 
+    def _cached_image_url(self, size):
+        """
+        The URL of the media cache view, which serves a local copy of the
+        image from flickr.com, fetching it first if need be.
+        size -- One of the keys from self.PHOTO_SIZES.
+        """
+        return reverse('ditto:media_cache', kwargs={
+                        'service': 'flickr', 'id': self.flickr_id, 'size': size})
+
     def _remote_image_url(self, size):
         """
         Generate the URL of an image of a particular size, on flickr.com.
@@ -626,37 +770,21 @@ class Photo(DittoItemModel, ExtraPhotoManagers):
             url_size = self.VIDEO_SIZES[size]['url_size']
             return '%splay/%s/%s/' % (self.permalink, url_size, secret)
 
-    def __getattr__(self, name):
-        """
-        Enables us to use properties like 'small_320_url' or 'site_mp4_url'.
-        Will call the correct internal helper method to return the URL.
-        """
-        try:
-            # Split 'small_240_url' into ['small_240', 'url']
-            size, attr = name.rsplit('_', 1)
-        except ValueError:
-            self._raise_attr_error(type(self).__name__, name)
-
-        if attr == 'url':
-            # eg video_original_url()
-            if size in self.VIDEO_SIZES:
-                return self._video_url(size)
-            elif size in self.PHOTO_SIZES:
-                return self._image_url(size)
-            else:
-                self._raise_attr_error(type(self).__name__, name)
-        else:
-            self._raise_attr_error(type(self).__name__, name)
-
-    def _raise_attr_error(self, obj, attr):
-        msg = "'{0}' object has no attribute '{1}'"
-        raise AttributeError(msg.format(obj, attr))
-
     def _summary_source(self):
         "Used to make the `summary` property."
         return self.description
 
 
+def _add_size_url_descriptors():
+    "Adds the properties like Photo.small_320_url and Photo.site_mp4_url."
+    for size in Photo.PHOTO_SIZES:
+        setattr(Photo, '%s_url' % size, SizeURLDescriptor(size, '_image_url'))
+    for size in Photo.VIDEO_SIZES:
+        setattr(Photo, '%s_url' % size, SizeURLDescriptor(size, '_video_url'))
+
+_add_size_url_descriptors()
+
+
 class Photoset(TimeStampedModelMixin, DiffModelMixin, models.Model):
     user = models.ForeignKey('User')
     flickr_id = models.BigIntegerField(null=False, blank=False, unique=True,
@@ -802,3 +930,46 @@ class User(TimeStampedModelMixin, DiffModelMixin, models.Model):
         else:
             return 'https://www.flickr.com/images/buddyicon.gif'
 
+
+
+class EquipmentCount(TimeStampedModelMixin, models.Model):
+    """
+    The number of public Photos a User took in a year with each camera,
+    lens or focal length, from the Photos' EXIF data. So that these can be
+    listed without counting every Photo.
+
+    Kept up to date by PhotoSaver, and can be rebuilt with the
+    update_flickr_equipment_counts management command.
+    """
+
+    KIND_CHOICES = (
+        ('camera',          'Camera'),
+        ('lens',            'Lens'),
+        ('focal_length',    'Focal length'),
+    )
+
+    # The Photo field that each kind is counted from.
+    KIND_FIELDS = {
+        'camera':       'exif_camera',
+        'lens':         'exif_lens_model',
+        'focal_length': 'exif_focal_length',
+    }
+
+    user = models.ForeignKey('User')
+    year = models.PositiveSmallIntegerField(null=True, blank=True,
+                    help_text="The year the Photos were taken, if known.")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    name = models.CharField(max_length=50,
+                                    help_text="eg, 'Canon EOS 5D' or '50 mm'.")
+    count = models.PositiveIntegerField(default=0,
+                                help_text="The number of public Photos.")
+
+    objects = managers.EquipmentCountManager()
+
+    class Meta:
+        ordering = ('-count',)
+        unique_together = (('user', 'year', 'kind', 'name'),)
+        index_together = (('kind', 'year'),)
+
+    def __str__(self):
+        return '%s: %s (%s)' % (self.get_kind_display(), self.name, self.count)
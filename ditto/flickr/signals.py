@@ -0,0 +1,65 @@
+import threading
+
+from django.db.models.signals import post_delete, post_save, pre_delete,\
+        pre_save
+from django.dispatch import receiver
+
+from .models import Photo, PhotoTagCount, TaggedPhoto
+
+
+# Adding, changing or deleting a TaggedPhoto (including in the Admin, or
+# with Photo.tags.add(), remove() or clear()) updates its Tag's count.
+
+@receiver(pre_save, sender=TaggedPhoto,
+          dispatch_uid='ditto.flickr.tagged_photo_counts')
+def tagged_photo_pre_save(sender, instance, raw, **kwargs):
+    "Remember the TaggedPhoto's Tag, in case it's being changed."
+    if instance.pk is not None and not raw:
+        instance._old_tag_id = TaggedPhoto.objects.filter(
+                    pk=instance.pk).values_list('tag_id', flat=True).first()
+
+
+@receiver(post_save, sender=TaggedPhoto,
+          dispatch_uid='ditto.flickr.tagged_photo_counts')
+def tagged_photo_post_save(sender, instance, raw, **kwargs):
+    if not raw:
+        tag_ids = {instance.tag_id, getattr(instance, '_old_tag_id', None)}
+        tag_ids.discard(None)
+        PhotoTagCount.objects.tags_changed(tag_ids)
+
+
+@receiver(post_delete, sender=TaggedPhoto,
+          dispatch_uid='ditto.flickr.tagged_photo_counts')
+def tagged_photo_post_delete(sender, instance, **kwargs):
+    if instance.content_object_id not in _deleting_photo_ids():
+        PhotoTagCount.objects.tags_changed([instance.tag_id])
+
+
+# Deleting a Photo (including with a QuerySet's delete(), or when deleting
+# its User) deletes its TaggedPhotos. Rather than updating each one's count
+# as it's deleted, they're all updated once the Photo has gone.
+
+_deleting = threading.local()
+
+
+def _deleting_photo_ids():
+    "The IDs of Photos being deleted in this thread."
+    if not hasattr(_deleting, 'photo_ids'):
+        _deleting.photo_ids = set()
+    return _deleting.photo_ids
+
+
+@receiver(pre_delete, sender=Photo, dispatch_uid='ditto.flickr.photo_tags')
+def photo_pre_delete(sender, instance, **kwargs):
+    "Remember the Photo's Tags before the TaggedPhotos are deleted."
+    instance._deleted_tag_ids = list(
+                            instance.tags.values_list('pk', flat=True))
+    _deleting_photo_ids().add(instance.pk)
+
+
+@receiver(post_delete, sender=Photo, dispatch_uid='ditto.flickr.photo_tags')
+def photo_post_delete(sender, instance, **kwargs):
+    _deleting_photo_ids().discard(instance.pk)
+    tag_ids = getattr(instance, '_deleted_tag_ids', [])
+    if tag_ids:
+        PhotoTagCount.objects.tags_changed(tag_ids)
@@ -1,17 +1,29 @@
 import datetime
+import re
+
 import pytz
 
 from django import template
+from django.db.models import Sum
 from django.utils.html import format_html
 
-from ..models import Photo, Photoset, User
+from .. import app_settings
+from ..models import EquipmentCount, Photo, Photoset, User
+from ...core.imagegenerators import webp_supported
 from ...core.templatetags.ditto_core import display_time
-from ...core.utils import get_annual_item_counts
+from ...core.utils import get_annual_item_counts, make_picture, make_srcset
 
 
 register = template.Library()
 
 
+# The Photo.PHOTO_SIZES used in srcsets, smallest first.
+# The squares are cropped so can't be mixed with the others.
+SRCSET_SIZES = ('thumbnail', 'small', 'small_320', 'medium', 'medium_640',
+                'medium_800', 'large', 'large_1600', 'large_2048',)
+SRCSET_SQUARE_SIZES = ('square', 'large_square',)
+
+
 @register.assignment_tag
 def recent_photos(nsid=None, limit=10):
     """Returns a QuerySet of recent public Photos, in reverse-chronological
@@ -112,3 +124,130 @@ def annual_photo_counts(nsid=None, count_by='post_time'):
 
     return get_annual_item_counts(qs, field_name)
 
+
+def _equipment_counts(kind, nsid=None, year=None):
+    """
+    Returns a QuerySet of dicts like {'name': 'Canon EOS 5D', 'count': 123},
+    most-used first, from EquipmentCounts of this kind.
+    """
+    counts = EquipmentCount.objects.filter(kind=kind)
+    if nsid is None:
+        counts = counts.filter(user__in=User.objects_with_accounts.all())
+    else:
+        counts = counts.filter(user__nsid=nsid)
+    if year is not None:
+        counts = counts.filter(year=year)
+    return counts.values('name')\
+                .annotate(count=Sum('count'))\
+                .order_by('-count', 'name')
+
+
+@register.assignment_tag
+def top_cameras(nsid=None, year=None, limit=10):
+    """
+    Get the cameras used to take the most public Photos.
+    Returns a list of dicts, most-used first, like:
+        [ {'name': 'Canon EOS 5D', 'count': 1234}, ... ]
+
+    Keyword arguments:
+    nsid -- A Flickr user's NSID or None (for Photos by all Users).
+    year -- Only count Photos taken in this year. Default, all years.
+    limit -- Maximum number of cameras. Default is 10.
+    """
+    return list(_equipment_counts('camera', nsid, year)[:limit])
+
+
+@register.assignment_tag
+def top_lenses(nsid=None, year=None, limit=10):
+    """
+    Get the lenses used to take the most public Photos.
+    Returns a list of dicts like top_cameras().
+    """
+    return list(_equipment_counts('lens', nsid, year)[:limit])
+
+
+@register.assignment_tag
+def focal_length_histogram(nsid=None, year=None):
+    """
+    Get the number of public Photos taken at each focal length.
+    Returns a list of dicts, sorted by focal length, like:
+        [ {'name': '4.2 mm', 'focal_length': 4.2, 'count': 12}, ... ]
+    Focal lengths that aren't numbers are left out.
+
+    Keyword arguments:
+    nsid -- A Flickr user's NSID or None (for Photos by all Users).
+    year -- Only count Photos taken in this year. Default, all years.
+    """
+    histogram = []
+    for row in _equipment_counts('focal_length', nsid, year):
+        match = re.match(r'\s*(\d+(?:\.\d+)?)', row['name'])
+        if match:
+            row['focal_length'] = float(match.group(1))
+            histogram.append(row)
+    return sorted(histogram, key=lambda row: row['focal_length'])
+
+
+def _photo_srcset(photo, square=False, webp=False, generated_sizes=None):
+    sizes = SRCSET_SQUARE_SIZES if square else SRCSET_SIZES
+    if app_settings.DITTO_FLICKR_USE_LOCAL_MEDIA:
+        # Only use files that already exist, so that showing a Photo doesn't
+        # generate every size of it.
+        if webp and not (app_settings.DITTO_FLICKR_USE_WEBP and
+                                                        webp_supported()):
+            return ''
+        if generated_sizes is None:
+            generated_sizes = photo.get_generated_sizes()
+        candidates = [(photo.generated_image_url(size, webp=webp,
+                                            generated_sizes=generated_sizes),
+                        getattr(photo, '%s_width' % size)) for size in sizes]
+    elif webp:
+        # WebP images are only available locally.
+        return ''
+    else:
+        candidates = [(getattr(photo, '%s_url' % size),
+                        getattr(photo, '%s_width' % size)) for size in sizes]
+    return make_srcset(candidates)
+
+
+@register.simple_tag
+def photo_srcset(photo, square=False):
+    """Returns the value for an <img>'s srcset attribute, listing all the
+    sizes of this Photo's image. eg:
+        <img src="{{ photo.small_url }}" srcset="{% photo_srcset photo %}"
+            sizes="240px" alt="">
+
+    Keyword arguments:
+    square -- If True, use the square sizes instead of the others.
+    """
+    return _photo_srcset(photo, square=square)
+
+
+@register.simple_tag
+def photo_picture(photo, size='small', sizes='', css_class=''):
+    """Returns an <img> for the Photo with a srcset of all its sizes, and its
+    placeholder, if any, as a background while it loads.
+    If DITTO_FLICKR_USE_LOCAL_MEDIA and DITTO_FLICKR_USE_WEBP are True, it's
+    in a <picture> with a <source> for the WebP versions.
+    With local media, the srcsets only include sizes that have already been
+    generated (see the generate_flickr_thumbnails command). eg:
+        {% photo_picture photo size='small' css_class='img-fluid' %}
+
+    Keyword arguments:
+    size -- One of Photo.PHOTO_SIZES, used for the src, width and height.
+    sizes -- Value for the sizes attribute. Default is size's width in px.
+    css_class -- Value for the <img>'s class attribute.
+    """
+    square = size in SRCSET_SQUARE_SIZES
+    # Only parse this once:
+    generated_sizes = photo.get_generated_sizes()
+    return make_picture(src=getattr(photo, '%s_url' % size),
+                        width=getattr(photo, '%s_width' % size),
+                        height=getattr(photo, '%s_height' % size),
+                        srcset=_photo_srcset(photo, square=square,
+                                        generated_sizes=generated_sizes),
+                        webp_srcset=_photo_srcset(photo, square=square,
+                                        webp=True,
+                                        generated_sizes=generated_sizes),
+                        sizes=sizes,
+                        css_class=css_class,
+                        placeholder=photo.placeholder)
@@ -15,11 +15,11 @@ class AccountAdmin(admin.ModelAdmin):
             'fields': ('username', 'realname', 'api_key', 'is_active', )
         }),
         ('Data', {
-            'fields': ('time_created', 'time_modified',)
+            'fields': ('last_scrobble_time', 'time_created', 'time_modified',)
         }),
     )
 
-    readonly_fields = ('time_created', 'time_modified',)
+    readonly_fields = ('last_scrobble_time', 'time_created', 'time_modified',)
 
 
 @admin.register(Artist)
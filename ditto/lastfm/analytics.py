@@ -0,0 +1,321 @@
+"""
+Statistics about listening habits, calculated from all of an Account's
+Scrobbles (or everyone's) at once using NumPy.
+
+Requires NumPy to be installed. Use like:
+
+    from ditto.lastfm import analytics
+
+    analytics.streaks(account)
+    analytics.hour_weekday_counts(account)
+    analytics.sessions(account, gap=30)
+    analytics.artist_curve(artist, account, period='month')
+
+`account` can be None to use everyone's Scrobbles.
+
+The Scrobbles are only loaded from the database when some have been
+added, deleted or saved (by any process) since they were last loaded in
+this process, which is checked with cube.get_version(). Results are cached
+until then too, up to MAX_RESULTS for each Account.
+"""
+from collections import OrderedDict
+import datetime
+import threading
+
+import pytz
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from .cube import CHUNK_SIZE, get_version, mark_changed, to_microseconds
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Microseconds in an hour.
+HOUR = 60 * 60 * 1000000
+
+# 1970-01-01 was a Thursday; this makes Monday 0.
+EPOCH_WEEKDAY = 3
+
+# The most results to cache for each ListeningData. eg, one streaks() for
+# each day, and one artist_curve() for each Artist and period.
+MAX_RESULTS = 100
+
+
+class ListeningData(object):
+    """
+    NumPy arrays of the post_time (as datetime64[us], UTC), artist ID and
+    track ID of every Scrobble by one Account, or all Accounts, sorted by
+    post_time.
+    """
+
+    def __init__(self, account_id=None):
+        self.account_id = account_id
+
+        self.post_times = np.zeros(0, dtype='datetime64[us]')
+        self.artists = np.zeros(0, dtype=np.int64)
+        self.tracks = np.zeros(0, dtype=np.int64)
+
+        # The result of cube.get_version() when loaded:
+        self.version = None
+
+        # Results of calculations, keyed by the function and arguments,
+        # least recently used first.
+        self.results = OrderedDict()
+
+        # Held while loading or calculating.
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.post_times)
+
+    def scrobbles(self):
+        "The QuerySet of Scrobbles we use."
+        from .models import Scrobble
+        qs = Scrobble.objects.all()
+        if self.account_id is not None:
+            qs = qs.filter(account_id=self.account_id)
+        return qs
+
+    def update(self):
+        "Reloads the data if the Scrobbles have changed since it was loaded."
+        version = get_version()
+        with self.lock:
+            if version != self.version:
+                self.load()
+                self.version = version
+
+    def load(self):
+        "Loads all the Scrobbles, CHUNK_SIZE at a time."
+        times, artists, tracks = [], [], []
+        rows = self.scrobbles().order_by('post_time').values_list(
+                                'post_time', 'artist_id', 'track_id').iterator()
+        while True:
+            chunk = []
+            for row in rows:
+                chunk.append((to_microseconds(row[0]), row[1], row[2]))
+                if len(chunk) == CHUNK_SIZE:
+                    break
+            if len(chunk) == 0:
+                break
+            array = np.array(chunk, dtype=np.int64)
+            times.append(array[:, 0])
+            artists.append(array[:, 1])
+            tracks.append(array[:, 2])
+
+        if len(times) > 0:
+            self.post_times = np.concatenate(times).astype('datetime64[us]')
+            self.artists = np.concatenate(artists)
+            self.tracks = np.concatenate(tracks)
+        else:
+            self.post_times = np.zeros(0, dtype='datetime64[us]')
+            self.artists = np.zeros(0, dtype=np.int64)
+            self.tracks = np.zeros(0, dtype=np.int64)
+        self.results = OrderedDict()
+
+    def get_result(self, key, calculate):
+        """
+        Returns the cached result for key, or calculate()'s. Only the
+        MAX_RESULTS most recently used results are kept.
+        """
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+            else:
+                self.results[key] = calculate()
+                while len(self.results) > MAX_RESULTS:
+                    self.results.popitem(last=False)
+            return self.results[key]
+
+
+# ListeningData objects, keyed by Account ID (None for all Accounts).
+_data = {}
+
+# Held while getting from, or changing, _data.
+_lock = threading.Lock()
+
+
+def get_data(account=None):
+    """
+    Returns the up-to-date ListeningData for an Account, or all Accounts.
+    Raises ImproperlyConfigured if NumPy isn't installed.
+    """
+    if np is None:
+        raise ImproperlyConfigured(
+                "NumPy must be installed to use ditto.lastfm.analytics.")
+
+    account_id = account.pk if account is not None else None
+    with _lock:
+        if account_id not in _data:
+            _data[account_id] = ListeningData(account_id)
+        data = _data[account_id]
+    data.update()
+    return data
+
+
+def _local_hours(post_times):
+    """
+    Returns an array of the hours since the epoch, in the current time
+    zone, for an array of datetime64[us] UTC times.
+    """
+    times = post_times.astype(np.int64)
+    # Work out the UTC offset once for each distinct hour, not every time.
+    unique_hours, inverse = np.unique(times // HOUR, return_inverse=True)
+    tz = timezone.get_current_timezone()
+    offsets = np.array([
+        datetime.datetime.fromtimestamp(int(hour) * 3600, pytz.utc)
+                .astimezone(tz).utcoffset() // datetime.timedelta(microseconds=1)
+        for hour in unique_hours], dtype=np.int64)
+    if len(offsets) == 0:
+        return times // HOUR
+    return (times + offsets[inverse]) // HOUR
+
+
+def streaks(account=None):
+    """
+    Returns a dict about the runs of consecutive days (in UTC) with at
+    least one Scrobble:
+        'longest': The longest run, or None if there are no Scrobbles.
+        'current': The run that includes today or yesterday, or None.
+    Each run is a dict with 'start' and 'end' (datetime.dates) and 'days'.
+    """
+    data = get_data(account)
+    today = timezone.now().astimezone(pytz.utc).date()
+
+    def calculate():
+        days = np.unique(data.post_times.astype('datetime64[D]'))
+        if len(days) == 0:
+            return {'longest': None, 'current': None}
+
+        # Indexes of the days that start a new run:
+        starts = np.flatnonzero(np.diff(days) != np.timedelta64(1, 'D')) + 1
+        starts = np.concatenate(([0], starts))
+        ends = np.concatenate((starts[1:], [len(days)])) - 1
+        lengths = ends - starts + 1
+
+        def run(i):
+            return {
+                'start': days[starts[i]].astype(datetime.date),
+                'end': days[ends[i]].astype(datetime.date),
+                'days': int(lengths[i]),
+            }
+
+        result = {'longest': run(int(np.argmax(lengths))), 'current': None}
+        last = run(len(starts) - 1)
+        if (today - last['end']).days <= 1:
+            result['current'] = last
+        return result
+
+    return data.get_result(('streaks', today), calculate)
+
+
+def hour_weekday_counts(account=None):
+    """
+    Returns the number of Scrobbles for each hour of each day of the week,
+    in the current time zone, for drawing a heatmap.
+
+    A list of 7 lists (Monday first), each of 24 integers (midnight first).
+    """
+    data = get_data(account)
+
+    def calculate():
+        hours = _local_hours(data.post_times)
+        weekdays = (hours // 24 + EPOCH_WEEKDAY) % 7
+        counts = np.bincount(weekdays * 24 + hours % 24, minlength=7 * 24)
+        return counts.reshape(7, 24).tolist()
+
+    key = ('hour_weekday_counts', timezone.get_current_timezone_name())
+    return data.get_result(key, calculate)
+
+
+def sessions(account=None, gap=30):
+    """
+    Groups Scrobbles into listening sessions: runs of Scrobbles with no more
+    than `gap` minutes between each one.
+
+    Returns a dict of:
+        'count': The number of sessions.
+        'average_scrobbles': The mean number of Scrobbles per session.
+        'average_minutes': The mean time from first to last Scrobble.
+        'longest': The session with most Scrobbles, a dict with 'start' and
+                   'end' (datetimes) and 'scrobbles'. None if no Scrobbles.
+    """
+    data = get_data(account)
+
+    def calculate():
+        times = data.post_times
+        if len(times) == 0:
+            return {'count': 0, 'average_scrobbles': 0,
+                    'average_minutes': 0, 'longest': None}
+
+        starts = np.flatnonzero(
+                        np.diff(times) > np.timedelta64(gap, 'm')) + 1
+        starts = np.concatenate(([0], starts))
+        ends = np.concatenate((starts[1:], [len(times)])) - 1
+        lengths = ends - starts + 1
+        minutes = (times[ends] - times[starts]) / np.timedelta64(1, 'm')
+        longest = int(np.argmax(lengths))
+
+        def to_datetime(t):
+            return t.astype(datetime.datetime).replace(tzinfo=pytz.utc)
+
+        return {
+            'count': len(starts),
+            'average_scrobbles': float(lengths.mean()),
+            'average_minutes': float(minutes.mean()),
+            'longest': {
+                'start': to_datetime(times[starts[longest]]),
+                'end': to_datetime(times[ends[longest]]),
+                'scrobbles': int(lengths[longest]),
+            },
+        }
+
+    return data.get_result(('sessions', gap), calculate)
+
+
+def artist_curve(artist, account=None, period='month'):
+    """
+    Returns the number of times an Artist was scrobbled in each day, month
+    or year, from their first Scrobble to their last. Periods are in UTC.
+
+    A list of dicts, each with 'date' (a datetime.date, the start of the
+    period) and 'count'.
+
+    artist -- An Artist object.
+    period -- 'day', 'month' or 'year'.
+    """
+    units = {'day': 'D', 'month': 'M', 'year': 'Y'}
+    if period not in units:
+        raise ValueError('period must be one of "day", "month" or "year", '
+                         'not %s' % period)
+
+    data = get_data(account)
+    unit = units[period]
+
+    def calculate():
+        periods = data.post_times[data.artists == artist.pk]\
+                                .astype('datetime64[%s]' % unit)
+        if len(periods) == 0:
+            return []
+        offsets = (periods - periods[0]).astype(np.int64)
+        counts = np.bincount(offsets)
+        dates = periods[0] + np.arange(len(counts))
+        return [{'date': d.astype('datetime64[D]').astype(datetime.date),
+                 'count': int(c)} for d, c in zip(dates, counts)]
+
+    return data.get_result(('artist_curve', artist.pk, period), calculate)
+
+
+def invalidate():
+    """
+    Makes the data be reloaded, in every process, next time it's used. For
+    when Scrobbles have been changed without being saved. See
+    cube.mark_changed().
+    """
+    mark_changed()
+    with _lock:
+        _data.clear()
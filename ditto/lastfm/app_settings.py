@@ -0,0 +1,28 @@
+from django.conf import settings
+
+
+# Creating all the defaults for settings.
+# In our code, if we want to use a DITTO_LASTFM_* setting we should import
+# from here, not django.conf.settings.
+
+# How many threads fetch pages of Scrobbles at once:
+DITTO_LASTFM_FETCH_THREADS = getattr(settings,
+                                        'DITTO_LASTFM_FETCH_THREADS', 4)
+
+# The maximum number of API requests per second those threads make:
+DITTO_LASTFM_FETCH_RATE_LIMIT = getattr(settings,
+                                        'DITTO_LASTFM_FETCH_RATE_LIMIT', 5)
+
+# How many times we try to fetch each page of Scrobbles before giving up:
+DITTO_LASTFM_FETCH_TRIES = getattr(settings, 'DITTO_LASTFM_FETCH_TRIES', 3)
+
+# If True, and NumPy is installed, the top_albums, top_artists and top_tracks
+# template tags use an in-memory copy of all Scrobbles (see
+# ditto.lastfm.cube) instead of querying the database:
+DITTO_LASTFM_USE_SCROBBLE_CUBE = getattr(settings,
+                                    'DITTO_LASTFM_USE_SCROBBLE_CUBE', False)
+
+# A directory the Scrobble cube is saved in, so that it can be loaded rather
+# than rebuilt by each process. None means it's not saved:
+DITTO_LASTFM_SCROBBLE_CUBE_DIR = getattr(settings,
+                                    'DITTO_LASTFM_SCROBBLE_CUBE_DIR', None)
@@ -5,3 +5,5 @@ class DittoLastfmConfig(AppConfig):
     name = 'ditto.lastfm'
     verbose_name = 'Ditto Last.fm'
 
+    def ready(self):
+        import ditto.lastfm.signals
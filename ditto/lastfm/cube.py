@@ -0,0 +1,298 @@
+"""
+An optional, in-memory, columnar copy of every Scrobble, for quickly
+answering "most scrobbled" queries over any period of time.
+
+It needs NumPy to be installed, and DITTO_LASTFM_USE_SCROBBLE_CUBE to be
+True. Use like:
+
+    from ditto.lastfm import cube
+    scrobble_cube = cube.get_fresh_cube()
+
+    if scrobble_cube is not None:
+        # A list of (track_id, count) tuples, most scrobbled first:
+        scrobble_cube.top('track', account_id=1, limit=10)
+
+The cube is kept in step with the database: get_fresh_cube() appends any
+new Scrobbles, or rebuilds it if Scrobbles have been deleted or re-saved.
+This is worked out from the ScrobbleVersion row, which is updated whenever
+Scrobbles are, so changes made by any process are noticed. If DITTO_LASTFM_SCROBBLE_CUBE_DIR is set, the cube is saved there
+and loaded as memory-mapped files, so it doesn't have to be rebuilt in
+every process.
+"""
+from datetime import datetime, timedelta
+import json
+import os
+import threading
+
+import pytz
+
+from . import app_settings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# The columns, all int64. post_time is in microseconds since the epoch.
+# Scrobbles with no album have an album of -1.
+COLUMNS = ('post_time', 'account', 'artist', 'track', 'album')
+
+# The kinds of thing top() can count, and the column of their IDs:
+KINDS = {'artist': 'artist', 'album': 'album', 'track': 'track'}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+# How many Scrobbles to fetch from the database at once.
+CHUNK_SIZE = 10000
+
+
+def to_microseconds(dt):
+    "Turns an aware datetime into an int of microseconds since the epoch."
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def get_version():
+    """
+    Returns a tuple of how many times Scrobbles have been (added, changed),
+    which goes up whenever any are created, deleted or saved, by any
+    process. See ScrobbleVersion.
+    """
+    from .models import ScrobbleVersion
+    return ScrobbleVersion.objects.get_version()
+
+
+def mark_changed():
+    """
+    Makes every process's cube and analytics data reload next time they're
+    used. For when Scrobbles have been changed without being saved, eg with
+    QuerySet.update(); Scrobbles that are saved or deleted are noticed
+    anyway.
+    """
+    from .models import ScrobbleVersion
+    ScrobbleVersion.objects.bump(changed=1)
+
+
+class ScrobbleCube(object):
+    """
+    NumPy arrays of the post_time, account, artist, track and album IDs of
+    every Scrobble, sorted by post_time.
+    """
+
+    def __init__(self, directory=None):
+        """
+        directory -- If set, the cube is saved to, and loaded from, files here.
+        """
+        self.directory = directory
+
+        # Dict of column name => array.
+        self.columns = {name: np.zeros(0, dtype=np.int64) for name in COLUMNS}
+
+        # The result of get_version() when last updated. The first update
+        # always loads every Scrobble.
+        self.added = 0
+        self.changed = -1
+
+        # The highest pk of the Scrobbles in the cube.
+        self.max_pk = 0
+
+    def __len__(self):
+        return len(self.columns['post_time'])
+
+    def is_fresh(self, version):
+        "Does the cube match a database with this get_version()?"
+        return (self.added, self.changed) == version
+
+    def update(self):
+        """
+        Makes the cube match the database. If Scrobbles have only been
+        added since it was last updated, they're appended, otherwise it's
+        rebuilt.
+        """
+        from .models import Scrobble
+        version = get_version()
+
+        if self.is_fresh(version):
+            return
+
+        added, changed = version
+        if changed == self.changed:
+            expected = len(self) + added - self.added
+            self._append(Scrobble.objects.filter(pk__gt=self.max_pk))
+        else:
+            expected = None
+
+        if len(self) != expected:
+            # Scrobbles were changed, or added with a lower pk than ours.
+            self.columns = {name: np.zeros(0, dtype=np.int64)
+                                                        for name in COLUMNS}
+            self.max_pk = 0
+            self._append(Scrobble.objects.all())
+
+        self.added, self.changed = added, changed
+        self.save()
+
+    def _append(self, scrobbles):
+        "Adds the Scrobbles in the scrobbles QuerySet to the columns."
+        chunks = {name: [self.columns[name]] for name in COLUMNS}
+        rows = scrobbles.order_by('pk').values_list(
+                    'post_time', 'account_id', 'artist_id', 'track_id',
+                    'album_id', 'pk').iterator()
+
+        while True:
+            chunk = []
+            for row in rows:
+                chunk.append((to_microseconds(row[0]), row[1], row[2], row[3],
+                              -1 if row[4] is None else row[4]))
+                self.max_pk = row[5]
+                if len(chunk) == CHUNK_SIZE:
+                    break
+            if len(chunk) == 0:
+                break
+            array = np.array(chunk, dtype=np.int64)
+            for i, name in enumerate(COLUMNS):
+                chunks[name].append(array[:, i])
+
+        columns = {name: np.concatenate(chunks[name]) for name in COLUMNS}
+
+        times = columns['post_time']
+        if len(times) > 1 and np.any(times[1:] < times[:-1]):
+            # eg, older Scrobbles were fetched after newer ones.
+            order = np.argsort(times, kind='mergesort')
+            columns = {name: column[order] for name, column in columns.items()}
+
+        self.columns = columns
+
+    def top(self, kind, account_id=None, album_id=None, artist_id=None,
+                        min_post_time=None, max_post_time=None, limit=10):
+        """
+        Returns a list of (id, count) tuples for the most-scrobbled Artists,
+        Albums or Tracks, most-scrobbled first.
+
+        kind -- 'artist', 'album' or 'track'.
+        account_id, album_id, artist_id -- Only count Scrobbles with these.
+        min_post_time, max_post_time -- Aware datetimes; only count
+                                        Scrobbles between these, inclusive.
+        limit -- The maximum number of tuples to return, or 'all'.
+        """
+        ids = self._filter(KINDS[kind], account_id, album_id, artist_id,
+                                                min_post_time, max_post_time)
+        # Ignore Scrobbles with no album:
+        ids = ids[ids >= 0]
+        if len(ids) == 0:
+            return []
+
+        counts = np.bincount(ids)
+        found = np.flatnonzero(counts)
+        # Most-scrobbled first; ties in order of ID.
+        found = found[np.argsort(-counts[found], kind='mergesort')]
+        if limit != 'all':
+            found = found[:limit]
+        return [(int(i), int(counts[i])) for i in found]
+
+    def count_scrobbles(self, account_id=None, album_id=None, artist_id=None,
+                            min_post_time=None, max_post_time=None):
+        "Returns the number of Scrobbles matching the arguments of top()."
+        return len(self._filter('track', account_id, album_id, artist_id,
+                                                min_post_time, max_post_time))
+
+    def _filter(self, column, account_id, album_id, artist_id,
+                                            min_post_time, max_post_time):
+        "Returns the values of column for the matching Scrobbles."
+        times = self.columns['post_time']
+        start, end = 0, len(times)
+        if min_post_time is not None:
+            start = np.searchsorted(times, to_microseconds(min_post_time),
+                                                                side='left')
+        if max_post_time is not None:
+            end = np.searchsorted(times, to_microseconds(max_post_time),
+                                                                side='right')
+
+        values = self.columns[column][start:end]
+        mask = None
+        for name, value in (('account', account_id), ('album', album_id),
+                                                    ('artist', artist_id)):
+            if value is not None:
+                matches = self.columns[name][start:end] == value
+                mask = matches if mask is None else (mask & matches)
+
+        if mask is not None:
+            values = values[mask]
+        return values
+
+    def load(self):
+        "Loads the cube from self.directory, if it's been saved there."
+        if not self.directory:
+            return
+        try:
+            with open(self._path('meta.json')) as f:
+                meta = json.load(f)
+            columns = {name: np.load(self._path('%s.npy' % name),
+                                                        mmap_mode='r')
+                        for name in COLUMNS}
+        except (IOError, OSError, ValueError):
+            return
+        self.columns = columns
+        self.max_pk = meta['max_pk']
+        # Not in files saved by older versions, so they'll be rebuilt:
+        self.added = meta.get('added', 0)
+        self.changed = meta.get('changed', -1)
+
+    def save(self):
+        "Saves the cube to self.directory, if set."
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for name in COLUMNS:
+            self._save_file('%s.npy' % name,
+                            lambda f: np.save(f, self.columns[name]))
+        # Written last, so it doesn't describe columns that weren't saved.
+        self._save_file('meta.json', lambda f: f.write(json.dumps(
+                    {'added': self.added, 'changed': self.changed,
+                     'max_pk': self.max_pk}).encode()))
+
+    def _save_file(self, filename, write):
+        "Writes to a temporary file and then replaces filename with it."
+        tmp_path = self._path('%s.tmp' % filename)
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, self._path(filename))
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+
+# The process's cube, created by get_fresh_cube().
+_cube = None
+
+_lock = threading.Lock()
+
+
+def get_fresh_cube():
+    """
+    Returns the process's ScrobbleCube, updated to match the database.
+    Returns None if the cube isn't enabled, or NumPy isn't installed.
+    """
+    global _cube
+
+    if not app_settings.DITTO_LASTFM_USE_SCROBBLE_CUBE or np is None:
+        return None
+
+    with _lock:
+        if _cube is None:
+            _cube = ScrobbleCube(
+                        directory=app_settings.DITTO_LASTFM_SCROBBLE_CUBE_DIR)
+            _cube.load()
+        _cube.update()
+        return _cube
+
+
+def invalidate():
+    """
+    Makes every process's cube rebuild next time it's used. For when
+    Scrobbles have been changed without being saved. See mark_changed().
+    """
+    mark_changed()
+    if _cube is not None:
+        with _lock:
+            _cube.changed = -1
@@ -1,24 +1,265 @@
 import calendar
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from itertools import islice
 import json
 import pytz
 import requests
 import time
 import urllib
 
+from django.db import transaction
+from django.db.models import Max
+
 from ditto import TITLE, VERSION
-from .models import Account, Album, Artist, Scrobble, Track
+from . import app_settings
+from .models import Account, Album, Artist, Scrobble, ScrobbleVersion, Track
 from .utils import slugify_name
 from ..core.utils import datetime_now
+from ..core.utils.ratelimiter import RateLimiter
 
 
 LASTFM_API_ENDPOINT = 'http://ws.audioscrobbler.com/2.0/'
 
+# The most values we put in one `__in` lookup, to keep under SQLite's
+# limit on query parameters.
+MAX_LOOKUP_SIZE = 500
+
 
 class FetchError(Exception):
     pass
 
 
+def _chunks(items, size=MAX_LOOKUP_SIZE):
+    "Yields successive lists of up to `size` items from the list `items`."
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ScrobbleSaver(object):
+    """
+    Saves scrobbles for one Account, in the format the API returns them,
+    along with their Artists, Tracks and Albums.
+
+    Used by ScrobblesFetcher, and ScrobblesIngester for exported files.
+
+    Use like:
+        saver = ScrobbleSaver(account)
+        created_count = saver.save_scrobbles(scrobbles, fetch_time)
+        # And once they've all been saved:
+        saver.update_account()
+    """
+
+    def __init__(self, account):
+        self.account = account
+
+        # The post_time of the most recent Scrobble saved.
+        self.last_scrobble_time = None
+
+        # Artists, Tracks and Albums we've already saved, so that we only
+        # save each one once.
+        # Artists are keyed by slug, Tracks and Albums by (artist pk, slug).
+        self.artists = {}
+        self.tracks = {}
+        self.albums = {}
+
+    def update_account(self):
+        """
+        Saves the time of the most recent Scrobble saved on the Account, if
+        it's more recent than the one it already has.
+        Only call this if every Scrobble was saved, so that next time we
+        don't miss any that failed.
+        """
+        latest = self.last_scrobble_time
+        current = self.account.last_scrobble_time
+        if latest is not None and (current is None or latest > current):
+            self.account.last_scrobble_time = latest
+            Account.objects.filter(pk=self.account.pk).update(
+                                                    last_scrobble_time=latest)
+
+    def save_scrobbles(self, scrobbles, fetch_time):
+        """
+        Saves a list of scrobbles in a single transaction.
+
+        Any Artists, Tracks and Albums are created/updated, once per saver.
+        New Scrobbles are then created with a single query. Scrobbles we
+        already have (the same Account, Track and post_time) are left alone.
+
+        Arguments:
+        scrobbles -- A list of dicts of data from the Last.fm API.
+        fetch_time -- Datetime of when the data was fetched.
+
+        Returns the number of new Scrobbles created.
+        """
+        with transaction.atomic():
+            scrobble_objs = [self._make_scrobble(scrobble, fetch_time)
+                                                    for scrobble in scrobbles]
+
+            existing = set()
+            post_times = sorted(set(s.post_time for s in scrobble_objs))
+            for chunk in _chunks(post_times):
+                existing.update(Scrobble.objects.filter(
+                        account=self.account, post_time__in=chunk
+                    ).values_list('track_id', 'post_time'))
+
+            new_objs = []
+            for scrobble_obj in scrobble_objs:
+                key = (scrobble_obj.track_id, scrobble_obj.post_time)
+                if key not in existing:
+                    # Also skips any duplicates within this page.
+                    existing.add(key)
+                    new_objs.append(scrobble_obj)
+
+            Scrobble.objects.bulk_create(new_objs)
+            Scrobble.update_daily_counts(new_objs)
+            if len(new_objs) > 0:
+                ScrobbleVersion.objects.bump(added=len(new_objs))
+
+        for scrobble_obj in scrobble_objs:
+            if self.last_scrobble_time is None or \
+                        scrobble_obj.post_time > self.last_scrobble_time:
+                self.last_scrobble_time = scrobble_obj.post_time
+
+        return len(new_objs)
+
+    def _make_scrobble(self, scrobble, fetch_time):
+        """
+        Saves/updates the scrobble's Artist, Track and Album, if we haven't
+        already, and returns an unsaved Scrobble object.
+
+        Arguments:
+        scrobble -- A dict of data from the Last.fm API.
+        fetch_time -- Datetime of when the data was fetched.
+        """
+        artist_slug, track_slug = self._get_slugs(scrobble['url'])
+
+        artist = self._save_artist(artist_slug, scrobble['artist'])
+
+        track = self._save_track(artist, track_slug, scrobble)
+
+        if scrobble['album']['#text'] == '':
+            album = None
+        else:
+            album = self._save_album(artist, scrobble['album'])
+
+        # Unixtime to datetime object:
+        scrobble_time = datetime.utcfromtimestamp(
+                            int(scrobble['date']['uts'])
+                        ).replace(tzinfo=pytz.utc)
+
+        scrobble_obj = Scrobble(
+            account=self.account,
+            artist=artist,
+            track=track,
+            album=album,
+            post_time=scrobble_time,
+            post_year=scrobble_time.year,
+            raw=json.dumps(scrobble),
+            fetch_time=fetch_time,
+        )
+        # bulk_create() doesn't call save(), which usually sets these:
+        scrobble_obj.title = scrobble_obj._make_title()
+        scrobble_obj.summary = scrobble_obj._make_summary()
+
+        return scrobble_obj
+
+    def _save_artist(self, artist_slug, data):
+        """
+        Returns the Artist, creating/updating it the first time it's seen.
+
+        Arguments:
+        artist_slug -- The Artist's slug from the scrobble's URL.
+        data -- The 'artist' dict from the API's scrobble data.
+        """
+        slug = artist_slug.lower()
+        if slug not in self.artists:
+            self.artists[slug], created = Artist.objects.update_or_create(
+                slug=slug,
+                defaults={
+                    'name': data['#text'],
+                    'original_slug': artist_slug,
+                    'mbid': data['mbid'], # Might be "".
+                }
+            )
+        return self.artists[slug]
+
+    def _save_track(self, artist, track_slug, data):
+        """
+        Returns the Track, creating/updating it the first time it's seen.
+
+        Arguments:
+        artist -- The Track's Artist object.
+        track_slug -- The Track's slug from the scrobble's URL.
+        data -- The API's scrobble data.
+        """
+        key = (artist.pk, track_slug.lower())
+        if key not in self.tracks:
+            self.tracks[key], created = Track.objects.update_or_create(
+                slug=key[1],
+                artist=artist,
+                defaults={
+                    'name': data['name'],
+                    'original_slug': track_slug,
+                    'mbid': data['mbid'], # Might be "".
+                }
+            )
+        return self.tracks[key]
+
+    def _save_album(self, artist, data):
+        """
+        Returns the Album, creating/updating it the first time it's seen.
+
+        Arguments:
+        artist -- The Album's Artist object.
+        data -- The 'album' dict from the API's scrobble data.
+        """
+        # The API data doesn't provide a URL/slug for the album, so
+        # we make our own:
+        album_slug = slugify_name(data['#text'])
+
+        key = (artist.pk, album_slug.lower())
+        if key not in self.albums:
+            self.albums[key], created = Album.objects.update_or_create(
+                slug=key[1],
+                artist=artist,
+                defaults={
+                    'name': data['#text'],
+                    'original_slug': album_slug,
+                    'mbid': data['mbid'], # Might be "".
+                }
+            )
+        return self.albums[key]
+
+    def _get_slugs(self, scrobble_url):
+        """
+        Get the artist and track slugs from a scrobble's URL.
+        The scrobble's URL is also the Track's URL.
+
+        scrobble_url is like 'https://www.last.fm/music/Artist/_/Track'
+        returns two strings, artist_slug and track_slug.
+        """
+        url = scrobble_url.rstrip('/')
+
+        # Need to replace semicolons as urlparse() treats them (legitimately)
+        # as alternatives to '&' as a query string separator, and so omits
+        # anything after them.
+        url = url.replace(';', '%3B')
+
+        # www.last.fm/music/Artist/_/Track':
+        url_path = urllib.parse.urlparse(url).path
+        path_parts = url_path.split('/')
+
+        artist_slug = path_parts[-3]  # 'Artist'
+        track_slug = path_parts[-1]   # 'Track'
+
+        # Put those naughty semicolons back in:
+        artist_slug = artist_slug.replace('%3B', ';')
+        track_slug = track_slug.replace('%3B', ';')
+
+        return artist_slug, track_slug
+
+
 class ScrobblesFetcher(object):
     """
     Fetches scrobbles from the API for one Account.
@@ -42,12 +283,33 @@ class ScrobblesFetcher(object):
         # We'll set this to a datetime if we're fetching scrobbles since x.
         self.min_datetime = None
 
-        self.page_number = 1
-
+        # Set when we fetch the first page.
         self.total_pages = 1
 
         self.results_count = 0
 
+        # How many threads fetch pages after the first one.
+        self.max_workers = app_settings.DITTO_LASTFM_FETCH_THREADS
+
+        # How many pages can be requested, or waiting to be saved, at once.
+        self.max_pages_ahead = 2 * self.max_workers
+
+        # Shared by all threads so they don't call the API too often.
+        self.rate_limiter = RateLimiter(
+                        per_second=app_settings.DITTO_LASTFM_FETCH_RATE_LIMIT)
+
+        # How many times we try to fetch each page.
+        self.max_tries = app_settings.DITTO_LASTFM_FETCH_TRIES
+
+        # Seconds to wait before the first retry of a page; doubles each time.
+        self.retry_delay = 1
+
+        # Error messages for pages that couldn't be fetched.
+        self.page_errors = []
+
+        # If True, we stop fetching pages once one contains no new Scrobbles.
+        self.stop_at_existing = False
+
         # What we'll return:
         self.return_value = {'fetched': 0}
 
@@ -56,6 +318,9 @@ class ScrobblesFetcher(object):
         else:
             raise ValueError("An Account object is required")
 
+        # Saves the Scrobbles, and the Artists, Tracks and Albums in them.
+        self.saver = ScrobbleSaver(account)
+
         if account.has_credentials():
             self.account = account
         else:
@@ -97,48 +362,137 @@ class ScrobblesFetcher(object):
 
             self.min_datetime = datetime_now() - timedelta(days=days)
 
-        elif fetch_type == 'recent':
-            try:
-                scrobble = Scrobble.objects.latest('post_time')
-                self.min_datetime = scrobble.post_time
-            except Scrobble.DoesNotExist:
-                pass
+        elif fetch_type == 'recent' and self.account:
+            self.min_datetime = self._get_last_scrobble_time()
+            self.stop_at_existing = True
 
         self._fetch_pages()
 
         if self._not_failed():
-            self.return_value['success'] = True
+            if len(self.page_errors) > 0:
+                self.return_value['success'] = False
+                self.return_value['messages'] = self.page_errors
+            else:
+                self.return_value['success'] = True
+                self.saver.update_account()
             self.return_value['fetched'] = self.results_count
 
         return self.return_value
 
     def _fetch_pages(self):
-        while self.page_number <= self.total_pages and self._not_failed():
-            self._fetch_page()
-            self.page_number += 1
-            time.sleep(0.5)
+        """
+        Fetches and saves the first page, which tells us how many pages
+        there are. The rest are then fetched by several threads at once,
+        while this thread saves them, one at a time, in order.
+
+        If a page still can't be fetched after retrying, its error is added
+        to self.page_errors and we carry on with the other pages.
+
+        If self.stop_at_existing is True, we stop once a page contains only
+        Scrobbles we already have, because the pages are in reverse
+        chronological order.
+        """
+        more = self._save_page(1, lambda: self._request_page(1))
+
+        if not more or not self._not_failed() or self.total_pages <= 1:
+            return
+
+        page_numbers = range(2, self.total_pages + 1)
+
+        if self.max_workers <= 1:
+            for page_number in page_numbers:
+                if not self._save_page(page_number,
+                                    lambda: self._request_page(page_number)):
+                    break
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                self._fetch_pages_in_threads(executor, page_numbers)
+
+    def _fetch_pages_in_threads(self, executor, page_numbers):
+        """
+        Requests pages using executor's threads, and saves them in order.
+        Only self.max_pages_ahead pages are requested, or waiting to be
+        saved, at once, so the results don't pile up in memory. Those still
+        waiting are cancelled if we stop early, or if saving raises an
+        exception.
+        """
+        page_numbers = iter(page_numbers)
+        pending = deque()
+
+        def submit(count):
+            for page_number in islice(page_numbers, count):
+                pending.append((page_number,
+                        executor.submit(self._request_page, page_number)))
+
+        try:
+            submit(self.max_pages_ahead)
+            while pending:
+                page_number, future = pending.popleft()
+                if not self._save_page(page_number, future.result):
+                    break
+                submit(1)
+        finally:
+            for page_number, future in pending:
+                future.cancel()
+
+    def _request_page(self, page_number):
+        """
+        Fetches a single page of results, trying up to self.max_tries times.
+        Doesn't use the database, so can be called from any thread.
 
-    def _fetch_page(self):
+        Returns a tuple of (the datetime it was fetched, list of results).
+        Raises FetchError if every try fails.
         """
-        Fetch a single page of results.
-        Uses the value of self.page_number.
+        for attempt in range(1, self.max_tries + 1):
+            self.rate_limiter.wait()
+            try:
+                return (datetime_now(), self._send_request(page_number))
+            except FetchError:
+                if attempt == self.max_tries:
+                    raise
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    def _save_page(self, page_number, get_results):
         """
-        fetch_time = datetime_now()
+        Saves a single page of results.
+
+        page_number -- The number of the page.
+        get_results -- Called with no arguments to get the tuple returned by
+                       _request_page(), or raise its FetchError.
 
+        Returns False if there's no need to save any more pages, or True.
+        """
         try:
-            results = self._send_request()
+            fetch_time, results = get_results()
         except FetchError as e:
-            self.return_value['success'] = False
-            self.return_value['messages'] = [str(e)]
-            return
+            if page_number == 1:
+                # Without the first page we don't know how many there are.
+                self.return_value['success'] = False
+                self.return_value['messages'] = [str(e)]
+            else:
+                self.page_errors.append(str(e))
+            return True
+
+        scrobbles = [s for s in results if 'date' in s]
+        # Don't save nowplaying scrobbles, that have no 'date'.
+        created_count = self.saver.save_scrobbles(scrobbles, fetch_time)
+        self.results_count += len(scrobbles)
 
-        for scrobble in results:
-            if 'date' in scrobble:
-                # Don't save nowplaying scrobbles, that have no 'date'.
-                self._save_scrobble(scrobble, fetch_time)
-                self.results_count += 1
+        if self.stop_at_existing and len(scrobbles) > 0 and created_count == 0:
+            return False
+        else:
+            return True
 
-        return
+    def _get_last_scrobble_time(self):
+        """
+        Returns the post_time of the Account's most recent Scrobble, or None.
+        """
+        if self.account.last_scrobble_time:
+            return self.account.last_scrobble_time
+        else:
+            # eg, Scrobbles fetched before Accounts recorded this.
+            return self.account.scrobbles.aggregate(
+                                Max('post_time'))['post_time__max']
 
     def _not_failed(self):
         """Has everything gone smoothly so far? ie, no failure registered?"""
@@ -151,14 +505,14 @@ class ScrobblesFetcher(object):
         "The name of the API method."
         return 'user.getrecenttracks'
 
-    def _api_args(self):
-        "Returns a dict of args for the API call."
+    def _api_args(self, page_number):
+        "Returns a dict of args for the API call for one page of results."
         args = {
             'user':     self.account.username,
             'api_key':  self.account.api_key,
             'format':   'json',
             'method':   self._api_method(),
-            'page':     self.page_number,
+            'page':     page_number,
             'limit':    self.items_per_page,
         }
 
@@ -168,14 +522,14 @@ class ScrobblesFetcher(object):
 
         return args
 
-    def _send_request(self):
+    def _send_request(self, page_number):
         """
-        Send a request to the Last.fm API.
+        Send a request to the Last.fm API for one page of results.
 
         Raises FetchError if something goes wrong.
         Returns a list of results if all goes well.
         """
-        query_string = urllib.parse.urlencode(self._api_args())
+        query_string = urllib.parse.urlencode(self._api_args(page_number))
 
         url = "{}?{}".format(LASTFM_API_ENDPOINT, query_string)
 
@@ -187,116 +541,23 @@ class ScrobblesFetcher(object):
         except requests.exceptions.RequestException as e:
             raise FetchError(
                     "Error when fetching Scrobbles (page %s): %s" % \
-                                                    (self.page_number, str(e)))
+                                                    (page_number, str(e)))
 
         results = json.loads(response.text)
 
         if 'error' in results:
             raise FetchError(
                     "Error %s when fetching Scrobbles (page %s): %s" % \
-                    (results['error'], self.page_number, results['message'])
+                    (results['error'], page_number, results['message'])
                 )
 
         # Set total number of pages first time round:
         attr = results['recenttracks']['@attr']
-        if self.page_number == 1 and 'totalPages' in attr:
+        if page_number == 1 and 'totalPages' in attr:
             self.total_pages = int(attr['totalPages'])
 
         return results['recenttracks']['track']
 
-    def _save_scrobble(self, scrobble, fetch_time):
-        """
-        Saves/updates a scrobble.
-
-        Arguments:
-        scrobble -- A dict of data from the Last.fm API.
-        fetch_time -- Datetime of when the data was fetched.
-        """
-        artist_slug, track_slug = self._get_slugs(scrobble['url'])
-
-        artist, created = Artist.objects.update_or_create(
-            slug=artist_slug.lower(),
-            defaults={
-                'name': scrobble['artist']['#text'],
-                'original_slug': artist_slug,
-                'mbid': scrobble['artist']['mbid'], # Might be "".
-            }
-        )
-
-        track, created = Track.objects.update_or_create(
-            slug=track_slug.lower(),
-            artist=artist,
-            defaults={
-                'name': scrobble['name'],
-                'original_slug': track_slug,
-                'mbid': scrobble['mbid'], # Might be "".
-            }
-        )
-
-        if scrobble['album']['#text'] == '':
-            album = None
-        else:
-            # The API data doesn't provide a URL/slug for the album, so
-            # we make our own:
-            album_slug = slugify_name(scrobble['album']['#text'])
-
-            album, created = Album.objects.update_or_create(
-                slug=album_slug.lower(),
-                artist=artist,
-                defaults={
-                    'name': scrobble['album']['#text'],
-                    'original_slug': album_slug,
-                    'mbid': scrobble['album']['mbid'], # Might be "".
-                }
-            )
-
-        # Unixtime to datetime object:
-        scrobble_time = datetime.utcfromtimestamp(
-                            int(scrobble['date']['uts'])
-                        ).replace(tzinfo=pytz.utc)
-
-        scrobble_obj, created = Scrobble.objects.update_or_create(
-            account=self.account,
-            track=track,
-            post_time=scrobble_time,
-            defaults={
-                'artist':       artist,
-                'raw':          json.dumps(scrobble),
-                'fetch_time':   fetch_time,
-                'album':        album,
-            }
-        )
-
-        return scrobble_obj
-
-    def _get_slugs(self, scrobble_url):
-        """
-        Get the artist and track slugs from a scrobble's URL.
-        The scrobble's URL is also the Track's URL.
-
-        scrobble_url is like 'https://www.last.fm/music/Artist/_/Track'
-        returns two strings, artist_slug and track_slug.
-        """
-        url = scrobble_url.rstrip('/')
-
-        # Need to replace semicolons as urlparse() treats them (legitimately)
-        # as alternatives to '&' as a query string separator, and so omits
-        # anything after them.
-        url = url.replace(';', '%3B')
-
-        # www.last.fm/music/Artist/_/Track':
-        url_path = urllib.parse.urlparse(url).path
-        path_parts = url_path.split('/')
-
-        artist_slug = path_parts[-3]  # 'Artist'
-        track_slug = path_parts[-1]   # 'Track'
-
-        # Put those naughty semicolons back in:
-        artist_slug = artist_slug.replace('%3B', ';')
-        track_slug = track_slug.replace('%3B', ';')
-
-        return artist_slug, track_slug
-
 
 class ScrobblesMultiAccountFetcher(object):
     """
@@ -0,0 +1,256 @@
+import csv
+from datetime import datetime
+import json
+import os
+import pytz
+
+from .fetch import ScrobbleSaver
+from .models import LASTFM_URL_ROOT
+from .utils import slugify_name
+from ..core.utils import datetime_now
+
+
+class IngestError(Exception):
+    pass
+
+
+class ScrobblesIngester(object):
+    """
+    For importing a file of exported scrobbles for one Account.
+
+    The file can be:
+
+    * CSV, with a header row naming the columns. Recognised columns are
+      'artist', 'track' (or 'name' or 'title'), 'album', 'artist_mbid',
+      'track_mbid', 'album_mbid', and either 'uts' (a unix timestamp) or
+      'date' (eg, '31 Jan 2016, 12:34' or '2016-01-31 12:34:56', in UTC).
+
+    * JSON Lines: one JSON object per line. Either a scrobble in the format
+      the Last.fm API returns, or an object with the same keys as the CSV.
+
+    The file is read a line at a time and saved chunk_size scrobbles at a
+    time. After each chunk the number of rows done is saved in a checkpoint
+    file alongside it (eg, 'scrobbles.csv.checkpoint'). If the import is
+    interrupted, running it again on the same file continues from there.
+    The checkpoint is deleted once the whole file is imported.
+
+    Use like:
+        results = ScrobblesIngester(account).ingest('/path/to/scrobbles.csv')
+
+    results will be a dict of data about what happened, including
+    results['success'] which is boolean. Raises IngestError if the file
+    can't be read, or has a row we can't understand.
+    """
+
+    # How many scrobbles to save at once.
+    chunk_size = 1000
+
+    # Formats of the 'date' column we understand:
+    date_formats = (
+        '%d %b %Y, %H:%M',
+        '%d %b %Y %H:%M',
+        '%Y-%m-%d %H:%M:%S',
+        '%Y-%m-%dT%H:%M:%S',
+        '%Y-%m-%d %H:%M',
+    )
+
+    def __init__(self, account):
+        self.account = account
+
+        # Used as the 'fetch_time' for each Scrobble.
+        self.fetch_time = datetime_now()
+
+        self.saver = ScrobbleSaver(account)
+
+        # How many rows we've read from the file, including any skipped
+        # because they were imported before.
+        self.row_count = 0
+
+        # How many new Scrobbles were created.
+        self.created_count = 0
+
+    def ingest(self, path, file_format=None):
+        """
+        Import all the scrobbles in the file at path.
+
+        path -- Path to the CSV or JSON Lines file.
+        file_format -- 'csv' or 'json'. If None, we guess from the file's
+                       extension.
+        """
+        file_format = self._get_format(path, file_format)
+        checkpoint_path = '%s.checkpoint' % path
+        start_row = self._read_checkpoint(checkpoint_path)
+
+        try:
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                chunk = []
+                for line_number, row in self._read_rows(f, file_format):
+                    self.row_count += 1
+                    if self.row_count <= start_row:
+                        # Imported before the last run was interrupted.
+                        continue
+                    scrobble = self._to_api_format(row, line_number)
+                    if scrobble is not None:
+                        chunk.append(scrobble)
+                    if len(chunk) == self.chunk_size:
+                        self._save_chunk(chunk, checkpoint_path)
+                        chunk = []
+                self._save_chunk(chunk, checkpoint_path)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            raise IngestError(e)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        self.saver.update_account()
+
+        return {'success': True,
+                'account': str(self.account),
+                'rows': self.row_count,
+                'imported': self.created_count, }
+
+    def _get_format(self, path, file_format):
+        "Returns 'csv' or 'json', or raises IngestError."
+        if file_format is None:
+            extension = os.path.splitext(path)[1].lower()
+            if extension == '.csv':
+                file_format = 'csv'
+            elif extension in ('.json', '.jsonl', '.ndjson'):
+                file_format = 'json'
+            else:
+                raise IngestError(
+                    "Can't tell the format of %s from its extension" % path)
+
+        if file_format not in ('csv', 'json'):
+            raise IngestError(
+                'The format should be "csv" or "json", not "%s"' % file_format)
+
+        return file_format
+
+    def _read_rows(self, f, file_format):
+        """
+        Yields a tuple for each row in the file: the number of the line it
+        starts on, and the unparsed row (a dict for CSV, a string for JSON).
+        """
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            if reader.fieldnames is None:
+                return
+            # Normalise the header, eg ' Artist' to 'artist':
+            reader.fieldnames = [name.strip().lower()
+                                            for name in reader.fieldnames]
+            line_number = reader.line_num + 1
+            for row in reader:
+                yield line_number, row
+                line_number = reader.line_num + 1
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if line.strip() != '':
+                    yield line_number, line
+
+    def _to_api_format(self, row, line_number):
+        """
+        Turns a row from the file into a dict like those the Last.fm API
+        returns, so ScrobbleSaver can save it.
+        Returns None if it's a scrobble with no time, eg 'now playing'.
+        Raises IngestError if the row is missing something we need.
+        """
+        if isinstance(row, str):
+            try:
+                row = json.loads(row)
+            except ValueError:
+                raise IngestError(
+                            "Could not load JSON from line %s" % line_number)
+            if not isinstance(row, dict):
+                raise IngestError(
+                        "Line %s is not a JSON object" % line_number)
+            if isinstance(row.get('artist'), dict):
+                return self._check_api_format(row, line_number)
+            row = {str(k).strip().lower(): v for k, v in row.items()}
+
+        def get(*keys):
+            for key in keys:
+                if row.get(key) not in (None, ''):
+                    return str(row[key]).strip()
+            return ''
+
+        artist = get('artist')
+        track = get('track', 'name', 'title')
+        if artist == '' or track == '':
+            raise IngestError(
+                    "Line %s has no artist or track name" % line_number)
+
+        return {
+            'artist': {'#text': artist, 'mbid': get('artist_mbid')},
+            'album': {'#text': get('album'), 'mbid': get('album_mbid')},
+            'name': track,
+            'mbid': get('track_mbid'),
+            'url': '%s/music/%s/_/%s' % (LASTFM_URL_ROOT,
+                                    slugify_name(artist), slugify_name(track)),
+            'date': {'uts': self._get_uts(get('uts', 'timestamp'),
+                                          get('date', 'utc_time'),
+                                          line_number)},
+        }
+
+    def _check_api_format(self, scrobble, line_number):
+        "Checks a scrobble that's already in the API's format."
+        if 'date' not in scrobble:
+            return None
+        try:
+            int(scrobble['date']['uts'])
+            scrobble['artist']['#text']
+            scrobble['album']['#text']
+            scrobble['name']
+            scrobble['url']
+        except (KeyError, TypeError, ValueError):
+            raise IngestError(
+                    "Line %s is missing some scrobble data" % line_number)
+        scrobble['artist'].setdefault('mbid', '')
+        scrobble['album'].setdefault('mbid', '')
+        scrobble.setdefault('mbid', '')
+        return scrobble
+
+    def _get_uts(self, uts, date, line_number):
+        "Returns the unix timestamp of the scrobble as a string."
+        if uts != '':
+            try:
+                return str(int(uts))
+            except ValueError:
+                pass
+        if date != '':
+            for date_format in self.date_formats:
+                try:
+                    dt = datetime.strptime(date, date_format)
+                except ValueError:
+                    continue
+                return str(int(dt.replace(tzinfo=pytz.utc).timestamp()))
+
+        raise IngestError("Line %s has no valid time" % line_number)
+
+    def _save_chunk(self, chunk, checkpoint_path):
+        """
+        Saves a list of scrobbles in one transaction, and then records how
+        many rows of the file we've done.
+        """
+        if len(chunk) > 0:
+            self.created_count += self.saver.save_scrobbles(
+                                                        chunk, self.fetch_time)
+        self._write_checkpoint(checkpoint_path)
+
+    def _read_checkpoint(self, checkpoint_path):
+        "Returns the number of rows already imported, or 0."
+        try:
+            with open(checkpoint_path, 'r') as f:
+                return int(json.load(f)['rows'])
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError, KeyError, TypeError):
+            raise IngestError(
+                    "Could not read the checkpoint file %s" % checkpoint_path)
+
+    def _write_checkpoint(self, checkpoint_path):
+        "Writes a temporary file and then replaces the checkpoint with it."
+        tmp_path = '%s.tmp' % checkpoint_path
+        with open(tmp_path, 'w') as f:
+            json.dump({'rows': self.row_count}, f)
+        os.replace(tmp_path, checkpoint_path)
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...ingest import IngestError, ScrobblesIngester
+from ...models import Account
+
+
+class Command(BaseCommand):
+    """Imports Scrobbles for one Account from an exported CSV or JSON Lines
+    file. See ditto.lastfm.ingest.ScrobblesIngester for the formats.
+
+    If the import is interrupted, run the same command again to carry on
+    from where it stopped.
+
+    Usage:
+        ./manage.py import_lastfm_scrobbles --account=gyford --path=/Users/phil/Downloads/scrobbles.csv
+
+    The format is guessed from the file's extension, or can be set:
+        ./manage.py import_lastfm_scrobbles --account=gyford --path=/Users/phil/Downloads/scrobbles.txt --format=json
+    """
+
+    help = "Imports Scrobbles for a Last.fm Account from an exported CSV or JSON Lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--account',
+            action='store',
+            default=False,
+            help='The username of the Last.fm user to import Scrobbles for. e.g. "rj".'
+        )
+
+        parser.add_argument(
+            '--path',
+            action='store',
+            default=False,
+            help='Path to the CSV or JSON Lines file.'
+        )
+
+        parser.add_argument(
+            '--format',
+            action='store',
+            default=None,
+            choices=['csv', 'json'],
+            help='The format of the file, if not clear from its extension.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['account']:
+            raise CommandError("Specify the Account's username, eg --account=gyford")
+
+        if not options['path']:
+            raise CommandError("Specify the location of the file, eg --path=/Path/To/scrobbles.csv")
+
+        try:
+            account = Account.objects.get(username=options['account'])
+        except Account.DoesNotExist:
+            raise CommandError("There's no Account with the username '%s'" % options['account'])
+
+        try:
+            result = ScrobblesIngester(account).ingest(
+                            options['path'], file_format=options['format'])
+        except IngestError as e:
+            raise CommandError("Failed to import Scrobbles: %s" % e)
+
+        if options.get('verbosity', 1) > 0:
+            self.stdout.write('%s: Imported %s Scrobble%s from %s row%s' % (
+                result['account'],
+                result['imported'], '' if result['imported'] == 1 else 's',
+                result['rows'], '' if result['rows'] == 1 else 's'))
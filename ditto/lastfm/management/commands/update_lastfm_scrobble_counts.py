@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Account, AlbumDailyCount, ArtistDailyCount,\
+    TrackDailyCount
+
+
+class Command(BaseCommand):
+    """Rebuilds the daily counts of Scrobbles per Artist, Album and Track,
+    which are used for charts. These are kept up to date when Scrobbles are
+    fetched, so this is only needed if Scrobbles have been changed in other
+    ways, eg, deleted in bulk.
+
+    For all accounts:
+        ./manage.py update_lastfm_scrobble_counts
+
+    For one account:
+        ./manage.py update_lastfm_scrobble_counts --account=gyford
+    """
+
+    help = "Rebuilds the daily counts of Scrobbles per Artist, Album and Track for one or all Last.fm Accounts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--account',
+            action='store',
+            default=False,
+            help='The username of the Last.fm user to rebuild counts for. e.g. "rj".'
+        )
+
+    def handle(self, *args, **options):
+        account = None
+
+        if options['account']:
+            try:
+                account = Account.objects.get(username=options['account'])
+            except Account.DoesNotExist:
+                raise CommandError("There's no Account with the username '%s'" % options['account'])
+
+        count = 0
+        for model in (ArtistDailyCount, AlbumDailyCount, TrackDailyCount):
+            count += model.objects.rebuild(account=account)
+
+        if options.get('verbosity', 1) > 0:
+            self.stdout.write('Created %s daily count%s' % (
+                                        count, '' if count == 1 else 's'))
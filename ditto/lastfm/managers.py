@@ -1,6 +1,11 @@
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, time
+from functools import reduce
+import operator
+import pytz
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Coalesce
 
 
 class WithScrobbleCountsManager(models.Manager):
@@ -17,6 +22,11 @@ class WithScrobbleCountsManager(models.Manager):
     # Can we filter these (things) by Track?
     is_filterable_by_track = True
 
+    # The most things that can have Scrobbles subtracted from their daily
+    # counts (see _count_scrobbles_outside_times()), to keep under SQLite's
+    # limit of 999 parameters per query.
+    max_outside_things = 100
+
     def with_scrobble_counts(self, **kwargs):
         """
         Adds a `scrobble_count` field to the Queryset's objects, and
@@ -95,6 +105,11 @@ class WithScrobbleCountsManager(models.Manager):
             raise TypeError('max_post_time must be a datetime.datetime, '
                             'not a %s' % type(max_post_time))
 
+        if self._can_use_daily_counts(**kwargs):
+            outside_counts = self._count_scrobbles_outside_times(**kwargs)
+            if len(outside_counts) <= self.max_outside_things:
+                return self._with_daily_counts(outside_counts, **kwargs)
+
         filter_kwargs = {}
 
         if account:
@@ -125,6 +140,125 @@ class WithScrobbleCountsManager(models.Manager):
                 scrobble_count = models.Count('scrobbles', distinct=True)
             ).order_by('-scrobble_count')
 
+    def _can_use_daily_counts(self, **kwargs):
+        """
+        Can the scrobble_counts be summed from the daily counts (see
+        DailyScrobbleCountManager), rather than counting Scrobbles?
+
+        Only if we're not filtering by a different kind of thing (eg, Tracks
+        by Album).
+        """
+        return not (kwargs.get('album', None) or kwargs.get('track', None))
+
+    def _count_scrobbles_outside_times(self, **kwargs):
+        """
+        The daily counts are for whole days in UTC. If min_post_time or
+        max_post_time are part-way through a day, this counts the Scrobbles
+        on that day which are before min_post_time or after max_post_time,
+        so they can be subtracted from the daily counts.
+
+        Returns a Counter of the number of Scrobbles for each thing's ID.
+        """
+        from .models import Scrobble
+        account         = kwargs.get('account', None)
+        min_post_time   = kwargs.get('min_post_time', None)
+        max_post_time   = kwargs.get('max_post_time', None)
+        artist          = kwargs.get('artist', None)
+
+        outside = []
+
+        if min_post_time is not None:
+            min_post_time = min_post_time.astimezone(pytz.utc)
+            day_start = datetime.combine(min_post_time.date(), time.min)\
+                                                    .replace(tzinfo=pytz.utc)
+            if min_post_time > day_start:
+                outside.append(models.Q(post_time__gte=day_start,
+                                        post_time__lt=min_post_time))
+
+        if max_post_time is not None:
+            max_post_time = max_post_time.astimezone(pytz.utc)
+            day_end = datetime.combine(max_post_time.date(), time.max)\
+                                                    .replace(tzinfo=pytz.utc)
+            if max_post_time < day_end:
+                outside.append(models.Q(post_time__gt=max_post_time,
+                                        post_time__lte=day_end))
+
+        if len(outside) == 0:
+            return Counter()
+
+        field_name = self.model._meta.model_name
+        scrobbles = Scrobble.objects.filter(
+                                    reduce(operator.or_, outside),
+                                    **{'%s__isnull' % field_name: False})
+        if account:
+            scrobbles = scrobbles.filter(account=account)
+        if artist:
+            scrobbles = scrobbles.filter(
+                                    **{'%s__artist' % field_name: artist})
+
+        return Counter(dict(
+                scrobbles.values_list('%s_id' % field_name)\
+                         .annotate(num=models.Count('pk'))\
+                         .order_by()))
+
+    def _with_daily_counts(self, outside_counts, **kwargs):
+        """
+        The same as with_scrobble_counts(), but sums each thing's daily
+        counts. Should only be used if _can_use_daily_counts() is True.
+
+        outside_counts -- The result of _count_scrobbles_outside_times(),
+                          which are subtracted from the daily counts.
+        """
+        account         = kwargs.get('account', None)
+        min_post_time   = kwargs.get('min_post_time', None)
+        max_post_time   = kwargs.get('max_post_time', None)
+        artist          = kwargs.get('artist', None)
+
+        filter_kwargs = {}
+
+        if account:
+            filter_kwargs['daily_counts__account'] = account
+
+        if artist:
+            filter_kwargs['artist'] = artist
+
+        if min_post_time:
+            filter_kwargs['daily_counts__date__gte'] = \
+                                    min_post_time.astimezone(pytz.utc).date()
+
+        if max_post_time:
+            filter_kwargs['daily_counts__date__lte'] = \
+                                    max_post_time.astimezone(pytz.utc).date()
+
+        if len(filter_kwargs) > 0:
+            # As when counting Scrobbles, things with no counts are only
+            # included if there are no filters.
+            filter_kwargs['daily_counts__count__gt'] = 0
+
+        scrobble_count = Coalesce(
+                        models.Sum('daily_counts__count'), models.Value(0))
+
+        if len(outside_counts) > 0:
+            # Group the things by how many to subtract, to use fewer
+            # query parameters.
+            ids_by_num = {}
+            for thing_id, num in outside_counts.items():
+                ids_by_num.setdefault(num, []).append(thing_id)
+            scrobble_count = scrobble_count - models.Case(
+                    *[models.When(pk__in=sorted(ids), then=models.Value(num))
+                                for num, ids in sorted(ids_by_num.items())],
+                    default=models.Value(0),
+                    output_field=models.IntegerField())
+
+        qs = self.filter(**filter_kwargs).annotate(
+                                                scrobble_count=scrobble_count)
+
+        if len(outside_counts) > 0:
+            # Exclude things only scrobbled outside the times.
+            qs = qs.filter(scrobble_count__gt=0)
+
+        return qs.order_by('-scrobble_count')
+
 
 class TracksManager(WithScrobbleCountsManager):
     """
@@ -166,3 +300,161 @@ class ArtistsManager(WithScrobbleCountsManager):
     # We can't filter a list of Artists by Artist.
     is_filterable_by_artist = False
 
+
+class DailyScrobbleCountManager(models.Manager):
+    """
+    For the models storing how many times an Account scrobbled each Artist,
+    Album or Track on each day (in UTC).
+
+    The model's `counted_field` is the name of the field for the Artist,
+    Album or Track.
+    """
+
+    # How many counts to look up and change in each query, to keep under
+    # SQLite's limit of 999 parameters per query.
+    batch_size = 150
+
+    def add_scrobbles(self, scrobbles, amount=1):
+        """
+        Adds `amount` to the counts for each of the Scrobbles. Use -1 to
+        remove them instead. Counts that reach 0 are deleted.
+
+        scrobbles -- An iterable of Scrobble objects.
+        """
+        field_name = '%s_id' % self.model.counted_field
+        changes = self._count((s.account_id, s.post_time, getattr(s, field_name))
+                                                            for s in scrobbles)
+        changes = sorted((key, num * amount) for key, num in changes.items())
+
+        for i in range(0, len(changes), self.batch_size):
+            self._apply_changes(field_name,
+                                dict(changes[i:i + self.batch_size]))
+
+    def _apply_changes(self, field_name, changes):
+        """
+        Changes the counts by the amounts in `changes`, a dict mapping
+        (account_id, date, thing_id) to the number to add.
+        """
+        existing = {}
+        rows = self.filter(
+                    account_id__in=set(key[0] for key in changes),
+                    date__in=set(key[1] for key in changes),
+                    **{'%s__in' % field_name: set(key[2] for key in changes)}
+                ).values_list('pk', 'account_id', 'date', field_name, 'count')
+        for pk, account_id, date, thing_id, count in rows:
+            existing[(account_id, date, thing_id)] = (pk, count)
+
+        new_counts = {}
+        deleted_pks = []
+        new_objs = []
+
+        for key, change in changes.items():
+            if key in existing:
+                pk, count = existing[key]
+                if count + change > 0:
+                    new_counts[pk] = count + change
+                else:
+                    deleted_pks.append(pk)
+            elif change > 0:
+                new_objs.append(self.model(account_id=key[0],
+                                           date=key[1],
+                                           count=change,
+                                           **{field_name: key[2]}))
+
+        if len(new_counts) > 0:
+            # A single UPDATE for all the changed counts.
+            self.filter(pk__in=new_counts.keys()).update(
+                count=models.Case(
+                    *[models.When(pk=pk, then=models.Value(count))
+                                        for pk, count in new_counts.items()],
+                    output_field=models.PositiveIntegerField()))
+
+        if len(deleted_pks) > 0:
+            self.filter(pk__in=deleted_pks).delete()
+
+        self.bulk_create(new_objs)
+
+    def rebuild(self, account=None):
+        """
+        Deletes and recreates all of the counts from the Scrobbles.
+
+        Keyword arguments:
+        account -- An Account object to only rebuild its counts. Default, all.
+
+        Returns the number of counts created.
+        """
+        from .models import Scrobble
+        field_name = '%s_id' % self.model.counted_field
+        scrobbles = Scrobble.objects.all()
+        counts = self.get_queryset()
+
+        if account is not None:
+            scrobbles = scrobbles.filter(account=account)
+            counts = counts.filter(account=account)
+
+        changes = self._count(scrobbles.values_list(
+                    'account_id', 'post_time', field_name).iterator())
+
+        new_objs = [self.model(account_id=key[0],
+                               date=key[1],
+                               count=num,
+                               **{field_name: key[2]})
+                    for key, num in changes.items()]
+
+        with transaction.atomic():
+            counts.delete()
+            self.bulk_create(new_objs, batch_size=500)
+
+        return len(new_objs)
+
+    def _count(self, rows):
+        """
+        Returns a Counter of the number of Scrobbles for each
+        (account_id, date, thing_id).
+
+        rows -- An iterable of (account_id, post_time, thing_id) for each
+                Scrobble, where thing_id is the ID of its Artist, Album or
+                Track, if any.
+        """
+        counts = Counter()
+        for account_id, post_time, thing_id in rows:
+            if thing_id is not None:
+                date = post_time.astimezone(pytz.utc).date()
+                counts[(account_id, date, thing_id)] += 1
+        return counts
+
+
+class ScrobbleVersionManager(models.Manager):
+    """
+    For the single ScrobbleVersion row, which records how many times
+    Scrobbles have been added and changed.
+    """
+
+    # The pk of the only row.
+    row_pk = 1
+
+    def get_version(self):
+        "Returns a tuple of the (added, changed) numbers."
+        version = self.filter(pk=self.row_pk).values_list('added', 'changed')
+        return version.first() or (0, 0)
+
+    def bump(self, added=0, changed=0):
+        """
+        Adds to the numbers of Scrobbles added and/or changed.
+
+        Keyword arguments:
+        added -- The number of Scrobbles that have been created.
+        changed -- The number of Scrobbles that have been saved (with
+                   different times, Accounts, Artists, Albums or Tracks),
+                   deleted, or otherwise changed.
+        """
+        updated = self.filter(pk=self.row_pk).update(
+                                        added=models.F('added') + added,
+                                        changed=models.F('changed') + changed)
+        if updated == 0:
+            try:
+                with transaction.atomic():
+                    self.create(pk=self.row_pk, added=added, changed=changed)
+            except IntegrityError:
+                # Another process created it first.
+                self.bump(added=added, changed=changed)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 22:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_last_scrobble_time(apps, schema_editor):
+    "Sets each Account's last_scrobble_time from its existing Scrobbles."
+    Account = apps.get_model('lastfm', 'Account')
+    for account in Account.objects.all():
+        account.last_scrobble_time = account.scrobbles.aggregate(
+                                models.Max('post_time'))['post_time__max']
+        account.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastfm', '0007_set_post_year'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='last_scrobble_time',
+            field=models.DateTimeField(blank=True, help_text='The time of the most recent Scrobble fetched for this Account. Fetches of recent Scrobbles start from here. Set automatically.', null=True),
+        ),
+        migrations.RunPython(set_last_scrobble_time,
+                                reverse_code=migrations.RunPython.noop),
+    ]
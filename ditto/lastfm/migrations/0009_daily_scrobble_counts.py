@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 22:21
+from __future__ import unicode_literals
+
+from collections import Counter
+
+from django.db import migrations, models
+import django.db.models.deletion
+import pytz
+
+
+def set_daily_counts(apps, schema_editor):
+    """
+    Creates the daily counts of Artists, Albums and Tracks from the
+    existing Scrobbles.
+    """
+    Scrobble = apps.get_model('lastfm', 'Scrobble')
+    for field_name in ('artist', 'album', 'track'):
+        DailyCount = apps.get_model('lastfm', '%sDailyCount' % field_name)
+        counts = Counter()
+        for account_id, post_time, thing_id in Scrobble.objects.values_list(
+                        'account_id', 'post_time', '%s_id' % field_name)\
+                        .iterator():
+            if thing_id is not None:
+                date = post_time.astimezone(pytz.utc).date()
+                counts[(account_id, date, thing_id)] += 1
+        DailyCount.objects.bulk_create([
+                DailyCount(account_id=key[0], date=key[1], count=num,
+                            **{'%s_id' % field_name: key[2]})
+                for key, num in counts.items()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastfm', '0008_account_last_scrobble_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlbumDailyCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='lastfm.Account')),
+                ('album', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_counts', to='lastfm.Album')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArtistDailyCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='lastfm.Account')),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_counts', to='lastfm.Artist')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrackDailyCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='lastfm.Account')),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_counts', to='lastfm.Track')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='trackdailycount',
+            unique_together=set([('track', 'account', 'date')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='artistdailycount',
+            unique_together=set([('artist', 'account', 'date')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='albumdailycount',
+            unique_together=set([('album', 'account', 'date')]),
+        ),
+        migrations.RunPython(set_daily_counts,
+                                reverse_code=migrations.RunPython.noop),
+    ]
@@ -30,6 +30,9 @@ class Account(TimeStampedModelMixin, models.Model):
     is_active = models.BooleanField(default=True,
                         help_text="If false, new scrobbles won't be fetched.")
 
+    last_scrobble_time = models.DateTimeField(null=True, blank=True,
+        help_text="The time of the most recent Scrobble fetched for this Account. Fetches of recent Scrobbles start from here. Set automatically.")
+
     def __str__(self):
         return self.realname
 
@@ -254,13 +257,43 @@ class Scrobble(DittoItemModel, models.Model):
         ordering = ['-post_time']
 
     def save(self, *args, **kwargs):
-        self.title = truncate_string(
+        self.title = self._make_title()
+
+        is_new = self.pk is None
+        counted_fields = ('account', 'post_time', 'artist', 'album', 'track')
+        is_moved = not is_new and any(
+                    self.get_field_diff(name) for name in counted_fields)
+
+        if is_moved:
+            # Remove the counts for where this Scrobble used to be:
+            old = Scrobble.objects.filter(pk=self.pk).first()
+            if old is not None:
+                self.update_daily_counts([old], -1)
+
+        super().save(*args, **kwargs)
+
+        if is_new or is_moved:
+            self.update_daily_counts([self])
+            ScrobbleVersion.objects.bump(added=int(is_new),
+                                         changed=int(is_moved))
+
+    @staticmethod
+    def update_daily_counts(scrobbles, amount=1):
+        """
+        Adds `amount` (eg, 1 or -1) to the daily counts of Artists, Albums
+        and Tracks for each of the Scrobble objects.
+        """
+        for model in (ArtistDailyCount, AlbumDailyCount, TrackDailyCount):
+            model.objects.add_scrobbles(scrobbles, amount)
+
+    def _make_title(self):
+        "Used to make the `title` property."
+        return truncate_string(
             '{} – {}'.format(self.track.artist.name, self.track.name),
             chars=255,
             truncate='…',
             at_word_boundary=True
         )
-        super().save(*args, **kwargs)
 
     def _summary_source(self):
         "Used to make the `summary` property."
@@ -337,3 +370,81 @@ class Track(TimeStampedModelMixin, models.Model):
         """
         return self.scrobbles.order_by('-post_time').first()
 
+
+
+class DailyScrobbleCount(models.Model):
+    """
+    How many times an Account scrobbled a thing (an Artist, Album or Track)
+    on one day (in UTC).
+
+    These are kept up to date when Scrobbles are fetched, saved or deleted
+    (see signals.py), and are used by with_scrobble_counts() so that charts
+    don't have to count every Scrobble. They can be rebuilt with the
+    update_lastfm_scrobble_counts management command, eg after using
+    QuerySet.update() on Scrobbles.
+    """
+
+    # The name of the child class's field for the thing being counted.
+    counted_field = 'set__counted_field__in_child_class'
+
+    account = models.ForeignKey('Account', related_name='+')
+    date = models.DateField(db_index=True)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = managers.DailyScrobbleCountManager()
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return '%s (%s): %s' % (getattr(self, self.counted_field),
+                                self.date, self.count)
+
+
+class ArtistDailyCount(DailyScrobbleCount):
+    counted_field = 'artist'
+
+    artist = models.ForeignKey('Artist', related_name='daily_counts')
+
+    class Meta:
+        unique_together = (('artist', 'account', 'date'),)
+
+
+class AlbumDailyCount(DailyScrobbleCount):
+    counted_field = 'album'
+
+    album = models.ForeignKey('Album', related_name='daily_counts')
+
+    class Meta:
+        unique_together = (('album', 'account', 'date'),)
+
+
+class TrackDailyCount(DailyScrobbleCount):
+    counted_field = 'track'
+
+    track = models.ForeignKey('Track', related_name='daily_counts')
+
+    class Meta:
+        unique_together = (('track', 'account', 'date'),)
+
+
+class ScrobbleVersion(models.Model):
+    """
+    A single row whose numbers go up whenever Scrobbles are added or
+    changed, by any process.
+
+    The Scrobble cube and analytics, which keep copies of the Scrobbles in
+    memory, use this to tell whether their copies are out of date with a
+    single, quick, query. See ScrobbleVersionManager.
+    """
+
+    # The number of Scrobbles that have ever been created.
+    added = models.PositiveIntegerField(default=0)
+
+    # How many times Scrobbles have been deleted or changed.
+    changed = models.PositiveIntegerField(default=0)
+
+    objects = managers.ScrobbleVersionManager()
+
+    def __str__(self):
+        return 'Added: %s, changed: %s' % (self.added, self.changed)
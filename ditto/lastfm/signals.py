@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Scrobble, ScrobbleVersion
+
+
+# Deleting Scrobbles, including with a QuerySet's delete(), or when deleting
+# their Account, must update the daily counts, and make the Scrobble cube and
+# analytics reload them.
+
+@receiver(post_delete, sender=Scrobble,
+          dispatch_uid='ditto.lastfm.deleted_scrobbles')
+def scrobble_post_delete(sender, instance, **kwargs):
+    Scrobble.update_daily_counts([instance], -1)
+    ScrobbleVersion.objects.bump(changed=1)
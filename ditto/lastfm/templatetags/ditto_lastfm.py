@@ -6,6 +6,7 @@ from django import template
 from django.db.models import Count
 from django.utils.html import format_html
 
+from .. import analytics, cube
 from ..models import Account, Album, Artist, Scrobble, Track
 from ...core.utils import get_annual_item_counts
 
@@ -51,7 +52,8 @@ def get_post_times(date, period):
     period -- String, 'day', 'month' or 'year'.
     """
     if isinstance(date, datetime.datetime):
-        min_post_time = date.replace(hour=0, minute=0, second=0)
+        min_post_time = date.replace(hour=0, minute=0, second=0,
+                                                                microsecond=0)
         max_post_time = date.replace(
                             hour=23, minute=59, second=59, microsecond=999999)
     else:
@@ -75,11 +77,67 @@ def get_post_times(date, period):
     return min_post_time, max_post_time
 
 
+def top_from_cube(model, limit, **kwargs):
+    """
+    Used by top_albums(), top_artists() and top_tracks() to get the
+    most-scrobbled things from the Scrobble cube, if it's enabled.
+
+    Returns a list of model objects, each with a `scrobble_count`, or None
+    if the cube isn't being used.
+
+    Arguments:
+    model -- Album, Artist or Track.
+    limit -- Maximum number to get, or 'all'.
+    kwargs -- Optional account, album, artist, min_post_time, max_post_time.
+    """
+    scrobble_cube = cube.get_fresh_cube()
+    if scrobble_cube is None:
+        return None
+
+    top = scrobble_cube.top(
+                model.__name__.lower(),
+                account_id=getattr(kwargs.get('account'), 'pk', None),
+                album_id=getattr(kwargs.get('album'), 'pk', None),
+                artist_id=getattr(kwargs.get('artist'), 'pk', None),
+                min_post_time=kwargs.get('min_post_time'),
+                max_post_time=kwargs.get('max_post_time'),
+                limit=limit)
+
+    qs = model.objects.all()
+    if model is not Artist:
+        qs = qs.select_related('artist')
+    objects = qs.in_bulk([pk for pk, count in top])
+
+    results = []
+    for pk, count in top:
+        if pk in objects:
+            objects[pk].scrobble_count = count
+            results.append(objects[pk])
+
+    if not any(kwargs.values()) and (limit == 'all' or len(results) < limit):
+        # As with_scrobble_counts() does, include things with no Scrobbles
+        # if there are no filters.
+        if limit == 'all':
+            others = [obj for obj in qs if obj.pk not in objects]
+        else:
+            others = qs.exclude(pk__in=objects.keys())[:limit - len(results)]
+        for obj in others:
+            obj.scrobble_count = 0
+            results.append(obj)
+
+    return results
+
+
 @register.assignment_tag
 def top_albums(account=None, artist=None, limit=10, date=None, period='day'):
     """Returns a QuerySet of most-scrobbled Albums, with the most-scrobbled
     first.
 
+    If the Scrobble cube is enabled (DITTO_LASTFM_USE_SCROBBLE_CUBE) this is
+    a list of Album objects instead, so only iterate over the result, or use
+    len() or the `length` filter; don't call QuerySet methods on it. Each
+    object has a `scrobble_count` either way.
+
     Restrict to Albums by one Artist by suppling the `artist`.
     Restrict to only one user's scrobbles by supplying the `account`.
 
@@ -119,6 +177,10 @@ def top_albums(account=None, artist=None, limit=10, date=None, period='day'):
         qs_kwargs['min_post_time'] = min_post_time
         qs_kwargs['max_post_time'] = max_post_time
 
+    results = top_from_cube(Album, limit, **qs_kwargs)
+    if results is not None:
+        return results
+
     qs = Album.objects.with_scrobble_counts(**qs_kwargs)
 
     if limit != 'all':
@@ -132,6 +194,11 @@ def top_artists(account=None, limit=10, date=None, period='day'):
     """Returns a QuerySet of the most-scrobbled Artists, with the
     most-scrobbled first.
 
+    If the Scrobble cube is enabled (DITTO_LASTFM_USE_SCROBBLE_CUBE) this is
+    a list of Artist objects instead, so only iterate over the result, or use
+    len() or the `length` filter; don't call QuerySet methods on it. Each
+    object has a `scrobble_count` either way.
+
     Restrict to only one user's scrobbles by supplying the `account`.
 
     By default gets all Artists.
@@ -161,6 +228,10 @@ def top_artists(account=None, limit=10, date=None, period='day'):
         qs_kwargs['min_post_time'] = min_post_time
         qs_kwargs['max_post_time'] = max_post_time
 
+    results = top_from_cube(Artist, limit, **qs_kwargs)
+    if results is not None:
+        return results
+
     qs = Artist.objects.with_scrobble_counts(**qs_kwargs)
 
     if limit != 'all':
@@ -175,6 +246,11 @@ def top_tracks(account=None, album=None, artist=None, limit=10, date=None, perio
     Returns a QuerySet of most-scrobbled Tracks, with the most-scrobbled
     first.
 
+    If the Scrobble cube is enabled (DITTO_LASTFM_USE_SCROBBLE_CUBE) this is
+    a list of Track objects instead, so only iterate over the result, or use
+    len() or the `length` filter; don't call QuerySet methods on it. Each
+    object has a `scrobble_count` either way.
+
     Restrict to Tracks from one Album by supplying the 'album'.
     Restrict to Tracks by one Artist by suppling the `artist`.
     Restrict to only one user's scrobbles by supplying the `account`.
@@ -223,6 +299,10 @@ def top_tracks(account=None, album=None, artist=None, limit=10, date=None, perio
         qs_kwargs['min_post_time'] = min_post_time
         qs_kwargs['max_post_time'] = max_post_time
 
+    results = top_from_cube(Track, limit, **qs_kwargs)
+    if results is not None:
+        return results
+
     qs = Track.objects.with_scrobble_counts(**qs_kwargs)
 
     if limit != 'all':
@@ -320,3 +400,75 @@ def annual_scrobble_counts(account=None):
 
     return get_annual_item_counts(qs)
 
+
+def check_account(account):
+    "Used by the listening tags to check the supplied account."
+    if account is not None and not isinstance(account, Account):
+        raise TypeError('account must be an Account instance, '
+                        'not a %s' % type(account))
+
+
+@register.assignment_tag
+def listening_streaks(account=None):
+    """
+    Get the longest, and current, runs of consecutive days with Scrobbles.
+    Returns a dict like:
+        {'longest': {'start': date1, 'end': date2, 'days': 42},
+         'current': {'start': date3, 'end': date4, 'days': 3}}
+    Either can be None. Requires NumPy.
+
+    Keyword arguments:
+    account -- An Account object or None (for Scrobbles by all Accounts).
+    """
+    check_account(account)
+    return analytics.streaks(account)
+
+
+@register.assignment_tag
+def listening_heatmap(account=None):
+    """
+    Get the number of Scrobbles in each hour of each day of the week, in
+    the current time zone. Returns a list of 7 lists (Monday first), each of
+    24 integers (midnight first). Requires NumPy.
+
+    Keyword arguments:
+    account -- An Account object or None (for Scrobbles by all Accounts).
+    """
+    check_account(account)
+    return analytics.hour_weekday_counts(account)
+
+
+@register.assignment_tag
+def listening_sessions(account=None, gap=30):
+    """
+    Get statistics about listening sessions: runs of Scrobbles no more than
+    `gap` minutes apart. Returns a dict with 'count', 'average_scrobbles',
+    'average_minutes' and 'longest'. Requires NumPy.
+
+    Keyword arguments:
+    account -- An Account object or None (for Scrobbles by all Accounts).
+    gap -- The most minutes between two Scrobbles in the same session.
+    """
+    check_account(account)
+    if isinstance(gap, int) == False:
+        raise ValueError("`gap` must be an integer")
+    return analytics.sessions(account, gap=gap)
+
+
+@register.assignment_tag
+def artist_listening_curve(artist, account=None, period='month'):
+    """
+    Get the number of times an Artist was scrobbled in each day, month or
+    year. Returns a list of dicts, each with 'date' and 'count'.
+    Requires NumPy.
+
+    Keyword arguments:
+    artist -- An Artist object. Required.
+    account -- An Account object or None (for Scrobbles by all Accounts).
+    period -- A String: 'day', 'month', or 'year'.
+    """
+    if not isinstance(artist, Artist):
+        raise TypeError('artist must be an Artist instance, '
+                        'not a %s' % type(artist))
+    check_account(account)
+    return analytics.artist_curve(artist, account, period=period)
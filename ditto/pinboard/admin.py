@@ -21,10 +21,10 @@ class AccountAdmin(admin.ModelAdmin):
             'fields': ('api_token',),
             'description': 'Your API Token can be found at <a href="From https://pinboard.in/settings/password ">pinboard.in/settings/password</a>'}),
         ('Data', {
-            'fields': ('time_created', 'time_modified',)
+            'fields': ('last_update_time', 'last_all_update_time', 'time_created', 'time_modified',)
         }),
     )
-    readonly_fields = ('time_created', 'time_modified',)
+    readonly_fields = ('last_update_time', 'last_all_update_time', 'time_created', 'time_modified',)
 
 
 @admin.register(Bookmark)
@@ -1,11 +1,16 @@
 # coding: utf-8
+import codecs
 import datetime
 import json
 import pytz
 import requests
+import time
 import urllib
 
-from .models import Account, Bookmark
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction
+
+from .models import Account, Bookmark, BookmarkTag
 from ..core.utils import datetime_now
 
 
@@ -15,15 +20,87 @@ PINBOARD_ALTERNATE_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 PINBOARD_DATE_FORMAT = "%Y-%m-%d"
 
 
+# The most values we put in one `__in` lookup, to keep under SQLite's
+# limit on query parameters.
+MAX_LOOKUP_SIZE = 500
+
+# The longest a single bookmark's JSON can be when streaming a response,
+# so that a malformed response isn't all read into memory.
+MAX_JSON_ITEM_SIZE = 1024 * 1024
+
+
 class FetchError(Exception):
     pass
 
 
+def _chunks(items, size=MAX_LOOKUP_SIZE):
+    "Yields successive lists of up to `size` items from the list `items`."
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _iter_json_list(chunks, max_item_size=MAX_JSON_ITEM_SIZE):
+    """Yields each item in a JSON list as soon as it has been received.
+
+    chunks -- An iterable of strings that together make up the JSON for
+              a list of objects, eg ['[{"a": 1}, {"b"', ': 2}]'].
+    max_item_size -- The most characters we'll hold while waiting for the
+              rest of one item.
+
+    Raises FetchError as soon as the JSON isn't a list, has an item that
+    isn't valid, or has an item longer than max_item_size. Or if it ends
+    before the list does.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise FetchError("Expected a JSON list")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # If the error is in the last few characters (eg, a partial
+                # 'true' or '\u00e9'), or in a string that hasn't ended yet,
+                # we haven't received the whole item yet.
+                if not (e.pos >= len(buffer) - 6 or
+                                e.msg.startswith('Unterminated string')):
+                    raise FetchError("Invalid JSON: %s" % e)
+                if len(buffer) - pos > max_item_size:
+                    raise FetchError("An item in the JSON list is longer "
+                                     "than %s characters" % max_item_size)
+                break
+            yield item
+        buffer = buffer[pos:]
+
+    raise FetchError("The JSON list ended unexpectedly")
+
+
 class BookmarksFetcher(object):
     """The parent class containing common methods.
     Use one of the child classes to fetch a particular set of Bookmarks.
     """
 
+    # When fetching all Bookmarks, how many we save at once.
+    batch_size = 1000
+
+    # Pinboard allows one API call every three seconds, per user.
+    request_interval = 3
+
     def fetch(self):
         raise FetchError('Call a child class like AllBookmarksFetcher or RecentBookmarksFetcher')
 
@@ -37,6 +114,12 @@ class BookmarksFetcher(object):
         params -- Any params specific to the type (eg, url='http://foo.com')
                     These will be used directly with the Pinboard API.
         username -- the username of the one Account to fetch (or None for all).
+
+        For 'all' and 'recent' fetches, we first ask Pinboard when the
+        Account's Bookmarks last changed. If that's no later than when we
+        last fetched them, nothing is fetched, and the Account's result
+        includes 'unchanged': True. For 'all' fetches, only previous 'all'
+        fetches count, as a 'recent' fetch might not have got everything.
         """
         # Each element will be a dict, like:
         # {'account':'philgyford', 'success':True, 'fetched':12}
@@ -47,9 +130,35 @@ class BookmarksFetcher(object):
         for account in accounts:
             fetch_time = datetime_now()
 
+            update_time = None
+            if fetch_type in ['all', 'recent']:
+                # Don't fetch anything if nothing's changed since last time:
+                update_time = self._get_update_time(account)
+                if fetch_type == 'all':
+                    last_update_time = account.last_all_update_time
+                else:
+                    last_update_time = account.last_update_time
+                if last_update_time is not None and \
+                        update_time is not None and \
+                        update_time <= last_update_time:
+                    result.append({'account': account.username,
+                                   'success': True,
+                                   'fetched': 0,
+                                   'unchanged': True})
+                    continue
+                time.sleep(self.request_interval)
+
             response = self._send_request(fetch_type, params, account)
 
-            if response['success']:
+            if response['success'] and fetch_type == 'all':
+                # This could be a lot of data, so we save it in batches as
+                # it arrives:
+                response.update(self._save_stream(
+                                account=account,
+                                http_response=response['response'],
+                                fetch_time=fetch_time))
+                del(response['response'])
+            elif response['success']:
                 # Tidy the raw data:
                 bookmarks_data = self._parse_response(
                                                 fetch_type, response['json'])
@@ -64,11 +173,33 @@ class BookmarksFetcher(object):
             else:
                 response['fetched'] = 0
 
+            if response['success'] and update_time is not None:
+                updates = {'last_update_time': update_time}
+                if fetch_type == 'all':
+                    updates['last_all_update_time'] = update_time
+                for name, value in updates.items():
+                    setattr(account, name, value)
+                Account.objects.filter(pk=account.pk).update(**updates)
+
             response['account'] = account.username
             result.append(response)
 
         return result
 
+    def _get_update_time(self, account):
+        """Asks Pinboard when the Account's Bookmarks last changed.
+        Returns a UTC datetime, or None if we couldn't find out.
+        """
+        response = self._send_request('update', {}, account)
+        if not response['success']:
+            return None
+        try:
+            return datetime.datetime.strptime(
+                            json.loads(response['json'])['update_time'],
+                            PINBOARD_DATETIME_FORMAT).replace(tzinfo=pytz.utc)
+        except (KeyError, TypeError, ValueError):
+            return None
+
     def _get_accounts(self, username):
         """Get all or one active accounts.
         username is None or a username.
@@ -92,10 +223,12 @@ class BookmarksFetcher(object):
 
         Returns a dict with a 'success' element: True or False.
         If False, will have a 'messages' element, a list.
-        If True, will have a 'json' element with the fetched data in.
+        If True, will have a 'json' element with the fetched data in. Or,
+        for the 'all' fetch_type, a 'response' element with the
+        requests.Response, whose content hasn't been read yet.
 
         Keyword arguments:
-        fetch_type -- 'all', 'date', 'recent' or 'url'.
+        fetch_type -- 'all', 'date', 'recent', 'url' or 'update'.
         params -- Any params needed for this type. eg 'dt':datetime.
         Account -- The account to fetch from.
         """
@@ -107,6 +240,8 @@ class BookmarksFetcher(object):
             url_parts.append('recent')
         elif fetch_type == 'all':
             url_parts.append('all')
+        elif fetch_type == 'update':
+            url_parts.append('update')
 
         url = "{}{}".format(PINBOARD_API_ENDPOINT, "/".join(url_parts))
 
@@ -119,7 +254,8 @@ class BookmarksFetcher(object):
         error_message = ''
 
         try:
-            response = requests.get(final_url)
+            # Don't load all of a (potentially huge) 'all' response at once:
+            response = requests.get(final_url, stream=(fetch_type == 'all'))
         except requests.exceptions.ConnectionError as e:
             error_message = "Can't connect to domain."
         except requests.exceptions.Timeout as e:
@@ -141,10 +277,61 @@ class BookmarksFetcher(object):
         if error_message:
             return {'account': account.username, 'success': False,
                                                 'messages': [error_message,]}
+        elif fetch_type == 'all':
+            return {'account': account.username, 'success': True,
+                                                        'response': response}
         else:
             return {'account': account.username, 'success': True,
                                                         'json': response.text}
 
+    def _save_stream(self, account, http_response, fetch_time):
+        """Reads the JSON list of bookmarks in an 'all' response as it
+        arrives, saving them self.batch_size at a time. So we never have
+        more than one batch of bookmarks in memory, however many there are.
+
+        Keyword arguments:
+        account -- The Account object to add these bookmarks for.
+        http_response -- The streaming requests.Response.
+        fetch_time -- The UTC time at which these bookmarks were fetched.
+
+        Returns a dict with 'fetched', the number of bookmarks saved. If
+        something went wrong part way through, it also has 'success' False
+        and 'messages'.
+        """
+        result = {'fetched': 0}
+        batch = []
+
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        chunks = (decoder.decode(chunk) for chunk in
+                        http_response.iter_content(chunk_size=64 * 1024))
+
+        try:
+            for post in _iter_json_list(chunks):
+                batch.append(post)
+                if len(batch) == self.batch_size:
+                    self._save_batch(account, batch, fetch_time)
+                    result['fetched'] += len(batch)
+                    batch = []
+            self._save_batch(account, batch, fetch_time)
+            result['fetched'] += len(batch)
+        except requests.exceptions.RequestException as e:
+            result['success'] = False
+            result['messages'] = ["Error while reading the response: %s" % e]
+        except (FetchError, ValueError) as e:
+            result['success'] = False
+            result['messages'] = ["Could not parse the response: %s" % e]
+        finally:
+            http_response.close()
+
+        return result
+
+    def _save_batch(self, account, posts, fetch_time):
+        "Parses and saves a list of bookmark data straight from the API."
+        if len(posts) > 0:
+            self._save_bookmarks(account=account,
+                                 bookmarks_data=self._parse_posts(posts),
+                                 fetch_time=fetch_time)
+
 
     def _parse_response(self, fetch_type, json_text):
         """Takes the JSON response for a Bookmark from the API and turns it
@@ -164,6 +351,12 @@ class BookmarksFetcher(object):
         else:
             posts = response['posts']
 
+        return self._parse_posts(posts)
+
+    def _parse_posts(self, posts):
+        """Tidies a list of bookmark data from the API, as used by
+        _parse_response(). Returns the list.
+        """
         for bookmark in posts:
             # Before we do anything to it, we give the bookmark a 'json'
             # element with its original state in:
@@ -181,42 +374,211 @@ class BookmarksFetcher(object):
         return posts
 
     def _save_bookmarks(self, account, bookmarks_data, fetch_time):
-        """Takes the raw JSON response from the API, creates or updates the
-        Bookmark objects.
+        """Takes the parsed data from the API, creates or updates the
+        Bookmark objects and their tags, all in one transaction.
+
+        New Bookmarks are created in bulk. Existing Bookmarks are only
+        updated if their data has changed, also in bulk. Tags are then
+        added and removed with set-based inserts and deletes, rather than
+        several queries per tag.
 
         Keyword arguments:
         account -- The Account object to add these bookmarks for.
         bookmarks_data -- A list, each one data to create a single Bookmark.
         fetch_time -- The UTC time at which these bookmarks were fetched.
         """
-        for bookmark in bookmarks_data:
-            self._save_bookmark(bookmark, fetch_time, account)
+        # Keyed by URL, in case the same one appears twice:
+        bookmarks_data = {b['href']: b for b in bookmarks_data}
+
+        with transaction.atomic():
+            existing = {}
+            for urls in _chunks(list(bookmarks_data.keys())):
+                for bookmark_obj in Bookmark.objects.filter(
+                                                account=account, url__in=urls):
+                    existing[bookmark_obj.url] = bookmark_obj
+
+            new_objs = []
+            changed_objs = []
+            # IDs of Bookmarks whose privacy has changed:
+            privacy_changed_ids = set()
+
+            for url, bookmark in bookmarks_data.items():
+                fields = {
+                    'title': bookmark['description'],
+                    'is_private': not bookmark['shared'],
+                    'raw': bookmark['json'],
+                    'description': bookmark['extended'],
+                    'to_read': bookmark['toread'],
+                    'post_time': bookmark['time'],
+                }
+                if url in existing:
+                    bookmark_obj = existing[url]
+                    if all(getattr(bookmark_obj, name) == value
+                                            for name, value in fields.items()):
+                        continue
+                    if bookmark_obj.is_private != fields['is_private']:
+                        privacy_changed_ids.add(bookmark_obj.pk)
+                    changed_objs.append(bookmark_obj)
+                else:
+                    bookmark_obj = Bookmark(account=account, url=url)
+                    bookmark_obj.url_hash = bookmark_obj._make_url_hash()
+                    new_objs.append(bookmark_obj)
+
+                for name, value in fields.items():
+                    setattr(bookmark_obj, name, value)
+                bookmark_obj.fetch_time = fetch_time
+                # bulk_create() and update() don't call save(), which
+                # usually sets these:
+                bookmark_obj.summary = bookmark_obj._make_summary()
+                bookmark_obj.post_year = bookmark_obj.post_time.year
+
+            Bookmark.objects.bulk_create(new_objs)
+            self._update_bookmarks(changed_objs)
+
+            # Get them all again, because bulk_create() doesn't set IDs on
+            # all databases.
+            bookmark_ids = {}
+            for urls in _chunks(list(bookmarks_data.keys())):
+                bookmark_ids.update(Bookmark.objects.filter(
+                        account=account, url__in=urls).values_list('url', 'pk'))
+
+            self._save_tags(
+                    {bookmark_ids[url]: bookmark['tags']
+                                    for url, bookmark in bookmarks_data.items()},
+                    privacy_changed_ids)
+
+    def _update_bookmarks(self, bookmark_objs):
+        """Saves the changed fields of existing Bookmarks, using one UPDATE
+        query for each batch of them.
 
-    def _save_bookmark(self, bookmark, fetch_time, account):
-        """Takes data for a single bookmark from the API response and creates
-        or updates the Bookmark object.
+        Keyword arguments:
+        bookmark_objs -- A list of Bookmark objects.
+        """
+        fields = ['title', 'is_private', 'raw', 'description', 'to_read',
+                  'post_time', 'fetch_time', 'summary', 'post_year']
+        now = datetime_now()
+
+        # Each Bookmark uses two query parameters per field. Keep well under
+        # SQLite's limit of 999 parameters per query.
+        batch_size = 900 // (2 * len(fields) + 1)
+
+        for objs in _chunks(bookmark_objs, batch_size):
+            updates = {}
+            for name in fields:
+                field = Bookmark._meta.get_field(name)
+                updates[name] = models.Case(
+                    *[models.When(pk=obj.pk,
+                                  then=models.Value(getattr(obj, name)))
+                                                            for obj in objs],
+                    output_field=field)
+            Bookmark.objects.filter(pk__in=[obj.pk for obj in objs]).update(
+                                                time_modified=now, **updates)
+
+    def _save_tags(self, bookmark_tags, privacy_changed_ids):
+        """Makes each Bookmark's tags match the tag names we've been given.
+
+        Works out which Bookmark-tag relationships are new, and which have
+        gone, then creates and deletes them in bulk. The counts of those
+        tags, and of all the tags on Bookmarks whose privacy has changed,
+        are then updated.
 
         Keyword arguments:
-        bookmark_data -- A list, each one data to create a single Bookmark.
-        fetch_time -- The UTC time at which these bookmarks were fetched.
-        account -- The Account object to add these bookmarks for.
+        bookmark_tags -- A dict of Bookmark IDs to lists of tag names.
+        privacy_changed_ids -- A set of the IDs of Bookmarks whose
+                               is_private has changed.
         """
+        through = Bookmark.tags.through
+        content_type = ContentType.objects.get_for_model(Bookmark)
+
+        names = set()
+        for tag_names in bookmark_tags.values():
+            names.update(tag_names)
+        tags = self._get_or_create_tags(names)
+
+        # (bookmark ID, tag ID) for every tag the Bookmarks should have:
+        wanted = set()
+        for bookmark_id, tag_names in bookmark_tags.items():
+            wanted.update((bookmark_id, tags[name].pk) for name in tag_names)
+
+        # (bookmark ID, tag ID) => TaggedBookmark ID, for the current tags:
+        current = {}
+        for bookmark_ids in _chunks(list(bookmark_tags.keys())):
+            for pk, bookmark_id, tag_id in through.objects.filter(
+                            content_type=content_type,
+                            object_id__in=bookmark_ids,
+                        ).values_list('pk', 'object_id', 'tag_id'):
+                current[(bookmark_id, tag_id)] = pk
+
+        to_add = wanted.difference(current.keys())
+        to_delete = set(current.keys()).difference(wanted)
+
+        through.objects.bulk_create([
+                through(content_type=content_type,
+                        object_id=bookmark_id,
+                        tag_id=tag_id)
+                for bookmark_id, tag_id in to_add])
+
+        with BookmarkTag.objects.batch_updates():
+            # Deleting these adds their tags to the batch, see signals.py.
+            for pks in _chunks([current[key] for key in to_delete]):
+                through.objects.filter(pk__in=pks).delete()
+
+            # bulk_create() doesn't send signals, so add the new ones here:
+            changed_tag_ids = set(tag_id for bookmark_id, tag_id in to_add)
+            changed_tag_ids.update(tag_id for bookmark_id, tag_id in wanted
+                                        if bookmark_id in privacy_changed_ids)
+            BookmarkTag.objects.tags_changed(changed_tag_ids)
+
+    def _get_or_create_tags(self, names):
+        """Returns a dict of BookmarkTag objects keyed by name, creating any
+        that don't exist yet in bulk.
 
-        bookmark_obj, created = Bookmark.objects.update_or_create(
-            account=account,
-            url=bookmark['href'],
-            defaults={
-                'title': bookmark['description'],
-                'is_private': not bookmark['shared'],
-                'raw': bookmark['json'],
-                'description': bookmark['extended'],
-                'to_read': bookmark['toread'],
-                'fetch_time': fetch_time,
-                'post_time': bookmark['time'],
-            }
-        )
-
-        bookmark_obj.tags.set(*bookmark['tags'])
+        Keyword arguments:
+        names -- A set of tag names.
+        """
+        tags = {}
+        for chunk in _chunks(list(names)):
+            for tag in BookmarkTag.objects.filter(name__in=chunk):
+                tags[tag.name] = tag
+
+        missing = names.difference(tags.keys())
+        if len(missing) == 0:
+            return tags
+
+        # Work out unique slugs, in the same way as BookmarkTag.save() would,
+        # adding '_1', '_2', etc if the slug is already used.
+        slugs = {name: BookmarkTag().slugify(name) for name in missing}
+        attempts = {name: None for name in missing}
+        clashing = set(missing)
+        while len(clashing) > 0:
+            used = set()
+            for chunk in _chunks([slugs[name] for name in clashing]):
+                used.update(BookmarkTag.objects.filter(slug__in=chunk)\
+                                            .values_list('slug', flat=True))
+            taken = set(slug for name, slug in slugs.items()
+                                                    if name not in clashing)
+            next_clashing = set()
+            for name in sorted(clashing):
+                if slugs[name] in used or slugs[name] in taken:
+                    attempts[name] = (attempts[name] or 0) + 1
+                    slugs[name] = BookmarkTag().slugify(name, attempts[name])
+                    next_clashing.add(name)
+                else:
+                    taken.add(slugs[name])
+            clashing = next_clashing
+
+        BookmarkTag.objects.bulk_create([
+                BookmarkTag(name=name, slug=slugs[name],
+                            is_private_tag=name.startswith('.'))
+                for name in missing])
+
+        # Get them again, because bulk_create() doesn't set IDs on all
+        # databases.
+        for chunk in _chunks(list(missing)):
+            for tag in BookmarkTag.objects.filter(name__in=chunk):
+                tags[tag.name] = tag
+
+        return tags
 
 
 class AllBookmarksFetcher(BookmarksFetcher):
@@ -2,6 +2,8 @@ from django.db import models
 
 from taggit.managers import _TaggableManager
 
+from ..core.managers import TagCountsManagerMixin
+
 
 class PublicToreadManager(models.Manager):
     """Returns public Bookmarks from any of the Accounts marked 'to_read'."""
@@ -17,6 +19,62 @@ class ToreadManager(models.Manager):
         return super().get_queryset().filter(to_read=True)
 
 
+class BookmarkTagManager(TagCountsManagerMixin, models.Manager):
+
+    def update_counts(self, tag_ids=None):
+        """
+        Counts the public, and all, Bookmarks with each BookmarkTag, and
+        saves them in the tags' public_count and total_count.
+
+        Keyword arguments:
+        tag_ids -- An iterable of the IDs of BookmarkTags to count.
+                   Default, all.
+        """
+        tags = self.get_queryset()
+        if tag_ids is not None:
+            tag_ids = set(tag_ids)
+            if len(tag_ids) == 0:
+                return
+            tags = tags.filter(pk__in=tag_ids)
+
+        totals = dict(tags.annotate(num=models.Count('bookmark'))\
+                                                .values_list('pk', 'num'))
+        publics = dict(tags.filter(bookmark__is_private=False)\
+                                .annotate(num=models.Count('bookmark'))\
+                                .values_list('pk', 'num'))
+
+        changed_counts = {}
+        for tag in tags.values('pk', 'public_count', 'total_count'):
+            public = publics.get(tag['pk'], 0)
+            total = totals.get(tag['pk'], 0)
+            if (tag['public_count'], tag['total_count']) != (public, total):
+                changed_counts[tag['pk']] = (public, total)
+
+        # Update them in as few queries as possible, while keeping under
+        # SQLite's limit of 999 parameters per query.
+        changed_counts = list(changed_counts.items())
+        for i in range(0, len(changed_counts), 150):
+            batch = changed_counts[i:i + 150]
+            self.filter(pk__in=[pk for pk, counts in batch]).update(
+                public_count=models.Case(
+                    *[models.When(pk=pk, then=models.Value(public))
+                                        for pk, (public, total) in batch],
+                    output_field=models.PositiveIntegerField()),
+                total_count=models.Case(
+                    *[models.When(pk=pk, then=models.Value(total))
+                                        for pk, (public, total) in batch],
+                    output_field=models.PositiveIntegerField()))
+
+    def update_tag_counts(self, tag_ids):
+        """
+        Used by TagCountsManagerMixin. Counts the tags in batches, to keep
+        under SQLite's limit of 999 parameters per query.
+        """
+        tag_ids = sorted(set(tag_ids))
+        for i in range(0, len(tag_ids), 500):
+            self.update_counts(tag_ids[i:i + 500])
+
+
 class _BookmarkTaggableManager(_TaggableManager):
     """Providing some extra features related to private Bookmarks and tags."""
 
@@ -25,12 +83,20 @@ class _BookmarkTaggableManager(_TaggableManager):
             * Doesn't count tags on private Bookmarks
             * Doesn't show tags that start with '.' (Pinboard's private tags)
         Overriding django-taggit's standard `most_common()` method.
+
+        For all Bookmarks, this reads the counts stored on each BookmarkTag.
         """
+        if self.instance is None:
+            return self.through.tag_model().objects\
+                    .filter(is_private_tag=False, public_count__gt=0)\
+                    .annotate(num_times=models.F('public_count'))\
+                    .order_by('-num_times')
+
         extra_filters = {
             'bookmark__is_private': False,
         }
 
-        return self.get_queryset(extra_filters).exclude(name__startswith='.').annotate(
+        return self.get_queryset(extra_filters).filter(is_private_tag=False).annotate(
             num_times=models.Count(self.through.tag_relname())
         ).order_by('-num_times')
 
@@ -41,9 +107,28 @@ class _BookmarkTaggableManager(_TaggableManager):
 
         Use like `Bookmark.tags.all()`.
         """
-        return self.get_queryset().exclude(name__startswith='.').order_by('name')
+        return self.get_queryset().filter(is_private_tag=False).order_by('name')
 
     def names(self):
         """Override default so we order by name."""
-        return self.get_queryset().exclude(name__startswith='.').order_by('name').values_list('name', flat=True)
+        return self.get_queryset().filter(is_private_tag=False).order_by('name').values_list('name', flat=True)
+
+    # Adding or removing tags updates their counts (see signals.py) once
+    # for all of the tags, rather than once for each.
+
+    def add(self, *tags):
+        with self.through.tag_model().objects.batch_updates():
+            super().add(*tags)
+
+    def set(self, *tags, **kwargs):
+        with self.through.tag_model().objects.batch_updates():
+            super().set(*tags, **kwargs)
+
+    def remove(self, *tags):
+        with self.through.tag_model().objects.batch_updates():
+            super().remove(*tags)
+
+    def clear(self):
+        with self.through.tag_model().objects.batch_updates():
+            super().clear()
 
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 22:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_tag_counts(apps, schema_editor):
+    """
+    Sets `is_private_tag`, `public_count` and `total_count` on every
+    BookmarkTag.
+    """
+    Bookmark = apps.get_model('pinboard', 'Bookmark')
+    BookmarkTag = apps.get_model('pinboard', 'BookmarkTag')
+    TaggedBookmark = apps.get_model('pinboard', 'TaggedBookmark')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+
+    BookmarkTag.objects.filter(name__startswith='.').update(
+                                                        is_private_tag=True)
+
+    try:
+        content_type = ContentType.objects.get(app_label='pinboard',
+                                                            model='bookmark')
+    except ContentType.DoesNotExist:
+        # No Bookmarks have ever been tagged.
+        return
+
+    public_ids = set(Bookmark.objects.filter(is_private=False)\
+                                            .values_list('pk', flat=True))
+    counts = {}
+    for row in TaggedBookmark.objects.filter(content_type=content_type)\
+                                        .values('tag_id', 'object_id'):
+        public, total = counts.get(row['tag_id'], (0, 0))
+        if row['object_id'] in public_ids:
+            public += 1
+        counts[row['tag_id']] = (public, total + 1)
+
+    for tag_id, (public, total) in counts.items():
+        BookmarkTag.objects.filter(pk=tag_id).update(public_count=public,
+                                                     total_count=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pinboard', '0024_bookmark_post_year'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookmarktag',
+            name='is_private_tag',
+            field=models.BooleanField(db_index=True, default=False, help_text="Pinboard's private tags start with '.'. Set automatically on save."),
+        ),
+        migrations.AddField(
+            model_name='bookmarktag',
+            name='public_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='The number of public Bookmarks with this tag.'),
+        ),
+        migrations.AddField(
+            model_name='bookmarktag',
+            name='total_count',
+            field=models.PositiveIntegerField(default=0, help_text='The number of public and private Bookmarks with this tag.'),
+        ),
+
+        migrations.RunPython(set_tag_counts, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 22:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pinboard', '0025_bookmarktag_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='last_update_time',
+            field=models.DateTimeField(blank=True, help_text="When Pinboard said this Account's Bookmarks last changed, as of the last fetch. Set automatically.", null=True),
+        ),
+    ]
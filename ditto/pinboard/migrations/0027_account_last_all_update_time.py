@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 22:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pinboard', '0026_account_last_update_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='last_all_update_time',
+            field=models.DateTimeField(blank=True, help_text="When Pinboard said this Account's Bookmarks last changed, as of the last fetch of all of them. Set automatically.", null=True),
+        ),
+    ]
@@ -6,7 +6,8 @@ from django.db import models
 from taggit.managers import TaggableManager
 from taggit.models import GenericTaggedItemBase, TagBase
 
-from .managers import _BookmarkTaggableManager, PublicToreadManager, ToreadManager
+from .managers import _BookmarkTaggableManager, BookmarkTagManager,\
+        PublicToreadManager, ToreadManager
 from ..core.models import DittoItemModel, TimeStampedModelMixin
 
 
@@ -25,6 +26,13 @@ class Account(TimeStampedModelMixin, models.Model):
                     help_text='eg, "philgyford:1234567890ABCDEFGHIJ"')
     is_active = models.BooleanField(default=True, null=False, blank=False,
                         help_text="If false, new Bookmarks won't be fetched.")
+    last_update_time = models.DateTimeField(null=True, blank=True,
+                help_text="When Pinboard said this Account's Bookmarks last "
+                        "changed, as of the last fetch. Set automatically.")
+    last_all_update_time = models.DateTimeField(null=True, blank=True,
+                help_text="When Pinboard said this Account's Bookmarks last "
+                        "changed, as of the last fetch of all of them. Set "
+                        "automatically.")
 
     def __str__(self):
         return self.username
@@ -64,10 +72,23 @@ class BookmarkTag(TimeStampedModelMixin, TagBase):
     that, if at all.
     """
 
+    is_private_tag = models.BooleanField(default=False, db_index=True,
+        help_text="Pinboard's private tags start with '.'. Set automatically on save.")
+    public_count = models.PositiveIntegerField(default=0, db_index=True,
+        help_text="The number of public Bookmarks with this tag.")
+    total_count = models.PositiveIntegerField(default=0,
+        help_text="The number of public and private Bookmarks with this tag.")
+
+    objects = BookmarkTagManager()
+
     class Meta:
         verbose_name = "Tag"
         verbose_name_plural = "Tags"
 
+    def save(self, *args, **kwargs):
+        self.is_private_tag = self.name.startswith('.')
+        super().save(*args, **kwargs)
+
     def slugify(self, tag, i=None):
         """Pinboard's slugs for tags don't encode many things. Most unicode
         characters are allowed as-is, and only a few special characters
@@ -176,9 +197,18 @@ class Bookmark(DittoItemModel, ExtraBookmarkManagers):
         chance of clashes. But it seems good enough for now.
         """
         if not self.url_hash:
-            self.url_hash = hashlib.md5(
-                                    self.url.encode('utf-8')).hexdigest()[:12]
+            self.url_hash = self._make_url_hash()
+        privacy_changed = self.pk is not None and \
+                                    self.get_field_diff('is_private') is not None
         super().save(*args, **kwargs)
+        if privacy_changed:
+            # The public counts of all this Bookmark's tags have changed.
+            BookmarkTag.objects.tags_changed(
+                        self.tags.get_queryset().values_list('pk', flat=True))
+
+    def _make_url_hash(self):
+        "Returns the 12-character hash of the URL used in our local URLs."
+        return hashlib.md5(self.url.encode('utf-8')).hexdigest()[:12]
 
     def get_absolute_url(self):
         from django.core.urlresolvers import reverse
@@ -0,0 +1,56 @@
+from django.db.models.signals import post_delete, post_save, pre_delete,\
+        pre_save
+from django.dispatch import receiver
+
+from .models import Bookmark, BookmarkTag, TaggedBookmark
+
+
+# Adding, changing or deleting a TaggedBookmark (including in the Admin, or
+# with Bookmark.tags.add(), remove() or clear()) updates its tag's counts.
+
+@receiver(pre_save, sender=TaggedBookmark,
+          dispatch_uid='ditto.pinboard.tagged_bookmark_counts')
+def tagged_bookmark_pre_save(sender, instance, raw, **kwargs):
+    "Remember the TaggedBookmark's tag, in case it's being changed."
+    if instance.pk is not None and not raw:
+        instance._old_tag_id = TaggedBookmark.objects.filter(
+                    pk=instance.pk).values_list('tag_id', flat=True).first()
+
+
+@receiver(post_save, sender=TaggedBookmark,
+          dispatch_uid='ditto.pinboard.tagged_bookmark_counts')
+def tagged_bookmark_post_save(sender, instance, raw, **kwargs):
+    if not raw:
+        tag_ids = {instance.tag_id, getattr(instance, '_old_tag_id', None)}
+        tag_ids.discard(None)
+        BookmarkTag.objects.tags_changed(tag_ids)
+
+
+@receiver(post_delete, sender=TaggedBookmark,
+          dispatch_uid='ditto.pinboard.tagged_bookmark_counts')
+def tagged_bookmark_post_delete(sender, instance, **kwargs):
+    # If its Bookmark has been deleted, bookmark_post_delete() has already
+    # updated the counts.
+    if Bookmark.objects.filter(pk=instance.object_id).exists():
+        BookmarkTag.objects.tags_changed([instance.tag_id])
+
+
+# Deleting a Bookmark (including with a QuerySet's delete(), or when
+# deleting its Account) also deletes its TaggedBookmarks, but only after the
+# Bookmark itself. So all of its tags' counts are updated together as soon
+# as the Bookmark has gone.
+
+@receiver(pre_delete, sender=Bookmark,
+          dispatch_uid='ditto.pinboard.bookmark_tags')
+def bookmark_pre_delete(sender, instance, **kwargs):
+    "Remember the Bookmark's tags before the TaggedBookmarks are deleted."
+    instance._deleted_tag_ids = list(
+                    instance.tags.get_queryset().values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Bookmark,
+          dispatch_uid='ditto.pinboard.bookmark_tags')
+def bookmark_post_delete(sender, instance, **kwargs):
+    tag_ids = getattr(instance, '_deleted_tag_ids', [])
+    if tag_ids:
+        BookmarkTag.objects.tags_changed(tag_ids)
@@ -11,3 +11,8 @@ DITTO_TWITTER_USE_LOCAL_MEDIA = getattr(settings,
                                     'DITTO_TWITTER_USE_LOCAL_MEDIA', False)
 
 
+
+DITTO_TWITTER_USE_WEBP = getattr(settings, 'DITTO_TWITTER_USE_WEBP', False)
+
+DITTO_TWITTER_USE_MEDIA_CACHE = getattr(settings,
+                                    'DITTO_TWITTER_USE_MEDIA_CACHE', False)
@@ -9,6 +9,7 @@ from . import FetchError
 from .savers import TweetSaver, UserSaver
 from ..models import Media, Tweet, User
 from ...core.utils import datetime_now
+from ...core.imagegenerators import make_placeholder
 from ...core.utils.downloader import DownloadException, filedownloader
 
 
@@ -556,6 +557,11 @@ class FetchFiles(object):
                 media_obj.mp4_file.save(
                                     os.path.basename(filepath), django_file)
             else:
+                # Make this from its own copy of the file, which is closed
+                # after use, before the original is saved.
+                with open(filepath, 'rb') as placeholder_source:
+                    media_obj.placeholder = make_placeholder(
+                                                File(placeholder_source))
                 media_obj.image_file.save(
                                     os.path.basename(filepath), django_file)
 
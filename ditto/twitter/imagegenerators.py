@@ -1,14 +1,19 @@
-from imagekit import ImageSpec, register
+from imagekit import register
 from imagekit.processors import Adjust, ResizeToFill, ResizeToFit, Transpose
 
+from ..core.imagegenerators import DraftSpec, WebPSpecMixin
 
-class TwitterSpec(ImageSpec):
+
+class TwitterSpec(DraftSpec):
     "Base class for Medium and Small specs."
     format = 'JPEG'
     options = {'quality': 80}
     # If original image is smaller, don't enlarge it:
     upscale = False
 
+    def get_box(self):
+        return (self.width, self.height)
+
     def __init__(self, source):
         self.processors = [
                 Transpose(),
@@ -39,10 +44,14 @@ class Small(TwitterSpec):
 register.generator('ditto_twitter:small', Small)
 
 
-class Thumbnail(ImageSpec):
+class Thumbnail(DraftSpec):
     width = 150
     height = 150
     upscale = True
+    crop = True
+
+    def get_box(self):
+        return (self.width, self.height)
 
     def __init__(self, source):
         self.processors = [
@@ -53,3 +62,22 @@ class Thumbnail(ImageSpec):
 
 register.generator('ditto_twitter:thumbnail', Thumbnail)
 
+
+# WebP versions, used if DITTO_TWITTER_USE_WEBP is True.
+
+class MediumWebP(WebPSpecMixin, Medium):
+    pass
+
+register.generator('ditto_twitter:medium_webp', MediumWebP)
+
+
+class SmallWebP(WebPSpecMixin, Small):
+    pass
+
+register.generator('ditto_twitter:small_webp', SmallWebP)
+
+
+class ThumbnailWebP(WebPSpecMixin, Thumbnail):
+    pass
+
+register.generator('ditto_twitter:thumbnail_webp', ThumbnailWebP)
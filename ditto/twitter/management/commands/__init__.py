@@ -3,8 +3,11 @@ import argparse
 
 from django.core.management.base import CommandError
 
-from ....core.management.commands import DittoBaseCommand
-from ...models import Account
+from ....core.imagegenerators import webp_supported
+from ....core.management.commands import DittoBaseCommand,\
+                                            ThumbnailsCommandMixin
+from ... import app_settings
+from ...models import Account, Media
 
 
 class FetchTwitterCommand(DittoBaseCommand):
@@ -94,3 +97,25 @@ class UpdateTwitterCommand(DittoBaseCommand):
         """
         return {}
 
+
+
+class MediaThumbnailsMixin(ThumbnailsCommandMixin):
+    """
+    For commands that pre-generate all the sizes of Media's images from their
+    downloaded original files.
+    """
+
+    thumbnails_field = 'image_file'
+    thumbnails_sizes = Media.IMAGE_SIZES
+    thumbnails_singular_noun = 'Media'
+    thumbnails_plural_noun = 'Media'
+
+    def thumbnails_webp(self):
+        return app_settings.DITTO_TWITTER_USE_WEBP and webp_supported()
+
+    def generate_media_thumbnails(self, regenerate=False, processes=None,
+                                                                verbosity=1):
+        return self.generate_thumbnails(Media.objects.all(),
+                                regenerate=regenerate,
+                                processes=processes,
+                                verbosity=verbosity)
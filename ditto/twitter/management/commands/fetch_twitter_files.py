@@ -1,15 +1,18 @@
 # coding: utf-8
 from ....core.management.commands import DittoBaseCommand
 from ...fetch.fetchers import FilesFetcher
+from . import MediaThumbnailsMixin
 
 
-class Command(DittoBaseCommand):
+class Command(MediaThumbnailsMixin, DittoBaseCommand):
     """Fetches images and Animated GIFs' video files from Twitter.
 
     eg:
     ./manage.py fetch_twitter_files
     ./manage.py fetch_twitter_files --all
 
+    To also pre-generate all the resized images afterwards:
+    ./manage.py fetch_twitter_files --thumbnails
     """
 
     help = "Fetches images and Animated GIFs' video files from Twitter"
@@ -27,7 +30,22 @@ class Command(DittoBaseCommand):
             help="Fetch ALL files, even if they've been downloaded before. Otherwise, only fetch files that haven't already been downloaded."
         )
 
+        parser.add_argument(
+            '--thumbnails',
+            action='store_true',
+            default=False,
+            help="After fetching, generate all the resized images for Media that don't have them yet."
+        )
+
+        self.add_processes_argument(parser)
+
     def handle(self, *args, **options):
         results = FilesFetcher().fetch(fetch_all=options['all'])
         self.output_results(results, options.get('verbosity', 1))
 
+        if options['thumbnails']:
+            self.generate_media_thumbnails(
+                                    processes=options['processes'],
+                                    verbosity=options.get('verbosity', 1))
+
+
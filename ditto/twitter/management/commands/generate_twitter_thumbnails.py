@@ -0,0 +1,33 @@
+# coding: utf-8
+from ....core.management.commands import DittoBaseCommand
+from . import MediaThumbnailsMixin
+
+
+class Command(MediaThumbnailsMixin, DittoBaseCommand):
+    """Generates all the resized images for Media with downloaded original
+    files, so that they don't have to be generated when first requested.
+
+    eg:
+    ./manage.py generate_twitter_thumbnails
+    ./manage.py generate_twitter_thumbnails --all
+    ./manage.py generate_twitter_thumbnails --processes=4
+    """
+
+    help = "Generates resized images from Twitter Media's original files"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            default=False,
+            help="Generate images for ALL Media, even if they've been generated before. Otherwise, only generate those that haven't been."
+        )
+
+        self.add_processes_argument(parser)
+
+    def handle(self, *args, **options):
+        self.generate_media_thumbnails(regenerate=options['all'],
+                                    processes=options['processes'],
+                                    verbosity=options.get('verbosity', 1))
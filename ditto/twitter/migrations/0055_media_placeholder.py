@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 21:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('twitter', '0054_media_generated_sizes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='placeholder',
+            field=models.TextField(blank=True, help_text='Data URI of a tiny version of the image, shown while it loads. Set automatically.'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 21:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from ditto.core.utils import geohash
+
+
+def set_geohash(apps, schema_editor):
+    """
+    Sets the `geohash` value on every Tweet with a location.
+    """
+    Tweet = apps.get_model('twitter', 'Tweet')
+    for row in Tweet.objects.exclude(latitude=None).exclude(longitude=None):
+        Tweet.objects.filter(pk=row.pk).update(
+                        geohash=geohash.encode(row.latitude, row.longitude))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('twitter', '0055_media_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, help_text="Identifies the area of the map the item's in. Set automatically on save.", max_length=12),
+        ),
+
+        migrations.RunPython(set_geohash, reverse_code=migrations.RunPython.noop),
+    ]
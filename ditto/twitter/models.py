@@ -4,6 +4,7 @@ import os
 from django.core.urlresolvers import reverse
 from django.db import models
 from django.templatetags.static import static
+from django.utils.functional import cached_property
 
 from imagekit.cachefiles import ImageCacheFile
 
@@ -11,8 +12,11 @@ from . import app_settings
 from . import imagegenerators
 from . import managers
 from .utils import htmlify_description, htmlify_tweet
+from ..core.imagegenerators import webp_supported
 from ..core.managers import PublicItemManager
-from ..core.models import DiffModelMixin, DittoItemModel, TimeStampedModelMixin
+from ..core.models import DiffModelMixin, DittoItemModel, GeohashMixin,\
+                            GeneratedSizesMixin, TimeStampedModelMixin
+from ..core.utils.thumbnails import get_cachefile_storage
 
 import json
 
@@ -95,18 +99,23 @@ class Account(TimeStampedModelMixin, models.Model):
             return False
 
 
-class Media(TimeStampedModelMixin, models.Model):
+class Media(TimeStampedModelMixin, GeneratedSizesMixin, models.Model):
     """A photo, video or animated GIF attached to a Tweet.
 
     They have a bunch of common fields, and then some extra for Videos.
     A Tweet could have zero, one or more Medias. Yes that's the plural shut up.
     """
 
+    generated_sizes_source = 'image_file'
+
     # Mapping our internal names for sizes to the imagekit generators:
     IMAGE_SIZES = {
-        'medium':       { 'generator': imagegenerators.Medium, },
-        'small':        { 'generator': imagegenerators.Small, },
-        'thumb':        { 'generator': imagegenerators.Thumbnail, },
+        'medium':       { 'generator': imagegenerators.Medium,
+                          'webp_generator': imagegenerators.MediumWebP, },
+        'small':        { 'generator': imagegenerators.Small,
+                          'webp_generator': imagegenerators.SmallWebP, },
+        'thumb':        { 'generator': imagegenerators.Thumbnail,
+                          'webp_generator': imagegenerators.ThumbnailWebP, },
     }
 
     MEDIA_TYPES = (
@@ -207,6 +216,19 @@ class Media(TimeStampedModelMixin, models.Model):
         "Because we usually actually want 150, not whatever thumb_h is."
         return 150
 
+    @cached_property
+    def has_public_tweet(self):
+        """
+        Is this Media attached to at least one public Tweet?
+        Uses the prefetched tweets, if they have been.
+        """
+        if self.pk is None:
+            return False
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        if 'tweets' in prefetched:
+            return any(not tweet.is_private for tweet in prefetched['tweets'])
+        return self.tweets.filter(is_private=False).exists()
+
     @property
     def large_url(self):
         "URL to local or remote original-size image."
@@ -283,21 +305,72 @@ class Media(TimeStampedModelMixin, models.Model):
         """
         if app_settings.DITTO_TWITTER_USE_LOCAL_MEDIA:
             return self._local_image_url(size)
+        elif app_settings.DITTO_TWITTER_USE_MEDIA_CACHE and \
+                                                        self.has_public_tweet:
+            # The media cache view only serves Media with public Tweets.
+            return self._cached_image_url(size)
         else:
             return self._remote_image_url(size)
 
-    def _local_image_url(self, size):
+    def webp_image_url(self, size):
+        """
+        The URL of a WebP version of an image of a particular size, hosted
+        locally. Or '' if DITTO_TWITTER_USE_LOCAL_MEDIA and
+        DITTO_TWITTER_USE_WEBP aren't both True, or there's no WebP version of
+        this size.
+        size -- one of 'medium', 'small', or 'thumb'.
+        """
+        if app_settings.DITTO_TWITTER_USE_LOCAL_MEDIA and \
+            app_settings.DITTO_TWITTER_USE_WEBP and \
+            size in self.IMAGE_SIZES and \
+            webp_supported():
+            return self._local_image_url(size, webp=True)
+        else:
+            return ''
+
+    def generated_image_url(self, size, webp=False, generated_sizes=None):
+        """
+        The URL of an image of a particular size, hosted locally, but only if
+        it doesn't need generating first: ie, it's the original file, or a
+        size that's been pre-generated. Otherwise None.
+        size -- one of 'large', 'medium', 'small', or 'thumbnail'.
+        webp -- If True, the URL of the WebP version of the image.
+        generated_sizes -- The result of get_generated_sizes(), if it's
+                           already been called.
+        """
+        if not self.image_file:
+            return None
+        if size == 'large':
+            return None if webp else self.image_file.url
+        if generated_sizes is None:
+            generated_sizes = self.get_generated_sizes()
+        name = generated_sizes.get('%s_webp' % size if webp else size)
+        if name:
+            return get_cachefile_storage().url(name)
+        else:
+            return None
+
+    def _local_image_url(self, size, webp=False):
         """
         Generate the URL of an image of a particular size, hosted locally,
         based on the original file (which must already be downloaded).
         size -- one of 'large', 'medium', 'small', or 'thumbnail'.
+        webp -- If True, the URL of the WebP version of the image.
         """
         if self.image_file:
             if size == 'large':
                 # Essentially the original file.
                 return self.image_file.url
             else:
-                generator = self.IMAGE_SIZES[size]['generator']
+                if webp:
+                    generator = self.IMAGE_SIZES[size]['webp_generator']
+                    size = '%s_webp' % size
+                else:
+                    generator = self.IMAGE_SIZES[size]['generator']
+                url = self.get_generated_size_url(size)
+                if url is not None:
+                    # Already generated, so no need to check storage.
+                    return url
                 try:
                     image_generator = generator(source=self.image_file)
                     result = ImageCacheFile(image_generator)
@@ -310,6 +383,15 @@ class Media(TimeStampedModelMixin, models.Model):
             # We haven't downloaded an original file for this.
             return static('img/original_missing.jpg')
 
+    def _cached_image_url(self, size):
+        """
+        The URL of the media cache view, which serves a local copy of the
+        image from Twitter, fetching it first if need be.
+        size -- one of 'large', 'medium', 'small', or 'thumbnail'.
+        """
+        return reverse('ditto:media_cache', kwargs={
+                    'service': 'twitter', 'id': self.twitter_id, 'size': size})
+
     def _remote_image_url(self, size):
         """
         Generate the URL of an image of a particular size, at Twitter.
@@ -380,7 +462,7 @@ class ExtraTweetManagers(models.Model):
         abstract = True
 
 
-class Tweet(DittoItemModel, ExtraTweetManagers):
+class Tweet(DittoItemModel, ExtraTweetManagers, GeohashMixin):
     """We don't replicate all of the possible Tweet attributes here, only
     enough to display the most useful things. Given we save the raw JSON
     about this tweet, we could add more attributes in future, even if original
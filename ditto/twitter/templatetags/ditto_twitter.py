@@ -4,12 +4,19 @@ import pytz
 from django import template
 from django.db.models import Count
 
+from .. import app_settings
 from ..models import Tweet, User
-from ...core.utils import get_annual_item_counts
+from ...core.imagegenerators import webp_supported
+from ...core.utils import get_annual_item_counts, make_picture, make_srcset
 
 
 register = template.Library()
 
+
+# The Media image sizes used in srcsets, smallest first.
+# 'thumb' is cropped, so isn't included.
+SRCSET_SIZES = ('small', 'medium', 'large',)
+
 @register.assignment_tag
 def recent_tweets(screen_name=None, limit=10):
     """Returns a QuerySet of recent public Tweets, in reverse-chronological
@@ -144,3 +151,63 @@ def annual_favorite_counts(screen_name=None):
 
     return get_annual_item_counts(tweets)
 
+
+def _media_srcset(media, webp=False, generated_sizes=None):
+    if app_settings.DITTO_TWITTER_USE_LOCAL_MEDIA:
+        # Only use files that already exist, so that showing a Media doesn't
+        # generate every size of it.
+        if webp and not (app_settings.DITTO_TWITTER_USE_WEBP and
+                                                        webp_supported()):
+            return ''
+        if generated_sizes is None:
+            generated_sizes = media.get_generated_sizes()
+        candidates = [(media.generated_image_url(size, webp=webp,
+                                            generated_sizes=generated_sizes),
+                        getattr(media, '%s_w' % size)) for size in SRCSET_SIZES]
+    elif webp:
+        # WebP images are only available locally.
+        return ''
+    else:
+        candidates = [(getattr(media, '%s_url' % size),
+                        getattr(media, '%s_w' % size)) for size in SRCSET_SIZES]
+    return make_srcset(candidates)
+
+
+@register.simple_tag
+def media_srcset(media):
+    """Returns the value for an <img>'s srcset attribute, listing the small,
+    medium and large sizes of this Media's image. eg:
+        <img src="{{ media.small_url }}" srcset="{% media_srcset media %}"
+            sizes="680px" alt="">
+    """
+    return _media_srcset(media)
+
+
+@register.simple_tag
+def media_picture(media, size='medium', sizes='', css_class=''):
+    """Returns an <img> for the Media with a srcset of its sizes, and its
+    placeholder, if any, as a background while it loads.
+    If DITTO_TWITTER_USE_LOCAL_MEDIA and DITTO_TWITTER_USE_WEBP are True, it's
+    in a <picture> with a <source> for the WebP versions.
+    With local media, the srcsets only include sizes that have already been
+    generated (see the generate_twitter_thumbnails command). eg:
+        {% media_picture media size='medium' css_class='img-fluid' %}
+
+    Keyword arguments:
+    size -- One of 'small', 'medium' or 'large', used for the src, width and
+            height.
+    sizes -- Value for the sizes attribute. Default is size's width in px.
+    css_class -- Value for the <img>'s class attribute.
+    """
+    # Only parse this once:
+    generated_sizes = media.get_generated_sizes()
+    return make_picture(src=getattr(media, '%s_url' % size),
+                        width=getattr(media, '%s_w' % size),
+                        height=getattr(media, '%s_h' % size),
+                        srcset=_media_srcset(media,
+                                        generated_sizes=generated_sizes),
+                        webp_srcset=_media_srcset(media, webp=True,
+                                        generated_sizes=generated_sizes),
+                        sizes=sizes,
+                        css_class=css_class,
+                        placeholder=media.placeholder)
@@ -0,0 +1,132 @@
+import base64
+import io
+import os
+import shutil
+import tempfile
+
+from django.core.files import File
+from django.test import TestCase
+from PIL import Image
+
+from ditto.core.imagegenerators import Intermediate, make_placeholder
+from ditto.flickr import imagegenerators as flickr_generators
+from ditto.twitter import imagegenerators as twitter_generators
+
+
+class ImageTestCase(TestCase):
+    "Parent for tests that need an original image file."
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_source(self, size=(2000, 1500), format='JPEG'):
+        "Returns a File of an image of size."
+        path = os.path.join(self.tmp_dir, 'original.%s' % format.lower())
+        Image.new('RGB', size, (200, 100, 50)).save(path, format)
+        return File(open(path, 'rb'))
+
+    def generate(self, generator, source, intermediate=None):
+        "Returns the PIL Image generated by the generator class."
+        spec = generator(source=source)
+        spec.intermediate = intermediate
+        return Image.open(spec.generate())
+
+
+class DraftSpecTestCase(ImageTestCase):
+
+    def test_draft_size_fit(self):
+        spec = flickr_generators.Small(source=None)
+        self.assertEqual(spec.get_draft_size((2000, 1000)), (480, 240))
+
+    def test_draft_size_fill(self):
+        spec = flickr_generators.Square(source=None)
+        self.assertEqual(spec.get_draft_size((2000, 1000)), (300, 150))
+
+    def test_draft_size_none(self):
+        "No shrinking if the original is less than twice the final size."
+        spec = flickr_generators.Large(source=None)
+        self.assertIsNone(spec.get_draft_size((2000, 1500)))
+
+    def test_fit_size(self):
+        img = self.generate(flickr_generators.Small, self.make_source())
+        self.assertEqual(img.size, (240, 180))
+        self.assertEqual(img.format, 'JPEG')
+
+    def test_fill_size(self):
+        img = self.generate(flickr_generators.Square, self.make_source())
+        self.assertEqual(img.size, (75, 75))
+
+    def test_no_upscale(self):
+        img = self.generate(flickr_generators.Large2048, self.make_source())
+        self.assertEqual(img.size, (2000, 1500))
+
+    def test_upscale(self):
+        img = self.generate(flickr_generators.Thumbnail,
+                                            self.make_source(size=(50, 40)))
+        self.assertEqual(img.size, (100, 80))
+
+    def test_keeps_format(self):
+        "A spec without a format should keep the original's format."
+        img = self.generate(twitter_generators.Thumbnail,
+                                            self.make_source(format='PNG'))
+        self.assertEqual(img.size, (150, 150))
+        self.assertEqual(img.format, 'PNG')
+
+    def test_draft_decodes_smaller(self):
+        "A JPEG should be decoded at a reduced size."
+        source = self.make_source()
+        intermediate = Intermediate(source)
+        intermediate.get_image(flickr_generators.Small(source=source))
+        # 1/4 scale is the smallest that's still at least 480x360:
+        self.assertEqual(intermediate.image.size, (500, 375))
+        self.assertEqual(intermediate.original_size, (2000, 1500))
+
+    def test_intermediate_shared(self):
+        "Sizes made from a shared intermediate are the same as without."
+        source = self.make_source()
+        intermediate = Intermediate(source)
+        sizes = []
+        for generator in (flickr_generators.Large,
+                          flickr_generators.Medium,
+                          flickr_generators.Square):
+            sizes.append(
+                    self.generate(generator, source, intermediate).size)
+        self.assertEqual(sizes, [(1024, 768), (500, 375), (75, 75)])
+        # Shrunk for the last, smallest, size:
+        self.assertEqual(intermediate.image.size, (200, 150))
+
+    def test_intermediate_reloads_for_bigger(self):
+        "If a bigger size is used after a smaller one, re-decode the original."
+        source = self.make_source()
+        intermediate = Intermediate(source)
+        self.generate(flickr_generators.Square, source, intermediate)
+        img = self.generate(flickr_generators.Large, source, intermediate)
+        self.assertEqual(img.size, (1024, 768))
+        self.assertEqual(intermediate.image.size, (2000, 1500))
+
+
+class MakePlaceholderTestCase(ImageTestCase):
+
+    def test_placeholder(self):
+        placeholder = make_placeholder(self.make_source())
+        prefix = 'data:image/jpeg;base64,'
+        self.assertTrue(placeholder.startswith(prefix))
+        img = Image.open(io.BytesIO(
+                            base64.b64decode(placeholder[len(prefix):])))
+        self.assertEqual(img.size, (16, 12))
+
+    def test_placeholder_with_intermediate(self):
+        "Should use the already-shrunk image."
+        source = self.make_source()
+        intermediate = Intermediate(source)
+        self.generate(flickr_generators.Square, source, intermediate)
+        self.assertTrue(make_placeholder(source, intermediate))
+        self.assertEqual(intermediate.image.size, (32, 24))
+
+    def test_bad_file(self):
+        path = os.path.join(self.tmp_dir, 'empty.jpg')
+        open(path, 'wb').close()
+        self.assertEqual(make_placeholder(File(open(path, 'rb'))), '')
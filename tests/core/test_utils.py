@@ -2,6 +2,7 @@
 import datetime
 import os
 import pytz
+from unittest import skipIf
 from unittest.mock import patch
 
 from django.test import TestCase
@@ -10,8 +11,15 @@ from freezegun import freeze_time
 import responses
 from requests.exceptions import HTTPError
 
-from ditto.core.utils import datetime_now, datetime_from_str, truncate_string
+from ditto.core.imagegenerators import webp_supported
+from ditto.core.utils import datetime_now, datetime_from_str, make_picture,\
+        make_srcset, truncate_string
+from ditto.core.utils import geohash
 from ditto.core.utils.downloader import DownloadException, filedownloader
+from ditto.core.utils.ratelimiter import RateLimiter
+from ditto.core.utils.thumbnails import ThumbnailGenerator
+from ditto.flickr.factories import PhotoFactory
+from ditto.flickr.models import Photo
 
 
 class DatetimeNowTestCase(TestCase):
@@ -171,3 +179,216 @@ class FileDownloaderTestCase(TestCase):
         )
         self.assertEqual(filename, '26348530105.mov')
 
+
+
+class RateLimiterTestCase(TestCase):
+
+    @patch('time.sleep')
+    @patch('time.monotonic')
+    def test_first_call_does_not_wait(self, monotonic, sleep):
+        monotonic.return_value = 100.0
+        RateLimiter(per_second=4).wait()
+        self.assertFalse(sleep.called)
+
+    @patch('time.sleep')
+    @patch('time.monotonic')
+    def test_waits_between_calls(self, monotonic, sleep):
+        monotonic.return_value = 100.0
+        limiter = RateLimiter(per_second=4)
+        limiter.wait()
+        limiter.wait()
+        limiter.wait()
+        self.assertEqual(sleep.call_args_list[0][0][0], 0.25)
+        self.assertEqual(sleep.call_args_list[1][0][0], 0.5)
+
+    @patch('time.sleep')
+    @patch('time.monotonic')
+    def test_no_wait_after_interval(self, monotonic, sleep):
+        monotonic.return_value = 100.0
+        limiter = RateLimiter(per_second=4)
+        limiter.wait()
+        monotonic.return_value = 101.0
+        limiter.wait()
+        self.assertFalse(sleep.called)
+
+    @patch('time.sleep')
+    def test_no_limit(self, sleep):
+        limiter = RateLimiter(per_second=None)
+        limiter.wait()
+        limiter.wait()
+        self.assertFalse(sleep.called)
+
+
+class GeohashTestCase(TestCase):
+
+    def test_encode(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11),
+                                                                'u4pruydqqvj')
+
+    def test_encode_default_precision(self):
+        self.assertEqual(len(geohash.encode(51.5074, -0.1278)), 12)
+
+    def test_encode_edges(self):
+        self.assertEqual(geohash.encode(90, 180, 3), 'zzz')
+        self.assertEqual(geohash.encode(-90, -180, 3), '000')
+
+    def test_decode(self):
+        latitude, longitude = geohash.decode('gcpvj0')
+        self.assertAlmostEqual(latitude, 51.50665, places=5)
+        self.assertAlmostEqual(longitude, -0.12634, places=5)
+
+    def test_covering_prefixes(self):
+        prefixes = geohash.covering_prefixes(51.4, -0.3, 51.6, 0.1)
+        self.assertEqual(sorted(prefixes), ['gcpu', 'gcpv', 'u10h', 'u10j'])
+
+    def test_covering_prefixes_contain_points(self):
+        "Every point in the area should be in one of the cells."
+        prefixes = geohash.covering_prefixes(51.4, -0.3, 51.6, 0.1)
+        for lat, lon in [(51.4, -0.3), (51.6, 0.1), (51.5, 0), (51.45, -0.2)]:
+            self.assertIn(geohash.encode(lat, lon)[:4], prefixes)
+
+    def test_covering_prefixes_whole_world(self):
+        self.assertEqual(geohash.covering_prefixes(-90, -180, 90, 180), [])
+
+    def test_covering_prefixes_180th_meridian(self):
+        prefixes = geohash.covering_prefixes(-10, 170, 10, -170)
+        self.assertIn(geohash.encode(0, 175)[:2], prefixes)
+        self.assertIn(geohash.encode(0, -175)[:2], prefixes)
+        self.assertNotIn(geohash.encode(0, 0)[:2], prefixes)
+
+    def test_tile_bbox(self):
+        south, west, north, east = geohash.tile_bbox(1, 1, 0)
+        self.assertAlmostEqual(south, 0)
+        self.assertAlmostEqual(west, 0)
+        self.assertAlmostEqual(north, 85.0511, places=4)
+        self.assertAlmostEqual(east, 180)
+
+
+class ThumbnailGeneratorTestCase(TestCase):
+
+    def setUp(self):
+        self.photo = PhotoFactory()
+        self.generator = ThumbnailGenerator(sizes=Photo.PHOTO_SIZES,
+                                        field_name='original_file',
+                                        processes=1)
+
+    def test_generates_sizes(self):
+        result = self.generator.generate(Photo.objects.all())
+        self.assertEqual(result, {'success': True, 'generated': 1})
+        self.photo.refresh_from_db()
+        sizes = self.photo.get_generated_sizes()
+        # All sizes except 'original', which has no generator:
+        self.assertEqual(len(sizes), len(Photo.PHOTO_SIZES) - 1)
+        self.assertNotIn('original', sizes)
+        self.assertRegex(sizes['small'], r'^CACHE/images/flickr/.*/example/[^\.]+\.jpg$')
+        self.assertTrue(
+                self.photo.placeholder.startswith('data:image/jpeg;base64,'))
+
+    def test_skips_generated(self):
+        self.generator.generate(Photo.objects.all())
+        result = self.generator.generate(Photo.objects.all())
+        self.assertEqual(result['generated'], 0)
+
+    def test_generates_missing_placeholder(self):
+        self.generator.generate(Photo.objects.all())
+        Photo.objects.update(placeholder='')
+        result = self.generator.generate(Photo.objects.all())
+        self.assertEqual(result['generated'], 1)
+
+    @patch('ditto.core.utils.thumbnails.make_placeholder')
+    def test_placeholder_failure_recorded(self, make_placeholder):
+        "If the placeholder can't be made, it isn't tried every time."
+        make_placeholder.return_value = ''
+        result = self.generator.generate(Photo.objects.all())
+        self.assertTrue(result['success'])
+        self.assertEqual(result['generated'], 1)
+        self.assertIn("Couldn't make a placeholder", result['warnings'][0])
+        self.photo.refresh_from_db()
+        self.assertTrue(self.photo.placeholder_failed())
+        self.assertEqual(len(self.photo.get_generated_sizes()),
+                         len(Photo.PHOTO_SIZES) - 1)
+
+        result = self.generator.generate(Photo.objects.all())
+        self.assertEqual(result['generated'], 0)
+        self.assertEqual(make_placeholder.call_count, 1)
+
+    def test_regenerates_generated(self):
+        self.generator.generate(Photo.objects.all())
+        result = self.generator.generate(Photo.objects.all(), regenerate=True)
+        self.assertEqual(result['generated'], 1)
+
+    def test_skips_missing_files(self):
+        PhotoFactory(original_file='')
+        result = self.generator.generate(Photo.objects.all())
+        self.assertEqual(result['generated'], 1)
+
+    @patch('ditto.core.utils.thumbnails.ImageCacheFile')
+    def test_error(self, cachefile):
+        cachefile.return_value.generate.side_effect = IOError('Oops')
+        result = self.generator.generate(Photo.objects.all())
+        self.assertFalse(result['success'])
+        self.assertEqual(result['generated'], 0)
+        self.assertIn('Oops', result['messages'][0])
+        self.photo.refresh_from_db()
+        self.assertEqual(self.photo.generated_sizes, '')
+
+    @skipIf(not webp_supported(), "Pillow can't save WebP images")
+    def test_generates_webp(self):
+        generator = ThumbnailGenerator(sizes=Photo.PHOTO_SIZES,
+                                    field_name='original_file',
+                                    processes=1,
+                                    webp=True)
+        generator.generate(Photo.objects.all())
+        self.photo.refresh_from_db()
+        sizes = self.photo.get_generated_sizes()
+        self.assertEqual(len(sizes), (len(Photo.PHOTO_SIZES) - 1) * 2)
+        self.assertRegex(sizes['small_webp'], r'\.webp$')
+
+
+class MakeSrcsetTestCase(TestCase):
+
+    def test_srcset(self):
+        self.assertEqual(
+            make_srcset([('/s.jpg', 240), ('/m.jpg', 500)]),
+            '/s.jpg 240w, /m.jpg 500w')
+
+    def test_skips_missing(self):
+        self.assertEqual(
+            make_srcset([('/s.jpg', None), ('', 320), ('/m.jpg', 500)]),
+            '/m.jpg 500w')
+
+    def test_skips_duplicate_widths(self):
+        self.assertEqual(
+            make_srcset([('/s.jpg', 240), ('/m.jpg', 240)]),
+            '/s.jpg 240w')
+
+
+class MakePictureTestCase(TestCase):
+
+    def test_img(self):
+        self.assertEqual(
+            make_picture('/s.jpg', 240, 180),
+            '<img src="/s.jpg" width="240" height="180" alt="">')
+
+    def test_srcset(self):
+        self.assertEqual(
+            make_picture('/s.jpg', 240, 180, srcset='/s.jpg 240w, /m.jpg 500w',
+                                                        css_class='img-fluid'),
+            '<img src="/s.jpg" width="240" height="180" alt="" '
+            'srcset="/s.jpg 240w, /m.jpg 500w" sizes="240px" '
+            'class="img-fluid">')
+
+    def test_placeholder(self):
+        self.assertEqual(
+            make_picture('/s.jpg', 240, 180, placeholder='data:image/jpeg;base64,AB+/='),
+            '<img src="/s.jpg" width="240" height="180" alt="" '
+            'style="background-image:url(data:image/jpeg;base64,AB+/=);'
+            'background-size:cover">')
+
+    def test_webp(self):
+        self.assertEqual(
+            make_picture('/s.jpg', 240, 180, srcset='/s.jpg 240w',
+                        webp_srcset='/s.webp 240w', sizes='50vw'),
+            '<picture><source type="image/webp" srcset="/s.webp 240w" '
+            'sizes="50vw"><img src="/s.jpg" width="240" height="180" alt="" '
+            'srcset="/s.jpg 240w" sizes="50vw"></picture>')
@@ -1,12 +1,19 @@
 import datetime
+import os
+import shutil
+import tempfile
 from unittest.mock import patch
 import pytz
 
 from django.apps import apps
 from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.test import override_settings, TestCase
 
+from ditto.core import app_settings
 from ditto.core.utils import datetime_from_str
+from ditto.core.utils.downloader import DownloadException
+from ditto.flickr import app_settings as flickr_settings
+from ditto.twitter import app_settings as twitter_settings
 from ditto.flickr import factories as flickrfactories
 from ditto.lastfm import factories as lastfmfactories
 from ditto.pinboard import factories as pinboardfactories
@@ -359,3 +366,190 @@ class DittoDayArchiveTestCase(TestCase):
         response = self.client.get(self.make_url('twitter', 'likes'))
         self.assertEqual(0, len(response.context['twitter_favorite_list']))
 
+
+
+class MediaCacheViewTestCase(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.default_flickr = flickr_settings.DITTO_FLICKR_USE_MEDIA_CACHE
+        self.default_twitter = twitter_settings.DITTO_TWITTER_USE_MEDIA_CACHE
+        self.default_header = app_settings.DITTO_MEDIA_CACHE_SENDFILE_HEADER
+        flickr_settings.DITTO_FLICKR_USE_MEDIA_CACHE = True
+        twitter_settings.DITTO_TWITTER_USE_MEDIA_CACHE = True
+        self.photo = flickrfactories.PhotoFactory(flickr_id=4567, farm=3,
+                                                server='1234', secret='9876')
+
+    def tearDown(self):
+        flickr_settings.DITTO_FLICKR_USE_MEDIA_CACHE = self.default_flickr
+        twitter_settings.DITTO_TWITTER_USE_MEDIA_CACHE = self.default_twitter
+        app_settings.DITTO_MEDIA_CACHE_SENDFILE_HEADER = self.default_header
+        shutil.rmtree(self.media_root)
+
+    def make_url(self, service, id, size):
+        return reverse('ditto:media_cache',
+                            kwargs={'service': service, 'id': id, 'size': size})
+
+    def download(self, url, acceptable_content_types):
+        "Used instead of filedownloader.download(); copies a fixture."
+        filepath = os.path.join(tempfile.mkdtemp(), 'download.jpg')
+        shutil.copy('tests/core/fixtures/images/marmite.jpg', filepath)
+        return filepath
+
+    def get(self, url):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            return self.client.get(url)
+
+    @patch('ditto.core.views.filedownloader.download')
+    def test_fetches_and_saves_image(self, download):
+        download.side_effect = self.download
+        response = self.get(self.make_url('flickr', 4567, 'medium'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        download.assert_called_once_with(
+                        'https://farm3.static.flickr.com/1234/4567_9876.jpg',
+                        ['image/jpeg', 'image/jpg', 'image/png', 'image/gif'])
+        self.assertTrue(os.path.exists(os.path.join(self.media_root,
+                                        'media-cache/flickr/4567/medium.jpg')))
+
+    @patch('ditto.core.views.filedownloader.download')
+    def test_serves_saved_image(self, download):
+        "The second request shouldn't fetch the image again."
+        download.side_effect = self.download
+        self.get(self.make_url('flickr', 4567, 'medium'))
+        response = self.get(self.make_url('flickr', 4567, 'medium'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(download.call_count, 1)
+
+    @patch('ditto.core.views.filedownloader.download')
+    def test_cache_headers(self, download):
+        download.side_effect = self.download
+        response = self.get(self.make_url('flickr', 4567, 'medium'))
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertTrue(response.has_header('Expires'))
+
+    @patch('ditto.core.views.filedownloader.download')
+    def test_sendfile_header(self, download):
+        download.side_effect = self.download
+        app_settings.DITTO_MEDIA_CACHE_SENDFILE_HEADER = 'X-Sendfile'
+        response = self.get(self.make_url('flickr', 4567, 'medium'))
+        self.assertEqual(response['X-Sendfile'], os.path.join(
+                        self.media_root, 'media-cache/flickr/4567/medium.jpg'))
+        self.assertEqual(response.content, b'')
+
+    @patch('ditto.core.views.filedownloader.download')
+    def test_twitter(self, download):
+        download.side_effect = self.download
+        twitterfactories.PhotoFactory(twitter_id=1234,
+                        image_url='https://pbs.twimg.com/media/abc.png',
+                        tweets=(twitterfactories.TweetFactory(),))
+        response = self.get(self.make_url('twitter', 1234, 'small'))
+        self.assertEqual(response.status_code, 200)
+        download.assert_called_once_with(
+                        'https://pbs.twimg.com/media/abc.png:small',
+                        ['image/jpeg', 'image/jpg', 'image/png', 'image/gif'])
+        self.assertTrue(os.path.exists(os.path.join(self.media_root,
+                                        'media-cache/twitter/1234/small.png')))
+
+    @patch('ditto.core.views.filedownloader.download')
+    def test_redirects_on_download_error(self, download):
+        download.side_effect = DownloadException('Oops')
+        response = self.get(self.make_url('flickr', 4567, 'medium'))
+        self.assertRedirects(response,
+                        'https://farm3.static.flickr.com/1234/4567_9876.jpg',
+                        fetch_redirect_response=False)
+
+    def test_404_private_photo(self):
+        flickrfactories.PhotoFactory(flickr_id=7890, is_private=True)
+        response = self.get(self.make_url('flickr', 7890, 'medium'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_404_private_twitter_media(self):
+        "Media only attached to private Tweets isn't available."
+        user = twitterfactories.UserFactory(is_private=True)
+        twitterfactories.PhotoFactory(twitter_id=5678,
+                        tweets=(twitterfactories.TweetFactory(user=user),))
+        response = self.get(self.make_url('twitter', 5678, 'small'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_404_twitter_media_without_tweets(self):
+        twitterfactories.PhotoFactory(twitter_id=5678)
+        response = self.get(self.make_url('twitter', 5678, 'small'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_404_invalid_size(self):
+        response = self.get(self.make_url('flickr', 4567, 'enormous'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_404_invalid_service(self):
+        response = self.get(self.make_url('instagram', 4567, 'medium'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_404_when_disabled(self):
+        flickr_settings.DITTO_FLICKR_USE_MEDIA_CACHE = False
+        response = self.get(self.make_url('flickr', 4567, 'medium'))
+        self.assertEqual(response.status_code, 404)
+
+
+class MapTilesViewTestCase(TestCase):
+
+    def setUp(self):
+        user = flickrfactories.UserFactory()
+        flickrfactories.AccountFactory(user=user)
+        # Two in London, one in Paris:
+        flickrfactories.PhotoFactory(user=user,
+                                    latitude=51.5074, longitude=-0.1278)
+        flickrfactories.PhotoFactory(user=user,
+                                    latitude=51.5080, longitude=-0.1280)
+        flickrfactories.PhotoFactory(user=user,
+                                    latitude=48.8566, longitude=2.3522)
+        # Private, and no location:
+        flickrfactories.PhotoFactory(user=user, is_private=True,
+                                    latitude=51.5074, longitude=-0.1278)
+        flickrfactories.PhotoFactory(user=user)
+
+    def make_url(self, service, zoom, x, y):
+        return reverse('ditto:map_tiles',
+                kwargs={'service': service, 'zoom': zoom, 'x': x, 'y': y})
+
+    def test_world_tile(self):
+        response = self.client.get(self.make_url('flickr', 0, 0, 0))
+        self.assertEqual(response.status_code, 200)
+        clusters = response.json()['clusters']
+        self.assertEqual(sum(c['count'] for c in clusters), 3)
+
+    def test_clusters(self):
+        "The London photos should be grouped together, apart from Paris."
+        response = self.client.get(self.make_url('flickr', 0, 0, 0))
+        clusters = sorted(response.json()['clusters'],
+                                                key=lambda c: c['count'])
+        self.assertEqual([c['count'] for c in clusters], [1, 2])
+        self.assertAlmostEqual(clusters[1]['latitude'], 51.5077, places=4)
+        self.assertAlmostEqual(clusters[1]['longitude'], -0.1279, places=4)
+
+    def test_empty_tile(self):
+        response = self.client.get(self.make_url('flickr', 4, 0, 0))
+        self.assertEqual(response.json(), {'clusters': []})
+
+    def test_cache_headers(self):
+        response = self.client.get(self.make_url('flickr', 0, 0, 0))
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=%s' % app_settings.DITTO_MAP_TILES_MAX_AGE,
+                                                    response['Cache-Control'])
+
+    def test_twitter(self):
+        user = twitterfactories.UserFactory()
+        twitterfactories.AccountFactory(user=user)
+        twitterfactories.TweetFactory(user=user,
+                                    latitude=51.5074, longitude=-0.1278)
+        response = self.client.get(self.make_url('twitter', 0, 0, 0))
+        self.assertEqual(response.json()['clusters'][0]['count'], 1)
+
+    def test_404_invalid_tile(self):
+        response = self.client.get(self.make_url('flickr', 1, 2, 0))
+        self.assertEqual(response.status_code, 404)
+
+    def test_404_invalid_service(self):
+        response = self.client.get(self.make_url('instagram', 0, 0, 0))
+        self.assertEqual(response.status_code, 404)
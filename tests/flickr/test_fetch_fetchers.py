@@ -12,14 +12,17 @@ from freezegun import freeze_time
 from django.test import override_settings, TestCase
 
 from .test_fetch import FlickrFetchTestCase
-from ditto.core.utils import datetime_now
+from ditto.core.utils import datetime_from_str, datetime_now
 from ditto.core.utils.downloader import filedownloader
-from ditto.flickr.factories import AccountFactory, PhotoFactory, UserFactory
+from ditto.flickr import app_settings
+from ditto.flickr.factories import AccountFactory, PhotoFactory,\
+    PhotosetFactory, UserFactory
 from ditto.flickr.fetch import FetchError
 from ditto.flickr.fetch.fetchers import Fetcher, PhotosFetcher,\
-    PhotosetsFetcher, RecentPhotosFetcher, UserFetcher, UserIdFetcher
+    PhotosetsFetcher, RecentPhotosFetcher, UpdatedPhotosFetcher,\
+    UserFetcher, UserIdFetcher
 from ditto.flickr.fetch.savers import UserSaver, PhotoSaver, PhotosetSaver
-from ditto.flickr.models import User
+from ditto.flickr.models import Account, User
 
 
 class FetcherTestCase(FlickrFetchTestCase):
@@ -183,6 +186,22 @@ class UserFetcherTestCase(FlickrFetchTestCase):
             'flickr/60/50/35034346050N01/avatars/%s' %
                                             os.path.basename(temp_filepath))
 
+    @patch.object(UserFetcher, '_fetch_and_save_avatar')
+    def test_does_not_download_unchanged_avatar(self, fetch_avatar):
+        "If the user's icon hasn't changed, the avatar isn't downloaded."
+        UserFactory(nsid='35034346050@N01', iconserver=7420, iconfarm=8)
+        self.expect_response('people.getInfo')
+        UserFetcher(account=self.account).fetch(nsid='35034346050@N01')
+        self.assertFalse(fetch_avatar.called)
+
+    @patch.object(UserFetcher, '_fetch_and_save_avatar')
+    def test_downloads_changed_avatar(self, fetch_avatar):
+        "If the user's icon has changed, the avatar is downloaded."
+        UserFactory(nsid='35034346050@N01', iconserver=1234, iconfarm=8)
+        self.expect_response('people.getInfo')
+        UserFetcher(account=self.account).fetch(nsid='35034346050@N01')
+        self.assertEqual(fetch_avatar.call_count, 1)
+
     def test_returns_correct_success_result(self):
         self.expect_response('people.getInfo')
         result = UserFetcher(account=self.account).fetch(
@@ -223,11 +242,86 @@ class PhotosFetcherTestCase(FlickrFetchTestCase):
         self.fetcher.results = self.load_fixture(
                                         'people.getPhotos')['photos']['photo']
         self.fetcher._fetch_extra()
-        # Each method is called once per photo_id:
+        # Each method is called once per photo_id, in any order because
+        # they're called from several threads:
         calls = [call('25822158530'), call('26069027966'), call('25822102530')]
-        fetch_photo_info.assert_has_calls(calls)
-        fetch_photo_sizes.assert_has_calls(calls)
-        fetch_photo_exif.assert_has_calls(calls)
+        fetch_photo_info.assert_has_calls(calls, any_order=True)
+        fetch_photo_sizes.assert_has_calls(calls, any_order=True)
+        fetch_photo_exif.assert_has_calls(calls, any_order=True)
+
+    @patch.object(PhotosFetcher, '_fetch_photo_info')
+    @patch.object(PhotosFetcher, '_fetch_photo_sizes')
+    @patch.object(PhotosFetcher, '_fetch_photo_exif')
+    def test_fetch_extra_keeps_order(self, fetch_photo_exif, fetch_photo_sizes, fetch_photo_info):
+        "The extra data should be in the same order as the photos."
+        self.expect_response('people.getInfo')
+        fetch_photo_info.side_effect = lambda photo_id: {'id': photo_id}
+        self.fetcher.results = self.load_fixture(
+                                        'people.getPhotos')['photos']['photo']
+        self.fetcher._fetch_extra()
+        self.assertEqual([r['info']['id'] for r in self.fetcher.results],
+                        ['25822158530', '26069027966', '25822102530'])
+        self.assertEqual(self.fetcher.results[0]['user_obj'].nsid,
+                        '35034346050@N01')
+
+    @patch.object(PhotosFetcher, '_fetch_photo_info')
+    @patch.object(PhotosFetcher, '_fetch_photo_sizes')
+    @patch.object(PhotosFetcher, '_fetch_photo_exif')
+    def test_fetch_extra_in_one_thread(self, fetch_photo_exif, fetch_photo_sizes, fetch_photo_info):
+        "It should work the same without a pool of threads."
+        self.expect_response('people.getInfo')
+        fetch_photo_info.side_effect = lambda photo_id: {'id': photo_id}
+        self.fetcher.max_workers = 1
+        self.fetcher.results = self.load_fixture(
+                                        'people.getPhotos')['photos']['photo']
+        self.fetcher._fetch_extra()
+        self.assertEqual([r['info']['id'] for r in self.fetcher.results],
+                        ['25822158530', '26069027966', '25822102530'])
+
+    @patch.object(PhotosFetcher, '_fetch_photo_info')
+    @patch.object(PhotosFetcher, '_fetch_photo_sizes')
+    @patch.object(PhotosFetcher, '_fetch_photo_exif')
+    def test_fetch_extra_raises_error(self, fetch_photo_exif, fetch_photo_sizes, fetch_photo_info):
+        "An error in one of the threads should be raised."
+        self.expect_response('people.getInfo')
+        fetch_photo_sizes.side_effect = FetchError('Oops')
+        self.fetcher.results = self.load_fixture(
+                                        'people.getPhotos')['photos']['photo']
+        with self.assertRaises(FetchError):
+            self.fetcher._fetch_extra()
+
+    @patch.object(PhotosFetcher, '_fetch_photo_info')
+    @patch.object(PhotosFetcher, '_fetch_photo_sizes')
+    @patch.object(PhotosFetcher, '_fetch_photo_exif')
+    def test_lean_fetch_extra(self, fetch_photo_exif, fetch_photo_sizes, fetch_photo_info):
+        "In lean mode, getSizes should only be called for videos."
+        self.expect_response('people.getInfo')
+        fetch_photo_sizes.return_value = {'size': []}
+        self.fetcher.lean = True
+        photos = self.load_fixture('people.getPhotos')['photos']['photo']
+        for photo in photos:
+            photo['media'] = 'photo'
+        photos[0]['url_m'] = 'https://farm2.staticflickr.com/1471/25822158530_123456abcd.jpg'
+        photos[0]['width_m'] = '500'
+        photos[0]['height_m'] = '375'
+        photos[2]['media'] = 'video'
+        self.fetcher.results = photos
+        self.fetcher._fetch_extra()
+        fetch_photo_sizes.assert_called_once_with('25822102530')
+        self.assertEqual(self.fetcher.results[0]['sizes'], {'size': [{
+            'label': 'Medium',
+            'width': '500',
+            'height': '375',
+            'source': 'https://farm2.staticflickr.com/1471/25822158530_123456abcd.jpg',
+            'media': 'photo',
+        }]})
+        self.assertEqual(self.fetcher.results[1]['sizes'], {'size': []})
+
+    @patch('ditto.flickr.fetch.fetchers.RateLimiter.wait')
+    def test_api_calls_are_rate_limited(self, wait):
+        self.expect_response('photos.getSizes')
+        self.fetcher._fetch_photo_sizes('26069027966')
+        wait.assert_called_once_with()
 
     @freeze_time("2015-08-14 12:00:00", tz_offset=-8)
     @patch.object(UserFetcher, '_fetch_and_save_avatar')
@@ -235,7 +329,9 @@ class PhotosFetcherTestCase(FlickrFetchTestCase):
     def test_fetch_user_if_missing_fetches(self, save_user, fetch_avatar):
         """If the user isn't in fetched_users, it is fetched and saved."""
 
-        save_user.return_value = UserFactory.create(nsid='35034346050@N01')
+        # The user's data was last fetched too long ago to use again:
+        save_user.return_value = UserFactory.create(nsid='35034346050@N01',
+                fetch_time=datetime_from_str('2015-08-01 12:00:00'))
 
         self.expect_response('people.getInfo')
         user_data = self.load_fixture('people.getInfo')['person']
@@ -246,6 +342,26 @@ class PhotosFetcherTestCase(FlickrFetchTestCase):
         self.assertEqual(self.fetcher.fetched_users['35034346050@N01'].nsid,
                         '35034346050@N01')
 
+    @freeze_time("2015-08-14 12:00:00", tz_offset=-8)
+    @patch.object(UserSaver, 'save_user')
+    def test_fetch_user_if_missing_uses_recent_user(self, save_user):
+        "If the user was fetched recently, on any occasion, it's not fetched."
+        user = UserFactory(nsid='35034346050@N01',
+                            fetch_time=datetime_from_str('2015-08-14 06:00:00'))
+        self.fetcher._fetch_user_if_missing('35034346050@N01')
+        self.assertFalse(save_user.called)
+        self.assertEqual(self.fetcher.fetched_users['35034346050@N01'], user)
+
+    @freeze_time("2015-08-14 12:00:00", tz_offset=-8)
+    @patch.object(UserFetcher, '_fetch_and_save_avatar')
+    def test_fetch_user_if_missing_no_ttl(self, fetch_avatar):
+        "If DITTO_FLICKR_USER_CACHE_TTL is 0, users are always fetched."
+        UserFactory(nsid='35034346050@N01',
+                            fetch_time=datetime_from_str('2015-08-14 11:59:00'))
+        self.expect_response('people.getInfo')
+        with patch.object(app_settings, 'DITTO_FLICKR_USER_CACHE_TTL', 0):
+            self.fetcher._fetch_user_if_missing('35034346050@N01')
+
     @patch.object(UserSaver, 'save_user')
     def test_fetch_user_if_missing_doesnt_fetch(self, save_user):
         """If the user is in fetched_users, it doesn't fetch the data again."""
@@ -395,6 +511,17 @@ class RecentPhotosFetcherTestCase(FlickrFetchTestCase):
         with patch('time.sleep'):
             self.fetcher.fetch(days=3)
 
+    @patch.object(PhotoSaver, 'save_photo')
+    @patch.object(PhotosFetcher, '_fetch_extra')
+    def test_requests_lean_extras(self, save_photo, fetch_extra):
+        "In lean mode, should ask for photos' sizes with the list of photos."
+        self.expect_response('people.getPhotos', params={'extras':
+            'media,url_t,url_s,url_n,url_m,url_z,url_c,url_l,url_h,url_k,url_o'})
+        self.fetcher.lean = True
+        with patch('time.sleep'):
+            results = self.fetcher.fetch(days='all')
+        self.assertTrue(results['success'])
+
     @freeze_time("2015-08-14 12:00:00", tz_offset=-8)
     @patch.object(PhotoSaver, 'save_photo')
     @patch.object(PhotosFetcher, '_fetch_photo_info')
@@ -402,8 +529,9 @@ class RecentPhotosFetcherTestCase(FlickrFetchTestCase):
     @patch.object(PhotosFetcher, '_fetch_photo_exif')
     def test_saves_photos(self, fetch_photo_info, fetch_photo_sizes, fetch_photo_exif, save_photo):
         """It should call save_photos() for each photo it fetches."""
+        # The photos' owner is the Account's user, whose data is recent
+        # enough not to be fetched again.
         self.expect_response('people.getPhotos')
-        self.expect_response('people.getInfo')
         with patch('time.sleep'):
             results = self.fetcher.fetch(days='all')
             self.assertEqual(save_photo.call_count, 3)
@@ -411,6 +539,81 @@ class RecentPhotosFetcherTestCase(FlickrFetchTestCase):
             self.assertEqual(results['fetched'], 3)
 
 
+class UpdatedPhotosFetcherTestCase(FlickrFetchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.account = AccountFactory(api_key='1234', api_secret='9876',
+                                    user=UserFactory(nsid='35034346050@N01'))
+
+    def make_time(self, unixtime):
+        return datetime.datetime.utcfromtimestamp(unixtime).replace(
+                                                            tzinfo=pytz.utc)
+
+    def expect_photos(self):
+        "The usual people.getPhotos fixture, with photos' last_update times."
+        body = self.load_fixture('people.getPhotos')
+        for photo, lastupdate in zip(body['photos']['photo'],
+                                    ['1400000000', '1450000000', '1460000000']):
+            photo['lastupdate'] = lastupdate
+        self.expect_response('people.getPhotos', body=json.dumps(body),
+                                                params={'extras': 'last_update'})
+
+    def fetch(self):
+        with patch('time.sleep'):
+            return UpdatedPhotosFetcher(account=self.account).fetch()
+
+    @patch.object(PhotoSaver, 'save_photo')
+    @patch.object(PhotosFetcher, '_fetch_extra')
+    def test_fetches_all_new_photos(self, fetch_extra, save_photo):
+        self.expect_photos()
+        results = self.fetch()
+        self.assertTrue(results['success'])
+        self.assertEqual(results['fetched'], 3)
+
+    @patch.object(PhotoSaver, 'save_photo')
+    @patch.object(PhotosFetcher, '_fetch_extra')
+    def test_skips_unchanged_photos(self, fetch_extra, save_photo):
+        PhotoFactory(flickr_id=25822158530,
+                            last_update_time=self.make_time(1400000000))
+        PhotoFactory(flickr_id=26069027966,
+                            last_update_time=self.make_time(1440000000))
+        self.expect_photos()
+        results = self.fetch()
+        self.assertEqual(results['fetched'], 2)
+        self.assertEqual(save_photo.call_count, 2)
+        self.assertEqual([call[0][0]['id'] for call in save_photo.call_args_list],
+                            ['26069027966', '25822102530'])
+
+    @patch.object(PhotoSaver, 'save_photo')
+    @patch.object(PhotosFetcher, '_fetch_extra')
+    def test_saves_watermark(self, fetch_extra, save_photo):
+        self.expect_photos()
+        self.fetch()
+        account = Account.objects.get(pk=self.account.pk)
+        self.assertEqual(account.photos_last_update_time,
+                                                self.make_time(1460000000))
+
+    @patch.object(PhotoSaver, 'save_photo')
+    @patch.object(PhotosFetcher, '_fetch_extra')
+    def test_skips_photos_older_than_watermark(self, fetch_extra, save_photo):
+        "Photos not updated since the watermark aren't fetched."
+        self.account.photos_last_update_time = self.make_time(1450000000)
+        self.account.save()
+        self.expect_photos()
+        results = self.fetch()
+        self.assertEqual(results['fetched'], 1)
+
+    @patch.object(PhotosFetcher, '_fetch_extra')
+    def test_does_not_save_watermark_on_failure(self, fetch_extra):
+        fetch_extra.side_effect = FetchError('Oops')
+        self.expect_photos()
+        results = self.fetch()
+        self.assertFalse(results['success'])
+        account = Account.objects.get(pk=self.account.pk)
+        self.assertIsNone(account.photos_last_update_time)
+
+
 class PhotosetsFetcherTestCase(FlickrFetchTestCase):
 
     def setUp(self):
@@ -418,6 +621,9 @@ class PhotosetsFetcherTestCase(FlickrFetchTestCase):
         account = AccountFactory(api_key='1234', api_secret='9876',
                                     user=UserFactory(nsid='35034346050@N01'))
         self.fetcher = PhotosetsFetcher(account=account)
+        # Our expected responses must be requested in order, so fetch one
+        # photoset's photos at a time:
+        self.fetcher.max_workers = 1
 
     def test_inherits_from_fetcher(self):
         self.assertTrue( issubclass(PhotosetsFetcher, Fetcher) )
@@ -496,6 +702,41 @@ class PhotosetsFetcherTestCase(FlickrFetchTestCase):
             self.assertTrue(results['success'])
             self.assertEqual(results['fetched'], 3)
 
+    @patch.object(PhotosetsFetcher, '_fetch_photos_in_photoset')
+    def test_fetches_photos_concurrently(self, fetch_photos):
+        "The results should be in the same order as the photosets."
+        fetch_photos.side_effect = lambda photoset_id: [{'id': photoset_id}]
+        self.fetcher.max_workers = 3
+        self.fetcher.results = self.load_fixture(
+                                    'photosets.getList')['photosets']['photoset']
+        self.fetcher._fetch_extra()
+        self.assertEqual([r['photos'][0]['id'] for r in self.fetcher.results],
+                ['72157665648859705', '72157662491524213', '72157645155015916'])
+
+    @patch.object(PhotosetsFetcher, '_fetch_photos_in_photoset')
+    def test_skips_unchanged_photosets(self, fetch_photos):
+        "Photosets with the same date_update and all their photos are skipped."
+        fetch_photos.return_value = []
+        photosets = self.load_fixture('photosets.getList')['photosets']['photoset']
+        # Unchanged, with all its photos:
+        unchanged = PhotosetFactory(flickr_id=72157662491524213,
+            last_update_time=datetime.datetime.utcfromtimestamp(
+                    1455804781).replace(tzinfo=pytz.utc))
+        unchanged.photos = PhotoFactory.create_batch(5)
+        # Unchanged, but missing photos:
+        PhotosetFactory(flickr_id=72157645155015916,
+            last_update_time=datetime.datetime.utcfromtimestamp(
+                    1444945714).replace(tzinfo=pytz.utc))
+        # Changed:
+        PhotosetFactory(flickr_id=72157665648859705,
+            last_update_time=datetime.datetime.utcfromtimestamp(
+                    1400000000).replace(tzinfo=pytz.utc))
+
+        self.fetcher.results = photosets
+        self.fetcher._fetch_extra()
+        self.assertEqual([r['photoset']['id'] for r in self.fetcher.results],
+                            ['72157665648859705', '72157645155015916'])
+
     def test_raises_error_if_fails_getting_photos(self):
         self.expect_response('photosets.getPhotos',
             body='{ "stat": "fail", "code": 1, "message": "Photoset not found" }')
@@ -5,6 +5,7 @@ import tempfile
 from unittest.mock import call, patch
 
 from django.test import override_settings, TestCase
+from PIL import Image
 
 from ditto.core.utils.downloader import DownloadException, filedownloader
 from ditto.flickr.factories import AccountFactory, PhotoFactory, UserFactory
@@ -155,6 +156,20 @@ class FilesFetcherTestCase(TestCase):
             )
         )
 
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    @patch.object(filedownloader, 'download')
+    def test_saves_placeholder(self, download):
+        "It should make the placeholder from the downloaded image."
+        jpg = tempfile.NamedTemporaryFile(suffix='.jpg')
+        Image.new('RGB', (400, 300)).save(jpg, 'JPEG')
+        jpg.flush()
+        download.return_value = jpg.name
+
+        self.fetcher._fetch_and_save_file(self.photo_2, 'photo')
+        self.photo_2.refresh_from_db()
+        self.assertTrue(
+            self.photo_2.placeholder.startswith('data:image/jpeg;base64,'))
+
     @override_settings(MEDIA_ROOT=tempfile.gettempdir())
     @patch.object(filedownloader, 'download')
     def test_saves_downloaded_video_file(self, download):
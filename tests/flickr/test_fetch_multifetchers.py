@@ -2,11 +2,12 @@ from unittest.mock import call, patch
 
 from .test_fetch import FlickrFetchTestCase
 from ditto.flickr.fetch import FetchError
-from ditto.flickr.fetch.fetchers import PhotosetsFetcher, RecentPhotosFetcher
+from ditto.flickr.fetch.fetchers import PhotosetsFetcher, RecentPhotosFetcher,\
+    UpdatedPhotosFetcher
 from ditto.flickr.fetch.filesfetchers import OriginalFilesFetcher
 from ditto.flickr.fetch.multifetchers import MultiAccountFetcher,\
     OriginalFilesMultiAccountFetcher, PhotosetsMultiAccountFetcher,\
-    RecentPhotosMultiAccountFetcher
+    RecentPhotosMultiAccountFetcher, UpdatedPhotosMultiAccountFetcher
 from ditto.flickr.factories import AccountFactory, UserFactory
 
 
@@ -94,6 +95,23 @@ class RecentPhotosMultiAccountFetcherTestCase(MultiAccountFetcherTestCase):
         self.assertEqual(return_value[0]['account'], 'bob')
 
 
+class UpdatedPhotosMultiAccountFetcherTestCase(MultiAccountFetcherTestCase):
+
+    @patch.object(UpdatedPhotosFetcher, 'fetch')
+    def test_calls_fetch_for_active_accounts(self, fetch):
+        "UpdatedPhotosFetcher.fetch() should be called twice."
+        UpdatedPhotosMultiAccountFetcher().fetch()
+        fetch.assert_has_calls([call(), call()])
+
+    @patch.object(UpdatedPhotosFetcher, 'fetch')
+    def test_returns_list_of_return_values(self, fetch):
+        ret = {'success': True, 'account': 'bob', 'fetched': 7}
+        fetch.side_effect = [ret, ret]
+        return_value = UpdatedPhotosMultiAccountFetcher().fetch()
+        self.assertEqual(len(return_value), 2)
+        self.assertEqual(return_value[0]['account'], 'bob')
+
+
 class PhotosetsMultiAccountFetcherTestCase(MultiAccountFetcherTestCase):
 
     @patch.object(PhotosetsFetcher, '__init__')
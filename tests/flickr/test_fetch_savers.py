@@ -9,10 +9,11 @@ from freezegun import freeze_time
 from taggit.models import Tag
 
 from .test_fetch import FlickrFetchTestCase
-from ditto.flickr.factories import PhotoFactory, UserFactory
+from ditto.flickr.factories import PhotoFactory, PhotosetFactory, UserFactory
 from ditto.flickr.fetch import FetchError
 from ditto.flickr.fetch.savers import UserSaver, PhotosetSaver, PhotoSaver
-from ditto.flickr.models import Photo, Photoset, TaggedPhoto, User
+from ditto.flickr.models import EquipmentCount, Photo, Photoset,\
+        PhotoTagCount, TaggedPhoto, User
 
 
 class UserSaverTestCase(FlickrFetchTestCase):
@@ -324,6 +325,68 @@ class PhotoSaverTestCase(FlickrFetchTestCase):
         self.assertNotIn('initial', tag_slugs)
         self.assertEqual(len(tag_slugs), 7)
 
+    def test_save_tags_query_count(self):
+        "Tags should be saved in bulk, not with queries for each one."
+        photo_info_data = self.load_fixture('photos.getInfo')['photo']
+        user_1 = UserFactory(nsid="35034346050@N01")
+        user_2 = UserFactory(nsid="12345678901@N01")
+        photo = PhotoFactory(user=user_1)
+        Tag.objects.create(slug='abbeydore', name='Abbey Dore')
+
+        # Existing relationships, tags, new tags, created tags, authors,
+        # new relationships, count tags, tag counts, new tag counts:
+        with self.assertNumQueries(9):
+            PhotoSaver()._save_tags(photo, photo_info_data['tags']['tag'])
+
+        self.assertEqual(len(photo.tags.all()), 7)
+        self.assertEqual(Tag.objects.filter(slug='abbeydore').count(), 1)
+
+    def test_save_tags_reuses_tags(self):
+        "Saving another photo's tags shouldn't look up the same tags again."
+        photo_info_data = self.load_fixture('photos.getInfo')['photo']
+        user_1 = UserFactory(nsid="35034346050@N01")
+        user_2 = UserFactory(nsid="12345678901@N01")
+        saver = PhotoSaver()
+        saver._save_tags(PhotoFactory(user=user_1),
+                                            photo_info_data['tags']['tag'])
+        photo = PhotoFactory(user=user_1)
+
+        # Existing relationships, new relationships, count tags, tag counts,
+        # update tag counts:
+        with self.assertNumQueries(5):
+            saver._save_tags(photo, photo_info_data['tags']['tag'])
+
+        self.assertEqual(len(photo.tags.all()), 7)
+
+    def test_save_tags_unchanged(self):
+        "If the tags haven't changed, nothing should be created or deleted."
+        photo_info_data = self.load_fixture('photos.getInfo')['photo']
+        user_1 = UserFactory(nsid="35034346050@N01")
+        user_2 = UserFactory(nsid="12345678901@N01")
+        photo = PhotoFactory(user=user_1)
+        PhotoSaver()._save_tags(photo, photo_info_data['tags']['tag'])
+
+        with self.assertNumQueries(1):
+            PhotoSaver()._save_tags(photo, photo_info_data['tags']['tag'])
+
+    def test_save_tags_updates_tag_counts(self):
+        "Adding and removing tags should update their PhotoTagCounts."
+        photo_info_data = self.load_fixture('photos.getInfo')['photo']
+        user_1 = UserFactory(nsid="35034346050@N01")
+        user_2 = UserFactory(nsid="12345678901@N01")
+        photo = PhotoFactory(user=user_1)
+        PhotoSaver()._save_tags(photo, photo_info_data['tags']['tag'])
+        count = PhotoTagCount.objects.get(tag__slug='abbeydore')
+        self.assertEqual(count.public_count, 1)
+        self.assertEqual(count.total_count, 1)
+
+        tags = [t for t in photo_info_data['tags']['tag']
+                                            if t['_content'] != 'abbeydore']
+        PhotoSaver()._save_tags(photo, tags)
+        self.assertFalse(
+            PhotoTagCount.objects.filter(tag__slug='abbeydore').exists())
+        self.assertEqual(PhotoTagCount.objects.count(), 6)
+
     def test_throws_error_if_tag_author_doesnt_exist(self):
         photo_info_data = self.load_fixture('photos.getInfo')['photo']
         photo = PhotoFactory()
@@ -344,6 +407,54 @@ class PhotoSaverTestCase(FlickrFetchTestCase):
         self.assertEqual(photo.longitude, None)
 
 
+    @patch.object(PhotoSaver, '_save_tags')
+    def test_saves_sizes_from_lean_fetch(self, save_tags):
+        "Sizes made from a list's url_* extras, rather than getSizes."
+        photo_data = self.make_photo_data()
+        photo_data['sizes'] = {'size': [
+            {'label': 'Medium', 'width': '500', 'height': '375',
+             'source': 'https://farm2.staticflickr.com/1576/26069027966_8f6590a206.jpg',
+             'media': 'photo'},
+        ]}
+        photo = self.make_photo_object(photo_data)
+        self.assertEqual(photo.medium_width, 500)
+        self.assertEqual(photo.medium_height, 375)
+        self.assertIsNone(photo.large_width)
+
+    @patch.object(PhotoSaver, '_save_tags')
+    def test_updates_equipment_counts(self, save_tags):
+        "update_equipment_counts() should count the saved Photo's equipment."
+        saver = PhotoSaver()
+        saver.save_photo(self.make_photo_data())
+        saver.update_equipment_counts()
+        cameras = EquipmentCount.objects.filter(kind='camera')
+        self.assertEqual(len(cameras), 1)
+        self.assertEqual(cameras[0].name, 'Sony NEX-6')
+        self.assertEqual(cameras[0].year, 2016)
+        self.assertEqual(cameras[0].count, 1)
+        self.assertEqual(saver.equipment_years, {})
+
+    @patch.object(PhotoSaver, '_save_tags')
+    def test_unchanged_equipment_not_counted_again(self, save_tags):
+        "If a Photo's equipment hasn't changed its counts aren't rebuilt."
+        photo_data = self.make_photo_data()
+        PhotoSaver().save_photo(photo_data)
+        saver = PhotoSaver()
+        saver.save_photo(photo_data)
+        self.assertEqual(saver.equipment_years, {})
+
+    @patch.object(PhotoSaver, '_save_tags')
+    def test_changed_equipment_counted(self, save_tags):
+        "If a Photo's equipment has changed, its counts are rebuilt."
+        photo_data = self.make_photo_data()
+        PhotoSaver().save_photo(photo_data)
+        photo_data['exif']['camera'] = 'Leica M6'
+        saver = PhotoSaver()
+        saver.save_photo(photo_data)
+        self.assertEqual(saver.equipment_years,
+                                    {photo_data['user_obj'].pk: set([2016])})
+
+
 class PhotosetSaverTestCase(FlickrFetchTestCase):
 
     def make_photoset_object(self, photoset_data):
@@ -437,3 +548,45 @@ class PhotosetSaverTestCase(FlickrFetchTestCase):
 
         self.assertEqual(photoset.photos.count(), 3)
 
+
+    def test_adds_photos_in_bulk(self):
+        "Photos should be looked up with one query, not one per photo."
+        photo_ids = [
+            24990464004, 25253437489, 25253471989, 25502409002, 25253527909,
+        ]
+        for id in photo_ids:
+            PhotoFactory(flickr_id=id)
+        photoset_data = self.make_photoset_data()
+        saver = PhotosetSaver()
+        # Photo lookup, update_or_create (select, insert), existing photos,
+        # bulk insert; plus a savepoint around update_or_create:
+        with self.assertNumQueries(7):
+            saver.save_photoset(photoset_data)
+
+    def test_updates_photos_order(self):
+        "Only the changes to the photoset's photos should be saved."
+        photo_ids = [
+            24990464004, 25253437489, 25253471989, 25502409002, 25253527909,
+        ]
+        photos = [PhotoFactory(flickr_id=id) for id in photo_ids]
+        old_photo = PhotoFactory()
+        photoset_data = self.make_photoset_data()
+        photoset = PhotosetFactory(flickr_id=72157665648859705)
+        photoset.photos = [old_photo, photos[1], photos[0]]
+
+        photoset = self.make_photoset_object(photoset_data)
+
+        self.assertEqual([p.flickr_id for p in photoset.photos.all()],
+                                                                photo_ids)
+
+    def test_photos_unchanged(self):
+        "If the photos are the same, they shouldn't be altered."
+        photo_ids = [
+            24990464004, 25253437489, 25253471989, 25502409002, 25253527909,
+        ]
+        photos = [PhotoFactory(flickr_id=id) for id in photo_ids]
+        photoset = PhotosetFactory(flickr_id=72157665648859705)
+        PhotosetSaver()._save_photos(photoset, photos)
+
+        with self.assertNumQueries(1):
+            PhotosetSaver()._save_photos(photoset, photos)
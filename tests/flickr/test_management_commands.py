@@ -5,7 +5,8 @@ from django.core.management.base import CommandError
 from django.test import TestCase
 from django.utils.six import StringIO
 
-from ditto.flickr.factories import AccountFactory, UserFactory
+from ditto.flickr.factories import AccountFactory, PhotoFactory, UserFactory
+from ditto.flickr.models import EquipmentCount, User
 
 
 class FetchFlickrAccountUserTestCase(TestCase):
@@ -189,6 +190,24 @@ class FetchFlickrPhotosTestCase(TestCase):
                                                     self.out_err.getvalue())
 
 
+    @patch('ditto.flickr.management.commands.fetch_flickr_photos.UpdatedPhotosMultiAccountFetcher')
+    def test_sends_updated_to_fetcher_with_account(self, fetcher):
+        call_command('fetch_flickr_photos', account='35034346050@N01',
+                                                                updated=True)
+        fetcher.assert_called_with(nsid='35034346050@N01')
+        fetcher.return_value.fetch.assert_called_with()
+
+    @patch('ditto.flickr.management.commands.fetch_flickr_photos.UpdatedPhotosMultiAccountFetcher')
+    def test_sends_updated_to_fetcher_no_account(self, fetcher):
+        call_command('fetch_flickr_photos', updated=True)
+        fetcher.assert_called_with(nsid=None)
+        fetcher.return_value.fetch.assert_called_with()
+
+    def test_fail_with_days_and_updated(self):
+        with self.assertRaises(CommandError):
+            call_command('fetch_flickr_photos', days='4', updated=True)
+
+
 class FetchFlickrPhotosetsTestCase(TestCase):
 
     def setUp(self):
@@ -230,3 +249,108 @@ class FetchFlickrPhotosetsTestCase(TestCase):
         self.assertIn('Phil Gyford: Failed to fetch Photosets: Oops',
                                                     self.out_err.getvalue())
 
+
+
+class GenerateFlickrThumbnailsTestCase(TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        self.out_err = StringIO()
+
+    @patch('ditto.core.management.commands.ThumbnailGenerator')
+    def test_generates_all_photos(self, generator):
+        generator.return_value.generate.return_value = {
+                                            'success': True, 'generated': 3}
+        call_command('generate_flickr_thumbnails', processes=2,
+                                                            stdout=self.out)
+        self.assertEqual(generator.call_args[1]['field_name'], 'original_file')
+        self.assertEqual(generator.call_args[1]['processes'], 2)
+        self.assertFalse(generator.return_value.generate.call_args[1]['regenerate'])
+        self.assertIn('Generated images for 3 Photos', self.out.getvalue())
+
+    @patch('ditto.core.management.commands.ThumbnailGenerator')
+    def test_regenerates_with_all(self, generator):
+        generator.return_value.generate.return_value = {
+                                            'success': True, 'generated': 1}
+        call_command('generate_flickr_thumbnails', '--all', stdout=self.out)
+        self.assertTrue(generator.return_value.generate.call_args[1]['regenerate'])
+        self.assertIn('Generated images for 1 Photo', self.out.getvalue())
+
+    @patch('ditto.core.management.commands.ThumbnailGenerator')
+    def test_with_account(self, generator):
+        generator.return_value.generate.return_value = {
+                                            'success': True, 'generated': 0}
+        AccountFactory(user=UserFactory(nsid='35034346050@N01'))
+        PhotoFactory(user=UserFactory(nsid='12345678901@N01'))
+        call_command('generate_flickr_thumbnails', account='35034346050@N01',
+                                                            stdout=self.out)
+        queryset = generator.return_value.generate.call_args[0][0]
+        self.assertEqual(queryset.count(), 0)
+
+    def test_fails_with_invalid_account(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_flickr_thumbnails', account='35034346050@N01')
+
+    @patch('ditto.core.management.commands.ThumbnailGenerator')
+    def test_error_output(self, generator):
+        generator.return_value.generate.return_value = {
+                    'success': False, 'generated': 0, 'messages': ['Oops']}
+        call_command('generate_flickr_thumbnails', stdout=self.out,
+                                                        stderr=self.out_err)
+        self.assertIn('Failed to generate images: Oops',
+                                                    self.out_err.getvalue())
+
+    @patch('ditto.core.management.commands.ThumbnailGenerator')
+    def test_warnings_output(self, generator):
+        generator.return_value.generate.return_value = {
+                    'success': True, 'generated': 1,
+                    'warnings': ["Couldn't make a placeholder from a.jpg"]}
+        call_command('generate_flickr_thumbnails', stdout=self.out,
+                                                        stderr=self.out_err)
+        self.assertIn("Couldn't make a placeholder from a.jpg",
+                                                    self.out_err.getvalue())
+
+    @patch('ditto.core.management.commands.ThumbnailGenerator')
+    @patch('ditto.flickr.management.commands.fetch_flickr_originals.OriginalFilesMultiAccountFetcher')
+    def test_fetch_originals_generates(self, fetcher, generator):
+        "fetch_flickr_originals --thumbnails should generate after fetching."
+        fetcher.return_value.fetch.return_value =\
+            [{'account': 'Phil Gyford', 'success': True, 'fetched': 2}]
+        generator.return_value.generate.return_value = {
+                                            'success': True, 'generated': 2}
+        call_command('fetch_flickr_originals', '--thumbnails', stdout=self.out)
+        self.assertIn('Generated images for 2 Photos', self.out.getvalue())
+
+    @patch('ditto.core.management.commands.ThumbnailGenerator')
+    @patch('ditto.flickr.management.commands.fetch_flickr_originals.OriginalFilesMultiAccountFetcher')
+    def test_fetch_originals_doesnt_generate(self, fetcher, generator):
+        fetcher.return_value.fetch.return_value =\
+            [{'account': 'Phil Gyford', 'success': True, 'fetched': 2}]
+        call_command('fetch_flickr_originals', stdout=self.out)
+        self.assertFalse(generator.called)
+
+
+class UpdateFlickrEquipmentCountsTestCase(TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        user = UserFactory(nsid='35034346050@N01')
+        AccountFactory(user=user)
+        PhotoFactory(user=user, exif_camera='Sony NEX-6')
+
+    def test_rebuilds_all(self):
+        call_command('update_flickr_equipment_counts', stdout=self.out)
+        self.assertEqual(EquipmentCount.objects.count(), 1)
+        self.assertIn('Created 1 equipment count', self.out.getvalue())
+
+    @patch('ditto.flickr.managers.EquipmentCountManager.rebuild')
+    def test_rebuilds_account(self, rebuild):
+        rebuild.return_value = 1
+        call_command('update_flickr_equipment_counts',
+                                account='35034346050@N01', stdout=self.out)
+        rebuild.assert_called_once_with(
+                                user=User.objects.get(nsid='35034346050@N01'))
+
+    def test_invalid_account(self):
+        with self.assertRaises(CommandError):
+            call_command('update_flickr_equipment_counts', account='NOPE')
@@ -4,13 +4,15 @@ import pytz
 from unittest.mock import Mock, patch
 
 from django.db import IntegrityError
+from django.forms import inlineformset_factory
 from django.test import TestCase
 
 from ditto.core.utils import datetime_from_str
 from ditto.flickr import app_settings
 from ditto.flickr.factories import AccountFactory, PhotoFactory,\
-        PhotosetFactory, UserFactory
-from ditto.flickr.models import Account, Photo, Photoset, User
+        PhotosetFactory, TagFactory, TaggedPhotoFactory, UserFactory
+from ditto.flickr.models import Account, EquipmentCount, Photo, Photoset,\
+        PhotoTagCount, TaggedPhoto, User
 
 
 class AccountTestCase(TestCase):
@@ -316,6 +318,31 @@ class PhotoTestCase(TestCase):
         photo = PhotoFactory(post_time=datetime_from_str('2015-01-01 12:00:00'))
         self.assertEqual(photo.post_year, 2015)
 
+    def test_geohash(self):
+        "The geohash should be set based on the location on save."
+        photo = PhotoFactory(latitude=57.64911, longitude=10.40744)
+        self.assertEqual(len(photo.geohash), 12)
+        self.assertTrue(photo.geohash.startswith('u4pruydqqvj'))
+
+    def test_geohash_no_location(self):
+        photo = PhotoFactory(latitude=None, longitude=None)
+        self.assertEqual(photo.geohash, '')
+
+    def test_within_bbox(self):
+        london = PhotoFactory(latitude=51.5074, longitude=-0.1278)
+        PhotoFactory(latitude=48.8566, longitude=2.3522)
+        PhotoFactory(latitude=51.5074, longitude=-0.1278, is_private=True)
+        PhotoFactory()
+        photos = Photo.public_objects.within_bbox(51.4, -0.3, 51.6, 0.1)
+        self.assertEqual(list(photos), [london])
+
+    def test_within_bbox_180th_meridian(self):
+        fiji = PhotoFactory(latitude=-17.7134, longitude=178.0650)
+        samoa = PhotoFactory(latitude=-13.7590, longitude=-172.1046)
+        PhotoFactory(latitude=-17.7134, longitude=0)
+        photos = Photo.objects.within_bbox(-20, 170, -10, -170)
+        self.assertEqual(set(photos), set([fiji, samoa]))
+
     def test_taken_year(self):
         "The taken_year should be set based on taken_time on save."
         photo = PhotoFactory(
@@ -481,6 +508,49 @@ class PhotoUrlsLocalTestCase(PhotoUrlsTestCase):
             self.assertEqual(self.photo.small_url,
                              '/static/img/original_error.jpg')
 
+    @patch('ditto.flickr.models.ImageCacheFile')
+    def test_generated_image_url(self, cachefile):
+        "If the size has been pre-generated, Imagekit shouldn't be used."
+        self.photo.generated_sizes = Photo.make_generated_sizes(
+                                    self.photo.original_file.name,
+                                    {'small': 'CACHE/images/flickr/small.jpg'})
+        self.assertEqual(self.photo.small_url,
+                                        'CACHE/images/flickr/small.jpg')
+        self.assertFalse(cachefile.called)
+
+    def test_image_url_is_cached(self):
+        "Each size's URL should only be made once per Photo."
+        with patch.object(Photo, '_local_image_url',
+                                    return_value='/small.jpg') as local_url:
+            self.assertEqual(self.photo.small_url, '/small.jpg')
+            self.assertEqual(self.photo.small_url, '/small.jpg')
+        local_url.assert_called_once_with('small')
+
+    def test_image_url_cache_cleared_on_save(self):
+        "Saving the Photo should make its URLs again."
+        with patch.object(Photo, '_local_image_url',
+                                    return_value='/small.jpg') as local_url:
+            self.photo.small_url
+            self.photo.save()
+            self.photo.small_url
+        self.assertEqual(local_url.call_count, 2)
+
+    def test_size_url_properties(self):
+        "Every size has a URL property, added without leaving a `size`."
+        from ditto.flickr import models
+        for size in Photo.PHOTO_SIZES:
+            self.assertTrue(hasattr(Photo, '%s_url' % size))
+        self.assertFalse(hasattr(models, 'size'))
+
+    def test_generated_image_url_changed_original(self):
+        "If the original file has changed, recorded sizes aren't used."
+        self.photo.generated_sizes = Photo.make_generated_sizes(
+                                    'flickr/old.jpg',
+                                    {'small': 'CACHE/images/flickr/small.jpg'})
+        self.assertEqual(self.photo.get_generated_sizes(), {})
+        self.assertRegexpMatches(self.photo.small_url,
+            'CACHE/images/flickr/34/56/123456N01/photos/2015/08/14/example.[^\.]+\.jpg')
+
 
 class PhotoNextPrevTestCase(TestCase):
 
@@ -533,3 +603,210 @@ class PhotoNextPrevTestCase(TestCase):
     def test_previous_none(self):
         self.assertIsNone(self.photo_1.get_previous())
 
+
+
+class EquipmentCountTestCase(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        taken_2015 = datetime_from_str('2015-06-01 12:00:00')
+        taken_2016 = datetime_from_str('2016-06-01 12:00:00')
+        PhotoFactory.create_batch(2, user=self.user, taken_time=taken_2015,
+                exif_camera='Sony NEX-6', exif_focal_length='50 mm')
+        PhotoFactory(user=self.user, taken_time=taken_2016,
+                exif_camera='Sony NEX-6', exif_lens_model='E 16mm F2.8')
+        PhotoFactory(user=self.user, taken_time=taken_2016,
+                exif_camera='Canon EOS 5D', is_private=True)
+
+    def get_counts(self, kind):
+        return {(c.year, c.name): c.count
+                for c in EquipmentCount.objects.filter(kind=kind)}
+
+    def test_str(self):
+        count = EquipmentCount(kind='camera', name='Sony NEX-6', count=3)
+        self.assertEqual(str(count), 'Camera: Sony NEX-6 (3)')
+
+    def test_rebuild(self):
+        self.assertEqual(EquipmentCount.objects.rebuild(), 4)
+        self.assertEqual(self.get_counts('camera'),
+                            {(2015, 'Sony NEX-6'): 2, (2016, 'Sony NEX-6'): 1})
+        self.assertEqual(self.get_counts('lens'), {(2016, 'E 16mm F2.8'): 1})
+        self.assertEqual(self.get_counts('focal_length'), {(2015, '50 mm'): 2})
+
+    def test_rebuild_replaces_counts(self):
+        EquipmentCount.objects.rebuild()
+        Photo.objects.filter(exif_camera='Canon EOS 5D').update(
+                                                            is_private=False)
+        EquipmentCount.objects.rebuild()
+        self.assertEqual(self.get_counts('camera'), {(2015, 'Sony NEX-6'): 2,
+                (2016, 'Sony NEX-6'): 1, (2016, 'Canon EOS 5D'): 1})
+
+    def test_rebuild_years(self):
+        "Only the specified years' counts should be replaced."
+        EquipmentCount.objects.rebuild()
+        Photo.objects.update(exif_camera='Leica M6')
+        EquipmentCount.objects.rebuild(years=[2016])
+        self.assertEqual(self.get_counts('camera'),
+                            {(2015, 'Sony NEX-6'): 2, (2016, 'Leica M6'): 1})
+
+    def test_rebuild_user(self):
+        "Only the specified user's counts should be replaced."
+        other_user = UserFactory()
+        PhotoFactory(user=other_user, exif_camera='Leica M6')
+        EquipmentCount.objects.rebuild(user=other_user)
+        self.assertEqual(EquipmentCount.objects.count(), 1)
+        self.assertEqual(EquipmentCount.objects.get().user, other_user)
+
+
+class PhotoTagCountTestCase(TestCase):
+
+    def setUp(self):
+        self.fish = TagFactory(slug='fish', name='fish')
+        self.carp = TagFactory(slug='carp', name='carp')
+        self.public_photo = PhotoFactory()
+        self.private_photo = PhotoFactory(is_private=True)
+        TaggedPhotoFactory(content_object=self.public_photo, tag=self.fish)
+        TaggedPhotoFactory(content_object=self.private_photo, tag=self.fish)
+        TaggedPhotoFactory(content_object=self.private_photo, tag=self.carp)
+        PhotoTagCount.objects.update_for_tags()
+
+    def test_str(self):
+        self.assertEqual(str(PhotoTagCount.objects.get(tag=self.fish)),
+                                                                    'fish (1)')
+
+    def test_update_for_tags(self):
+        fish_count = PhotoTagCount.objects.get(tag=self.fish)
+        self.assertEqual(fish_count.public_count, 1)
+        self.assertEqual(fish_count.total_count, 2)
+        carp_count = PhotoTagCount.objects.get(tag=self.carp)
+        self.assertEqual(carp_count.public_count, 0)
+        self.assertEqual(carp_count.total_count, 1)
+
+    def test_update_for_some_tags(self):
+        "Only the specified tags should be counted."
+        PhotoTagCount.objects.update(public_count=9)
+        PhotoTagCount.objects.update_for_tags([self.carp.pk])
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag=self.fish).public_count, 9)
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag=self.carp).public_count, 0)
+
+    def test_deletes_unused_counts(self):
+        TaggedPhoto.objects.filter(tag=self.carp).delete()
+        self.assertFalse(PhotoTagCount.objects.filter(tag=self.carp).exists())
+
+    def test_tagged_photo_changes(self):
+        "Adding, changing or deleting a TaggedPhoto updates the counts."
+        tagged_photo = TaggedPhotoFactory(content_object=PhotoFactory(),
+                                          tag=self.carp)
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag=self.carp).public_count, 1)
+        tagged_photo.tag = self.fish
+        tagged_photo.save()
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag=self.carp).public_count, 0)
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag=self.fish).public_count, 2)
+        tagged_photo.delete()
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag=self.fish).public_count, 1)
+
+    def test_inline_formset_changes(self):
+        "Editing a Photo's TaggedPhotos inline, as in the Admin."
+        TaggedPhotoFormSet = inlineformset_factory(Photo, TaggedPhoto,
+                    fields=('tag', 'flickr_id', 'author', 'machine_tag'))
+        tagged_photos = list(TaggedPhoto.objects.filter(
+                            content_object=self.private_photo).order_by('pk'))
+        author = tagged_photos[0].author
+        formset = TaggedPhotoFormSet({
+            'flickr_taggedphoto_items-TOTAL_FORMS': '3',
+            'flickr_taggedphoto_items-INITIAL_FORMS': '2',
+            # Change fish to carp:
+            'flickr_taggedphoto_items-0-id': tagged_photos[0].pk,
+            'flickr_taggedphoto_items-0-tag': self.carp.pk,
+            'flickr_taggedphoto_items-0-flickr_id': 'a',
+            'flickr_taggedphoto_items-0-author': author.pk,
+            # Delete carp:
+            'flickr_taggedphoto_items-1-id': tagged_photos[1].pk,
+            'flickr_taggedphoto_items-1-tag': self.carp.pk,
+            'flickr_taggedphoto_items-1-flickr_id': 'b',
+            'flickr_taggedphoto_items-1-author': author.pk,
+            'flickr_taggedphoto_items-1-DELETE': 'on',
+            # Add pike:
+            'flickr_taggedphoto_items-2-tag': TagFactory(slug='pike').pk,
+            'flickr_taggedphoto_items-2-flickr_id': 'c',
+            'flickr_taggedphoto_items-2-author': author.pk,
+        }, instance=self.private_photo)
+        self.assertTrue(formset.is_valid(), formset.errors)
+        formset.save()
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag=self.fish).total_count, 1)
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag=self.carp).total_count, 1)
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag__slug='pike').total_count, 1)
+
+    def test_remove_and_clear_tags(self):
+        self.private_photo.tags.remove('carp')
+        self.assertFalse(PhotoTagCount.objects.filter(tag=self.carp).exists())
+        self.public_photo.tags.clear()
+        fish_count = PhotoTagCount.objects.get(tag=self.fish)
+        self.assertEqual(fish_count.public_count, 0)
+        self.assertEqual(fish_count.total_count, 1)
+
+    def test_clear_tags_updates_counts_once(self):
+        with patch.object(PhotoTagCount.objects, 'update_for_tags') as update:
+            self.private_photo.tags.clear()
+        update.assert_called_once_with({self.fish.pk, self.carp.pk})
+
+    def test_photo_deletion_updates_counts_once(self):
+        with patch.object(PhotoTagCount.objects, 'update_for_tags') as update:
+            self.private_photo.delete()
+        self.assertEqual(update.call_count, 1)
+        self.assertEqual(set(update.call_args[0][0]),
+                         {self.fish.pk, self.carp.pk})
+
+    def test_update_for_tags_in_batches(self):
+        "It keeps within SQLite's limit on the number of query parameters."
+        tags = TagFactory.create_batch(5)
+        for tag in tags:
+            TaggedPhotoFactory(content_object=self.public_photo, tag=tag)
+        with patch.object(PhotoTagCount.objects, 'batch_size', 2):
+            PhotoTagCount.objects.update_for_tags(
+                                    [self.fish.pk] + [t.pk for t in tags])
+            PhotoTagCount.objects.filter(tag__in=tags).update(public_count=9)
+            PhotoTagCount.objects.update_for_tags(t.pk for t in tags)
+        self.assertEqual(
+            list(PhotoTagCount.objects.filter(tag__in=tags)
+                        .values_list('public_count', flat=True)), [1] * 5)
+
+    def test_photo_deletion(self):
+        "Deleting a Photo should update its tags' counts."
+        self.private_photo.delete()
+        self.assertFalse(PhotoTagCount.objects.filter(tag=self.carp).exists())
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag=self.fish).total_count, 1)
+
+    def test_photo_queryset_deletion(self):
+        Photo.objects.filter(pk=self.public_photo.pk).delete()
+        fish_count = PhotoTagCount.objects.get(tag=self.fish)
+        self.assertEqual(fish_count.public_count, 0)
+        self.assertEqual(fish_count.total_count, 1)
+
+    def test_photo_privacy_change(self):
+        "Changing a Photo's privacy should update its tags' counts."
+        self.private_photo.is_private = False
+        self.private_photo.save()
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag=self.fish).public_count, 2)
+        self.assertEqual(
+                PhotoTagCount.objects.get(tag=self.carp).public_count, 1)
+
+    def test_most_common(self):
+        "Only tags on public Photos should be included, most used first."
+        TaggedPhotoFactory(content_object=PhotoFactory(), tag=self.carp)
+        TaggedPhotoFactory(content_object=PhotoFactory(), tag=self.carp)
+        PhotoTagCount.objects.update_for_tags()
+        tags = Photo.tags.most_common()
+        self.assertEqual([(t.slug, t.num_times) for t in tags],
+                                                [('carp', 2), ('fish', 1)])
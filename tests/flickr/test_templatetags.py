@@ -1,15 +1,20 @@
 import datetime
 import pytz
+from unittest import skipIf
+from unittest.mock import patch
 
 from django.test import TestCase
 
 from freezegun import freeze_time
 
+from ditto.core.imagegenerators import webp_supported
 from ditto.core.templatetags.ditto_core import display_time
 from ditto.core.utils import datetime_now, datetime_from_str
+from ditto.flickr import app_settings
 from ditto.flickr.templatetags import ditto_flickr
 from ditto.flickr.factories import AccountFactory, PhotoFactory,\
         PhotosetFactory, UserFactory
+from ditto.flickr.models import EquipmentCount, Photo
 
 
 class TemplatetagsRecentPhotosTestCase(TestCase):
@@ -229,3 +234,131 @@ class AnnualPhotoCountsTakenTimeTestCase(TestCase):
         self.assertEqual(photos[2]['year'], 2017)
         self.assertEqual(photos[2]['count'], 0)
 
+
+
+class EquipmentCountsTestCase(TestCase):
+
+    def setUp(self):
+        account_user = UserFactory()
+        AccountFactory(user=account_user)
+        taken_2015 = datetime_from_str('2015-06-01 12:00:00')
+        taken_2016 = datetime_from_str('2016-06-01 12:00:00')
+        PhotoFactory.create_batch(2, user=account_user, taken_time=taken_2015,
+                exif_camera='Sony NEX-6', exif_focal_length='50 mm')
+        PhotoFactory(user=account_user, taken_time=taken_2016,
+                exif_camera='Canon EOS 5D', exif_focal_length='4.2 mm')
+        PhotoFactory(user=account_user, taken_time=taken_2016,
+                exif_camera='Canon EOS 5D', exif_focal_length='300 mm')
+        PhotoFactory(user=account_user, taken_time=taken_2016,
+                exif_camera='Sony NEX-6', exif_lens_model='E 16mm F2.8')
+        # Not by a User with an Account:
+        PhotoFactory(user=UserFactory(nsid='1234@N01'),
+                                exif_camera='Leica M6', exif_focal_length='50 mm')
+        EquipmentCount.objects.rebuild()
+
+    def test_top_cameras(self):
+        self.assertEqual(ditto_flickr.top_cameras(), [
+                                {'name': 'Sony NEX-6', 'count': 3},
+                                {'name': 'Canon EOS 5D', 'count': 2}])
+
+    def test_top_cameras_year(self):
+        self.assertEqual(ditto_flickr.top_cameras(year=2015),
+                                    [{'name': 'Sony NEX-6', 'count': 2}])
+
+    def test_top_cameras_nsid(self):
+        self.assertEqual(ditto_flickr.top_cameras(nsid='1234@N01'),
+                                    [{'name': 'Leica M6', 'count': 1}])
+
+    def test_top_cameras_limit(self):
+        self.assertEqual(len(ditto_flickr.top_cameras(limit=1)), 1)
+
+    def test_top_lenses(self):
+        self.assertEqual(ditto_flickr.top_lenses(),
+                                    [{'name': 'E 16mm F2.8', 'count': 1}])
+
+    def test_focal_length_histogram(self):
+        self.assertEqual(ditto_flickr.focal_length_histogram(), [
+                {'name': '4.2 mm', 'focal_length': 4.2, 'count': 1},
+                {'name': '50 mm', 'focal_length': 50.0, 'count': 2},
+                {'name': '300 mm', 'focal_length': 300.0, 'count': 1}])
+
+
+class PhotoSrcsetTestCase(TestCase):
+
+    def setUp(self):
+        self.photo = PhotoFactory(farm=3, server='1234', flickr_id=4567,
+                                secret='9876',
+                                small_width=240, small_height=180,
+                                small_320_width=320, small_320_height=240,
+                                medium_width=500, medium_height=375)
+        self.default_use_local = app_settings.DITTO_FLICKR_USE_LOCAL_MEDIA
+        self.default_use_webp = app_settings.DITTO_FLICKR_USE_WEBP
+
+    def tearDown(self):
+        app_settings.DITTO_FLICKR_USE_LOCAL_MEDIA = self.default_use_local
+        app_settings.DITTO_FLICKR_USE_WEBP = self.default_use_webp
+
+    def test_srcset(self):
+        srcset = ditto_flickr.photo_srcset(self.photo)
+        self.assertIn(
+            'https://farm3.static.flickr.com/1234/4567_9876_m.jpg 240w, '
+            'https://farm3.static.flickr.com/1234/4567_9876_n.jpg 320w, '
+            'https://farm3.static.flickr.com/1234/4567_9876.jpg 500w',
+            srcset)
+
+    def test_srcset_square(self):
+        self.assertEqual(ditto_flickr.photo_srcset(self.photo, square=True),
+            'https://farm3.static.flickr.com/1234/4567_9876_s.jpg 75w, '
+            'https://farm3.static.flickr.com/1234/4567_9876_q.jpg 150w')
+
+    def test_picture_remote(self):
+        "With remote images there's no WebP <source>."
+        html = ditto_flickr.photo_picture(self.photo, size='small',
+                                                        css_class='img-fluid')
+        self.assertTrue(html.startswith(
+            '<img src="https://farm3.static.flickr.com/1234/4567_9876_m.jpg" '
+            'width="240" height="180" alt="" srcset="'))
+        self.assertIn('sizes="240px" class="img-fluid">', html)
+
+    @skipIf(not webp_supported(), "Pillow can't save WebP images")
+    def test_picture_local_webp(self):
+        app_settings.DITTO_FLICKR_USE_LOCAL_MEDIA = True
+        app_settings.DITTO_FLICKR_USE_WEBP = True
+        self.photo.generated_sizes = Photo.make_generated_sizes(
+                self.photo.original_file.name,
+                {'small': 'CACHE/small.jpg', 'small_webp': 'CACHE/small.webp'})
+        html = ditto_flickr.photo_picture(self.photo, size='small')
+        self.assertTrue(html.startswith(
+                '<picture><source type="image/webp" '
+                'srcset="CACHE/small.webp 240w" sizes="240px">'))
+        self.assertIn('srcset="CACHE/small.jpg 240w"', html)
+
+    def test_picture_local_only_generated_sizes(self):
+        "It doesn't generate the sizes that don't exist yet."
+        app_settings.DITTO_FLICKR_USE_LOCAL_MEDIA = True
+        self.photo.generated_sizes = Photo.make_generated_sizes(
+                self.photo.original_file.name, {'medium': 'CACHE/medium.jpg'})
+        with patch('ditto.flickr.models.ImageCacheFile') as cachefile:
+            cachefile.return_value.url = '/media/CACHE/small.jpg'
+            html = ditto_flickr.photo_picture(self.photo, size='small')
+        # Only for the src:
+        self.assertEqual(cachefile.call_count, 1)
+        self.assertIn('srcset="CACHE/medium.jpg 500w"', html)
+
+    def test_picture_local_no_generated_sizes(self):
+        "With no generated sizes, there's only the src."
+        app_settings.DITTO_FLICKR_USE_LOCAL_MEDIA = True
+        app_settings.DITTO_FLICKR_USE_WEBP = True
+        with patch('ditto.flickr.models.ImageCacheFile') as cachefile:
+            cachefile.return_value.url = '/media/CACHE/small.jpg'
+            html = ditto_flickr.photo_picture(self.photo, size='small')
+        self.assertEqual(html,
+            '<img src="/media/CACHE/small.jpg" width="240" height="180" '
+            'alt="">')
+
+    def test_picture_local_no_webp(self):
+        app_settings.DITTO_FLICKR_USE_LOCAL_MEDIA = True
+        app_settings.DITTO_FLICKR_USE_WEBP = False
+        html = ditto_flickr.photo_picture(self.photo, size='small')
+        self.assertTrue(html.startswith('<img src="'))
+        self.assertNotIn('webp', html)
@@ -6,6 +6,7 @@ from django.test import TestCase
 from ditto.flickr.factories import AccountFactory, PhotoFactory,\
         PhotosetFactory, TagFactory, TaggedPhotoFactory, UserFactory
 from ditto.core.utils import datetime_now
+from ditto.flickr.models import PhotoTagCount
 
 class HomeViewTests(TestCase):
 
@@ -271,6 +272,8 @@ class TagViewTests(TestCase):
                                 content_object=self.cod_photo, tag=fish_tag)
         taggedphoto_4 = TaggedPhotoFactory(
                                 content_object=self.cod_photo, tag=cod_tag)
+        # Normally done when a PhotoSaver saves tags:
+        PhotoTagCount.objects.update_for_tags()
 
     def createDogPhoto(self):
         "Creates a photo tagged with 'dog' and 'mammal'."
@@ -0,0 +1,163 @@
+import datetime
+from unittest import skipIf
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.utils import timezone
+from freezegun import freeze_time
+
+from ditto.core.utils import datetime_from_str
+from ditto.lastfm import analytics
+from ditto.lastfm.factories import AccountFactory, ArtistFactory,\
+        ScrobbleFactory
+from ditto.lastfm.models import Scrobble
+
+
+@skipIf(analytics.np is None, "NumPy is not installed")
+class AnalyticsTestCase(TestCase):
+
+    def setUp(self):
+        analytics.invalidate()
+        self.account = AccountFactory()
+        self.artist = ArtistFactory()
+        for post_time in ('2016-04-04 12:00:00',    # A Monday
+                          '2016-04-04 12:10:00',
+                          '2016-04-04 13:00:00',
+                          '2016-04-05 09:00:00',
+                          '2016-04-06 09:00:00',
+                          '2016-04-08 09:00:00'):
+            ScrobbleFactory(account=self.account, artist=self.artist,
+                            post_time=datetime_from_str(post_time))
+
+    def tearDown(self):
+        analytics.invalidate()
+
+    def test_loads_data(self):
+        data = analytics.get_data(self.account)
+        self.assertEqual(len(data), 6)
+        self.assertEqual(list(data.artists), [self.artist.pk] * 6)
+
+    def test_caches_until_new_scrobbles(self):
+        data = analytics.get_data(self.account)
+        data.results['test'] = 'cached'
+        self.assertEqual(analytics.get_data(self.account).results['test'],
+                        'cached')
+        ScrobbleFactory(account=self.account)
+        self.assertNotIn('test', analytics.get_data(self.account).results)
+        self.assertEqual(len(analytics.get_data(self.account)), 7)
+
+    def test_checks_for_changes_with_one_query(self):
+        analytics.get_data(self.account)
+        with self.assertNumQueries(1):
+            analytics.get_data(self.account)
+
+    @patch.object(analytics, 'MAX_RESULTS', 2)
+    def test_limits_cached_results(self):
+        data = analytics.get_data(self.account)
+        data.get_result('a', lambda: 1)
+        data.get_result('b', lambda: 2)
+        # Now 'a' is the most recently used:
+        data.get_result('a', lambda: 'recalculated')
+        data.get_result('c', lambda: 3)
+        self.assertEqual(dict(data.results), {'a': 1, 'c': 3})
+
+    def test_reloads_after_save(self):
+        "Notices Scrobbles saved elsewhere, eg by another process."
+        analytics.get_data(self.account)
+        scrobble = Scrobble.objects.filter(account=self.account).first()
+        scrobble.artist = ArtistFactory()
+        scrobble.save()
+        self.assertIn(scrobble.artist.pk,
+                      list(analytics.get_data(self.account).artists))
+
+    def test_reloads_after_queryset_deletion(self):
+        analytics.get_data(self.account)
+        Scrobble.objects.filter(account=self.account).delete()
+        self.assertEqual(len(analytics.get_data(self.account)), 0)
+
+    def test_reloads_after_invalidate(self):
+        "Notices Scrobbles changed without being saved."
+        analytics.get_data(self.account)
+        artist = ArtistFactory()
+        Scrobble.objects.filter(account=self.account).update(artist=artist)
+        analytics.invalidate()
+        self.assertEqual(list(analytics.get_data(self.account).artists),
+                        [artist.pk] * 6)
+
+    def test_other_accounts(self):
+        ScrobbleFactory()
+        self.assertEqual(len(analytics.get_data(self.account)), 6)
+        self.assertEqual(len(analytics.get_data()), 7)
+
+    @freeze_time("2016-04-09 12:00:00", tz_offset=0)
+    def test_streaks(self):
+        result = analytics.streaks(self.account)
+        self.assertEqual(result['longest'], {
+                'start': datetime.date(2016, 4, 4),
+                'end': datetime.date(2016, 4, 6),
+                'days': 3})
+        self.assertEqual(result['current'], {
+                'start': datetime.date(2016, 4, 8),
+                'end': datetime.date(2016, 4, 8),
+                'days': 1})
+
+    @freeze_time("2016-04-12 12:00:00", tz_offset=0)
+    def test_streaks_no_current(self):
+        self.assertIsNone(analytics.streaks(self.account)['current'])
+
+    def test_streaks_no_scrobbles(self):
+        self.assertEqual(analytics.streaks(AccountFactory()),
+                        {'longest': None, 'current': None})
+
+    def test_hour_weekday_counts(self):
+        counts = analytics.hour_weekday_counts(self.account)
+        self.assertEqual(len(counts), 7)
+        self.assertEqual(len(counts[0]), 24)
+        self.assertEqual(counts[0][12], 2)  # Monday
+        self.assertEqual(counts[0][13], 1)
+        self.assertEqual(counts[1][9], 1)   # Tuesday
+        self.assertEqual(counts[4][9], 1)   # Friday
+        self.assertEqual(sum(sum(day) for day in counts), 6)
+
+    def test_hour_weekday_counts_time_zone(self):
+        with timezone.override('America/New_York'):
+            counts = analytics.hour_weekday_counts(self.account)
+        # 12:00 UTC is 08:00 in New York in April:
+        self.assertEqual(counts[0][8], 2)
+
+    def test_sessions(self):
+        result = analytics.sessions(self.account, gap=30)
+        self.assertEqual(result['count'], 5)
+        self.assertEqual(result['longest']['scrobbles'], 2)
+        self.assertEqual(result['longest']['start'],
+                        datetime_from_str('2016-04-04 12:00:00'))
+        self.assertEqual(result['longest']['end'],
+                        datetime_from_str('2016-04-04 12:10:00'))
+        self.assertEqual(result['average_scrobbles'], 1.2)
+        self.assertEqual(result['average_minutes'], 2)
+
+    def test_sessions_gap(self):
+        result = analytics.sessions(self.account, gap=60)
+        self.assertEqual(result['count'], 4)
+        self.assertEqual(result['longest']['scrobbles'], 3)
+
+    def test_artist_curve(self):
+        curve = analytics.artist_curve(self.artist, self.account, period='day')
+        self.assertEqual(curve, [
+            {'date': datetime.date(2016, 4, 4), 'count': 3},
+            {'date': datetime.date(2016, 4, 5), 'count': 1},
+            {'date': datetime.date(2016, 4, 6), 'count': 1},
+            {'date': datetime.date(2016, 4, 7), 'count': 0},
+            {'date': datetime.date(2016, 4, 8), 'count': 1},
+        ])
+
+    def test_artist_curve_month(self):
+        self.assertEqual(analytics.artist_curve(self.artist),
+                        [{'date': datetime.date(2016, 4, 1), 'count': 6}])
+
+    def test_artist_curve_no_scrobbles(self):
+        self.assertEqual(analytics.artist_curve(ArtistFactory()), [])
+
+    def test_artist_curve_invalid_period(self):
+        with self.assertRaises(ValueError):
+            analytics.artist_curve(self.artist, period='week')
@@ -0,0 +1,248 @@
+import itertools
+import shutil
+import tempfile
+from unittest import skipIf
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from ditto.core.utils import datetime_from_str
+from ditto.lastfm import app_settings, cube
+from ditto.lastfm.factories import AccountFactory, AlbumFactory,\
+        ArtistFactory, ScrobbleFactory, TrackFactory
+from ditto.lastfm.models import Scrobble, ScrobbleVersion
+from ditto.lastfm.templatetags import ditto_lastfm
+
+
+@skipIf(cube.np is None, "NumPy is not installed")
+class ScrobbleCubeTestCase(TestCase):
+
+    def setUp(self):
+        self.account = AccountFactory()
+        self.artist = ArtistFactory()
+        self.album = AlbumFactory(artist=self.artist)
+        self.track1 = TrackFactory(artist=self.artist)
+        self.track2 = TrackFactory(artist=self.artist)
+        self.scrobbles = [
+            ScrobbleFactory(account=self.account, artist=self.artist,
+                            track=self.track1, album=self.album,
+                            post_time=datetime_from_str('2015-08-11 12:00:00')),
+            ScrobbleFactory(account=self.account, artist=self.artist,
+                            track=self.track2, album=self.album,
+                            post_time=datetime_from_str('2015-08-12 12:00:00')),
+            ScrobbleFactory(account=self.account, artist=self.artist,
+                            track=self.track2,
+                            post_time=datetime_from_str('2015-08-13 12:00:00')),
+        ]
+        self.cube = cube.ScrobbleCube()
+        self.cube.update()
+
+    def test_columns(self):
+        self.assertEqual(len(self.cube), 3)
+        self.assertEqual(list(self.cube.columns['track']),
+                    [self.track1.pk, self.track2.pk, self.track2.pk])
+        self.assertEqual(list(self.cube.columns['album']),
+                    [self.album.pk, self.album.pk, -1])
+
+    def test_top(self):
+        self.assertEqual(self.cube.top('track'),
+                        [(self.track2.pk, 2), (self.track1.pk, 1)])
+
+    def test_top_ignores_no_album(self):
+        self.assertEqual(self.cube.top('album'), [(self.album.pk, 2)])
+
+    def test_top_limit(self):
+        self.assertEqual(self.cube.top('track', limit=1),
+                        [(self.track2.pk, 2)])
+
+    def test_top_times(self):
+        self.assertEqual(self.cube.top('track',
+                    min_post_time=datetime_from_str('2015-08-11 12:00:01'),
+                    max_post_time=datetime_from_str('2015-08-12 12:00:00')),
+                [(self.track2.pk, 1)])
+
+    def test_top_filters(self):
+        ScrobbleFactory(track=self.track1)
+        self.cube.update()
+        self.assertEqual(self.cube.top('track', account_id=self.account.pk),
+                        [(self.track2.pk, 2), (self.track1.pk, 1)])
+        self.assertEqual(self.cube.top('track', album_id=self.album.pk),
+                        [(self.track1.pk, 1), (self.track2.pk, 1)])
+        self.assertEqual(self.cube.top('track', artist_id=-1), [])
+
+    def test_count_scrobbles(self):
+        self.assertEqual(self.cube.count_scrobbles(
+                    min_post_time=datetime_from_str('2015-08-12 00:00:00')), 2)
+
+    def test_appends_new_scrobbles_in_order(self):
+        "Adds new Scrobbles, even if they're older than the others."
+        ScrobbleFactory(track=self.track1,
+                        post_time=datetime_from_str('2015-08-01 12:00:00'))
+        with patch.object(cube.ScrobbleCube, '_append',
+                          wraps=self.cube._append) as append:
+            self.cube.update()
+        self.assertEqual(append.call_args[0][0].count(), 1)
+        self.assertEqual(len(self.cube), 4)
+        self.assertEqual(self.cube.columns['track'][0], self.track1.pk)
+
+    def test_rebuilds_after_deletion(self):
+        self.scrobbles[0].delete()
+        self.cube.update()
+        self.assertEqual(self.cube.top('track'), [(self.track2.pk, 2)])
+
+    def test_rebuilds_after_queryset_deletion(self):
+        Scrobble.objects.filter(track=self.track1).delete()
+        self.cube.update()
+        self.assertEqual(self.cube.top('track'), [(self.track2.pk, 2)])
+
+    def test_rebuilds_after_save(self):
+        "Notices Scrobbles saved elsewhere, eg by another process."
+        scrobble = Scrobble.objects.get(pk=self.scrobbles[0].pk)
+        scrobble.track = self.track2
+        scrobble.save()
+        ScrobbleFactory(track=self.track1)
+        self.cube.update()
+        self.assertEqual(self.cube.top('track'),
+                        [(self.track2.pk, 3), (self.track1.pk, 1)])
+
+    def test_rebuilds_after_mark_changed(self):
+        "Notices Scrobbles changed without being saved, in any process."
+        Scrobble.objects.filter(track=self.track1).update(track=self.track2)
+        self.cube.update()
+        self.assertEqual(self.cube.top('track'), [(self.track2.pk, 2),
+                                                  (self.track1.pk, 1)])
+        cube.mark_changed()
+        self.cube.update()
+        self.assertEqual(self.cube.top('track'), [(self.track2.pk, 3)])
+
+    def test_fresh_cube_needs_one_query(self):
+        "Checking an unchanged cube doesn't count the Scrobbles."
+        with self.assertNumQueries(1):
+            self.cube.update()
+
+    def test_rebuilds_if_added_scrobbles_are_missing(self):
+        "eg, if a Scrobble with a lower pk was added after a higher one."
+        Scrobble.objects.filter(pk=self.scrobbles[0].pk).delete()
+        self.cube.update()
+        ScrobbleVersion.objects.bump(added=1)
+        with patch.object(cube.ScrobbleCube, '_append',
+                          wraps=self.cube._append) as append:
+            self.cube.update()
+        self.assertEqual(append.call_count, 2)
+        self.assertEqual(len(self.cube), 2)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            saved = cube.ScrobbleCube(directory=directory)
+            saved.update()
+            loaded = cube.ScrobbleCube(directory=directory)
+            loaded.load()
+            self.assertEqual(len(loaded), 3)
+            self.assertEqual(loaded.top('track'), saved.top('track'))
+            self.assertTrue(loaded.is_fresh(cube.get_version()))
+            self.assertEqual(loaded.max_pk, saved.max_pk)
+        finally:
+            shutil.rmtree(directory)
+
+
+@skipIf(cube.np is None, "NumPy is not installed")
+class GetFreshCubeTestCase(TestCase):
+
+    def setUp(self):
+        cube._cube = None
+
+    def tearDown(self):
+        cube._cube = None
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(cube.get_fresh_cube())
+
+    @patch.object(app_settings, 'DITTO_LASTFM_USE_SCROBBLE_CUBE', True)
+    def test_returns_fresh_cube(self):
+        ScrobbleFactory()
+        self.assertEqual(len(cube.get_fresh_cube()), 1)
+        ScrobbleFactory()
+        self.assertEqual(len(cube.get_fresh_cube()), 2)
+
+    @patch.object(app_settings, 'DITTO_LASTFM_USE_SCROBBLE_CUBE', True)
+    def test_loaded_cube_notices_changes(self):
+        "A cube loaded from files notices changes made by other processes."
+        directory = tempfile.mkdtemp()
+        try:
+            scrobble = ScrobbleFactory()
+            with patch.object(app_settings, 'DITTO_LASTFM_SCROBBLE_CUBE_DIR',
+                              directory):
+                cube.get_fresh_cube()
+                scrobble.track = TrackFactory()
+                scrobble.save()
+                # As if in a new process:
+                cube._cube = None
+                fresh = cube.get_fresh_cube()
+            self.assertEqual(fresh.top('track'), [(scrobble.track.pk, 1)])
+        finally:
+            shutil.rmtree(directory)
+
+    @patch.object(app_settings, 'DITTO_LASTFM_USE_SCROBBLE_CUBE', True)
+    def test_changed_scrobble_invalidates(self):
+        scrobble = ScrobbleFactory(
+                        post_time=datetime_from_str('2015-08-11 12:00:00'))
+        cube.get_fresh_cube()
+        scrobble.post_time = datetime_from_str('2015-08-12 12:00:00')
+        scrobble.save()
+        self.assertEqual(cube.get_fresh_cube().count_scrobbles(
+                    min_post_time=datetime_from_str('2015-08-12 00:00:00')), 1)
+
+
+@skipIf(cube.np is None, "NumPy is not installed")
+@patch.object(app_settings, 'DITTO_LASTFM_USE_SCROBBLE_CUBE', True)
+class TopTagsCubeTestCase(TestCase):
+    "The top_* template tags use the cube when it's enabled."
+
+    def setUp(self):
+        cube._cube = None
+        self.artist = ArtistFactory()
+        self.album = AlbumFactory(artist=self.artist)
+        self.track = TrackFactory(artist=self.artist)
+        ScrobbleFactory.create_batch(2, artist=self.artist, album=self.album,
+                        track=self.track,
+                        post_time=datetime_from_str('2015-08-11 12:00:00'))
+        ScrobbleFactory(post_time=datetime_from_str('2015-08-12 12:00:00'))
+
+    def tearDown(self):
+        cube._cube = None
+
+    def test_top_tracks(self):
+        tracks = ditto_lastfm.top_tracks()
+        self.assertEqual(len(tracks), 2)
+        self.assertEqual(tracks[0], self.track)
+        self.assertEqual(tracks[0].scrobble_count, 2)
+
+    def test_top_albums_date(self):
+        albums = ditto_lastfm.top_albums(
+                    date=datetime_from_str('2015-08-11 12:00:00'),
+                    period='day')
+        self.assertEqual(albums, [self.album])
+        self.assertEqual(albums[0].scrobble_count, 2)
+
+    def test_top_artists_account(self):
+        account = AccountFactory()
+        ScrobbleFactory(account=account, artist=self.artist)
+        artists = ditto_lastfm.top_artists(account=account)
+        self.assertEqual(artists, [self.artist])
+        self.assertEqual(artists[0].scrobble_count, 1)
+
+    def test_same_results_as_queryset(self):
+        "With or without the cube, the tags return the same objects."
+        tags = (ditto_lastfm.top_albums, ditto_lastfm.top_artists,
+                ditto_lastfm.top_tracks)
+        for tag, limit in itertools.product(tags, (5, 'all')):
+            with patch.object(app_settings,
+                                'DITTO_LASTFM_USE_SCROBBLE_CUBE', False):
+                from_db = tag(limit=limit)
+            from_cube = tag(limit=limit)
+            self.assertIsInstance(from_cube, list)
+            self.assertNotIsInstance(from_db, list)
+            self.assertEqual(len(from_cube), len(from_db))
+            self.assertEqual([(obj, obj.scrobble_count) for obj in from_cube],
+                             [(obj, obj.scrobble_count) for obj in from_db])
@@ -1,10 +1,12 @@
 import datetime
 import json
 import pytz
-from unittest.mock import call, patch
+from unittest.mock import Mock, call, patch
 
 import responses
+from django.db import IntegrityError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from freezegun import freeze_time
 
 from ditto.core.utils import datetime_now
@@ -12,7 +14,8 @@ from ditto.lastfm.factories import AccountFactory, AlbumFactory,\
     ArtistFactory, ScrobbleFactory, TrackFactory
 from ditto.lastfm.fetch import FetchError, ScrobblesFetcher,\
     ScrobblesMultiAccountFetcher
-from ditto.lastfm.models import Album, Artist, Scrobble, Track
+from ditto.lastfm.models import Album, Artist, Scrobble, Track,\
+    TrackDailyCount
 
 
 class ScrobblesFetcherTestCase(TestCase):
@@ -97,7 +100,7 @@ class ScrobblesFetcherTestCase(TestCase):
         was ending up with an empty track slug because ';' is seen as an
         alternative to '&' for separating query strings.
         """
-        artist_slug, track_slug = self.fetcher._get_slugs(
+        artist_slug, track_slug = self.fetcher.saver._get_slugs(
                             'http://www.last.fm/music/iamamiwhoami/_/;+john')
         self.assertEqual(track_slug, ';+john')
 
@@ -201,6 +204,7 @@ class ScrobblesFetcherSendTestCase(TestCase):
         "Sends the correct min time to API if we only want recent results."
         # We should fetch results from this scrobble's post_time onwards:
         scrobble = ScrobbleFactory(
+            account=self.account,
             post_time=datetime.datetime.strptime(
                 '2015-08-11 12:00:00', '%Y-%m-%d %H:%M:%S').replace(
                                                             tzinfo=pytz.utc))
@@ -209,6 +213,72 @@ class ScrobblesFetcherSendTestCase(TestCase):
         self.fetcher.fetch(fetch_type='recent')
         self.assertIn('from=1439294400', responses.calls[0].request.url)
 
+    @responses.activate
+    def test_sends_from_time_from_account_for_recent(self):
+        "Uses the Account's last_scrobble_time for recent results."
+        self.account.last_scrobble_time = datetime.datetime.strptime(
+                '2015-08-11 12:00:00', '%Y-%m-%d %H:%M:%S').replace(
+                                                            tzinfo=pytz.utc)
+        # A more recent scrobble by another account:
+        ScrobbleFactory(post_time=datetime.datetime.strptime(
+                '2015-08-12 12:00:00', '%Y-%m-%d %H:%M:%S').replace(
+                                                            tzinfo=pytz.utc))
+        self.add_recent_tracks_response(from_time=1439294400)
+        self.fetcher.fetch(fetch_type='recent')
+        self.assertIn('from=1439294400', responses.calls[0].request.url)
+
+    @responses.activate
+    def test_sets_last_scrobble_time(self):
+        "Saves the most recent scrobble's time on the Account."
+        self.add_recent_tracks_response()
+        self.fetcher.fetch(fetch_type='all')
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.last_scrobble_time,
+                            datetime.datetime.strptime(
+                                    '2016-09-22 15:52:49', '%Y-%m-%d %H:%M:%S'
+                                ).replace(tzinfo=pytz.utc))
+
+    @responses.activate
+    def test_does_not_set_last_scrobble_time_if_page_fails(self):
+        "Doesn't move the Account's last_scrobble_time on if a page failed."
+        body = self.load_fixture('user_getrecenttracks')
+        body['recenttracks']['@attr']['totalPages'] = "2"
+        self.add_recent_tracks_response(body=json.dumps(body))
+        self.add_recent_tracks_response(page=2, status=500)
+        self.fetcher.fetch(fetch_type='all')
+        self.account.refresh_from_db()
+        self.assertIsNone(self.account.last_scrobble_time)
+
+    @responses.activate
+    def test_recent_stops_at_page_of_existing_scrobbles(self):
+        "Recent fetches stop once a page has no new scrobbles."
+        self.fetcher.max_workers = 1
+        body = self.load_fixture('user_getrecenttracks')
+        body['recenttracks']['@attr']['totalPages'] = "3"
+        self.add_recent_tracks_response(body=json.dumps(body))
+        self.add_recent_tracks_response(body=json.dumps(body), page=2)
+        self.add_recent_tracks_response(body=json.dumps(body), page=3)
+        results = self.fetcher.fetch(fetch_type='recent')
+        self.assertTrue(results['success'])
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_recent_makes_one_request_if_nothing_new(self):
+        "If the first page has nothing new, only it is fetched."
+        self.add_recent_tracks_response()
+        self.fetcher.fetch(fetch_type='all')
+        responses.reset()
+
+        body = self.load_fixture('user_getrecenttracks')
+        body['recenttracks']['@attr']['totalPages'] = "2"
+        self.add_recent_tracks_response(body=json.dumps(body),
+                                        from_time=1474559569)
+        self.add_recent_tracks_response(body=json.dumps(body), page=2,
+                                        from_time=1474559569)
+        results = ScrobblesFetcher(self.account).fetch(fetch_type='recent')
+        self.assertTrue(results['success'])
+        self.assertEqual(len(responses.calls), 1)
+
     @responses.activate
     @freeze_time("2015-08-14 12:00:00", tz_offset=0)
     def test_sends_from_time_correctly_for_days(self):
@@ -231,6 +301,97 @@ class ScrobblesFetcherSendTestCase(TestCase):
         self.assertIn('page=1', responses.calls[0].request.url)
         self.assertIn('page=2', responses.calls[1].request.url)
 
+    @responses.activate
+    def test_requests_multiple_pages_in_one_thread(self):
+        "Fetches multiple pages one at a time if there's one thread."
+        self.fetcher.max_workers = 1
+        body = self.load_fixture('user_getrecenttracks')
+        body['recenttracks']['@attr']['totalPages'] = "3"
+        self.add_recent_tracks_response(body=json.dumps(body))
+        self.add_recent_tracks_response(body=json.dumps(body), page=2)
+        self.add_recent_tracks_response(body=json.dumps(body), page=3)
+        results = self.fetcher.fetch(fetch_type='all')
+        self.assertTrue(results['success'])
+        self.assertEqual(len(responses.calls), 3)
+        self.assertIn('page=3', responses.calls[2].request.url)
+
+    @responses.activate
+    def test_limits_pages_requested_ahead(self):
+        "Doesn't request pages far ahead of the one being saved."
+        self.add_recent_tracks_response()
+        self.fetcher.fetch(fetch_type='all')
+        responses.reset()
+
+        self.fetcher.max_workers = 2
+        self.fetcher.max_pages_ahead = 1
+        body = self.load_fixture('user_getrecenttracks')
+        body['recenttracks']['@attr']['totalPages'] = "4"
+        for page in range(2, 5):
+            self.add_recent_tracks_response(body=json.dumps(body), page=page,
+                                            from_time=1474559569)
+        body['recenttracks']['track'][1]['date']['uts'] = '1474600000'
+        self.add_recent_tracks_response(body=json.dumps(body),
+                                        from_time=1474559569)
+        self.fetcher.fetch(fetch_type='recent')
+        # Page 1 has a new scrobble; page 2 doesn't, so it stops there:
+        self.assertEqual(len(responses.calls), 2)
+
+    def test_cancels_pages_after_exception(self):
+        "If saving a page raises an exception, waiting pages are cancelled."
+        executor = Mock()
+        futures = [Mock(), Mock(), Mock()]
+        executor.submit.side_effect = futures
+        self.fetcher.max_pages_ahead = 3
+        with patch.object(self.fetcher, '_save_page',
+                          side_effect=IntegrityError('Oops')):
+            with self.assertRaises(IntegrityError):
+                self.fetcher._fetch_pages_in_threads(executor, range(2, 10))
+        self.assertEqual(executor.submit.call_count, 3)
+        futures[0].cancel.assert_not_called()
+        futures[1].cancel.assert_called_once_with()
+        futures[2].cancel.assert_called_once_with()
+
+    @responses.activate
+    def test_retries_failed_page(self):
+        "Tries fetching a page again if it fails."
+        body = self.load_fixture('user_getrecenttracks')
+        body['recenttracks']['@attr']['totalPages'] = "2"
+        self.add_recent_tracks_response(body=json.dumps(body))
+        # Page 2 fails the first time only:
+        statuses = [500, 200]
+        responses.add_callback(
+            responses.GET,
+            'http://ws.audioscrobbler.com/2.0/?method=user.getrecenttracks&user=bob&api_key=1234&format=json&page=2&limit=200',
+            callback=lambda request: (statuses.pop(0), {}, json.dumps(body)),
+            match_querystring=True,
+            content_type='application/json; charset=utf-8')
+        results = self.fetcher.fetch()
+        self.assertTrue(results['success'])
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(results['fetched'], 6)
+
+    @responses.activate
+    def test_continues_after_failed_page(self):
+        "One page failing every time doesn't stop the others being saved."
+        body = self.load_fixture('user_getrecenttracks')
+        body['recenttracks']['@attr']['totalPages'] = "3"
+        self.add_recent_tracks_response(body=json.dumps(body))
+        self.add_recent_tracks_response(page=2, status=500)
+        # Make page 3 a different scrobble:
+        body['recenttracks']['track'] = [body['recenttracks']['track'][1]]
+        body['recenttracks']['track'][0]['date']['uts'] = '1474000000'
+        self.add_recent_tracks_response(body=json.dumps(body), page=3)
+        results = self.fetcher.fetch()
+        self.assertFalse(results['success'])
+        self.assertEqual(len(results['messages']), 1)
+        self.assertIn(
+                'Error when fetching Scrobbles (page 2): 500 Server Error',
+                results['messages'][0])
+        self.assertEqual(results['fetched'], 4)
+        self.assertEqual(Scrobble.objects.count(), 4)
+        # Page 1, three tries at page 2, and page 3:
+        self.assertEqual(len(responses.calls), 5)
+
     @responses.activate
     def test_returns_correct_scrobble_count(self):
         "Should return the number of scrobbles fetched."
@@ -372,8 +533,8 @@ class ScrobblesFetcherSendTestCase(TestCase):
         self.assertEqual(len(scrobbles), 3)
 
     @responses.activate
-    def test_updates_existing_scrobbles(self):
-        "Updates existing scrobble objects"
+    def test_keeps_existing_scrobbles(self):
+        "Doesn't replace existing scrobble objects"
         # Make our existing scrobble:
         artist = ArtistFactory(slug='lou+reed')
         track = TrackFactory(artist=artist, slug='make+up')
@@ -390,7 +551,7 @@ class ScrobblesFetcherSendTestCase(TestCase):
         scrobbles = Scrobble.objects.all()
         # We have this many finished scrobbles in our JSON fixture:
         self.assertEqual(len(scrobbles), 3)
-        scrobble_reloaded = Scrobble.objects.get(artist=artist)
+        scrobble_reloaded = Scrobble.objects.get(track=track)
         self.assertEqual(scrobble.pk, scrobble_reloaded.pk)
 
     @responses.activate
@@ -413,6 +574,83 @@ class ScrobblesFetcherSendTestCase(TestCase):
         self.assertEqual(scrobble.raw, json.dumps(scrobble_json))
         self.assertEqual(scrobble.fetch_time, datetime_now())
 
+    @responses.activate
+    def test_does_not_change_existing_scrobbles(self):
+        "Leaves existing scrobbles alone rather than re-saving them."
+        artist = ArtistFactory(slug='lou+reed')
+        track = TrackFactory(artist=artist, slug='make+up')
+        post_time = datetime.datetime.strptime(
+                        '2016-09-22 09:23:33', '%Y-%m-%d %H:%M:%S'
+                    ).replace(tzinfo=pytz.utc)
+        ScrobbleFactory(account=self.account, track=track,
+                        post_time=post_time, raw='old')
+
+        self.add_recent_tracks_response()
+        results = self.fetcher.fetch(fetch_type='all')
+
+        self.assertEqual(results['fetched'], 3)
+        self.assertEqual(Scrobble.objects.get(track=track).raw, 'old')
+
+    @responses.activate
+    def test_does_not_duplicate_scrobbles_on_refetch(self):
+        "Fetching the same scrobbles twice doesn't create duplicates."
+        body = self.load_fixture('user_getrecenttracks')
+        body['recenttracks']['@attr']['totalPages'] = "2"
+        self.add_recent_tracks_response(body=json.dumps(body))
+        self.add_recent_tracks_response(body=json.dumps(body), page=2)
+        self.fetcher.fetch(fetch_type='all')
+        self.assertEqual(Scrobble.objects.count(), 3)
+
+    @responses.activate
+    @patch.object(Artist.objects, 'update_or_create',
+                                        wraps=Artist.objects.update_or_create)
+    @patch.object(Track.objects, 'update_or_create',
+                                        wraps=Track.objects.update_or_create)
+    def test_saves_artists_and_tracks_once(self, track_uoc, artist_uoc):
+        "Only saves each Artist and Track once per fetch, across pages."
+        body = self.load_fixture('user_getrecenttracks')
+        body['recenttracks']['@attr']['totalPages'] = "2"
+        self.add_recent_tracks_response(body=json.dumps(body))
+        self.add_recent_tracks_response(body=json.dumps(body), page=2)
+        self.fetcher.fetch(fetch_type='all')
+        self.assertEqual(artist_uoc.call_count, 3)
+        self.assertEqual(track_uoc.call_count, 3)
+
+    @responses.activate
+    def test_creates_scrobbles_in_one_query(self):
+        "Creates a page's new scrobbles with a single INSERT."
+        self.add_recent_tracks_response()
+        with CaptureQueriesContext(connection) as context:
+            self.fetcher.fetch(fetch_type='all')
+        inserts = [q for q in context.captured_queries
+                    if q['sql'].startswith('INSERT INTO "lastfm_scrobble"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Scrobble.objects.count(), 3)
+
+    @responses.activate
+    @freeze_time("2015-08-14 12:00:00", tz_offset=0)
+    def test_sets_scrobble_derived_fields(self):
+        "Sets the fields save() would usually set."
+        self.add_recent_tracks_response()
+        results = self.fetcher.fetch(fetch_type='all')
+        scrobble = Scrobble.objects.get(artist__slug='lou+reed')
+        self.assertEqual(scrobble.post_year, 2016)
+        self.assertEqual(scrobble.summary, '2016-09-22 09:23')
+
+    @responses.activate
+    def test_adds_daily_counts(self):
+        "Adds new scrobbles to the daily counts."
+        self.add_recent_tracks_response()
+        self.fetcher.fetch(fetch_type='all')
+        count = TrackDailyCount.objects.get(track__slug='make+up')
+        self.assertEqual(count.account, self.account)
+        self.assertEqual(str(count.date), '2016-09-22')
+        self.assertEqual(count.count, 1)
+        # Fetching again doesn't count them again:
+        ScrobblesFetcher(self.account).fetch(fetch_type='all')
+        self.assertEqual(TrackDailyCount.objects.get(
+                                            track__slug='make+up').count, 1)
+
     @responses.activate
     def test_leaves_album_blank(self):
         "If scrobble has no album, leaves its fields empty"
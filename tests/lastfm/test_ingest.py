@@ -0,0 +1,179 @@
+import datetime
+import json
+import os
+import pytz
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from ditto.lastfm.factories import AccountFactory
+from ditto.lastfm.fetch import ScrobbleSaver, _chunks
+from ditto.lastfm.ingest import IngestError, ScrobblesIngester
+from ditto.lastfm.models import Album, Artist, Scrobble, ScrobbleVersion,\
+        Track
+
+
+class ScrobblesIngesterTestCase(TestCase):
+
+    csv_content = (
+        'uts,artist,album,track,artist_mbid\n'
+        '1439294400,Lou Reed,Transformer,Vicious,abc-123\n'
+        '1439298000,Lou Reed,,Perfect Day,abc-123\n'
+        '1439301600,The Velvet Underground,Loaded,Sweet Jane,\n'
+    )
+
+    def setUp(self):
+        self.account = AccountFactory(username='bob')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_file(self, content, filename='scrobbles.csv'):
+        "Writes content to a file and returns its path."
+        path = os.path.join(self.directory, filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def ingest(self, path, **kwargs):
+        return ScrobblesIngester(self.account).ingest(path, **kwargs)
+
+    def test_imports_csv(self):
+        result = self.ingest(self.make_file(self.csv_content))
+        self.assertEqual(result, {'success': True, 'account': str(self.account),
+                                  'rows': 3, 'imported': 3})
+        self.assertEqual(Scrobble.objects.filter(account=self.account).count(),
+                         3)
+        self.assertEqual(Artist.objects.count(), 2)
+        self.assertEqual(Album.objects.count(), 2)
+
+    def test_uses_slugs(self):
+        "Artists and Tracks get the slugs they'd get from the API's URLs."
+        self.ingest(self.make_file(self.csv_content))
+        artist = Artist.objects.get(name='The Velvet Underground')
+        self.assertEqual(artist.slug, 'the+velvet+underground')
+        self.assertEqual(artist.original_slug, 'The+Velvet+Underground')
+        track = Track.objects.get(name='Sweet Jane')
+        self.assertEqual(track.slug, 'sweet+jane')
+        self.assertEqual(track.artist, artist)
+
+    def test_scrobble_data(self):
+        self.ingest(self.make_file(self.csv_content))
+        scrobble = Scrobble.objects.get(track__name='Vicious')
+        self.assertEqual(scrobble.post_time, datetime.datetime(
+                                        2015, 8, 11, 12, 0, 0, tzinfo=pytz.utc))
+        self.assertEqual(scrobble.album.name, 'Transformer')
+        self.assertEqual(scrobble.artist.mbid, 'abc-123')
+        self.assertIsNone(
+                Scrobble.objects.get(track__name='Perfect Day').album)
+
+    def test_dates(self):
+        path = self.make_file(
+            'Artist,Track,Date\n'
+            'Lou Reed,Vicious,"11 Aug 2015, 12:00"\n'
+            'Lou Reed,Perfect Day,2015-08-11 13:00:00\n')
+        self.ingest(path)
+        self.assertEqual(
+            sorted(Scrobble.objects.values_list('post_time', flat=True)),
+            [datetime.datetime(2015, 8, 11, 12, 0, 0, tzinfo=pytz.utc),
+             datetime.datetime(2015, 8, 11, 13, 0, 0, tzinfo=pytz.utc)])
+
+    def test_imports_api_format_json(self):
+        with open('tests/lastfm/fixtures/api/user_getrecenttracks.json') as f:
+            scrobbles = json.load(f)['recenttracks']['track']
+        path = self.make_file('\n'.join(json.dumps(s) for s in scrobbles),
+                              filename='scrobbles.jsonl')
+        result = self.ingest(path)
+        # The fixture's 'now playing' scrobble has no date and is skipped:
+        self.assertEqual(result['rows'], len(scrobbles))
+        self.assertEqual(result['imported'],
+                         len([s for s in scrobbles if 'date' in s]))
+
+    def test_imports_flat_json(self):
+        path = self.make_file(
+            '{"artist": "Lou Reed", "track": "Vicious", "uts": 1439294400}\n'
+            '\n'
+            '{"artist": "Lou Reed", "name": "Perfect Day", "uts": "1439298000"}\n',
+            filename='scrobbles.json')
+        self.assertEqual(self.ingest(path)['imported'], 2)
+
+    def test_format_argument(self):
+        path = self.make_file(self.csv_content, filename='scrobbles.txt')
+        self.assertEqual(self.ingest(path, file_format='csv')['imported'], 3)
+
+    def test_unknown_extension(self):
+        path = self.make_file(self.csv_content, filename='scrobbles.txt')
+        with self.assertRaises(IngestError):
+            self.ingest(path)
+
+    def test_missing_file(self):
+        with self.assertRaises(IngestError):
+            self.ingest(os.path.join(self.directory, 'nope.csv'))
+
+    def test_invalid_row(self):
+        path = self.make_file('artist,track,uts\nLou Reed,Vicious,\n')
+        with self.assertRaisesRegex(IngestError, 'Line 2 has no valid time'):
+            self.ingest(path)
+
+    def test_invalid_json(self):
+        path = self.make_file('{"artist": "Lou Reed"\n', filename='s.json')
+        with self.assertRaisesRegex(IngestError, 'line 1'):
+            self.ingest(path)
+
+    def test_does_not_duplicate(self):
+        path = self.make_file(self.csv_content)
+        self.ingest(path)
+        self.assertEqual(self.ingest(path)['imported'], 0)
+        self.assertEqual(Scrobble.objects.count(), 3)
+
+    def test_updates_scrobble_version(self):
+        path = self.make_file(self.csv_content)
+        self.ingest(path)
+        self.ingest(path)
+        self.assertEqual(ScrobbleVersion.objects.get_version(), (3, 0))
+
+    @patch.object(ScrobblesIngester, 'chunk_size', 2)
+    def test_saves_in_chunks(self):
+        with patch.object(ScrobbleSaver, 'save_scrobbles', autospec=True,
+                          side_effect=ScrobbleSaver.save_scrobbles) as save:
+            self.ingest(self.make_file(self.csv_content))
+        self.assertEqual([len(c[0][1]) for c in save.call_args_list], [2, 1])
+
+    def test_looks_up_existing_scrobbles_in_chunks(self):
+        "It keeps within SQLite's limit on the number of query parameters."
+        with patch('ditto.lastfm.fetch._chunks',
+                   side_effect=lambda items: _chunks(items, 2)) as chunks:
+            self.ingest(self.make_file(self.csv_content))
+            self.assertEqual(self.ingest(
+                        self.make_file(self.csv_content))['imported'], 0)
+        self.assertEqual(chunks.call_count, 2)
+        self.assertEqual(Scrobble.objects.count(), 3)
+
+    @patch.object(ScrobblesIngester, 'chunk_size', 2)
+    def test_resumes_from_checkpoint(self):
+        "If interrupted, carries on from the last chunk that was saved."
+        # The fourth row has no time, so the import fails after 1 chunk:
+        path = self.make_file(self.csv_content + 'Lou Reed,x,Bad,\n')
+        with self.assertRaises(IngestError):
+            self.ingest(path)
+        self.assertEqual(Scrobble.objects.count(), 2)
+        with open('%s.checkpoint' % path) as f:
+            self.assertEqual(json.load(f), {'rows': 2})
+
+        # Fix the row and try again:
+        path = self.make_file(self.csv_content +
+                              '1439305200,Lou Reed,,Walk on the Wild Side,\n')
+        result = self.ingest(path)
+        self.assertEqual(result['rows'], 4)
+        self.assertEqual(result['imported'], 2)
+        self.assertEqual(Scrobble.objects.count(), 4)
+        self.assertFalse(os.path.exists('%s.checkpoint' % path))
+
+    def test_sets_last_scrobble_time(self):
+        self.ingest(self.make_file(self.csv_content))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.last_scrobble_time,
+                datetime.datetime(2015, 8, 11, 14, 0, 0, tzinfo=pytz.utc))
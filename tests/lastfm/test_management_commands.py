@@ -6,7 +6,9 @@ from django.test import TestCase
 from django.utils.six import StringIO
 
 from ditto.lastfm.fetch import ScrobblesMultiAccountFetcher
-from ditto.lastfm.factories import AccountFactory
+from ditto.lastfm.factories import AccountFactory, ScrobbleFactory
+from ditto.lastfm.ingest import IngestError, ScrobblesIngester
+from ditto.lastfm.models import TrackDailyCount
 
 
 class FetchLastfmScrobblesTestCase(TestCase):
@@ -77,3 +79,72 @@ class FetchLastfmScrobblesTestCase(TestCase):
         self.assertIn('terry: Failed to fetch Scrobbles: Oops',
                                                     self.out_err.getvalue())
 
+
+
+class UpdateLastfmScrobbleCountsTestCase(TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        self.scrobble = ScrobbleFactory()
+        TrackDailyCount.objects.all().delete()
+
+    def test_rebuilds_counts(self):
+        call_command('update_lastfm_scrobble_counts', stdout=self.out)
+        self.assertEqual(TrackDailyCount.objects.get(
+                                        track=self.scrobble.track).count, 1)
+        self.assertIn('Created 2 daily counts', self.out.getvalue())
+
+    def test_account(self):
+        other = ScrobbleFactory()
+        TrackDailyCount.objects.all().delete()
+        call_command('update_lastfm_scrobble_counts',
+                     account=self.scrobble.account.username, stdout=self.out)
+        self.assertEqual(TrackDailyCount.objects.count(), 1)
+
+    def test_fails_with_invalid_account(self):
+        with self.assertRaises(CommandError):
+            call_command('update_lastfm_scrobble_counts', account='nope')
+
+
+class ImportLastfmScrobblesTestCase(TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        self.account = AccountFactory(username='terry')
+
+    def test_fails_with_no_account(self):
+        with self.assertRaises(CommandError):
+            call_command('import_lastfm_scrobbles', path='/a/file.csv')
+
+    def test_fails_with_invalid_account(self):
+        with self.assertRaises(CommandError):
+            call_command('import_lastfm_scrobbles', account='nope',
+                                                    path='/a/file.csv')
+
+    def test_fails_with_no_path(self):
+        with self.assertRaises(CommandError):
+            call_command('import_lastfm_scrobbles', account='terry')
+
+    @patch.object(ScrobblesIngester, 'ingest')
+    def test_sends_path_and_format(self, ingest):
+        ingest.return_value = {'success': True, 'account': 'terry',
+                               'rows': 1, 'imported': 1}
+        call_command('import_lastfm_scrobbles', account='terry',
+                        path='/a/file.txt', format='json', stdout=self.out)
+        ingest.assert_called_with('/a/file.txt', file_format='json')
+
+    @patch.object(ScrobblesIngester, 'ingest')
+    def test_success_output(self, ingest):
+        ingest.return_value = {'success': True, 'account': 'terry',
+                               'rows': 30, 'imported': 29}
+        call_command('import_lastfm_scrobbles', account='terry',
+                                        path='/a/file.csv', stdout=self.out)
+        self.assertIn('terry: Imported 29 Scrobbles from 30 rows',
+                                                        self.out.getvalue())
+
+    @patch.object(ScrobblesIngester, 'ingest')
+    def test_error(self, ingest):
+        ingest.side_effect = IngestError('Oops')
+        with self.assertRaisesRegex(CommandError, 'Oops'):
+            call_command('import_lastfm_scrobbles', account='terry',
+                                                        path='/a/file.csv')
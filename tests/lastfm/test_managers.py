@@ -1,9 +1,14 @@
+from unittest.mock import patch
+
+from django.db import models
 from django.test import TestCase
 
 from ditto.core.utils import datetime_from_str
 from ditto.lastfm.factories import AccountFactory, AlbumFactory,\
         ArtistFactory, ScrobbleFactory, TrackFactory
-from ditto.lastfm.models import Account, Album, Artist, Scrobble, Track
+from ditto.lastfm.managers import WithScrobbleCountsManager
+from ditto.lastfm.models import Account, Album, AlbumDailyCount, Artist,\
+        ArtistDailyCount, Scrobble, ScrobbleVersion, Track, TrackDailyCount
 
 
 class AlbumManagersWithScrobbleCountsTestCase(TestCase):
@@ -318,3 +323,201 @@ class TrackManagersWithScrobbleCountsTestCase(TestCase):
         with self.assertRaises(ValueError):
             Track.objects.with_scrobble_counts(track=track)
 
+
+
+class WithScrobbleCountsDailyCountsTestCase(TestCase):
+    "with_scrobble_counts() using the daily counts for whole days."
+
+    def setUp(self):
+        self.account = AccountFactory()
+        self.artist = ArtistFactory()
+        self.track = TrackFactory(artist=self.artist)
+        self.album = AlbumFactory(artist=self.artist)
+        for post_time in ('2015-08-11 12:00:00', '2015-08-12 01:00:00',
+                          '2015-08-12 23:00:00', '2015-08-13 12:00:00'):
+            ScrobbleFactory(account=self.account, artist=self.artist,
+                            track=self.track, album=self.album,
+                            post_time=datetime_from_str(post_time))
+
+    def test_uses_daily_counts(self):
+        "Sums daily counts rather than counting Scrobbles for whole days."
+        # One for the Tracks, one to prefetch their Artists:
+        with self.assertNumQueries(2):
+            tracks = list(Track.objects.with_scrobble_counts(
+                    min_post_time=datetime_from_str('2015-08-12 00:00:00'),
+                    max_post_time=datetime_from_str('2015-08-12 23:59:59').replace(
+                                                    microsecond=999999)))
+        self.assertEqual(len(tracks), 1)
+        self.assertEqual(tracks[0].scrobble_count, 2)
+        self.assertIn('dailycount', str(
+                Track.objects.with_scrobble_counts(
+                    min_post_time=datetime_from_str('2015-08-12 00:00:00')
+                ).query))
+
+    def test_part_days(self):
+        "Subtracts Scrobbles outside the times on the first and last days."
+        qs = Album.objects.with_scrobble_counts(
+                    min_post_time=datetime_from_str('2015-08-12 12:00:00'))
+        self.assertIn('dailycount', str(qs.query))
+        self.assertEqual(qs[0].scrobble_count, 2)
+        qs = Album.objects.with_scrobble_counts(
+                    min_post_time=datetime_from_str('2015-08-11 13:00:00'),
+                    max_post_time=datetime_from_str('2015-08-12 12:00:00'))
+        self.assertEqual(qs[0].scrobble_count, 1)
+
+    def test_part_days_excludes_uncounted(self):
+        "Things only scrobbled outside the times aren't included."
+        qs = Track.objects.with_scrobble_counts(
+                    min_post_time=datetime_from_str('2015-08-13 13:00:00'))
+        self.assertEqual(len(qs), 0)
+
+    def test_counts_scrobbles_for_many_part_day_things(self):
+        "Counts Scrobbles if too many things would need subtracting."
+        with patch.object(WithScrobbleCountsManager, 'max_outside_things', 0):
+            qs = Album.objects.with_scrobble_counts(
+                    min_post_time=datetime_from_str('2015-08-12 12:00:00'))
+            self.assertNotIn('dailycount', str(qs.query))
+            self.assertEqual(qs[0].scrobble_count, 2)
+
+    def test_counts_scrobbles_for_other_things(self):
+        "Counts Scrobbles if filtering by a different kind of thing."
+        qs = Track.objects.with_scrobble_counts(album=self.album)
+        self.assertNotIn('dailycount', str(qs.query))
+
+    def test_same_results_as_counting(self):
+        "Gives the same counts as counting the Scrobbles."
+        ScrobbleFactory(post_time=datetime_from_str('2015-08-12 12:00:00'))
+        for min_time, max_time in (('2015-08-12 00:00:00', None),
+                                   ('2015-08-12 06:00:00', None),
+                                   ('2015-08-11 00:00:00',
+                                    '2015-08-12 22:00:00'),
+                                   ('2015-08-12 00:30:00',
+                                    '2015-08-12 12:00:00')):
+            kwargs = {'min_post_time': datetime_from_str(min_time)}
+            filters = {'scrobbles__post_time__gte': kwargs['min_post_time']}
+            if max_time is not None:
+                kwargs['max_post_time'] = datetime_from_str(max_time)
+                filters['scrobbles__post_time__lte'] = kwargs['max_post_time']
+            for manager in (Album.objects, Artist.objects, Track.objects):
+                daily = manager.with_scrobble_counts(**kwargs)
+                counted = manager.filter(**filters)\
+                            .annotate(num=models.Count('scrobbles'))\
+                            .order_by('-num', 'pk')
+                self.assertEqual(
+                        sorted([(-o.scrobble_count, o.pk) for o in daily]),
+                        [(-o.num, o.pk) for o in counted])
+
+    def test_account_and_artist(self):
+        "Can filter daily counts by Account and Artist."
+        ScrobbleFactory(artist=self.artist, track=self.track)
+        tracks = Track.objects.with_scrobble_counts(account=self.account,
+                                                    artist=self.artist)
+        self.assertEqual(len(tracks), 1)
+        self.assertEqual(tracks[0].scrobble_count, 4)
+
+
+class DailyScrobbleCountManagerTestCase(TestCase):
+
+    def setUp(self):
+        self.account = AccountFactory()
+        self.artist = ArtistFactory()
+        self.track = TrackFactory(artist=self.artist)
+        self.scrobbles = [
+            ScrobbleFactory(account=self.account, artist=self.artist,
+                    track=self.track,
+                    post_time=datetime_from_str('2015-08-11 12:00:00')),
+            ScrobbleFactory(account=self.account, artist=self.artist,
+                    track=self.track,
+                    post_time=datetime_from_str('2015-08-11 13:00:00')),
+        ]
+
+    def test_counts_scrobbles_per_day(self):
+        counts = ArtistDailyCount.objects.filter(artist=self.artist)
+        self.assertEqual(len(counts), 1)
+        self.assertEqual(counts[0].account, self.account)
+        self.assertEqual(str(counts[0].date), '2015-08-11')
+        self.assertEqual(counts[0].count, 2)
+
+    def test_no_album_no_count(self):
+        "Scrobbles with no Album don't have Album counts."
+        self.assertEqual(AlbumDailyCount.objects.count(), 0)
+
+    def test_add_scrobbles(self):
+        TrackDailyCount.objects.add_scrobbles(self.scrobbles)
+        self.assertEqual(
+                TrackDailyCount.objects.get(track=self.track).count, 4)
+
+    def test_remove_scrobbles_deletes_empty_counts(self):
+        TrackDailyCount.objects.add_scrobbles(self.scrobbles[:1], -1)
+        self.assertEqual(
+                TrackDailyCount.objects.get(track=self.track).count, 1)
+        TrackDailyCount.objects.add_scrobbles(self.scrobbles[1:], -1)
+        self.assertEqual(TrackDailyCount.objects.count(), 0)
+
+    def test_add_scrobbles_in_batches(self):
+        "It keeps within SQLite's limit on the number of query parameters."
+        scrobbles = self.scrobbles + [
+            ScrobbleFactory(account=self.account, artist=self.artist,
+                    track=self.track,
+                    post_time=datetime_from_str('2015-08-%s 12:00:00' % day))
+            for day in range(12, 17)]
+        with patch.object(TrackDailyCount.objects, 'batch_size', 2):
+            TrackDailyCount.objects.add_scrobbles(scrobbles)
+        self.assertEqual(
+            list(TrackDailyCount.objects.order_by('date')
+                                    .values_list('count', flat=True)),
+            [4, 2, 2, 2, 2, 2])
+
+    def test_rebuild(self):
+        TrackDailyCount.objects.all().delete()
+        other = ScrobbleFactory()
+        TrackDailyCount.objects.filter(track=other.track).update(count=99)
+        self.assertEqual(TrackDailyCount.objects.rebuild(), 2)
+        self.assertEqual(
+                TrackDailyCount.objects.get(track=self.track).count, 2)
+        self.assertEqual(
+                TrackDailyCount.objects.get(track=other.track).count, 1)
+
+    def test_rebuild_account(self):
+        other = ScrobbleFactory()
+        TrackDailyCount.objects.all().update(count=99)
+        self.assertEqual(
+                TrackDailyCount.objects.rebuild(account=self.account), 1)
+        self.assertEqual(
+                TrackDailyCount.objects.get(track=self.track).count, 2)
+        self.assertEqual(
+                TrackDailyCount.objects.get(track=other.track).count, 99)
+
+
+class ScrobbleVersionManagerTestCase(TestCase):
+
+    def test_no_version(self):
+        self.assertEqual(ScrobbleVersion.objects.get_version(), (0, 0))
+
+    def test_bump(self):
+        ScrobbleVersion.objects.bump(added=3)
+        ScrobbleVersion.objects.bump(added=1, changed=2)
+        self.assertEqual(ScrobbleVersion.objects.get_version(), (4, 2))
+        self.assertEqual(ScrobbleVersion.objects.count(), 1)
+
+    def test_new_scrobble(self):
+        ScrobbleFactory()
+        self.assertEqual(ScrobbleVersion.objects.get_version(), (1, 0))
+
+    def test_moved_scrobble(self):
+        scrobble = ScrobbleFactory()
+        scrobble.track = TrackFactory()
+        scrobble.save()
+        self.assertEqual(ScrobbleVersion.objects.get_version(), (1, 1))
+
+    def test_unmoved_scrobble(self):
+        "Saving a Scrobble without changing what the cube uses."
+        scrobble = ScrobbleFactory()
+        scrobble.is_private = True
+        scrobble.save()
+        self.assertEqual(ScrobbleVersion.objects.get_version(), (1, 0))
+
+    def test_deleted_scrobbles(self):
+        ScrobbleFactory.create_batch(2)
+        Scrobble.objects.all().delete()
+        self.assertEqual(ScrobbleVersion.objects.get_version(), (2, 2))
@@ -3,7 +3,8 @@ from django.test import TestCase
 from ditto.core.utils import datetime_from_str
 from ditto.lastfm.factories import AccountFactory, AlbumFactory,\
         ArtistFactory, ScrobbleFactory, TrackFactory
-from ditto.lastfm.models import Account, Album, Artist, Scrobble, Track
+from ditto.lastfm.models import Account, Album, Artist, Scrobble, Track,\
+        TrackDailyCount
 
 
 class AccountTestCase(TestCase):
@@ -282,6 +283,48 @@ class ScrobbleTestCase(TestCase):
         self.assertEqual(scrobble.title, "Drew Danburry – Jerry Spinelli and Patricia Polacco or Every Moment of Every Day We Are Faced With the Decision as to Whether We Will Continue Doing What We Are Doing or Choose a Different Way to Do Things. This, Essentially, Means That It Is Also Our…")
 
 
+    def test_saving_adds_daily_counts(self):
+        "Creating a Scrobble adds it to the daily counts."
+        ScrobbleFactory(track=self.track,
+                        post_time=datetime_from_str('2016-04-07 12:00:00'))
+        count = TrackDailyCount.objects.get(track=self.track)
+        self.assertEqual(str(count.date), '2016-04-07')
+        self.assertEqual(count.count, 1)
+
+    def test_changing_moves_daily_counts(self):
+        "Changing a Scrobble's time moves it between daily counts."
+        scrobble = ScrobbleFactory(track=self.track,
+                        post_time=datetime_from_str('2016-04-07 12:00:00'))
+        scrobble.post_time = datetime_from_str('2016-04-08 12:00:00')
+        scrobble.save()
+        counts = TrackDailyCount.objects.filter(track=self.track)
+        self.assertEqual(len(counts), 1)
+        self.assertEqual(str(counts[0].date), '2016-04-08')
+
+    def test_deleting_removes_daily_counts(self):
+        "Deleting a Scrobble removes it from the daily counts."
+        scrobble = ScrobbleFactory(track=self.track)
+        scrobble.delete()
+        self.assertEqual(TrackDailyCount.objects.count(), 0)
+
+    def test_queryset_deleting_removes_daily_counts(self):
+        "Deleting Scrobbles in a QuerySet removes them from the daily counts."
+        ScrobbleFactory.create_batch(2, track=self.track,
+                        post_time=datetime_from_str('2016-04-07 12:00:00'))
+        ScrobbleFactory(track=self.track,
+                        post_time=datetime_from_str('2016-04-08 12:00:00'))
+        Scrobble.objects.filter(
+                post_time=datetime_from_str('2016-04-07 12:00:00')).delete()
+        counts = TrackDailyCount.objects.filter(track=self.track)
+        self.assertEqual([(str(c.date), c.count) for c in counts],
+                         [('2016-04-08', 1)])
+
+    def test_account_deleting_removes_daily_counts(self):
+        scrobble = ScrobbleFactory(track=self.track)
+        scrobble.account.delete()
+        self.assertEqual(TrackDailyCount.objects.count(), 0)
+
+
 class TrackTestCase(TestCase):
 
     def test_str(self):
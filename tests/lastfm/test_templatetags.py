@@ -1,6 +1,9 @@
+from unittest import skipIf
+
 from django.test import TestCase
 
 from ditto.core.utils import datetime_from_str
+from ditto.lastfm import analytics
 from ditto.lastfm.templatetags import ditto_lastfm
 from ditto.lastfm.factories import AccountFactory, AlbumFactory,\
         ArtistFactory, ScrobbleFactory, TrackFactory
@@ -603,3 +606,44 @@ class DayScrobblesTestCase(TestCase):
         with self.assertRaises(TypeError):
             ditto_lastfm.day_scrobbles(account='bob')
 
+
+@skipIf(analytics.np is None, "NumPy is not installed")
+class ListeningTagsTestCase(TestCase):
+
+    def setUp(self):
+        analytics.invalidate()
+        self.account = AccountFactory()
+        self.artist = ArtistFactory()
+        ScrobbleFactory(account=self.account, artist=self.artist,
+                        post_time=datetime_from_str('2016-04-04 12:00:00'))
+
+    def tearDown(self):
+        analytics.invalidate()
+
+    def test_listening_streaks(self):
+        streaks = ditto_lastfm.listening_streaks(account=self.account)
+        self.assertEqual(streaks['longest']['days'], 1)
+
+    def test_listening_heatmap(self):
+        heatmap = ditto_lastfm.listening_heatmap(account=self.account)
+        self.assertEqual(heatmap[0][12], 1)
+
+    def test_listening_sessions(self):
+        sessions = ditto_lastfm.listening_sessions(account=self.account)
+        self.assertEqual(sessions['count'], 1)
+
+    def test_listening_sessions_gap_error(self):
+        with self.assertRaises(ValueError):
+            ditto_lastfm.listening_sessions(gap='30')
+
+    def test_artist_listening_curve(self):
+        curve = ditto_lastfm.artist_listening_curve(self.artist)
+        self.assertEqual(curve[0]['count'], 1)
+
+    def test_artist_error(self):
+        with self.assertRaises(TypeError):
+            ditto_lastfm.artist_listening_curve('bob')
+
+    def test_account_error(self):
+        with self.assertRaises(TypeError):
+            ditto_lastfm.listening_heatmap(account='bob')
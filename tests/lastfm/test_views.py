@@ -102,6 +102,17 @@ class AlbumListViewTests(TestCase):
         response = self.client.get("%s?days=7" % reverse('lastfm:album_list'))
         self.assertEqual(response.context['album_list'][0].scrobble_count, 1)
 
+    @freeze_time("2016-10-05 12:00:00", tz_offset=-8)
+    def test_7_days_from_now(self):
+        "Only includes Scrobbles from exactly 7 days ago onwards."
+        artist = ArtistFactory()
+        album = AlbumFactory(artist=artist)
+        for post_time in ('2016-09-28 11:00:00', '2016-09-28 13:00:00'):
+            ScrobbleFactory(artist=artist, album=album,
+                            post_time=datetime_from_str(post_time))
+        response = self.client.get("%s?days=7" % reverse('lastfm:album_list'))
+        self.assertEqual(response.context['album_list'][0].scrobble_count, 1)
+
 
 class ArtistAlbumsViewTests(TestCase):
 
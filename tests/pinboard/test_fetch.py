@@ -8,12 +8,14 @@ import pytz
 from requests.exceptions import ConnectionError, RequestException, Timeout, TooManyRedirects
 import responses
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from ditto.pinboard.factories import AccountFactory, BookmarkFactory
 from ditto.pinboard.fetch import BookmarksFetcher, AllBookmarksFetcher,\
         DateBookmarksFetcher, RecentBookmarksFetcher, UrlBookmarksFetcher,\
-        FetchError
+        FetchError, _iter_json_list
 from ditto.pinboard.models import Account, Bookmark, BookmarkTag
 
 
@@ -33,6 +35,15 @@ class FetchTypesTestRemoteCase(FetchTestCase):
     data: AllBookmarksFetcher, DateBookmarksFetcher, etc.
     """
 
+    def setUp(self):
+        super().setUp()
+        # Don't wait between the 'update' request and others:
+        self.sleep_patch = patch('time.sleep')
+        self.sleep = self.sleep_patch.start()
+
+    def tearDown(self):
+        self.sleep_patch.stop()
+
     def add_response(self, body, method='get', status=200):
         """If the URL given here is called, then the request is faked, and
         `body` is what will be returned from the request to the URL.
@@ -76,6 +87,132 @@ class FetchTypesTestRemoteCase(FetchTestCase):
         self.assertTrue(result[0]['success'])
         self.assertEqual(result[0]['fetched'], 12)
 
+    @responses.activate
+    @patch.object(BookmarksFetcher, 'batch_size', 5)
+    def test_fetch_all_in_batches(self):
+        "Saves all bookmarks batch_size at a time"
+        self.add_response(
+                method='all',
+                body=self.make_success_body(method='all', num_posts=12)
+            )
+        with patch.object(BookmarksFetcher, '_save_bookmarks') as save:
+            result = AllBookmarksFetcher().fetch(username='philgyford')
+        self.assertEqual(
+            [len(c[1]['bookmarks_data']) for c in save.call_args_list],
+            [5, 5, 2])
+        self.assertEqual(result[0]['fetched'], 12)
+
+    @responses.activate
+    @patch.object(BookmarksFetcher, 'batch_size', 5)
+    def test_fetch_all_truncated(self):
+        "Saves the batches it can if the response ends early"
+        body = self.make_success_body(method='all', num_posts=12)
+        self.add_response(method='all', body=body[:-200])
+        result = AllBookmarksFetcher().fetch(username='philgyford')
+        self.assertFalse(result[0]['success'])
+        self.assertIn('Could not parse', result[0]['messages'][0])
+        self.assertEqual(result[0]['fetched'], 10)
+        self.assertEqual(Bookmark.objects.count(), 10)
+
+    @responses.activate
+    def test_fetch_all_empty(self):
+        self.add_response(method='all', body='[]')
+        result = AllBookmarksFetcher().fetch(username='philgyford')
+        self.assertTrue(result[0]['success'])
+        self.assertEqual(result[0]['fetched'], 0)
+
+    def add_update_response(self, update_time='2015-06-18T09:48:31Z'):
+        "Fakes the response from posts/update."
+        self.add_response(method='update',
+                          body='{"update_time":"%s"}' % update_time)
+
+    @responses.activate
+    def test_fetch_recent_skipped_if_unchanged(self):
+        "Doesn't fetch Bookmarks if nothing has changed since the last fetch"
+        self.user_1.last_update_time = datetime.datetime(
+                                    2015, 6, 18, 9, 48, 31, tzinfo=pytz.utc)
+        self.user_1.save()
+        self.add_update_response()
+        self.add_response(method='recent',
+                                    body=self.make_success_body(num_posts=5))
+        result = RecentBookmarksFetcher().fetch(num=5, username='philgyford')
+        self.assertTrue(result[0]['success'])
+        self.assertTrue(result[0]['unchanged'])
+        self.assertEqual(result[0]['fetched'], 0)
+        self.assertEqual(len(responses.calls), 1)
+        self.assertFalse(self.sleep.called)
+
+    @responses.activate
+    def test_fetch_all_if_changed(self):
+        "Fetches Bookmarks, and stores the update time, if they've changed"
+        self.user_1.last_all_update_time = datetime.datetime(
+                                    2015, 6, 17, 9, 48, 31, tzinfo=pytz.utc)
+        self.user_1.save()
+        self.add_update_response()
+        self.add_response(method='all',
+                    body=self.make_success_body(method='all', num_posts=3))
+        result = AllBookmarksFetcher().fetch(username='philgyford')
+        self.assertEqual(result[0]['fetched'], 3)
+        self.assertNotIn('unchanged', result[0])
+        self.sleep.assert_called_once_with(3)
+        self.user_1.refresh_from_db()
+        self.assertEqual(self.user_1.last_update_time, datetime.datetime(
+                                    2015, 6, 18, 9, 48, 31, tzinfo=pytz.utc))
+        self.assertEqual(self.user_1.last_all_update_time, datetime.datetime(
+                                    2015, 6, 18, 9, 48, 31, tzinfo=pytz.utc))
+
+    @responses.activate
+    def test_fetch_all_skipped_if_unchanged(self):
+        self.user_1.last_all_update_time = datetime.datetime(
+                                    2015, 6, 18, 9, 48, 31, tzinfo=pytz.utc)
+        self.user_1.save()
+        self.add_update_response()
+        result = AllBookmarksFetcher().fetch(username='philgyford')
+        self.assertTrue(result[0]['unchanged'])
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_fetch_all_after_recent(self):
+        "A 'recent' fetch doesn't stop a later 'all' fetch from happening"
+        self.add_update_response()
+        self.add_response(method='recent',
+                                    body=self.make_success_body(num_posts=2))
+        self.add_response(method='all',
+                    body=self.make_success_body(method='all', num_posts=5))
+        RecentBookmarksFetcher().fetch(num=2, username='philgyford')
+        self.user_1.refresh_from_db()
+        self.assertIsNone(self.user_1.last_all_update_time)
+        result = AllBookmarksFetcher().fetch(username='philgyford')
+        self.assertNotIn('unchanged', result[0])
+        self.assertEqual(result[0]['fetched'], 5)
+
+    @responses.activate
+    def test_does_not_store_update_time_on_failure(self):
+        self.add_update_response()
+        self.add_response(method='recent', body='Error', status=500)
+        result = RecentBookmarksFetcher().fetch(num=5, username='philgyford')
+        self.assertFalse(result[0]['success'])
+        self.user_1.refresh_from_db()
+        self.assertIsNone(self.user_1.last_update_time)
+
+    @responses.activate
+    def test_fetches_if_update_check_fails(self):
+        self.user_1.last_update_time = datetime.datetime(
+                                    2015, 6, 18, 9, 48, 31, tzinfo=pytz.utc)
+        self.user_1.save()
+        self.add_response(method='update', body='Error', status=500)
+        self.add_response(method='recent',
+                                    body=self.make_success_body(num_posts=5))
+        result = RecentBookmarksFetcher().fetch(num=5, username='philgyford')
+        self.assertEqual(result[0]['fetched'], 5)
+
+    @responses.activate
+    def test_date_fetch_does_not_check_update(self):
+        self.add_response(body=self.make_success_body(num_posts=4))
+        DateBookmarksFetcher().fetch(post_date='2015-06-18',
+                                                        username='philgyford')
+        self.assertEqual(len(responses.calls), 1)
+
     @responses.activate
     def test_fetch_date_success(self):
         """Successfully fetches bookmarks for a particular date"""
@@ -377,3 +514,150 @@ class FetchTypesSaveTestCase(FetchTestCase):
         # Nothing has changed, and so the fetch_time should be the original:
         self.assertEqual(bookmarks[0].fetch_time, fetch_time)
 
+
+
+class FetchSaveBulkTestCase(FetchTestCase):
+    "Saving Bookmarks and their tags in bulk."
+
+    def make_bookmark_data(self, url='http://example.com/', tags='fish carp',
+                                                            shared=True):
+        return {
+            'href': url,
+            'description': 'My title',
+            'extended': 'My description',
+            'json': '{}',
+            'time': datetime.datetime(2015, 6, 18, 9, 48, 31, tzinfo=pytz.utc),
+            'shared': shared,
+            'toread': False,
+            'tags': tags.split(),
+        }
+
+    def save(self, bookmarks_data):
+        BookmarksFetcher()._save_bookmarks(
+                account=self.user_1, bookmarks_data=bookmarks_data,
+                fetch_time=datetime.datetime.utcnow().replace(tzinfo=pytz.utc))
+
+    def test_sets_derived_fields(self):
+        self.save([self.make_bookmark_data()])
+        bookmark = Bookmark.objects.get(url='http://example.com/')
+        self.assertEqual(bookmark.url_hash, bookmark._make_url_hash())
+        self.assertEqual(bookmark.summary, 'My description')
+        self.assertEqual(bookmark.post_year, 2015)
+
+    def test_tag_counts(self):
+        self.save([self.make_bookmark_data(),
+                   self.make_bookmark_data(url='http://example.org/',
+                                           tags='fish', shared=False)])
+        fish = BookmarkTag.objects.get(name='fish')
+        self.assertEqual(fish.public_count, 1)
+        self.assertEqual(fish.total_count, 2)
+        self.assertEqual(BookmarkTag.objects.get(name='carp').total_count, 1)
+
+    def test_removes_tags(self):
+        self.save([self.make_bookmark_data()])
+        self.save([self.make_bookmark_data(tags='fish')])
+        bookmark = Bookmark.objects.get(url='http://example.com/')
+        self.assertEqual(list(bookmark.tags.names()), ['fish'])
+        self.assertEqual(BookmarkTag.objects.get(name='carp').total_count, 0)
+
+    def test_keeps_unchanged_tags(self):
+        "Doesn't delete and re-add tags that are still on the Bookmark."
+        self.save([self.make_bookmark_data()])
+        through = Bookmark.tags.through
+        fish_tagged = through.objects.get(tag__name='fish')
+        self.save([self.make_bookmark_data(tags='fish salmon')])
+        self.assertEqual(through.objects.get(tag__name='fish').pk,
+                         fish_tagged.pk)
+
+    def test_privacy_change_updates_counts(self):
+        self.save([self.make_bookmark_data()])
+        self.save([self.make_bookmark_data(shared=False)])
+        self.assertTrue(
+                Bookmark.objects.get(url='http://example.com/').is_private)
+        fish = BookmarkTag.objects.get(name='fish')
+        self.assertEqual(fish.public_count, 0)
+        self.assertEqual(fish.total_count, 1)
+
+    def test_unique_tag_slugs(self):
+        "New tags get unique slugs, like when saving them one at a time."
+        BookmarkTag.objects.create(name='dog')
+        self.save([self.make_bookmark_data(tags='DOG Dog')])
+        self.assertEqual(
+                sorted(BookmarkTag.objects.values_list('slug', flat=True)),
+                ['dog', 'dog_1', 'dog_2'])
+
+    def test_private_tags(self):
+        self.save([self.make_bookmark_data(tags='.secret')])
+        self.assertTrue(BookmarkTag.objects.get(name='.secret').is_private_tag)
+
+    def test_query_count(self):
+        "The number of queries doesn't depend on the number of tags."
+        bookmarks_data = [
+            self.make_bookmark_data(url='http://example.com/%s' % n,
+                                    tags='tag%s tag%s common' % (n, n + 100))
+            for n in range(20)]
+        with CaptureQueriesContext(connection) as queries:
+            self.save(bookmarks_data)
+        self.assertLess(len(queries), 20)
+        self.assertEqual(Bookmark.tags.through.objects.count(), 60)
+
+    def test_many_bookmarks(self):
+        "Saves more Bookmarks than fit in one query's parameters on SQLite."
+        self.save([self.make_bookmark_data(url='http://example.com/%s' % n,
+                                           tags='tag%s' % n)
+                                                        for n in range(600)])
+        self.save([self.make_bookmark_data(url='http://example.com/%s' % n,
+                                           tags='tag%s' % n, shared=False)
+                                                        for n in range(600)])
+        self.assertEqual(Bookmark.objects.filter(is_private=True).count(), 600)
+        self.assertEqual(
+                BookmarkTag.objects.filter(total_count=1).count(), 600)
+
+
+class IterJsonListTestCase(TestCase):
+
+    def test_items_split_across_chunks(self):
+        chunks = [' [{"a": 1', '}, {"b": "x,]"}', ',{"c"', ': [3]}', ']\t\n']
+        self.assertEqual(list(_iter_json_list(chunks)),
+                         [{'a': 1}, {'b': 'x,]'}, {'c': [3]}])
+
+    def test_yields_before_the_end(self):
+        "Items are yielded as soon as they've arrived."
+        def chunks():
+            yield '[{"a": 1}, '
+            raise AssertionError('Read too far')
+        self.assertEqual(next(_iter_json_list(chunks())), {'a': 1})
+
+    def test_not_a_list(self):
+        with self.assertRaises(FetchError):
+            list(_iter_json_list(['{"a": 1}']))
+
+    def test_incomplete(self):
+        with self.assertRaises(FetchError):
+            list(_iter_json_list(['[{"a": 1}, {"b"']))
+
+    def test_partial_values(self):
+        "Waits for the rest of values that are split across chunks."
+        chunks = ['[{"a": tr', 'ue, "b": "caf\\u00', 'e9", "c": "long',
+                  ' string"}]']
+        self.assertEqual(list(_iter_json_list(chunks)),
+                         [{'a': True, 'b': 'caf\u00e9', 'c': 'long string'}])
+
+    def test_invalid_item(self):
+        "Fails as soon as an item is invalid, without reading further."
+        def chunks():
+            yield '[{"a": 1}, {"b": nope, "c": 2'
+            raise AssertionError('Read too far')
+        items = _iter_json_list(chunks())
+        self.assertEqual(next(items), {'a': 1})
+        with self.assertRaisesRegex(FetchError, 'Invalid JSON'):
+            next(items)
+
+    def test_item_too_long(self):
+        "Fails if one item gets too long, without reading further."
+        def chunks():
+            yield '[{"a": "'
+            while True:
+                yield 'x' * 10
+        with self.assertRaisesRegex(FetchError, 'longer than 100'):
+            list(_iter_json_list(chunks(), max_item_size=100))
@@ -1,6 +1,7 @@
 # coding: utf-8
 import datetime
 import pytz
+from unittest.mock import patch
 
 from django.db import IntegrityError
 from django.test import TestCase
@@ -8,7 +9,8 @@ from django.test.utils import override_settings
 
 from ditto.core.utils import datetime_from_str
 from ditto.pinboard.factories import AccountFactory, BookmarkFactory
-from ditto.pinboard.models import Account, Bookmark, BookmarkTag
+from ditto.pinboard.models import Account, Bookmark, BookmarkTag,\
+        TaggedBookmark
 
 
 class AccountTestCase(TestCase):
@@ -149,6 +151,104 @@ class BookmarkTestCase(TestCase):
         self.assertEqual(bookmark_reloaded.tags.all()[0].name, 'alsopublic')
         self.assertEqual(bookmark_reloaded.tags.all()[1].name, 'ispublic')
 
+    def test_tags_private_flag(self):
+        "Tags starting with '.' should be marked as private"
+        bookmark = BookmarkFactory()
+        bookmark.tags.set('ispublic', '.isprivate')
+        self.assertTrue(BookmarkTag.objects.get(name='.isprivate').is_private_tag)
+        self.assertFalse(BookmarkTag.objects.get(name='ispublic').is_private_tag)
+
+    def test_tags_counts(self):
+        "Setting tags should update the tags' counts"
+        BookmarkFactory(is_private=False).tags.set('fish', 'carp')
+        BookmarkFactory(is_private=True).tags.set('fish')
+        fish = BookmarkTag.objects.get(name='fish')
+        self.assertEqual(fish.public_count, 1)
+        self.assertEqual(fish.total_count, 2)
+        carp = BookmarkTag.objects.get(name='carp')
+        self.assertEqual(carp.public_count, 1)
+        self.assertEqual(carp.total_count, 1)
+
+    def test_tags_counts_removed(self):
+        "Removing a tag should update its count"
+        bookmark = BookmarkFactory()
+        bookmark.tags.set('fish', 'carp')
+        bookmark.tags.set('fish')
+        self.assertEqual(BookmarkTag.objects.get(name='carp').total_count, 0)
+
+    def test_tags_counts_add_remove_clear(self):
+        "Adding, removing and clearing tags should update their counts"
+        bookmark = BookmarkFactory()
+        bookmark.tags.add('fish', 'carp', 'pike')
+        self.assertEqual(BookmarkTag.objects.get(name='pike').total_count, 1)
+        bookmark.tags.remove('pike')
+        self.assertEqual(BookmarkTag.objects.get(name='pike').total_count, 0)
+        bookmark.tags.clear()
+        self.assertEqual(BookmarkTag.objects.get(name='fish').total_count, 0)
+        self.assertEqual(BookmarkTag.objects.get(name='carp').total_count, 0)
+
+    def test_tags_counts_updated_once(self):
+        "Tags' counts should be updated together, not one at a time"
+        bookmark = BookmarkFactory()
+        with patch.object(BookmarkTag.objects, 'update_counts') as update:
+            bookmark.tags.add('fish', 'carp')
+        self.assertEqual(update.call_count, 1)
+
+    def test_tags_counts_tagged_bookmark_changes(self):
+        "Changing TaggedBookmarks directly, eg in the Admin, updates counts"
+        bookmark = BookmarkFactory()
+        bookmark.tags.set('fish')
+        tagged = TaggedBookmark.objects.get(object_id=bookmark.pk)
+        tagged.tag = BookmarkTag.objects.create(name='carp', slug='carp')
+        tagged.save()
+        self.assertEqual(BookmarkTag.objects.get(name='fish').total_count, 0)
+        self.assertEqual(BookmarkTag.objects.get(name='carp').total_count, 1)
+        tagged.delete()
+        self.assertEqual(BookmarkTag.objects.get(name='carp').total_count, 0)
+
+    def test_tags_counts_bookmark_deletion(self):
+        "Deleting a Bookmark should update its tags' counts"
+        bookmark = BookmarkFactory()
+        bookmark.tags.set('fish', 'carp')
+        BookmarkFactory().tags.set('fish')
+        with patch.object(BookmarkTag.objects, 'update_counts',
+                    wraps=BookmarkTag.objects.update_counts) as update:
+            bookmark.delete()
+        self.assertEqual(update.call_count, 1)
+        self.assertEqual(BookmarkTag.objects.get(name='fish').total_count, 1)
+        self.assertEqual(BookmarkTag.objects.get(name='carp').total_count, 0)
+
+    def test_tags_counts_bookmark_queryset_deletion(self):
+        BookmarkFactory(is_private=False).tags.set('fish')
+        Bookmark.objects.all().delete()
+        self.assertEqual(BookmarkTag.objects.get(name='fish').public_count, 0)
+
+    def test_tags_counts_privacy_change(self):
+        "Changing a Bookmark's privacy should update its tags' counts"
+        bookmark = BookmarkFactory(is_private=False)
+        bookmark.tags.set('fish', '.private')
+        bookmark.is_private = True
+        bookmark.save()
+        self.assertEqual(BookmarkTag.objects.get(name='fish').public_count, 0)
+        self.assertEqual(
+                    BookmarkTag.objects.get(name='.private').public_count, 0)
+
+    def test_tags_update_counts(self):
+        bookmark = BookmarkFactory()
+        bookmark.tags.set('fish')
+        BookmarkTag.objects.update(public_count=0, total_count=0)
+        BookmarkTag.objects.update_counts()
+        self.assertEqual(BookmarkTag.objects.get(name='fish').public_count, 1)
+
+    def test_tags_update_many_counts(self):
+        "Updates more counts than fit in one query's parameters on SQLite"
+        bookmark = BookmarkFactory()
+        bookmark.tags.set(*['tag%s' % n for n in range(400)])
+        BookmarkTag.objects.update(public_count=0, total_count=0)
+        BookmarkTag.objects.update_counts()
+        self.assertEqual(
+                BookmarkTag.objects.filter(public_count=1).count(), 400)
+
     def test_slugs_match_tags_true(self):
         "Returns true if a list of slugs is the same to bookmark's tags"
         bookmark = BookmarkFactory()
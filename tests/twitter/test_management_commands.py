@@ -440,3 +440,39 @@ class FetchFiles(TestCase):
                                                         stderr=self.out_err)
         self.assertIn('Failed to fetch Files: Oops', self.out_err.getvalue())
 
+
+
+class GenerateThumbnails(TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        self.out_err = StringIO()
+
+    @patch('ditto.core.management.commands.ThumbnailGenerator')
+    def test_generates(self, generator):
+        generator.return_value.generate.return_value = {
+                                            'success': True, 'generated': 3}
+        call_command('generate_twitter_thumbnails', stdout=self.out)
+        self.assertEqual(generator.call_args[1]['field_name'], 'image_file')
+        self.assertFalse(generator.return_value.generate.call_args[1]['regenerate'])
+        self.assertIn('Generated images for 3 Media', self.out.getvalue())
+
+    @patch('ditto.core.management.commands.ThumbnailGenerator')
+    def test_regenerates_with_all(self, generator):
+        generator.return_value.generate.return_value = {
+                                            'success': True, 'generated': 3}
+        call_command('generate_twitter_thumbnails', '--all', stdout=self.out)
+        self.assertTrue(generator.return_value.generate.call_args[1]['regenerate'])
+
+    @patch('ditto.core.management.commands.ThumbnailGenerator')
+    @patch('ditto.twitter.management.commands.fetch_twitter_files.FilesFetcher')
+    def test_fetch_files_generates(self, fetcher, generator):
+        "fetch_twitter_files --thumbnails should generate after fetching."
+        fetcher.return_value.fetch.return_value =\
+                                            [{'success': True, 'fetched': 2}]
+        generator.return_value.generate.return_value = {
+                                            'success': True, 'generated': 2}
+        call_command('fetch_twitter_files', '--thumbnails', processes=2,
+                                                            stdout=self.out)
+        self.assertEqual(generator.call_args[1]['processes'], 2)
+        self.assertIn('Generated images for 2 Media', self.out.getvalue())
@@ -273,6 +273,55 @@ class PhotoLocalTestCase(TestCase):
             self.assertEqual(photo.small_url,
                              '/static/img/original_error.jpg')
 
+    @patch('ditto.twitter.models.ImageCacheFile')
+    def test_generated_image_url(self, cachefile):
+        "If the size has been pre-generated, Imagekit shouldn't be used."
+        photo = PhotoFactory()
+        photo.generated_sizes = Media.make_generated_sizes(
+                                    photo.image_file.name,
+                                    {'small': 'CACHE/images/twitter/small.jpg'})
+        self.assertEqual(photo.small_url, 'CACHE/images/twitter/small.jpg')
+        self.assertFalse(cachefile.called)
+
+
+class PhotoCacheTestCase(TestCase):
+    "Testing photos when using the media cache view."
+
+    def setUp(self):
+        self.default_use_cache = app_settings.DITTO_TWITTER_USE_MEDIA_CACHE
+        app_settings.DITTO_TWITTER_USE_MEDIA_CACHE = True
+
+    def tearDown(self):
+        app_settings.DITTO_TWITTER_USE_MEDIA_CACHE = self.default_use_cache
+
+    def test_size_urls(self):
+        photo = PhotoFactory(twitter_id=1234, tweets=(TweetFactory(),))
+        self.assertEqual(photo.large_url, '/media-cache/twitter/1234/large')
+        self.assertEqual(photo.medium_url, '/media-cache/twitter/1234/medium')
+        self.assertEqual(photo.thumbnail_url, '/media-cache/twitter/1234/thumb')
+
+    def test_private_media_uses_remote_urls(self):
+        "Media only on private Tweets isn't served by the cache view."
+        user = UserFactory(is_private=True)
+        photo = PhotoFactory(twitter_id=1234,
+                            image_url='https://pbs.twimg.com/media/a.jpg',
+                            tweets=(TweetFactory(user=user),))
+        self.assertEqual(photo.large_url,
+                         'https://pbs.twimg.com/media/a.jpg:large')
+
+    def test_media_without_tweets_uses_remote_urls(self):
+        photo = PhotoFactory(twitter_id=1234,
+                            image_url='https://pbs.twimg.com/media/a.jpg')
+        self.assertEqual(photo.small_url,
+                         'https://pbs.twimg.com/media/a.jpg:small')
+
+    def test_uses_prefetched_tweets(self):
+        PhotoFactory(twitter_id=1234, tweets=(TweetFactory(),))
+        photo = Media.objects.prefetch_related('tweets').get(twitter_id=1234)
+        with self.assertNumQueries(0):
+            self.assertEqual(photo.large_url,
+                             '/media-cache/twitter/1234/large')
+
 
 class VideoTestCase(TestCase):
     "Most things are the same for photos and videos, so not re-testing here."
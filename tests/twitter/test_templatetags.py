@@ -1,10 +1,16 @@
 import datetime
 import pytz
+from unittest import skipIf
+from unittest.mock import patch
 
 from django.test import TestCase
 
+from ditto.core.imagegenerators import webp_supported
 from ditto.core.utils import datetime_from_str
-from ditto.twitter.factories import AccountFactory, TweetFactory, UserFactory
+from ditto.twitter import app_settings
+from ditto.twitter.factories import AccountFactory, PhotoFactory,\
+        TweetFactory, UserFactory
+from ditto.twitter.models import Media
 from ditto.twitter.templatetags import ditto_twitter
 
 
@@ -298,3 +304,54 @@ class AnnualFavoriteCountsTestCase(TestCase):
         self.assertEqual(tweets[2]['year'], 2017)
         self.assertEqual(tweets[2]['count'], 0)
 
+
+
+class MediaSrcsetTestCase(TestCase):
+
+    def setUp(self):
+        self.media = PhotoFactory(image_url='https://pbs.twimg.com/media/a.jpg')
+        self.default_use_local = app_settings.DITTO_TWITTER_USE_LOCAL_MEDIA
+        self.default_use_webp = app_settings.DITTO_TWITTER_USE_WEBP
+
+    def tearDown(self):
+        app_settings.DITTO_TWITTER_USE_LOCAL_MEDIA = self.default_use_local
+        app_settings.DITTO_TWITTER_USE_WEBP = self.default_use_webp
+
+    def test_srcset(self):
+        self.assertEqual(ditto_twitter.media_srcset(self.media),
+            'https://pbs.twimg.com/media/a.jpg:small 340w, '
+            'https://pbs.twimg.com/media/a.jpg:medium 600w, '
+            'https://pbs.twimg.com/media/a.jpg:large 938w')
+
+    def test_picture_remote(self):
+        html = ditto_twitter.media_picture(self.media, size='small')
+        self.assertTrue(html.startswith(
+            '<img src="https://pbs.twimg.com/media/a.jpg:small" width="340" '
+            'height="143" alt="" srcset="'))
+
+    @skipIf(not webp_supported(), "Pillow can't save WebP images")
+    def test_picture_local_webp(self):
+        app_settings.DITTO_TWITTER_USE_LOCAL_MEDIA = True
+        app_settings.DITTO_TWITTER_USE_WEBP = True
+        self.media.generated_sizes = Media.make_generated_sizes(
+            self.media.image_file.name,
+            {'medium': 'CACHE/medium.jpg', 'medium_webp': 'CACHE/medium.webp'})
+        html = ditto_twitter.media_picture(self.media)
+        self.assertTrue(html.startswith(
+                '<picture><source type="image/webp" '
+                'srcset="CACHE/medium.webp 600w" sizes="600px">'))
+        self.assertIn('srcset="CACHE/medium.jpg 600w, ', html)
+
+    def test_picture_local_only_generated_sizes(self):
+        "It doesn't generate the sizes that don't exist yet."
+        app_settings.DITTO_TWITTER_USE_LOCAL_MEDIA = True
+        self.media.generated_sizes = Media.make_generated_sizes(
+            self.media.image_file.name, {'small': 'CACHE/small.jpg'})
+        with patch('ditto.twitter.models.ImageCacheFile') as cachefile:
+            cachefile.return_value.url = '/media/CACHE/medium.jpg'
+            html = ditto_twitter.media_picture(self.media)
+        # Only for the src:
+        self.assertEqual(cachefile.call_count, 1)
+        # 'large' is the original file:
+        self.assertRegex(html,
+            r'srcset="CACHE/small\.jpg 340w, twitter/media/[^ ]+ 938w"')